@@ -32,6 +32,7 @@ import importlib
 import importlib.util
 import io
 import inspect
+import itertools
 import json
 import logging
 import multiprocessing
@@ -1839,8 +1840,12 @@ def origin_get(depth = 1):
     """
     Return the name of the file and line from which this was called
     """
-    o = inspect.stack()[depth]
-    return "%s:%s" % (o[1], o[2])
+    # walk the frames, inspect.stack() is too expensive for something
+    # called this often
+    frame = inspect.currentframe()
+    for _ in range(depth):
+        frame = frame.f_back
+    return "%s:%s" % (frame.f_code.co_filename, frame.f_lineno)
 
 
 def origin_get_object_path(o):
@@ -2170,7 +2175,9 @@ def conditional_eval(tag, kw, conditional, origin,
     if conditional == None:
         return True
     try:
-        return expr_parser.parse(conditional, kw)
+        # compiled once per expression, as this is called for each
+        # target and BSP with the same handful of them
+        return expr_parser.precompile_fn(conditional)(kw)
     except Exception as e:
         raise Exception("error evaluating %s %s "
                         "'%s' from '%s': %s"
@@ -3818,6 +3825,15 @@ def buildah_image_create(image_name, dockerfile_s, maybe = True,
 
 
 
+class _fsdb_batch_c(dict):
+    # A dictionary that keeps the order in which keys were last set,
+    # so reassigning a key moves it to the end; see fsdb_c.batch()
+    def __setitem__(self, key, value):
+        self.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+
+
 class fsdb_c(object):
     """
     This is a very simple key/value flat database
@@ -3860,7 +3876,8 @@ class fsdb_c(object):
       since now a.b.c is an scalar and thus can't have subfields
 
     This can be time consuming depending on the number of fields being
-    set (felt at the thousands), so use :meth:`set_keys` to set in bulk.
+    set (felt at the thousands), so use :meth:`set_many`,
+    :meth:`batch` or :meth:`set_keys` to set in bulk.
 
     FIXME:
 
@@ -3939,6 +3956,133 @@ class fsdb_c(object):
             f"value must be None, str, int, float, bool; got {type(value)}"
 
 
+    def generation_get(self):
+        """
+        Return a value that changes every time the database is
+        modified
+
+        This allows users to cache data derived from the database
+        (eg: the inventory) and know when it has to be refreshed:
+
+        >>> generation = fsdb.generation_get()
+        >>> if generation != None and generation == cached_generation:
+        >>>     return cached_data
+        >>> data = somefunction(fsdb.get_as_dict())
+        >>> cached_data, cached_generation = data, generation
+
+        Note the generation has to be taken before reading the data.
+
+        :returns: opaque value that can only be compared for
+          equality with other values returned by this method; *None*
+          if the implementation does not support generations (and
+          thus, data can't be cached)
+        """
+        return None
+
+    def subkeys_stamp_get(self, key):
+        """
+        Return a value that changes when keys under *key* (*KEY.**)
+        are added or removed
+
+        Like :meth:`generation_get`, but only for a set of keys; take
+        it before reading the keys.
+
+        :returns: opaque value that can only be compared for
+          equality with other values returned by this method; *None*
+          if the implementation does not support it (and thus, data
+          can't be cached)
+        """
+        return None
+
+
+    @staticmethod
+    def _key_values_collapse(key_values, nested_flat_keyspace):
+        # Apply a list of (KEY, VALUE) in order to a dictionary,
+        # dropping those that a later one would wipe, so that setting
+        # them all in any order yields the same as setting them in
+        # sequence; eg:
+        #
+        # a.b.c = 1, a.b = 2  -> a.b = 2 (a.b wipes a.b.*)
+        # a.b = 2, a.b.c = 1  -> a.b.c = 1 (a.b can't be an scalar)
+        #
+        # To find the keys to drop without scanning all the ones we
+        # have so far on each, we keep an index of the keys under
+        # each prefix (a -> a.b, a.b.c; a.b -> a.b.c)
+        if isinstance(key_values, dict):
+            key_values = key_values.items()
+        d = {}
+        subkeys = collections.defaultdict(set)	# PREFIX -> { KEY, ... }
+
+        def _remove(key):
+            del d[key]
+            partl = key.split(".")
+            for count in range(1, len(partl)):
+                subkeys[".".join(partl[:count])].discard(key)
+
+        for key, value in key_values:
+            if nested_flat_keyspace:
+                partl = key.split(".")
+                prefixes = [
+                    ".".join(partl[:count]) for count in range(1, len(partl))
+                ]
+                for prefix in prefixes:
+                    if prefix in d:
+                        _remove(prefix)
+                for subkey in list(subkeys.get(key, ())):
+                    _remove(subkey)
+                for prefix in prefixes:
+                    subkeys[prefix].add(key)
+            d.pop(key, None)	# so the order is the latest
+            d[key] = value
+        return d
+
+
+    def set_many(self, key_values, force = True,
+                 nested_flat_keyspace: bool = True):
+        """
+        Set multiple keys in one go
+
+        :param key_values: dictionary of *KEY: VALUE* or list of
+          *(KEY, VALUE)*; these are applied in order, as if
+          :meth:`set` had been called for each
+          (see :meth:`batch`)
+
+        :param bool force: see :meth:`set`
+
+        :param bool nested_flat_keyspace: see :meth:`set`
+
+        Implementations may override this to coalesce the keyspace
+        cleanup and make the values visible as a group; this default
+        implementation just calls :meth:`set` for each.
+        """
+        for key, value in self._key_values_collapse(
+                key_values, nested_flat_keyspace).items():
+            self.set(key, value, force = force,
+                     nested_flat_keyspace = nested_flat_keyspace)
+
+
+    @contextlib.contextmanager
+    def batch(self, force = True, nested_flat_keyspace: bool = True):
+        """
+        Context manager to collect multiple key sets and write them
+        in one go with :meth:`set_many`
+
+        >>> with target.fsdb.batch() as batch:
+        >>>     batch['owner'] = "someuser"
+        >>>     batch['_alloc.id'] = "someallocid"
+
+        The values are written when the context exits (not if it
+        exits due to an exception), so they are not visible to
+        :meth:`get` while inside the context.
+
+        Parameters are passed to :meth:`set_many`.
+        """
+        batch = _fsdb_batch_c()
+        yield batch
+        self.set_many(batch, force = force,
+                      nested_flat_keyspace = nested_flat_keyspace)
+
+
     def get(self, key, default = None):
         """
         Return the value stored for a given key
@@ -3979,10 +4123,31 @@ class fsdb_symlink_c(fsdb_c):
     Creating a symlink, takes only one atomic system call, which fails
     if the link already exists. Same to read it. Thus, for small
     values, it is very efficient.
+
+    Groups of values written with :meth:`set_many` (or
+    :meth:`batch`) are seen all or none by :meth:`get_as_dict` and
+    :meth:`get_as_slist`: while writing a group, a marker is kept in
+    the *##groups##* subdirectory and a generation symlink in it
+    updated; readers retry if they saw a marker before reading or the
+    generation changed while they were reading.
     """
     class invalid_e(fsdb_c.exception):
         pass
 
+    #: How many times :meth:`get_as_dict` and :meth:`get_as_slist`
+    #: try to read while groups of values are being written (see
+    #: :meth:`set_many`) before giving up and returning what they
+    #: read, which might have part of a group.
+    group_read_tries = 200
+
+    #: Time (in seconds) to wait between tries; see
+    #: :data:`group_read_tries`
+    group_read_wait = 0.01
+
+    # used to generate unique generation values; see
+    # _group_generation_bump()
+    _group_generation_count = itertools.count()
+
     def __init__(self, dirname, use_uuid = None, concept = "directory"):
         """
         Initialize the database to be saved in the give location
@@ -4003,6 +4168,7 @@ class fsdb_symlink_c(fsdb_c):
             self.uuid = use_uuid
 
         self.location = dirname
+        self.groups_location = os.path.join(dirname, "##groups##")
 
     def _raw_valid(self, location):
         return os.path.islink(location)
@@ -4052,7 +4218,10 @@ class fsdb_symlink_c(fsdb_c):
 
     def keys(self, pattern = None):
         l = []
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
+        for _rootname, dirnames, filenames_raw in os.walk(self.location):
+            # keys all live in the toplevel directory; others (eg:
+            # fsdb_symlink_indexed_c's index) are not keys
+            dirnames.clear()
             filenames = []
             for filename_raw in filenames_raw:
                 if filename_raw.endswith("##field_creation##"):
@@ -4072,6 +4241,10 @@ class fsdb_symlink_c(fsdb_c):
                             continue
                     except FileNotFoundError:
                         continue
+                if "##" in filename_raw:
+                    # keys are always URL encoded, so this is not a
+                    # key, but our own metadata
+                    continue
                 # need to filter with the unquoted name...
                 filename = urllib.parse.unquote(filename_raw)
                 if pattern == None or fnmatch.fnmatch(filename, pattern):
@@ -4079,11 +4252,100 @@ class fsdb_symlink_c(fsdb_c):
                         l.append(filename)
         return l
 
+    def _group_generation_get(self):
+        try:
+            return self._raw_read(
+                os.path.join(self.groups_location, "##generation##"))
+        except FileNotFoundError:
+            return None
+
+    def _group_generation_bump(self):
+        # PID and count make it unique in this machine for the
+        # lifetime of this process; the time, for processes with
+        # recycled PIDs
+        location = os.path.join(self.groups_location, "##generation##")
+        location_new = f"{location}-{os.getpid()}-{threading.get_ident()}##tmp##"
+        rm_f(location_new)
+        self._raw_write(
+            location_new,
+            f"{os.getpid()}-{next(self._group_generation_count)}"
+            f"-{time.time_ns()}".encode())
+        self._raw_rename(location_new, location)
+
+    def _group_write_start(self):
+        # mark a group of values is being written, then change the
+        # generation; returns the marker, to remove when done
+        try:
+            # not makedirs(), if the database was removed, don't
+            # create it again
+            os.mkdir(self.groups_location)
+        except FileExistsError:
+            pass
+        marker = os.path.join(
+            self.groups_location,
+            f"{os.getpid()}-{threading.get_ident()}##writing##")
+        rm_f(marker)
+        self._raw_write(marker, b"%d" % os.getpid())
+        self._group_generation_bump()
+        return marker
+
+    def _group_writing(self):
+        # is any group of values being written?
+        try:
+            entries = os.scandir(self.groups_location)
+        except FileNotFoundError:
+            return False
+        with entries:
+            for entry in entries:
+                if not entry.name.endswith("##writing##"):
+                    continue
+                try:
+                    st_info = entry.stat(follow_symlinks = False)
+                except FileNotFoundError:
+                    continue
+                if time.time() - st_info.st_mtime > 30:
+                    # see keys(); a writer that died
+                    logging.error("WARNING: DB %s: removing dead group"
+                                  " marker %s", self.location, entry.name)
+                    rm_f(entry.path)
+                    continue
+                return True
+        return False
+
+    def _group_read(self, reader, *args):
+        # Call reader(*args), which reads multiple values, so it
+        # doesn't see only part of a group being written by
+        # set_many(); if there is a marker before reading, a group is
+        # being written; if the generation changed, a group was
+        # started while reading--try again.
+        for _count in range(self.group_read_tries):
+            generation = self._group_generation_get()
+            if not self._group_writing():
+                r = reader(*args)
+                if self._group_generation_get() == generation:
+                    return r
+            time.sleep(self.group_read_wait)
+        logging.warning("DB %s: groups of values kept being written while"
+                        " reading; data might be inconsistent",
+                        self.location)
+        return reader(*args)
+
     def get_as_slist(self, *patterns):
+        return self._group_read(self._get_as_slist, *patterns)
+
+    def get_as_dict(self, *patterns):
+        return self._group_read(self._get_as_dict, *patterns)
+
+    def _get_as_slist(self, *patterns):
         fl = []
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
+        for _rootname, dirnames, filenames_raw in os.walk(self.location):
+            # keys all live in the toplevel directory; others (eg:
+            # fsdb_symlink_indexed_c's index) are not keys
+            dirnames.clear()
             filenames = {}
             for filename in filenames_raw:
+                if "##" in filename:	# not a key, see keys()
+                    continue
                 filenames[urllib.parse.unquote(filename)] = filename
             if patterns:	# that means no args given
                 use = {}
@@ -4097,11 +4359,16 @@ class fsdb_symlink_c(fsdb_c):
                     bisect.insort(fl, ( filename, self._get_raw(filename_raw) ))
         return fl
 
-    def get_as_dict(self, *patterns):
+    def _get_as_dict(self, *patterns):
         d = {}
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
+        for _rootname, dirnames, filenames_raw in os.walk(self.location):
+            # keys all live in the toplevel directory; others (eg:
+            # fsdb_symlink_indexed_c's index) are not keys
+            dirnames.clear()
             filenames = {}
             for filename in filenames_raw:
+                if "##" in filename:	# not a key, see keys()
+                    continue
                 filenames[urllib.parse.unquote(filename)] = filename
             if patterns:	# that means no args given
                 use = {}
@@ -4116,6 +4383,36 @@ class fsdb_symlink_c(fsdb_c):
         return d
 
 
+    @staticmethod
+    def _value_encode(value):
+        # the storage is always a string, so encode what is not as
+        # string as T:REPR, where T is type (b boolean, n number,
+        # s string) and REPR is the textual repr, json valid
+        if isinstance(value, bool):
+            # do first, otherwise it will test as int
+            # str first so we get True/False
+            return b"b:" + str(value).encode()
+        if isinstance(value, numbers.Integral):
+            # sadly, this looses precission in floats. A lot
+            return b"i:%d" % value
+        if isinstance(value, numbers.Real):
+            # sadly, this can loose precission in floats--FIXME:
+            # better solution needed
+            return b"f:%.10f" % value
+        if isinstance(value, str):
+            # take care of special strings that might look like
+            # our formatting, escape them
+            if value.startswith("i:") \
+               or value.startswith("f:") \
+               or value.startswith("b:") \
+               or value.startswith("s:") \
+               or value == "":
+                return b"s:" + value.encode()
+            return b"s:" + value.encode()
+        if isinstance(value, bytes):
+            return b"x:" + value
+        raise ValueError("can't store value of type %s" % type(value))
+
     def set(self, key, value, force = True,
             nested_flat_keyspace: bool = True,
             _keys_index: dict = None):
@@ -4124,35 +4421,7 @@ class fsdb_symlink_c(fsdb_c):
         key_orig = key
         key, location = self._location_get(key)
         if value != None:
-            # the storage is always a string, so encode what is not as
-            # string as T:REPR, where T is type (b boolean, n number,
-            # s string) and REPR is the textual repr, json valid
-            if isinstance(value, bool):
-                # do first, otherwise it will test as int
-                # str first so we get True/False
-                value = b"b:" + str(value).encode()
-            elif isinstance(value, numbers.Integral):
-                # sadly, this looses precission in floats. A lot
-                value = b"i:%d" % value
-            elif isinstance(value, numbers.Real):
-                # sadly, this can loose precission in floats--FIXME:
-                # better solution needed
-                value = b"f:%.10f" % value
-            elif isinstance(value, str):
-                # take care of special strings that might look like
-                # our formatting, escape them
-                if value.startswith("i:") \
-                   or value.startswith("f:") \
-                   or value.startswith("b:") \
-                   or value.startswith("s:") \
-                   or value == "":
-                    value = b"s:" + value.encode()
-                else:
-                    value = b"s:" + value.encode()
-            elif isinstance(value, bytes):
-                value = b"x:" + value
-            else:
-                raise ValueError("can't store value of type %s" % type(value))
+            value = self._value_encode(value)
         if value == None:
             # note that we are setting None (aka: removing the value)
             # we also need to remove any "subfield" -- KEY.a, KEY.b
@@ -4354,23 +4623,83 @@ class fsdb_symlink_c(fsdb_c):
           This ensures some cleanup in the key space is done that
           allows mapping nested dictionaries to flat key/values
 
-        Note this version optimizes the cleaning up of key space
+        Note the keys are set sorted by name (so *a.b.c* goes after
+        *a.b* and thus wipes it); see :meth:`set_many` to set them in
+        the given order.
         """
+        self.set_many(sorted(key_list, key = lambda t: t[0]),
+                      force = force,
+                      nested_flat_keyspace = nested_flat_keyspace)
 
-        if nested_flat_keyspace:
-            # because we'll set multiple fields, generate this index
-            # only on the first run and use it for them all--this cuts
-            # a lot of time
-            all_keys_index = self._mkindex(set(self.keys()))
-        else:
-            all_keys_index = None
 
-        # We could paralellize, but some environments *flask* cough
-        # when we use concurrent, etc...
-        for key, value in sorted(key_list, key = lambda t: t[0]):
-            self.set(key, value, force = force,
-                     nested_flat_keyspace = nested_flat_keyspace,
-                     _keys_index = all_keys_index)
+    def _keys_index_mk(self):
+        # because we'll set multiple fields, generate this index
+        # only on the first run and use it for them all--this cuts
+        # a lot of time
+        return self._mkindex(set(self.keys()))
+
+
+    def set_many(self, key_values, force = True,
+                 nested_flat_keyspace: bool = True):
+        """
+        Set multiple keys in one go
+
+        See :meth:`fsdb_c.set_many` for parameters.
+
+        This version cleans up the keyspace for all the keys at once
+        (scanning the database only once) and then writes all the new
+        values to temporary entries before moving them in place.
+
+        :meth:`get_as_dict` and :meth:`get_as_slist` in this or other
+        processes see either none or all of the values (see the
+        class' documentation); note :meth:`get` reads a single key,
+        so successive calls to it can see part of the group.
+        """
+        if not force:
+            # we have to try to create each one and back off if
+            # it exists; there is nothing to coalesce
+            fsdb_c.set_many(self, key_values, force = False,
+                            nested_flat_keyspace = nested_flat_keyspace)
+            return
+        key_values = self._key_values_collapse(
+            key_values, nested_flat_keyspace)
+        if not key_values:
+            return
+        marker = self._group_write_start()
+        try:
+            if nested_flat_keyspace:
+                all_keys_index = self._keys_index_mk()
+                for key in key_values:
+                    self._keys_cleanup(self._key_quote(key),
+                                       all_keys_index = all_keys_index)
+            # stage all the values first (see set() on the naming), so
+            # that if any fails we don't have written anything
+            staged = []
+            removed = []
+            try:
+                for key, value in key_values.items():
+                    _key, location = self._location_get(key)
+                    if value == None:
+                        removed.append(location)
+                        continue
+                    location_new = f"{location}-{os.getpid()}-{threading.get_ident()}##field_creation##"
+                    rm_f(location_new)
+                    self._raw_write(location_new, self._value_encode(value))
+                    staged.append(( location_new, location ))
+            except:
+                for location_new, _location in staged:
+                    rm_f(location_new)
+                raise
+            for location_new, location in staged:
+                self._raw_rename(location_new, location)
+            for location in removed:
+                try:
+                    self._raw_unlink(location)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        finally:
+            rm_f(marker)
 
 
 
@@ -4447,6 +4776,288 @@ class fsdb_file_c(fsdb_symlink_c):
         os.replace(location_new, location)
 
 
+
+class fsdb_symlink_indexed_c(fsdb_symlink_c):
+    """
+    Symlink based database (see :class:`fsdb_symlink_c`) that keeps a
+    persistent index of the nested flat keyspace
+
+    :class:`fsdb_symlink_c` has to scan the whole database directory
+    on every :meth:`set` to find which keys have to be cleaned up to
+    keep the *nested flat keyspace* (see :class:`fsdb_c`)
+    congruent; with hundreds of keys, this makes each set O(number of
+    keys in the database).
+
+    This implementation keeps, in the *##index##* subdirectory, a
+    directory per key prefix that contains a marker per key that
+    lives under it; so for a key *a.b.c* we have the markers:
+
+    - *##index##/a/a.b.c*
+    - *##index##/a.b/a.b.c*
+
+    Setting *a.b.c* thus needs to:
+
+    - remove the scalars *a* and *a.b*, if existing
+
+    - remove any *a.b.c.** key, which are listed in *##index##/a.b.c/*
+
+    - create the markers for *a.b.c* in *##index##/a* and
+      *##index##/a.b*
+
+    all of which is O(depth of the key) (plus the number of subkeys
+    that have to be removed, which had to be done anyway).
+
+    Markers are symlinks, which are created and removed atomically
+    with a single system call, so the index can be shared by multiple
+    processes working on the same database. Markers are created
+    before a key is written and removed after it is removed, so at
+    worst a crash leaves behind a marker for a key that does not
+    exist, which is harmless.
+
+    Note all processes writing to a database directory need to use
+    this class, otherwise the index would go out of sync; if the index
+    does not exist (eg: a database created with
+    :class:`fsdb_symlink_c`), it is created when the object is
+    initialized.
+
+    Each modification also updates the *##index##/##generation##*
+    symlink with an unique value, which :meth:`generation_get`
+    returns.
+    """
+
+    #: name of the subdirectory where the index is kept; the *##*
+    #: guarantees it can't collide with a key, since they are always
+    #: URL encoded.
+    index_dirname = "##index##"
+
+    # used to generate unique generation values; see _generation_bump()
+    _generation_count = itertools.count()
+
+    def __init__(self, dirname, use_uuid = None, concept = "directory"):
+        fsdb_symlink_c.__init__(self, dirname, use_uuid = use_uuid,
+                                concept = concept)
+        self.index_location = os.path.join(self.location, self.index_dirname)
+        self.generation_location = os.path.join(self.index_location,
+                                                "##generation##")
+        if not os.path.isdir(self.index_location):
+            self._index_rebuild()
+
+    def _generation_bump(self):
+        # PID and count make it unique in this machine for the
+        # lifetime of this process; the time, for processes with
+        # recycled PIDs
+        generation = f"{os.getpid()}-{next(self._generation_count)}-{time.time_ns()}"
+        location_new = f"{self.generation_location}-{os.getpid()}-{threading.get_ident()}##tmp##"
+        rm_f(location_new)
+        os.symlink(generation, location_new)
+        os.replace(location_new, self.generation_location)
+
+    def generation_get(self):
+        try:
+            return os.readlink(self.generation_location)
+        except FileNotFoundError:
+            # never modified since the index was created, or the
+            # database was removed
+            return ""
+
+    #: Minimum age (in seconds) of the last change to a set of keys
+    #: for :meth:`subkeys_stamp_get` to return a stamp.
+    #:
+    #: Filesystem timestamps have a coarse granularity and a writer
+    #: creates the index marker right before the key; changes more
+    #: recent than this might still be followed by others that won't
+    #: change the stamp.
+    subkeys_stamp_age_min = 2
+
+    def subkeys_stamp_get(self, key):
+        """
+        Return a stamp that changes when keys under *key* (*KEY.**)
+        are added or removed
+
+        This allows caching information derived from all the keys
+        under a prefix and validating it cheaply, with a single
+        *stat()* of the index directory for the key. Note it does not
+        change when an existing key is modified.
+
+        :param str key: key prefix
+
+        :returns: hashable stamp or *None* if the keys were changed
+          too recently (see :data:`subkeys_stamp_age_min`) for a stamp
+          to be trusted; in that case, the information shall not be
+          cached.
+        """
+        try:
+            stat_info = os.stat(os.path.join(self.index_location,
+                                             self._key_quote(key)))
+        except FileNotFoundError:
+            # no key was ever created under it
+            return ( 0, 0 )
+        if time.time_ns() - stat_info.st_mtime_ns \
+           < self.subkeys_stamp_age_min * 1000000000:
+            return None
+        return ( stat_info.st_ino, stat_info.st_mtime_ns )
+
+    def _index_rebuild(self):
+        # build the index from scratch in a temporary directory and
+        # then move it in place, so it appears atomically for other
+        # processes; if someone did it before us, use theirs
+        index_location_tmp = \
+            f"{self.index_location}-{os.getpid()}-{threading.get_ident()}##tmp##"
+        shutil.rmtree(index_location_tmp, ignore_errors = True)
+        os.makedirs(index_location_tmp)
+        for key_quoted in self._keys_quoted():
+            self._index_add(key_quoted, index_location_tmp)
+        try:
+            os.rename(index_location_tmp, self.index_location)
+        except OSError as e:
+            if e.errno not in ( errno.EEXIST, errno.ENOTEMPTY ):
+                raise
+            shutil.rmtree(index_location_tmp, ignore_errors = True)
+
+    def _index_add(self, key_quoted, index_location = None):
+        # add markers for KEY in the index dirs of each prefix
+        if index_location == None:
+            index_location = self.index_location
+        partl = key_quoted.split('.')
+        for count in range(1, len(partl)):
+            prefix_location = os.path.join(index_location,
+                                           ".".join(partl[:count]))
+            marker_location = os.path.join(prefix_location, key_quoted)
+            try:
+                os.symlink(key_quoted, marker_location)
+            except FileExistsError:
+                pass
+            except FileNotFoundError:
+                # first key in this prefix, create its directory
+                os.makedirs(prefix_location, exist_ok = True)
+                try:
+                    os.symlink(key_quoted, marker_location)
+                except FileExistsError:
+                    pass
+
+    def _index_remove(self, key_quoted):
+        # remove markers for KEY from the index dirs of each prefix
+        partl = key_quoted.split('.')
+        for count in range(1, len(partl)):
+            rm_f(os.path.join(self.index_location,
+                              ".".join(partl[:count]), key_quoted))
+
+    def _subkeys_quoted(self, key_quoted):
+        # list keys under KEY (KEY.*), as recorded in the index
+        try:
+            return os.listdir(os.path.join(self.index_location, key_quoted))
+        except FileNotFoundError:
+            return []
+
+    def _keys_quoted(self):
+        # all the keys live in the toplevel directory, so there is no
+        # need to walk subdirectories (like the index)
+        for entry in os.scandir(self.location):
+            if "##" in entry.name:
+                # not a key (eg: a value being created, see keys())
+                continue
+            if entry.is_symlink():
+                yield entry.name
+
+    def _unlink_quoted(self, key_quoted):
+        # remove a key and its index markers; return if it existed
+        try:
+            self._raw_unlink(self._location_get_raw(key_quoted))
+        except FileNotFoundError:
+            return False
+        self._index_remove(key_quoted)
+        return True
+
+    def keys(self, pattern = None):
+        l = []
+        for entry in os.scandir(self.location):
+            filename_raw = entry.name
+            if filename_raw.endswith("##field_creation##"):
+                try:	# is this a leftover creation file?
+                    mtime_age = time.time() - entry.stat(follow_symlinks = False).st_mtime
+                    if mtime_age > 30:
+                        # see fsdb_symlink_c.keys()
+                        logging.error("WARNING: DB %s field %s: removing dead"
+                                      " creation field", self.location, filename_raw)
+                        self._raw_unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if not entry.is_symlink():
+                continue
+            filename = urllib.parse.unquote(filename_raw)
+            if pattern == None or fnmatch.fnmatch(filename, pattern):
+                l.append(filename)
+        return l
+
+    def _get_as_slist(self, *patterns):
+        fl = []
+        for key_quoted in self._keys_quoted():
+            key = urllib.parse.unquote(key_quoted)
+            if patterns and not field_needed(key, patterns):
+                continue
+            value = self._get_raw(key_quoted, self)
+            if value is not self:	# removed while we were listing
+                fl.append(( key, value ))
+        fl.sort(key = lambda i: i[0])
+        return fl
+
+    def _get_as_dict(self, *patterns):
+        return dict(self._get_as_slist(*patterns))
+
+    def set(self, key, value, force = True,
+            nested_flat_keyspace: bool = True,
+            _keys_index: dict = None):
+        # _keys_index is ignored, we have our own index
+        key_quoted = self._key_quote(key)
+        if value != None:
+            # mark before writing; see class doc
+            self._index_add(key_quoted)
+        r = fsdb_symlink_c.set(self, key, value, force = force,
+                               nested_flat_keyspace = nested_flat_keyspace)
+        if value == None:
+            self._index_remove(key_quoted)
+        self._generation_bump()
+        return r
+
+    def _keys_cleanup(self, key, all_keys_index = None):
+        # Note *key* comes already quoted from fsdb_symlink_c.set();
+        # all_keys_index is ignored, we have our own index.
+        #
+        # When setting a.b.c, a and a.b can't be scalars
+        partl = key.split('.')
+        for count in range(1, len(partl)):
+            self._unlink_quoted(".".join(partl[:count]))
+        # and any a.b.c.* has to go, since a.b.c is now an scalar
+        for subkey_quoted in self._subkeys_quoted(key):
+            self._unlink_quoted(subkey_quoted)
+
+    def _keys_index_mk(self):
+        # we have our own index, no need to build one
+        return None
+
+    def set_many(self, key_values, force = True,
+                 nested_flat_keyspace: bool = True):
+        if not force:
+            # fsdb_c.set_many() -> set() will maintain the index
+            fsdb_c.set_many(self, key_values, force = False,
+                            nested_flat_keyspace = nested_flat_keyspace)
+            return
+        key_values = self._key_values_collapse(
+            key_values, nested_flat_keyspace)
+        # mark before writing; see class doc
+        for key, value in key_values.items():
+            if value != None:
+                self._index_add(self._key_quote(key))
+        fsdb_symlink_c.set_many(self, key_values, force = True,
+                                nested_flat_keyspace = nested_flat_keyspace)
+        for key, value in key_values.items():
+            if value == None:
+                self._index_remove(self._key_quote(key))
+        if key_values:
+            self._generation_bump()
+
+
 def retry_cb_tries(ExceptionToCheck,
                    tries: int = 4, delay: float = 3, backoff: float = 1,
                    header: str = None,
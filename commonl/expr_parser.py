@@ -82,6 +82,7 @@ Would match it.
 """
 
 import copy
+import functools
 import numbers
 import re
 import threading
@@ -348,8 +349,204 @@ def ast_expr(ast, env):
         # analysis phase, FIXME: exercise for the reader who has time
         return True if re.compile(ast[2]).search(value) else False
 
+def _is_symbol(val):
+    # see the FIXME in ast_expr() on why we can't use isinstance()
+    return "_t_symbol_c'" in repr(val.__class__)
+
+def _ast_compile(ast):
+    # Returns a function that given an environment evaluates the AST
+    # as ast_expr() would, but without walking the tree again
+    #
+    # Leafs get the value straight from the environment when it is a
+    # string (most inventory fields are), calling ast_sym() only for
+    # the rest; that saves a function call and a few type checks per
+    # leaf, which is most of the cost of evaluating.
+    operator = ast[0]
+    if operator == "not":
+        fn = _ast_compile(ast[1])
+        return lambda env: not fn(env)
+    if operator == "or":
+        fn1 = _ast_compile(ast[1])
+        fn2 = _ast_compile(ast[2])
+        return lambda env: fn1(env) or fn2(env)
+    if operator == "and":
+        fn1 = _ast_compile(ast[1])
+        fn2 = _ast_compile(ast[2])
+        return lambda env: fn1(env) and fn2(env)
+    symbol = ast[1]
+    if operator == "exists":
+        def _exists(env):
+            e = env.get(symbol, "")
+            if e.__class__ is not str:
+                e = ast_sym(symbol, env)
+            return True if e else False
+        return _exists
+    value = ast[2]
+    if operator == "==":
+        def _eq(env):
+            e = env.get(symbol, "")
+            if e.__class__ is not str:
+                e = ast_sym(symbol, env)
+            return e == value
+        return _eq
+    if operator == "!=":
+        def _ne(env):
+            e = env.get(symbol, "")
+            if e.__class__ is not str:
+                e = ast_sym(symbol, env)
+            return e != value
+        return _ne
+    if operator in ( ">", "<", ">=", "<=" ):
+        value = int(value)
+        if operator == ">":
+            return lambda env: ast_sym_int(symbol, env) > value
+        if operator == "<":
+            return lambda env: ast_sym_int(symbol, env) < value
+        if operator == ">=":
+            return lambda env: ast_sym_int(symbol, env) >= value
+        return lambda env: ast_sym_int(symbol, env) <= value
+    if operator == "in":
+        if _is_symbol(symbol) and _is_symbol(value):
+            return lambda env: ast_sym(symbol, env) in ast_sym(value, env)
+        if _is_symbol(symbol):
+            def _in_constant(env):
+                e = env.get(symbol, "")
+                if e.__class__ is not str:
+                    e = ast_sym(symbol, env)
+                return e in value
+            return _in_constant
+        if _is_symbol(value):
+            def _in_symbol(env):
+                e = env.get(value, "")
+                if e.__class__ is not str:
+                    e = ast_sym(value, env)
+                return symbol in e
+            return _in_symbol
+        result = symbol in value
+        return lambda env: result
+    if operator == ":":
+        regex = re.compile(value)
+        def _match(env):
+            e = env.get(symbol, "")
+            if e.__class__ is not str:
+                # see ast_expr()
+                e = str(ast_sym(symbol, env))
+            return True if regex.search(e) else False
+        return _match
+    raise SyntaxError("Unknown operator '%s'" % operator)
+
 _mutex = threading.Lock()
 
+# id(AST) -> ( AST, FUNCTION ); we keep the AST so the ID can't be
+# reused while in the cache
+_ast_compiled = {}
+_ast_compiled_max = 256
+
+def ast_compile(ast: tuple):
+    """
+    Compile an AST expression into a Python function
+
+    Evaluating an expression on many environments (eg: a target
+    specification over an inventory of targets) walks the AST for
+    each; this compiles it once into nested closures:
+
+    >>> ast = commonl.expr_parser.precompile('type == "qemu" and ram > 2')
+    >>> fn = commonl.expr_parser.ast_compile(ast)
+    >>> fn({ "type": "qemu", "ram": 4 })
+    True
+
+    Compiled functions are cached, so calling this repeatedly with
+    the same AST object is cheap.
+
+    :param tuple ast: ast expression returned by :func:`precompile`
+
+    :returns callable: function that takes an environment
+      dictionary and returns the result of evaluating the expression
+      in it, like :func:`parse`.
+    """
+    entry = _ast_compiled.get(id(ast), None)
+    if entry and entry[0] is ast:
+        return entry[1]
+    fn = _ast_compile(ast)
+    if len(_ast_compiled) >= _ast_compiled_max:
+        _ast_compiled.clear()
+    _ast_compiled[id(ast)] = ( ast, fn )
+    return fn
+
+
+
+@functools.lru_cache(maxsize = 512)
+def precompile_fn(expr_text: str):
+    """
+    Compile an expression into a Python function
+
+    Same as :func:`ast_compile` but starting from the expression
+    text; results are cached, so calling this repeatedly with the
+    same expression is cheap.
+
+    :param str expr_text: string with the expression text
+
+    :returns callable: function that takes an environment
+      dictionary and returns the result of evaluating the expression
+    """
+    return ast_compile(precompile(expr_text))
+
+
+
+def ast_candidates(ast: tuple, lookup: callable):
+    """
+    Use indexes to narrow down which environments an AST expression
+    might be true on
+
+    When an expression has to be evaluated on many environments
+    (eg: a target specification over an inventory of targets), the
+    ones it can be true on can be found much faster for the
+    equality and membership conditions by looking them up in
+    indexes; conditions joined by *and* intersect, by *or* join.
+
+    :param tuple ast: ast expression returned by :func:`precompile`
+
+    :param callable lookup: function to look up indexes, called as:
+
+      - *lookup("==", SYMBOL, VALUES)*: return the set of environment
+        keys on which *SYMBOL* might be equal to any of the constants
+        in list *VALUES*
+
+      - *lookup("in", SYMBOL, VALUE)*: return the set of environment
+        keys on which constant *VALUE* might be in *SYMBOL*
+
+      or *None* if it can't tell.
+
+    :returns set: set of keys of the environments the expression
+      might be true on (it still has to be evaluated on them) or
+      *None* if it has to be evaluated on all of them.
+    """
+    operator = ast[0]
+    if operator == "and":
+        candidates1 = ast_candidates(ast[1], lookup)
+        candidates2 = ast_candidates(ast[2], lookup)
+        if candidates1 == None:
+            return candidates2
+        if candidates2 == None:
+            return candidates1
+        return candidates1 & candidates2
+    if operator == "or":
+        candidates1 = ast_candidates(ast[1], lookup)
+        if candidates1 == None:
+            return None
+        candidates2 = ast_candidates(ast[2], lookup)
+        if candidates2 == None:
+            return None
+        return candidates1 | candidates2
+    if operator == "==":
+        return lookup("==", ast[1], [ ast[2] ])
+    if operator == "in" and _is_symbol(ast[1]) \
+       and isinstance(ast[2], list):
+        return lookup("==", ast[1], ast[2])
+    if operator == "in" and not _is_symbol(ast[1]) and _is_symbol(ast[2]):
+        return lookup("in", ast[2], ast[1])
+    return None
+
 
 
 def precompile(expr_text: str):
@@ -422,8 +619,8 @@ def parse(expr_text: str, env: dict, ast: tuple = None):
     commonl.assert_dict_key_strings(env, env)
     # Like it's C counterpart, state machine is not thread-safe
     if ast == None:
-        ast = precompile(expr_text)
-    return ast_expr(ast, env)
+        return precompile_fn(expr_text)(env)
+    return ast_compile(ast)(env)
 
 
 
@@ -476,7 +673,10 @@ if __name__ == "__main__":
             print("TOKEN", tok.type, tok.value)
         print("PARSE TREE", parser.parse(line))
         result = parse(line, local_env)
-        if expected != result:
+        result_ast = ast_expr(precompile(line), local_env)
+        if result != result_ast:
+            print("FAIL: compiled got %s, AST %s" % (result, result_ast))
+        elif expected != result:
             print("FAIL: expected %s, got %s" % (expected, result))
         else:
             print("OK")
@@ -220,6 +220,7 @@ class test_tcf_mixin(object):
         args.tags_spec = []
         args.repeat_evaluation = 1
         args.max_permutations = 10
+        args.permutations_randomizer = "random"
         args.not_found_mismatch = False
         args.remove_tmpdir = True
         args.shard = None
@@ -793,7 +794,8 @@ host = '127.0.0.1'
 
         .. warning:: THIS WILL AFFECT all uses of this test daemon instance
         """
-        with open(os.path.join(self.lib_dir,
+        # the daemon looks for this in its --state-path
+        with open(os.path.join(self.state_dir,
                                "local_auth_disabled"), "w") as wf:
             wf.write("")
 
@@ -28,6 +28,7 @@ import collections
 import concurrent.futures
 import datetime
 import errno
+import glob
 import inspect
 import itertools
 import json
@@ -1213,7 +1214,15 @@ class server_c:
         with filelock.FileLock(self.cache_lockfile):
             return self.fsdb.get(self.aka + "." + field, default)
 
+    def _inventory_cache_wipe(self):
+        # the inventory caches are regular files, not fsdb fields
+        for file_name in glob.glob(os.path.join(
+                glob.escape(self.cache_dir),
+                glob.escape(self.aka) + ".inventory-*.pickle")):
+            commonl.rm_f(file_name)
+
     def _cache_wipe(self):
+        self._inventory_cache_wipe()
         # a wee bit obscure; writing None wipes the field and all
         # the subfields (NAME. and NAME.*)
         return self.fsdb.set(self.aka, None)
@@ -1224,6 +1233,7 @@ class server_c:
         """
         logger.info("%s: cache deleted in %s", self.url, self.cache_lockfile)
         with filelock.FileLock(self.cache_lockfile):
+            self._inventory_cache_wipe()
             r = self.fsdb.set(self.aka, None)
             commonl.rm_f(self.cache_lockfile)
             return r
@@ -2194,6 +2204,117 @@ class server_c:
 
 
 
+    #: Use the *targets-delta/* call to get the inventory
+    #:
+    #: This is set to *False* once we find the server doesn't
+    #: support it, so we don't keep trying.
+    inventory_delta = True
+
+    def _inventory_cache_file_name(self, projections):
+        if self.cache_dir == None:
+            return None
+        return os.path.join(
+            self.cache_dir,
+            # see _inventory_cache_wipe()
+            f"{self.aka}.inventory-{commonl.mkid(repr(projections))}.pickle")
+
+    def _inventory_cache_load(self, file_name):
+        # returns { TARGETID: ( ETAG, RT, RT_FLAT ) }; invalid or
+        # missing caches are just empty
+        if file_name == None:
+            return {}
+        try:
+            with open(file_name, "rb") as f:
+                cache = pickle.load(f)
+            if isinstance(cache, dict):
+                return cache
+            log_sd.info("%s: ignoring invalid inventory cache", file_name)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_sd.info("%s: ignoring invalid inventory cache: %s",
+                        file_name, e)
+        return {}
+
+    def _inventory_cache_save(self, file_name, cache):
+        if file_name == None:
+            return
+        # tmp + replace, so parallel processes don't see partial data
+        with tempfile.NamedTemporaryFile(dir = self.cache_dir,
+                                         delete = False) as f:
+            pickle.dump(cache, f, protocol = pickle.HIGHEST_PROTOCOL)
+            f.flush()
+        os.replace(f.name, file_name)
+
+
+    def _targets_get_delta(self, projections):
+        """
+        Get the inventory of all the targets, downloading only what
+        changed since last time
+
+        The inventory of each target and its ETag is kept in a
+        persistent cache file in :data:`cache_dir`, along with its
+        flattened form; the server gets the ETags we know and sends
+        only the inventories that changed (and the list of ETags of
+        the current targets, so we know which were removed).
+
+        :returns: dictionary keyed by target ID of tuples *( RT,
+          RT_FLAT )* (where *RT_FLAT* is a list as returned by
+          :func:`commonl.dict_to_flat`) or *None* if the server doesn't
+          support the *targets-delta/* call.
+        """
+        file_name = self._inventory_cache_file_name(projections)
+        cache = self._inventory_cache_load(file_name)
+        data = {}
+        if projections:
+            data['projections'] = json.dumps(projections)
+        if cache:
+            data['etags'] = json.dumps({
+                target_id: etag for target_id, ( etag, _rt, _rt_flat )
+                in cache.items()
+            })
+        try:
+            r = self.send_request("GET", "targets-delta/",
+                                  data = data, raw = True, timeout = 30)
+        except requests.exceptions.HTTPError as e:
+            # see commonl.request_response_maybe_raise()
+            if getattr(e, "status_code", None) != 404:
+                raise
+            log_sd.info("%s: server doesn't support targets-delta/,"
+                        " getting full inventory", self.url)
+            self.inventory_delta = False
+            return None
+        r = json.loads(r.text, object_pairs_hook = collections.OrderedDict)
+        etags = r['etags']
+        changed = r['targets']
+        cache_new = {}
+        for target_id, etag in etags.items():
+            rt = changed.get(target_id, None)
+            if rt != None:
+                # Note the empty_dict!! it's important; we want to
+                # keep empty nested dictionaries, because even if
+                # empty, the presence of the key might be used by
+                # clients to tell things about the remote target
+                cache_new[target_id] = (
+                    etag, rt, commonl.dict_to_flat(rt, empty_dict = True))
+            elif target_id in cache:
+                cache_new[target_id] = cache[target_id]
+            else:
+                # the server thinks we have it, but we do not--cache
+                # is busted, so wipe it and get it all
+                log_sd.info("%s: inventory cache %s invalid, refreshing",
+                            self.url, file_name)
+                commonl.rm_f(file_name)
+                return self._targets_get_delta(projections)
+        if changed or len(cache_new) != len(cache):
+            # save before returning, since the caller modifies them
+            self._inventory_cache_save(file_name, cache_new)
+        return {
+            target_id: ( rt, rt_flat )
+            for target_id, ( _etag, rt, rt_flat ) in cache_new.items()
+        }
+
+
     def targets_get(self, target_id = None, projections = None):
         commonl.assert_none_or_list_of_strings(projections, "projections",
                                                "field name")
@@ -2211,7 +2332,13 @@ class server_c:
             server_rts_flat = dict()
             server_inventory_keys = collections.defaultdict(set)
 
-            def _rt_handle(target_id, rt):
+            def _rt_handle(target_id, rt, rt_flat = None):
+                if rt_flat == None:
+                    # Note the empty_dict!! it's important; we want to
+                    # keep empty nested dictionaries, because even if
+                    # empty, the presence of the key might be used by
+                    # clients to tell things about the remote target
+                    rt_flat = commonl.dict_to_flat(rt, empty_dict = True)
                 rt[target_id] = True
                 fullid = self.aka + "/" + target_id
                 rt[fullid] = True
@@ -2227,12 +2354,9 @@ class server_c:
                 rt['server_aka'] = self.aka
                 server_rts[fullid] = rt
                 server_rts_flat[fullid] = dict(rt)
-                # Note the empty_dict!! it's important; we want to
-                # keep empty nested dictionaries, because even if
-                # empty, the presence of the key might be used by
-                # clients to tell things about the remote target
-                server_rts_flat[fullid].update(
-                    commonl.dict_to_flat(rt, empty_dict = True))
+                # the fields we added are not nested, so their
+                # flattened form is the same
+                server_rts_flat[fullid].update(rt_flat)
 
             if projections:
                 if isinstance(projections, set):
@@ -2256,19 +2380,30 @@ class server_c:
                 rt = json.loads(r.text, object_pairs_hook = collections.OrderedDict)
                 _rt_handle(target_id, rt)
             else:
-                r = self.send_request("GET", "targets/",
-                                      data = data, raw = True,
-                                      timeout = 30)
-                # When asking for multiple targets, we get
-                #
-                ## { TARGETID1: { FIELD: VALUE, ... }, TARGETID2: ... }
-                #
-                # Keep the order -- even if json spec doesn't contemplate it, we
-                # use it so the client can tell (if they want) the order in which
-                # for example, power rail components are defined in interfaces.power
-                r = json.loads(r.text, object_pairs_hook = collections.OrderedDict)
-                for target_id, rt in r.items():
-                    _rt_handle(target_id, rt)
+                rts = None
+                if self.inventory_delta:
+                    rts = self._targets_get_delta(projections)
+                if rts != None:
+                    # we got it from the cache + what changed
+                    for target_id, ( rt, rt_flat ) in rts.items():
+                        _rt_handle(target_id, rt, rt_flat)
+                else:
+                    r = self.send_request("GET", "targets/",
+                                          data = data, raw = True,
+                                          timeout = 30)
+                    # When asking for multiple targets, we get
+                    #
+                    ## { TARGETID1: { FIELD: VALUE, ... }, TARGETID2: ... }
+                    #
+                    # Keep the order -- even if json spec doesn't
+                    # contemplate it, we use it so the client can tell
+                    # (if they want) the order in which for example,
+                    # power rail components are defined in
+                    # interfaces.power
+                    r = json.loads(r.text,
+                                   object_pairs_hook = collections.OrderedDict)
+                    for target_id, rt in r.items():
+                        _rt_handle(target_id, rt)
             # for this server, collect how many different keys and
             # values we have; server_rts_flat is keyed by target name;
             # each contains a dict of inventory key and value
@@ -275,6 +275,85 @@ def scroll_updown(target,
 
 
 
+def _menu_scroll_to_entry_screen(target, name, entry_string, max_scrolls,
+                                 direction, highlight_string, column_key):
+    # Scroll to an entry tracking the menu in a terminal screen model
+    #
+    # Find in the screen which entry is highlighted and where the
+    # one we want is, then send all the keystrokes to get there in
+    # one go and check where we landed, instead of doing a round trip
+    # per keystroke.
+    #
+    # Returns the highlighted entry and match groups, or None if it
+    # can't figure it out (nothing highlighted, entry not on the
+    # screen, the menu doesn't move as expected) so the caller can
+    # fall back to scrolling one entry at a time.
+    try:
+        highlight = tcfl.tl.ansi_sgr_attrs(highlight_string)
+    except Exception as e:		# not a plain SGR sequence
+        target.report_info(f"{name}: can't use screen model for"
+                           f" highlight string: {e}", dlevel = 2)
+        return None, None
+    if isinstance(entry_string, bytes):
+        entry_string = entry_string.decode('utf-8')
+    entry_regex = re.compile(entry_string)
+    terminal = target.kws.get("bios.terminal_emulation", "vt100")
+    screen = tcfl.tl.ansi_screen_get(target)
+    scrolls = 0
+    highlighted_prev = None
+    while True:
+        target.console.wait_for_no_output(
+            target.console.default, silence_period = 0.6, poll_period = 0.2,
+            reason = f"menu to render, scrolling for entry '{entry_string}'")
+        screen.update()
+        entries = screen.menu_entries(column_key, highlight)
+        highlighted = [
+            index for index, entry in enumerate(entries)
+            if entry['highlighted']
+        ]
+        if len(highlighted) != 1:
+            target.report_info(f"{name}: screen shows {len(highlighted)}"
+                               " highlighted entries", dlevel = 2)
+            return None, None
+        current = highlighted[0]
+        entry = entries[current]
+        # menus that scroll might keep the highlight in the same row
+        if ( entry['row'], entry['key'] ) == highlighted_prev:
+            target.report_info(f"{name}: highlight did not move from"
+                               f" '{entry['key']}'", dlevel = 2)
+            return None, None
+        highlighted_prev = ( entry['row'], entry['key'] )
+        m = entry_regex.search(entry['key'])
+        if m:
+            return entry, m
+        candidates = [
+            index for index, entry in enumerate(entries)
+            if entry_regex.search(entry['key'])
+        ]
+        if candidates:
+            destination = min(candidates,
+                              key = lambda index: abs(index - current))
+        elif direction == "down":
+            # not on the screen; go to the last one and see if the
+            # menu scrolls
+            destination = len(entries) - 1
+        else:
+            destination = 0
+        count = min(abs(destination - current), max_scrolls - scrolls)
+        if count == 0:
+            return None, None
+        key = ansi_key_code(
+            "arrow_down" if destination > current else "arrow_up",
+            terminal)
+        target.report_info(
+            f"{name}: highlighted '{entry['key']}', sending {count}"
+            f" keystrokes to get to '{entries[destination]['key']}'",
+            dlevel = 1)
+        target.console_tx(key * count)    # USE CONSOLE_TX!!! see file header
+        scrolls += count
+
+
+
 def menu_scroll_to_entry(
         target, entry_string, has_value = False,
         max_scrolls = 30, direction = "down",
@@ -308,6 +387,15 @@ def menu_scroll_to_entry(
     So we fiest lock on the highlight string, extract if it could be a
     submenu or a key/value
 
+    When the highlight string is a plain ANSI SGR sequence, the menu
+    is first tracked in a terminal screen model
+    (:func:`tcfl.tl.ansi_screen_get`): we find which entry is
+    highlighted and where the wanted one is and send all the arrow
+    keys to get there at once. If that does not work (the entry is
+    not on the screen, nothing seems highlighted...), we fall back
+    to scrolling one entry at a time and looking at the highlight
+    sequences in the output.
+
     Look at :ref:`ANSI sequences <biosl_ansi_shortref>` for info on
     ANSI sequences.
 
@@ -453,6 +541,31 @@ def menu_scroll_to_entry(
         )
         + b")")
 
+    entry, m = _menu_scroll_to_entry_screen(
+        target, name, entry_string, max_scrolls, direction,
+        highlight_string, column_key)
+    if entry:
+        target.report_info("%s: highlighted entry found" % name)
+        # the next expectations have to look at what comes next
+        target.console.send_expect_sync(target.console.default)
+        # return the same fields the expectation below would
+        r = dict.fromkeys([
+            "row_value", "column_value", "value", "column_value_key",
+            "key_value", "row_novalue", "column_novalue_key", "key_novalue"
+        ])
+        suffix = "novalue" if entry['value'] == None else "value"
+        r["row_" + suffix] = b"%02d" % entry['row']
+        r["column_" + suffix + "_key"] = b"%02d" % column_key
+        r["key_" + suffix] = entry['key'].encode('utf-8')
+        if entry['value'] != None:
+            r['column_value'] = b"%02d" % entry['column_value']
+            r['value'] = entry['value'].encode('utf-8')
+        for group, value in m.groupdict().items():
+            r[group] = value.encode('utf-8') if value != None else None
+        return r
+    target.report_info(f"{name}: falling back to scrolling one by one",
+                       dlevel = 1)
+
     if isinstance(entry_string, str):
         # convert to bytes
         entry_string = entry_string.encode('utf-8')
@@ -17,11 +17,11 @@ process. :data:`agent_c.tcis` will contain the information about found
 testcases. 
 
 The discovery process involves enumerating all possible files in the
-paths passed as input and spawning a separate process for each (to
-isolate from crashes, failures to import and other errors). When a
-valid testcase is found, the process will be left as an execution
-server that can launch testcases to execute. See :class:`agent_c` for
-more details.
+paths passed as input and running the testcase drivers on each of
+them in a pool of worker processes (to isolate from crashes, failures
+to import and other errors). Results are cached on disk, so a file
+that has not changed since it was last scanned is not scanned
+again. See :class:`agent_c` for more details.
 
 Quick usage:
 
@@ -34,13 +34,16 @@ Quick usage:
 """
 import atexit
 import collections
+import concurrent.futures
+import hashlib
 import io
 import inspect
 import importlib
 import logging
 import multiprocessing
+import multiprocessing.connection
 import os
-import queue
+import pickle
 import re
 import shutil
 import subprocess
@@ -455,6 +458,278 @@ def _manifest_expand(sources, result, manifests):
 
 
 
+def _tcis_blocked(path, subcase_spec, exception, output = "",
+                  formatted_traceback = None):
+    # A discovery result for a file that could not be scanned
+    if formatted_traceback == None:
+        formatted_traceback = traceback.format_stack()
+    return {
+        path: [
+            tcfl.tc_info_c(
+                path, path,
+                subcase_spec = subcase_spec,
+                origin = path,
+                result = tcfl.result_c(blocked = 1),
+                output = output,
+                exception = exception,
+                formatted_traceback = formatted_traceback,
+            )
+        ]
+    }
+
+
+
+def _import_state_restore(modules, path, meta_path, path_hooks):
+    # Restore the import machinery state saved before scanning a file
+    for name in set(sys.modules) - set(modules):
+        del sys.modules[name]
+    for name, module in modules.items():
+        if sys.modules.get(name, None) is not module:
+            sys.modules[name] = module
+    sys.path[:] = path
+    sys.meta_path[:] = meta_path
+    if sys.path_hooks != path_hooks:
+        sys.path_hooks[:] = path_hooks
+        sys.path_importer_cache.clear()
+    importlib.invalidate_caches()
+
+def _find_in_file_worker(path, subcase_spec):
+    # RUNS IN A SEPARATE IMAGE (a discovery pool worker or a process
+    # forked for this file only)
+    # - main image inmune from imports
+    # - main image not susceptible to crashes
+    # - OOM killer won't affect main image and we'll be able to
+    #   track it
+    #
+    # Pool workers are reused for other files, so restore anything we
+    # change in the process' state before returning--including the
+    # import state, otherwise a module imported by a file (eg: a
+    # helper.py next to it) would be taken by another one importing
+    # a different module with the same name.
+    orig_stdout = sys.stdout
+    orig_stderr = sys.stderr
+    sys.stderr = sys.stdout = io.StringIO()
+    cwd = os.getcwd()
+    orig_modules = dict(sys.modules)
+    orig_path = list(sys.path)
+    orig_meta_path = list(sys.meta_path)
+    orig_path_hooks = list(sys.path_hooks)
+
+    logger = log_sub.getChild(path)
+    tcis = collections.defaultdict(list)
+    try:
+        _create_from_file_name(tcis, path, path, subcase_spec,
+                               logger = logger)
+        output = sys.stderr.getvalue()
+        for tcil in tcis.values():
+            for tci in tcil:
+                # we are just appending; the output of the
+                # discover process
+                if tci.output:
+                    tci.output += "\n\n"
+                if output:
+                    tci.output += "Discovery Process output:\n" + output
+    except Exception as e:
+        # FIXME: send error code
+        tcis = _tcis_blocked(
+            path, subcase_spec, e,
+            output = "Discovery Process output:\n" + sys.stderr.getvalue(),
+            formatted_traceback = traceback.format_tb(sys.exc_info()[2]))
+        # FIXME: get from traceback, last item
+        tcis[path][0].origin = getattr(e, "origin", None)
+    finally:
+        sys.stdout = orig_stdout
+        sys.stderr = orig_stderr
+        if os.getcwd() != cwd:
+            os.chdir(cwd)
+        _import_state_restore(orig_modules, orig_path, orig_meta_path,
+                              orig_path_hooks)
+        # asynchronous report drivers deliver from a thread; make sure
+        # what this file reported is out before we take another one
+        for driver in tcfl.tc.report_driver_c._drivers:
+            driver.flush()
+    return dict(tcis)
+
+
+
+def _drivers_signature():
+    # Identify the set of testcase drivers and the version of the
+    # code implementing them, so cached discovery results are
+    # invalidated when a driver is added, removed or modified
+    signature = [ __file__, tcfl.__file__ ]
+    for driver in tcfl.tc.tc_c._tc_drivers:
+        module = sys.modules.get(driver.__module__, None)
+        signature.append(f"{driver.__module__}.{driver.__qualname__}"
+                         f"@{getattr(module, '__file__', None)}")
+    stamps = []
+    for entry in signature:
+        filename = entry.rsplit("@", 1)[-1]
+        try:
+            st = os.stat(filename)
+            stamps.append(f"{entry}:{st.st_size}:{st.st_mtime_ns}")
+        except (OSError, TypeError, ValueError):
+            stamps.append(entry)
+    return commonl.mkid("\0".join(stamps), l = 16)
+
+
+
+class _cache_c:
+    """
+    On disk cache of discovery results
+
+    Each entry is keyed by the path of the file (as given and
+    absolute, since the testcase names are derived from it), the
+    subcases requested and the signature of the testcase driver set
+    (see :func:`_drivers_signature`); it contains the file's size,
+    modification time, content hash and the discovery result.
+
+    An entry is valid if the file's size and modification time match
+    (no need to read the file) or, if they don't, if the file's
+    contents still hash the same (eg: after a *git checkout* that
+    touched the file without changing it).
+
+    Entries are written to a temporary file and renamed in place, so
+    multiple processes can use the cache at the same time without
+    locking.
+    """
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        # FILENAME -> ( KEY, SIZE, MTIME_NS, DIGEST ), filled by get()
+        # so set() stores the stamp the file had *before* scanning it
+        self.stamps = {}
+        commonl.makedirs_p(path)
+
+    def _key(self, filename, subcase_spec):
+        return commonl.mkid(
+            "\0".join([
+                os.path.abspath(filename), filename,
+                "#".join(subcase_spec), self.signature
+            ]),
+            l = 32)
+
+    @staticmethod
+    def _digest(filename):
+        return commonl.hash_file(hashlib.sha256(), filename).hexdigest()
+
+    def _write(self, key, entry):
+        entry_path = os.path.join(self.path, key)
+        tmp_path = entry_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
+    def get(self, filename, subcase_spec):
+        """
+        Return the cached discovery result for a file
+
+        :returns dict: discovery result (as in :data:`agent_c.tcis`)
+          or *None* if missing or stale
+        """
+        key = self._key(filename, subcase_spec)
+        entry_path = os.path.join(self.path, key)
+        st = os.stat(filename)
+        try:
+            with open(entry_path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            entry = None
+        except Exception as e:	# corrupted, unpickable, etc, ignore
+            log.info(f"{filename}: ignoring discovery cache entry: {e}")
+            entry = None
+        if entry == None:
+            self.stamps[filename] = (
+                key, st.st_size, st.st_mtime_ns, self._digest(filename))
+            return None
+        if entry['size'] == st.st_size \
+           and entry['mtime_ns'] == st.st_mtime_ns:
+            # update the entry's mtime, so pruning sees it as used
+            os.utime(entry_path)
+            return entry['tcis']
+        digest = self._digest(filename)
+        if entry['digest'] == digest:
+            entry['size'] = st.st_size
+            entry['mtime_ns'] = st.st_mtime_ns
+            self._write(key, entry)
+            return entry['tcis']
+        self.stamps[filename] = ( key, st.st_size, st.st_mtime_ns, digest )
+        return None
+
+    def set(self, filename, tcis):
+        """
+        Store the discovery result for a file previously missed in
+        :meth:`get`
+
+        Results that contain errors are not cached, so they are
+        retried next time.
+        """
+        stamp = self.stamps.pop(filename, None)
+        if stamp == None:
+            return
+        for tcil in tcis.values():
+            for tci in tcil:
+                if tci.exception or tci.result \
+                   and ( tci.result.errors or tci.result.blocked ):
+                    return
+        key, size, mtime_ns, digest = stamp
+        try:
+            self._write(key, dict(size = size, mtime_ns = mtime_ns,
+                                  digest = digest, tcis = tcis))
+        except Exception as e:	# unpickable data, disk full...
+            log.info(f"{filename}: can't cache discovery result: {e}")
+
+    def prune(self, max_entries):
+        """
+        Remove the least recently used entries until there are only
+        *max_entries* left
+        """
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                try:
+                    entries.append(( entry.stat().st_mtime, entry.path ))
+                except FileNotFoundError:
+                    continue		# removed by someone else
+        if len(entries) <= max_entries:
+            return
+        entries.sort()
+        for _mtime, path in entries[:len(entries) - max_entries]:
+            commonl.rm_f(path)
+
+
+
+# Discovery worker pool, shared by all the agents in this process so
+# it stays warm across runs
+_pool = None
+_pool_key = None
+
+def _pool_get(processes, signature):
+    global _pool, _pool_key
+    if _pool != None and _pool_key == ( processes, signature ):
+        return _pool
+    _pool_kill()
+    # fork, so the workers see the testcase drivers that have been
+    # registered in this process; we re-create the pool if they
+    # change (see _drivers_signature())
+    _pool = concurrent.futures.ProcessPoolExecutor(
+        processes, mp_context = multiprocessing.get_context("fork"))
+    _pool_key = ( processes, signature )
+    return _pool
+
+def _pool_kill():
+    # Tear down the pool, killing any worker hung on a file
+    global _pool, _pool_key
+    if _pool == None:
+        return
+    # ProcessPoolExecutor has no public interface to terminate workers
+    for process in list(getattr(_pool, "_processes", {}).values()):
+        process.kill()
+    _pool.shutdown(wait = True, cancel_futures = True)
+    _pool = None
+    _pool_key = None
+
+
+
 class agent_c:
     """
     Discovery agent to find testcases
@@ -470,13 +745,25 @@ class agent_c:
     framework, etc since the driver class provides the adaptation
     layer for it.
 
-    The discovery process for each file is run on a separate
-    subprocess (to shield the caller from crashes, extra imports,
-    collisions between testcases, etc). When the subprocess finds a
-    file implements one or more valid subcases, it queues a message to
-    the agent with a list of :class:`tc_info_c` instances, each
-    definiting a testcase (containing info such as name, what kind of
-    targets is needs, what axis, tags, description, etc).
+    The discovery process for each file is run on a pool of worker
+    subprocesses (to shield the caller from crashes, extra imports,
+    collisions between testcases, etc). When a worker finds a file
+    implements one or more valid subcases, it returns to the agent a
+    list of :class:`tc_info_c` instances, each definiting a testcase
+    (containing info such as name, what kind of targets is needs, what
+    axis, tags, description, etc).
+
+    The pool is kept across runs in the same process. If a worker
+    crashes or hangs, the files it might have been working on are
+    scanned again, each on its own subprocess, so the failure is
+    attributed to the right file.
+
+    Discovery results are cached in :data:`cache_path`; a file is
+    only scanned again if it changed (as in size, modification time
+    and contents), if the subcases requested are different or if the
+    set of testcase drivers (or their code) changed. Note that changes
+    to files imported by a testcase are not detected; wipe the cache
+    if needed.
 
     (PENDING) the per-file process then becomes an execution server
     that on command from the orchestrator can spawn testcases for
@@ -490,22 +777,23 @@ class agent_c:
         #: Maximum number of seconds we'll wait for a discovery
         #: process to issue a result
         self.timeout = 30
-        #: Time to wait before checking if discovery processes are
-        #: done and we need to launch more.
+        #: Time to wait before checking if isolated discovery
+        #: processes are done
         self.wait_period = 0.25
-        self.manager = multiprocessing.Manager()
-        # create this in the main process, on the forked one it does
-        # not work
-        self.queue = self.manager.Queue(maxsize = 1000)
-        self.lock = self.manager.Lock()
-        self.cvar = self.manager.Condition(self.lock)
+        #: Where to cache discovery results (*None* to disable)
+        self.cache_path = os.path.join(
+            os.path.expanduser("~"), ".cache", "tcf", "discovery")
+        #: Maximum number of entries to keep in the cache; least
+        #: recently used are removed first.
+        self.cache_entries = 8192
         #: Number of testcases found
         self.tcis_count = 0
         #: Info about testcases found, indexed by file where found;
         #: #each entry is a list of :class:`tcfl.tc_info_c`
         self.tcis = {}
         self.result = tcfl.result_c()
-        self.proc_by_filename = {}
+        #: Files to scan and the subcases requested for each
+        self.subcase_spec_by_filename = {}
 
 
     # FIXME: rename to discover_, make public
@@ -524,58 +812,7 @@ class agent_c:
     ]
 
 
-    def _process_find_in_file(self, path, subcase_spec):
-        # RUNS IN A SEPARATE IMAGE
-        # - main image inmune from imports
-        # - main image not susceptible to crashes
-        # - OOM killer won't affect main image and we'll be able to
-        #   track it
-
-        orig_stderr = sys.stderr
-        sys.stderr = sys.stdout = io.StringIO()
-
-        logger = log_sub.getChild(path)
-        tcis = collections.defaultdict(list)
-        try:
-            _create_from_file_name(tcis, path, path, subcase_spec,
-                                   logger = logger)
-            output = sys.stderr.getvalue()
-            for path, tcil in tcis.items():
-                for tci in tcil:
-                    # we are just appending; the output of the
-                    # discover process
-                    if tci.output:
-                        tci.output += "\n\n"
-                    if output:
-                        tci.output += "Discovery Process output:\n" + output
-        except Exception as e:
-            # FIXME: send error code
-            if hasattr(e, "origin"):
-                origin = getattr(e, "origin")
-            else:
-                # FIXME: get from traceback, last item
-                origin = None
-            tcis[path] = [
-                tcfl.tc_info_c(
-                    path, path,
-                    subcase_spec = subcase_spec,
-                    origin = origin,
-                    result = tcfl.result_c(blocked = 1),
-                    output = "Discovery Process output:\n" + sys.stderr.getvalue(),
-                    exception = e,
-                    formatted_traceback = traceback.format_tb(sys.exc_info()[2])
-                )
-            ]
-        self.queue.put({ "discovery_result": tcis })
-
-
     def _find_in_file(self, path, subcase_spec):
-        # Run this as subprocesses instead of a formal pool; WHY?
-        #
-        # - the subprocesses are free to import stuff, fork others, etc
-        #   and won't affect the current running image
-        #
-        # - DO NOT USE A POOL: if they crash, the Pool gets stuck
         file_name = os.path.basename(path)
         for ignore_regex, origin in self.filename_ignore_regexs:
             if ignore_regex.match(file_name):
@@ -584,12 +821,7 @@ class agent_c:
                 self.result.skipped += 1
                 return
 
-        self.proc_by_filename[path] = None
-        # NOTE we do not create p = commonl.fork_c() nor call
-        # p.start() to run here; this is done by agent_c.run() to run
-        # them in chunks (similar to a pool); otherwise we might have
-        # 10000 processes being started. Not fun. We don't use a pool,
-        # se above.
+        self.subcase_spec_by_filename[path] = subcase_spec
 
 
     def _find_in_directory(self, path, subcase_spec):
@@ -618,9 +850,6 @@ class agent_c:
 
 
     def _find_in_path(self, path, subcase_spec):
-        # FIXME this should cache stuff so we don't have to rescan all the
-        # times--if the ctime hasn't changed since our cache entry, then
-        # we use the cached value
         result = tcfl.result_c(0, 0, 0, 0, 0)
         tcfl.tc_global.report_info(
             "%s: finding testcases in " % path, dlevel = 4)
@@ -633,24 +862,102 @@ class agent_c:
             log.warning(f"{path}: invalid file type")
             result.blocked += 1
 
-    def tcis_get_from_queue(self):
-        tcis = {}
-        while True:
-            try:
-                msg = self.queue.get(block = False, timeout = 1)
-                if not isinstance(msg, dict):
-                    log.error(
-                        f"BUG: unknown message type {type(msg)}; expected dict")
+    def _discover_isolated(self, files):
+        # Scan each file on its own subprocess, so if it crashes or
+        # hangs, we know which file it was.
+        #
+        # Yields ( FILENAME, TCIS )
+        pending = list(files.items())
+        running = {}
+        while pending or running:
+            while pending and len(running) < self.threads:
+                filename, subcase_spec = pending.pop(0)
+                p = commonl.fork_function_c(_find_in_file_worker,
+                                            filename, subcase_spec)
+                p.start()
+                running[filename] = ( p, time.time() )
+            multiprocessing.connection.wait(
+                [ p.sentinel for p, _ts in running.values() ],
+                timeout = self.wait_period)
+            for filename, ( p, ts ) in list(running.items()):
+                # check exitcode before result, in case it sent it
+                # right before exiting
+                exitcode = p.exitcode
+                r, e, tb = p.result()
+                if r != None:
+                    tcis = r
+                elif e != None:
+                    tcis = _tcis_blocked(filename, files[filename], e,
+                                         formatted_traceback = [ tb ])
+                elif exitcode != None:
+                    log.error(f"{filename}: errored out")
+                    tcis = _tcis_blocked(
+                        filename, files[filename], RuntimeError(
+                            f"process failed with exitcode {exitcode}"))
+                elif time.time() - ts > self.timeout:
+                    log.error(f"{filename}: timed out")
+                    p.kill()
+                    tcis = _tcis_blocked(
+                        filename, files[filename], RuntimeError(
+                            f"discovery timed out after {self.timeout}s"))
+                else:
                     continue
-                for msg_k, msg_v in msg.items():
-                    if msg_k == "discovery_result":
-                        tcis.update(msg_v)
-                    else:
-                        log.error(
-                            f"BUG: unknown message type {type(msg)}")
-            except queue.Empty as e:	# queue.get() will raise on empty
-                break
-        return tcis
+                p.join()
+                del running[filename]
+                yield filename, tcis
+
+
+    def _discover(self, files):
+        # Scan the files in the discovery pool
+        #
+        # Yields ( FILENAME, TCIS )
+        suspects = {}
+        signature = _drivers_signature()
+        while files:
+            pool = _pool_get(self.threads, signature)
+            futures = {}
+            for filename, subcase_spec in files.items():
+                future = pool.submit(_find_in_file_worker,
+                                     filename, subcase_spec)
+                futures[future] = filename
+            requeue = {}
+            broken = False
+            not_done = set(futures)
+            while not_done:
+                done, not_done = concurrent.futures.wait(
+                    not_done, timeout = self.timeout,
+                    return_when = concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    # nothing completed in self.timeout seconds, so
+                    # whatever is running is hung; scan those on
+                    # their own and the rest on a new pool
+                    for future in not_done:
+                        filename = futures[future]
+                        if future.running():
+                            suspects[filename] = files[filename]
+                        else:
+                            requeue[filename] = files[filename]
+                    _pool_kill()
+                    break
+                for future in done:
+                    filename = futures[future]
+                    try:
+                        yield filename, future.result()
+                    except concurrent.futures.process.BrokenProcessPool:
+                        # a worker crashed, taking down whatever it
+                        # and the others were doing
+                        suspects[filename] = files[filename]
+                        broken = True
+                    except Exception as e:
+                        yield filename, _tcis_blocked(
+                            filename, files[filename], e)
+            if broken:
+                _pool_kill()		# next round gets a new one
+            files = requeue
+        if suspects:
+            log.warning(f"re-scanning {len(suspects)} files on separate"
+                        " processes after a discovery worker failed")
+            yield from self._discover_isolated(suspects)
 
 
     # COMPAT: removing list[str] so we work in python 3.8
@@ -703,89 +1010,35 @@ class agent_c:
 
             self._find_in_path(path, subcase_spec)
 
-        # ok, so now we have a bunch of proceses ready to start
-        # scanning
-        #
-        # This is a loop that keeps running, launching processes
-        # ensuring there are only N running at the same time (to keep
-        # a tab on resources).
-        procs = len(self.proc_by_filename)
-        log.warning(f"discovering on {procs} files")
-
-        while True:
-            # This has to be more hardcore
-            # We can't assume the process will notify, since if they
-            # crash for whichever reason they won't. So this needs to
-            # keep track of how many process have terminated, are
-            # running and notify more to start as neeedd.
-            pending = 0
-            running = 0
-            completed = 0
-
-            pending_tcs = []
-            for filename, p in list(self.proc_by_filename.items()):
-
-                if p == None:		   # did it start?
-                    pending += 1
-                    pending_tcs.append(filename)
-                    log.info(f"pending: {filename}")
-                elif p == True:		# already completed, see next
-                    completed += 1
-                elif p.exitcode == 0:   # done properly
-                    self.proc_by_filename[filename] = True
-                    completed += 1
-                    log.info(f"completed: {p.filename}")
-                elif p.exitcode != None:   # done
-                    self.proc_by_filename[filename] = True
-                    completed += 1
-                    log.error(f"{filename}: errored out")
-                    self.tcis[filename] = [
-                        tcfl.tc_info_c(
-                            filename, filename,
-                            origin = filename,
-                            result = tcfl.result_c(blocked = 1),
-                            exception = RuntimeError(
-                                f"process failed with exitcode {p.exitcode}"),
-                            formatted_traceback = traceback.format_stack(),
-                        )
-                    ]
-                else:
-                    log.info(f"currently running: {p.filename}")
-                    running += 1
-            log.warning(f"current loop {pending}/{running}/{completed}"
-                        f" out of {procs}")
-
-            if completed == procs:
-                log.warning(f"all {procs} discovery processes done")
-                break
-            if running < self.threads and pending_tcs:
-                # Fire up N of them
-                log.warning(
-                    f"starting {self.threads - running}"
-                    f" discoveries ({len(pending_tcs)},{pending} pending)")
-                for _ in range(self.threads - running):
-                    try:
-                        filename = pending_tcs.pop()
-                    except IndexError:
-                        break
-                    p = commonl.fork_c(self._process_find_in_file,
-                                       filename, subcase_spec)
-                    p.filename = filename
-                    log.info(f"started: {filename}")
-                    self.proc_by_filename[filename] = p
-                    p.start()
-
-            self.tcis.update(self.tcis_get_from_queue())
-            log.warning(
-                f"waiting {self.wait_period}s for"
-                f" {pending}/{running}/{completed}"
-                f" out of {procs}")
-            time.sleep(self.wait_period)
-
-
-        # we are done launching all subprocesses that discover
-        # testcases
-        self.tcis.update(self.tcis_get_from_queue())	# flush the queue
+        # Take from the cache whatever we can, scan the rest
+        files = len(self.subcase_spec_by_filename)
+        if self.cache_path:
+            cache = _cache_c(self.cache_path, _drivers_signature())
+        else:
+            cache = None
+        tcis_by_filename = {}
+        misses = {}
+        for filename, subcase_spec in self.subcase_spec_by_filename.items():
+            if cache:
+                tcis = cache.get(filename, subcase_spec)
+                if tcis != None:
+                    tcis_by_filename[filename] = tcis
+                    continue
+            misses[filename] = subcase_spec
+        log.warning(f"discovering on {files} files"
+                    f" ({files - len(misses)} cached)")
+
+        for filename, tcis in self._discover(misses):
+            tcis_by_filename[filename] = tcis
+            if cache:
+                cache.set(filename, tcis)
+        if cache:
+            cache.prune(self.cache_entries)
+
+        # keep the order in which files were found, so it is
+        # consistent from run to run
+        for filename in self.subcase_spec_by_filename:
+            self.tcis.update(tcis_by_filename.get(filename, {}))
 
         if len(self.tcis) == 0:
             log.error("WARNING! No testcases found")
@@ -69,6 +69,10 @@ class driver(tcfl.tc.report_driver_c):
       >>> verify_certs = False
 
     """
+    # talk to the database from a worker thread, so a slow database
+    # doesn't stall the testcases
+    asynchronous = True
+
     def __init__(self, es_hosts, index_name, **es_args):
         assert isinstance(index_name, str), \
             f"index_name: expected str; got {type(index_name)}"
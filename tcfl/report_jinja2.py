@@ -115,6 +115,10 @@ class driver(tc.report_driver_c):
     # abbreviations.
     timezone = os.environ.get('REPORT_TZ', os.environ.get('TZ', None))
 
+    # writing to the log files and rendering the templates is done
+    # from a worker thread, not from the testcase's
+    asynchronous = True
+
     def __init__(self, log_dir, timezone = None):
         """
         Initialize the Jinja2 templating driver
@@ -630,7 +634,9 @@ class driver(tc.report_driver_c):
             try:
                 of.write(f"[{d} +{delta:.1f}s] " + message)
             except ValueError as e:
-                testcase.log.error(f"can't write to dump file fd {of.name}/{of.fileno()}")
+                # eg: reported after COMPLETION closed the file
+                testcase.log.error(
+                    f"can't write to dump file {of.name}: {e}")
                 return
 
         if attachments != None:
@@ -173,6 +173,10 @@ class driver_summary(tcfl.tc.report_driver_c):
       index_column, index_value.
 
     """
+    # talk to the database from a worker thread, so a slow database
+    # doesn't stall the testcases
+    asynchronous = True
+
     def __init__(self, hostname, database, password = None,
                  port = 3307, ssl = True,
                  table_name_prefix = "", mariadb_extra_opts = None):
@@ -143,6 +143,10 @@ class driver(tcfl.tc.report_driver_c):
               ssl_ca_certs = PATH_TO_CA_FILE,
           )
     """
+    # talk to the database from a worker thread, so a slow database
+    # doesn't stall the testcases
+    asynchronous = True
+
     def __init__(self, url, db_name, collection_name, extra_params = None):
         assert isinstance(url, str)
         assert isinstance(db_name, str)
@@ -44,6 +44,40 @@ def _delete(server, allocid):
         # already wiped
 
 
+#: Ask servers to hold keepalives sent while waiting for allocations
+#: until their state changes (or up to a keepalive period), so we
+#: learn about it right away.
+#:
+#: Only useful with servers configured to allow it (see
+#: :data:`ttbl.allocation.keepalive_waiters_max`), since each waiting
+#: keepalive takes a server process; disabled by default.
+keepalive_wait = False
+
+def _keepalive_wait(server, data, wait):
+    # keepalive the allocations in data ({ ALLOCID: STATE }), asking
+    # the server to wait up to *wait* seconds for any of them to
+    # change state, so we know right away; servers that don't support
+    # waiting return right away, so we wait instead for the next
+    # keepalive
+    ts0 = time.time()
+    if wait > 0:
+        r = server.send_request("PUT", "keepalive?wait=%g" % wait,
+                                json = data, timeout = 160 + wait)
+    else:
+        r = server.send_request("PUT", "keepalive", json = data)
+    # COMPAT: old version packed the info in the 'result' field,
+    # newer have it in the first level dictionary
+    if 'result' in r:
+        result = r.pop('result')
+        r.update(result)
+    # COMPAT: end
+    if not any(allocid in r for allocid in data):
+        ts = time.time()
+        if ts - ts0 < wait:
+            time.sleep(wait - (ts - ts0))
+    return r
+
+
 # FIXME: what happens if the target is disabled / removed while we wait
 # FIXME: what happens if the conn
 def _alloc_targets(server, groups, obo = None,
@@ -138,12 +172,15 @@ def _alloc_targets(server, groups, obo = None,
                 raise tcfl.tc.blocked_e(
                     "can't acquire targets, still busy after %ds"
                     % queue_timeout, dict(targets = groups))
-            time.sleep(keepalive_period)
-            ts = time.time()
             state = data[allocid]
             try:
-                #print(f"DEBUG: alloc/keepalive", file = sys.stderr)
-                r = server.send_request("PUT", "keepalive", json = data)
+                if keepalive_wait:
+                    # returns as soon as the state changes
+                    r = _keepalive_wait(server, data, keepalive_period)
+                else:
+                    time.sleep(keepalive_period)
+                    r = _keepalive_wait(server, data, 0)
+                ts = time.time()
             except requests.exceptions.RequestException as e:
                 ts = time.time()
                 if retry_ts == None:
@@ -156,6 +193,7 @@ def _alloc_targets(server, groups, obo = None,
                 logging.warning(
                     f"retrying for {retry_timeout - (ts - retry_ts):.0f}s"
                     f" alloc/keepalive after connection error {type(e)}: {e}")
+                time.sleep(keepalive_period)
                 continue
         except KeyboardInterrupt:
             # HACK: if we are interrupted, cancel this allocation so
@@ -168,12 +206,6 @@ def _alloc_targets(server, groups, obo = None,
                 _delete(server, allocid)
             raise
 
-        # COMPAT: old version packed the info in the 'result' field,
-        # newer have it in the first level dictionary
-        if 'result' in r:
-            result = r.pop('result')
-            r.update(result)
-        # COMPAT: end
         commonl.progress(
             "allocation ID %s: [+%.1fs] alloc/keeping alive during state '%s': %s"
             % (allocid, ts - ts0, state, r))
@@ -204,15 +236,22 @@ def _alloc_hold(server, allocid, state, ts0, max_hold_time,
     retry_ts = None
     retry_timeout = 40
     while True:
-        time.sleep(keep_alive_period)
         ts = time.time()
         if max_hold_time > 0 and ts - ts0 > max_hold_time:
             # maximum hold time reached, release it
             break
         data = { allocid: state }
+        wait = keep_alive_period
+        if max_hold_time > 0:
+            wait = max(0, min(wait, ts0 + max_hold_time - ts))
         try:
-            #print(f"DEBUG: holding/keepalive ", file = sys.stderr)
-            r = server.send_request("PUT", "keepalive", json = data)
+            if keepalive_wait:
+                # returns as soon as the state changes
+                r = _keepalive_wait(server, data, wait)
+            else:
+                time.sleep(wait)
+                r = _keepalive_wait(server, data, 0)
+            ts = time.time()
         except requests.exceptions.RequestException as e:
             ts = time.time()
             if retry_ts == None:
@@ -225,14 +264,9 @@ def _alloc_hold(server, allocid, state, ts0, max_hold_time,
             logging.warning(
                 f"retrying for {retry_timeout - (ts - retry_ts):.0f}s"
                 f" hold/keepalive after connection error {type(e)} {e}")
+            time.sleep(keep_alive_period)
             continue
 
-        # COMPAT: old version packed the info in the 'result' field,
-        # newer have it in the first level dictionary
-        if 'result' in r:
-            result = r.pop('result')
-            r.update(result)
-        # COMPAT: end
         commonl.progress(
             "allocation ID %s: [+%.1fs] hold/keeping alive during state '%s': %s"
             % (allocid, ts - ts0, state, r))
@@ -28,9 +28,13 @@ wait for things to be found when such captures, such as images on screenshots.
 #     image_on_screenshot()
 #       _expect_image_on_screenshot_c
 #         detect()
-#           _squares_overlap()
-#             _template_find()
+#           _frame_get()
+#           _templates_match()
+#             _area_to_match()
+#             _templates_find()
+#               _template_pyramid_get()
 #               _template_find_gray()
+#           _squares_overlap()
 #         flush()
 #           _draw_text()
 #
@@ -42,9 +46,11 @@ import collections
 import contextlib
 import inspect
 import logging
+import math
 import os
 import shutil
 import time
+import zlib
 
 import commonl
 from . import tc
@@ -56,7 +62,8 @@ from . import msgid_c
 # show up in an screenshot
 #
 
-def _template_find_gray(image_gray, template, threshold = 0.8):
+def _template_find_gray(image_gray, template, threshold = 0.8,
+                        area = None):
     try:
         import cv2
         import imutils
@@ -69,86 +76,103 @@ def _template_find_gray(image_gray, template, threshold = 0.8):
     #
     # coordinates are 0,0 on top-left corner of the image
     #
+    # if area (X0, Y0, X1, Y1) in pixels is given, only look at the
+    # placements of the template that overlap it
     assert threshold > 0 and threshold <= 1
     width, height = template.shape[::-1]
     image_width, image_height = image_gray.shape[::-1]
+    x0 = y0 = 0
+    if area:
+        x0 = max(0, area[0] - width + 1)
+        y0 = max(0, area[1] - height + 1)
+        x1 = min(image_width, area[2] + width - 1)
+        y1 = min(image_height, area[3] + height - 1)
+        if x1 - x0 < width or y1 - y0 < height:
+            return []
+        image_gray = image_gray[y0:y1, x0:x1]
     result = cv2.matchTemplate(image_gray, template, cv2.TM_CCOEFF_NORMED)
     locations = numpy.where(result >= threshold)
     r = []
     for point in zip(*locations[::-1]):
         r.append((
-            float(point[0]) / image_width,
-            float(point[1]) / image_height,
-            float(point[0] + width) / image_width,
-            float(point[1] + height) / image_height,
+            float(x0 + point[0]) / image_width,
+            float(y0 + point[1]) / image_height,
+            float(x0 + point[0] + width) / image_width,
+            float(y0 + point[1] + height) / image_height,
         ))
     return r
 
-def _template_find(image_filename, image_rgb,
-                   template_filename, template,
-                   min_width = 30, min_height = 30):
+
+# cache of template downscales, keyed by template file, its
+# modification time and the size limits
+_template_pyramids = {}
+
+def _template_pyramid_get(template_filename, template,
+                          min_width = 30, min_height = 30):
+    # Return a list of (SCALE, TEMPLATE) of the template downscaled
+    # to each of _template_scales, until it gets smaller than the
+    # limits; computed only once per template
     try:
-        import cv2
         import imutils
         import numpy
     except ImportError as e:
         raise RuntimeError("Image matching won't work; need packages"
                            " cv2, imutils, numpy") from e
-    # Finds a template in an image, possibly scaling the template and
-    # returning the locations where found in a resolution indendent
-    # way
-    image_gray = cv2.cvtColor(image_rgb, cv2.COLOR_BGR2GRAY)
-    image_width, image_height = image_gray.shape[::-1]
-    template = cv2.imread(template_filename, 0)
-    template_width, template_height = template.shape[::-1]
-
-    #for scale in numpy.linspace(0.2, 1.0, 20)[::-1]:
-    squares = {}
-
-    # Scale down the image to find smaller hits of the icon
+    key = ( template_filename, os.stat(template_filename).st_mtime_ns,
+            min_width, min_height )
+    pyramid = _template_pyramids.get(key, None)
+    if pyramid != None:
+        return pyramid
+    pyramid = []
     for scale in numpy.linspace(0.2, 1.0, 20)[::-1]:
-
-        image_gray_resized = imutils.resize(
-            image_gray, width = int(image_gray.shape[1] * scale))
-
-        w, h = image_gray_resized.shape[::-1]
-
-        # stop if the image is smaller than the template
-        if w < template_width or h < template_height:
-            logging.warning("%s: stopping at scale %.2f: smaller than "
-                            "template", image_filename, scale)
-            break
-        if w < min_width or h < min_height:
-            logging.warning("%s: stopping at scale %.2f: smaller than "
-                            "args limit", image_filename, scale)
-            break
-
-        r = _template_find_gray(image_gray_resized, template)
-        for square in r:
-            square_original = (
-                int(square[0] * image_width),
-                int(square[1] * image_height),
-                int(square[2] * image_width),
-                int(square[3] * image_height),
-            )
-            squares[scale] = dict(relative = square,
-                                  absolute = square_original)
-
-    # scale down the template to find smaller hits of the template
-    for scale in numpy.linspace(0.2, 1.0, 20)[::-1]:
-
         template_resized = imutils.resize(
             template, width = int(template.shape[1] * scale))
-
         w, h = template_resized.shape[::-1]
-        #print "DEBUG scaling template to %d %d" % (w, h)
         # stop if the template size gets too small
         if w < min_width or h < min_height:
             logging.warning("%s: stopping at scale %.2f: smaller than "
                             "args limit", template_filename, scale)
             break
+        pyramid.append(( scale, template_resized ))
+    _template_pyramids[key] = pyramid
+    return pyramid
+
+
+def _templates_find(image_filename, image_gray, templates,
+                    image_pyramid = None):
+    try:
+        import imutils
+        import numpy
+    except ImportError as e:
+        raise RuntimeError("Image matching won't work; need packages"
+                           " cv2, imutils, numpy") from e
+    # Finds multiple templates in an image, possibly scaling the
+    # templates and returning the locations where found in a
+    # resolution indendent way
+    #
+    # templates is a dict keyed by name of (TEMPLATE_FILENAME,
+    # TEMPLATE, MIN_WIDTH, MIN_HEIGHT, AREA); AREA is None to look
+    # everywhere or (X0, Y0, X1, Y1) in pixels to only look for
+    # placements overlapping it (eg: because the rest of the image
+    # has not changed since we last looked).
+    #
+    # image_pyramid is a dict where the image downscales are cached,
+    # so they are done only once even if called multiple times for
+    # the same image.
+    #
+    # Returns a dict keyed by name of dicts keyed by scale of the
+    # squares where each template was found.
+    if image_pyramid == None:
+        image_pyramid = {}
+    image_width, image_height = image_gray.shape[::-1]
+    squares = {}
+    pending = {}
+    for name, ( template_filename, template,
+                min_width, min_height, area ) in templates.items():
+        squares[name] = {}
+        pending[name] = ( template.shape[::-1], min_width, min_height, area )
 
-        r = _template_find_gray(image_gray, template_resized)
+    def _squares_add(name, scale, r):
         for square in r:
             square_original = (
                 int(square[0] * image_width),
@@ -156,11 +180,88 @@ def _template_find(image_filename, image_rgb,
                 int(square[2] * image_width),
                 int(square[3] * image_height),
             )
-            squares[1/scale] = dict(relative = square,
-                                    absolute = square_original)
+            squares[name][scale] = dict(relative = square,
+                                        absolute = square_original)
+
+    # Scale down the image to find smaller hits of the templates; each
+    # downscale is done once for all the templates
+    full_scale_done = set()
+    for scale in numpy.linspace(0.2, 1.0, 20)[::-1]:
+        if not pending:
+            break
+        image_gray_resized = image_pyramid.get(scale, None)
+        if image_gray_resized is None:
+            image_gray_resized = imutils.resize(
+                image_gray, width = int(image_gray.shape[1] * scale))
+            image_pyramid[scale] = image_gray_resized
+        w, h = image_gray_resized.shape[::-1]
+        for name, ( template_size, min_width, min_height, area ) \
+            in list(pending.items()):
+            template_width, template_height = template_size
+            # stop if the image is smaller than the template
+            if w < template_width or h < template_height:
+                logging.warning("%s: stopping at scale %.2f: smaller than "
+                                "template", image_filename, scale)
+                del pending[name]
+                continue
+            if w < min_width or h < min_height:
+                logging.warning("%s: stopping at scale %.2f: smaller than "
+                                "args limit", image_filename, scale)
+                del pending[name]
+                continue
+            if area:
+                # each resized pixel averages the original ones it
+                # covers; add one pixel to account for rounding
+                area_resized = (
+                    area[0] * w // image_width - 1,
+                    area[1] * h // image_height - 1,
+                    -(-area[2] * w // image_width) + 1,
+                    -(-area[3] * h // image_height) + 1,
+                )
+            else:
+                area_resized = None
+            r = _template_find_gray(image_gray_resized,
+                                    templates[name][1],
+                                    area = area_resized)
+            _squares_add(name, scale, r)
+            if scale == 1.0:
+                full_scale_done.add(name)
+
+    # scale down the templates to find smaller hits of each
+    for name, ( template_filename, template,
+                min_width, min_height, area ) in templates.items():
+        pyramid = _template_pyramid_get(template_filename, template,
+                                        min_width, min_height)
+        for scale, template_resized in pyramid:
+            if scale == 1.0 and name in full_scale_done:
+                # same as matching on the image at full scale
+                continue
+            r = _template_find_gray(image_gray, template_resized,
+                                    area = area)
+            _squares_add(name, 1/scale, r)
 
     return squares
 
+
+def _template_find(image_filename, image_rgb,
+                   template_filename, template,
+                   min_width = 30, min_height = 30):
+    try:
+        import cv2
+    except ImportError as e:
+        raise RuntimeError("Image matching won't work; need packages"
+                           " cv2, imutils, numpy") from e
+    # Finds a template in an image, possibly scaling the template and
+    # returning the locations where found in a resolution indendent
+    # way
+    image_gray = cv2.cvtColor(image_rgb, cv2.COLOR_BGR2GRAY)
+    squares = _templates_find(
+        image_filename, image_gray,
+        { 'template': ( template_filename, template,
+                        min_width, min_height, None ) })
+    return squares['template']
+
+
 class _expect_image_on_screenshot_c(tc.expectation_c):
     # note the parameters are fully documented in
     # :meth:`extension.image_on_screenshot`
@@ -218,6 +319,8 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
         # FIXME: raise exception if too small
         self.min_width = min_width
         self.min_height = min_height
+        self.sequenced = target.rt.get('interfaces', {}).get('capture', {})\
+            .get(capturer, {}).get('sequenced', False)
 
     def poll_context(self):
         # we are polling from target with role TARGET.WANT_NAME from
@@ -231,9 +334,25 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
         # we'll share them amongs multiple expectations
         buffers_poll.setdefault('screenshot_count', 0)
         buffers_poll.setdefault('screenshots', [])
+        if self.sequenced:
+            # the capturer can tell us if the screen changed since the
+            # last frame we got; if not, no need to download it again
+            r = target.capture.start(
+                self.capturer, since = buffers_poll.get('sequence', None))
+            if not r.get('changed', True):
+                target.report_info('%s: screen unchanged since frame #%d'
+                                   % (self.capturer, r['sequence']),
+                                   dlevel = 3)
+                return
+            buffers_poll['sequence'] = r['sequence']
+        else:
+            r = target.capture.start(self.capturer)
         dirname = os.path.join(testcase.tmpdir,
                                'expect-buffer-poll-%s' % self.poll_name)
         commonl.makedirs_p(dirname)
+        # keep the extension the server gave the file, so it is
+        # easier to tell the format
+        _, extension = os.path.splitext(r.get('default', "screenshot.png"))
         filename = os.path.join(
             dirname,
             '.'.join([
@@ -241,16 +360,128 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
                 run_name, self.poll_name,
                 # FIXME: replace number with datestamp? ideally from server?
                 '%02d' % buffers_poll['screenshot_count'],
-                'png'
-            ])
+            ]) + extension
         )
-        target.capture.get(self.capturer, filename)
+        target.capture.get(self.capturer, "default", filename)
         buffers_poll['screenshot_count'] += 1
         buffers_poll['screenshots'].append(filename)
         target.report_info('captured screenshot from %s to %s'
                            % (self.capturer, filename), dlevel = 2)
 
 
+    @staticmethod
+    def _frame_get(buffers_poll, filename):
+        # Load a screenshot, converted to gray and hashed, only once
+        # for all the expectations that detect on it
+        import cv2
+        frame = buffers_poll.get('frame', None)
+        if frame != None and frame['filename'] == filename:
+            return frame
+        gray = cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2GRAY)
+        frame = dict(
+            filename = filename,
+            gray = gray,
+            crc = zlib.crc32(gray),
+            # downscales of the image, see _templates_find()
+            pyramid = {},
+            # results of _templates_find() for each expectation
+            results = {},
+        )
+        buffers_poll['frame'] = frame
+        return frame
+
+
+    def _area_to_match(self, state, frame):
+        # Return the area (X0, Y0, X1, Y1) in pixels where the
+        # template has to be looked for in the frame, *None* for all
+        # of it or *False* if it has not changed since the last
+        # frame we looked at (so it can't be found either)
+        import numpy
+        gray = frame['gray']
+        height, width = gray.shape
+        area = None
+        if self.in_area:
+            area = (
+                int(self.in_area[0] * width),
+                int(self.in_area[1] * height),
+                math.ceil(self.in_area[2] * width),
+                math.ceil(self.in_area[3] * height),
+            )
+        gray_last = state['gray']
+        if gray_last is None or gray_last.shape != gray.shape:
+            return area
+        if state['crc'] == frame['crc']:
+            return False
+        changed = gray_last != gray
+        rows = numpy.flatnonzero(changed.any(axis = 1))
+        if len(rows) == 0:
+            return False
+        cols = numpy.flatnonzero(changed.any(axis = 0))
+        changed_area = ( int(cols[0]), int(rows[0]),
+                         int(cols[-1]) + 1, int(rows[-1]) + 1 )
+        if area == None:
+            return changed_area
+        area = (
+            max(area[0], changed_area[0]),
+            max(area[1], changed_area[1]),
+            min(area[2], changed_area[2]),
+            min(area[3], changed_area[3]),
+        )
+        if area[0] >= area[2] or area[1] >= area[3]:
+            return False
+        return area
+
+
+    def _templates_match(self, run_name, frame, expectations):
+        # Look in the frame for the templates of all the expectations
+        # that haven't yet, in one go
+        templates = {}
+        for name, state in expectations.items():
+            if name in frame['results']:
+                continue
+            exp = state['expectation']
+            area = exp._area_to_match(state, frame)
+            state['gray'] = frame['gray']
+            state['crc'] = frame['crc']
+            if area == False:
+                frame['results'][name] = None
+                continue
+            templates[name] = (
+                exp.template_image_filename, exp.template_img,
+                exp.min_width, exp.min_height, area
+            )
+        if not templates:
+            return
+        ts0 = time.time()
+        frame['results'].update(_templates_find(
+            frame['filename'], frame['gray'], templates, frame['pyramid']))
+        self.target.report_info(
+            '%s/%s: matched %d templates (%s) in %.1fms'
+            % (run_name, self.name, len(templates),
+               " ".join(templates), 1000 * (time.time() - ts0)),
+            dlevel = 3)
+
+
+    @staticmethod
+    def _expectations_unregister(exp, buffers_poll):
+        expectations = buffers_poll.get('image_expectations', {})
+        state = expectations.get(exp.name, None)
+        if state and state['expectation'] is exp:
+            del expectations[exp.name]
+        if not expectations:
+            # nobody else will look at it
+            buffers_poll.pop('frame', None)
+
+
+    def on_found(self, run_name, poll_context, buffers_poll, buffers,
+                 ellapsed, timeout, match_data):
+        # found, no need to keep matching our template
+        self._expectations_unregister(self, buffers_poll)
+        tc.expectation_c.on_found(self, run_name, poll_context,
+                                  buffers_poll, buffers,
+                                  ellapsed, timeout, match_data)
+
+
     @staticmethod
     def _squares_overlap(ra, rb):
         #
@@ -284,6 +515,7 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
 
 
     def _draw_text(self, img, text, x, y):
+        import cv2
         img_w, img_h, _ = img.shape[::-1]
         # FIXME: make it a translucent box with an arrow at some point...
         font = cv2.FONT_HERSHEY_SIMPLEX
@@ -338,6 +570,7 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
           >>> }
 
         """
+        import cv2
         target = self.target
         if not buffers_poll.get('screenshot_count', 0):
             target.report_info('%s/%s: not detecting, no screenshots yet'
@@ -348,11 +581,23 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
                            % (run_name, self.name, most_recent),
                            dlevel = 2)
         buffers['current'] = most_recent
-        screenshot_img = cv2.imread(most_recent)
-        r = _template_find(
-            most_recent, screenshot_img,
-            self.template_image_filename, self.template_img,
-            min_width = self.min_width, min_height = self.min_height)
+        frame = self._frame_get(buffers_poll, most_recent)
+        # register so whoever detects first on a new screenshot
+        # matches our template too
+        expectations = buffers_poll.setdefault('image_expectations', {})
+        state = expectations.get(self.name, None)
+        if state == None or state['expectation'] is not self:
+            expectations[self.name] = dict(expectation = self,
+                                           gray = None, crc = None)
+        if self.name not in frame['results']:
+            self._templates_match(run_name, frame, expectations)
+        r = frame['results'][self.name]
+        if r == None:
+            target.report_info(
+                '%s/%s: not detecting, %s has not changed where we look'
+                % (run_name, self.name, most_recent), dlevel = 3)
+            return None
+        r = dict(r)	# we'll modify it and might be shared
         if self.in_area:
             r_in_area = {}
             ax0 = self.in_area[0]
@@ -367,7 +612,7 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
                 x1 = area_rel[2]
                 y1 = area_rel[3]
                 if x0 >= ax0 and y0 >= ay0 \
-                   and x1 <= ax1 and y1 <= ax1:
+                   and x1 <= ax1 and y1 <= ay1:
                     r_in_area[scale] = dict(relative = area_rel,
                                             absolute = area_abs)
                     target.report_info(
@@ -432,6 +677,8 @@ class _expect_image_on_screenshot_c(tc.expectation_c):
             return r
 
     def flush(self, testcase, run_name, buffers_poll, buffers, results):
+        import cv2
+        self._expectations_unregister(self, buffers_poll)
         if 'collateral' in buffers_poll:
             # write the collateral images, which basically have
             # squares drawn on the icons we were asked to look for--we
@@ -525,7 +772,7 @@ class extension(tc.target_extension_c):
         capturers = self.target.properties_get(f"interfaces.capture.{capturer}.*")
         return capturers.get('interfaces', {}).get('capture', {}).get(capturer, {})
 
-    def start(self, capturer):
+    def start(self, capturer, since: int = None):
         """
         Take a snapshot or start capturing
 
@@ -533,11 +780,29 @@ class extension(tc.target_extension_c):
 
         :param str capturer: capturer to use, as listed in the
           target's *capture*
+
+        :param int since: (optional) for capturers that number their
+          snapshots (inventory *interfaces.capture.CAPTURER.sequenced*
+          is *True*), *sequence* number returned by a previous call;
+          if the snapshot has not changed since, nothing is captured
+          and *changed* is returned as *False*:
+
+          >>> r = target.capture.start("screen")
+          >>> ...
+          >>> r = target.capture.start("screen", since = r['sequence'])
+          >>> if r['changed']:
+          >>>     target.capture.get("screen", "default", "screen.ppm")
+
         :returns: dictionary of values passed by the server
         """
+        assert since == None or isinstance(since, int)
         self.target.report_info("%s: starting capture" % capturer, dlevel = 3)
-        r = self.target.ttbd_iface_call("capture", "start", method = "PUT",
-                                        capturer = capturer)
+        if since == None:
+            r = self.target.ttbd_iface_call("capture", "start", method = "PUT",
+                                            capturer = capturer)
+        else:
+            r = self.target.ttbd_iface_call("capture", "start", method = "PUT",
+                                            capturer = capturer, since = since)
         self.target.report_info("%s: started capture: %s" % (capturer, r),
                                 dlevel = 2)
         return r
@@ -73,6 +73,7 @@ import numbers
 import os
 import re
 import sys
+import threading
 import time
 import traceback
 import typing
@@ -93,6 +94,258 @@ def _poll_context(target, console):
         + (console if console else target.console.default)
 
 
+#: Stream the console output instead of polling for it
+#:
+#: When greater than zero, console expectations (see
+#: :class:`expect_text_on_console_c`) read the console in a
+#: background thread that asks the server to keep each read
+#: open for up to this many seconds, sending new output as it comes
+#: (see :ref:`GET /targets/TARGETID/console/read
+#: <http_target_console_read>`). Polling the expectation then just
+#: looks at what has been received so far, without contacting the
+#: server.
+#:
+#: Each streaming console keeps a server worker busy while being
+#: read, so this is disabled by default; enable in a configuration
+#: file with:
+#:
+#: >>> tcfl.target_ext_console.stream_follow = 10
+stream_follow = 0
+
+class _console_streamer_c:
+    """
+    Read a console in the background to a local capture file
+
+    Keeps asking the server to read from where the previous read
+    left, following the console for :data:`stream_follow` seconds
+    each time, so new data is written to the capture file as soon
+    as the server sees it.
+
+    If the server can't follow, it falls back to reading every
+    *poll_period* seconds.
+
+    The thread stops on its own when nobody has asked for the
+    current state with :meth:`state_get` in *idle_max* seconds (eg:
+    the testcase is not expecting anything anymore) or when there
+    is an error; :meth:`state_get` reports it, so then a new one
+    can be started.
+    """
+    def __init__(self, target, console, of, read_offset, generation,
+                 poll_period, idle_max = 30):
+        self.target = target
+        self.console = console
+        self.of = of
+        self.poll_period = poll_period
+        self.idle_max = idle_max
+        self.lock = threading.Lock()
+        # all these are accessed under self.lock
+        self.read_offset = read_offset
+        self.generation = generation
+        self.exception = None
+        self.ts_state_get = time.time()
+        self.thread = threading.Thread(
+            target = self._run, args = ( tcfl.msgid_c.current(), ),
+            name = f"console-stream-{target.id}-{console}",
+            daemon = True)
+        self.thread.start()
+
+    def state_get(self):
+        """
+        Return the current state of the capture
+
+        :returns: tuple *( GENERATION, READ_OFFSET, ALIVE, EXCEPTION
+          )*; *ALIVE* is *False* if the thread has stopped and
+          *EXCEPTION* the exception that stopped it, if any.
+        """
+        with self.lock:
+            self.ts_state_get = time.time()
+            return self.generation, self.read_offset, \
+                self.thread.is_alive(), self.exception
+
+    def _chunk_cb(self, generation, offset):
+        # publish data as it is written to the capture file, so
+        # whoever is expecting it sees it without waiting for the
+        # whole follow request to end
+        with self.lock:
+            if self.generation == None or self.generation == generation:
+                self.generation = generation
+                self.read_offset = offset
+            # else the console restarted, _run() will re-read
+
+    def _read(self, read_offset, follow):
+        headers = {}
+        generation, new_offset, _total_bytes = \
+            self.target.console.read_full(
+                self.console, read_offset, fd = self.of, newline = '',
+                follow = follow, _headers = headers,
+                _chunk_cb = self._chunk_cb)
+        return generation, new_offset, 'X-Stream-Follow' in headers
+
+    def _run(self, msgid_parent):
+        target = self.target
+        with tcfl.msgid_c(parent = msgid_parent):
+            try:
+                while True:
+                    with self.lock:
+                        if time.time() - self.ts_state_get > self.idle_max:
+                            return
+                        read_offset = self.read_offset
+                        generation_prev = self.generation
+                    generation, new_offset, followed = \
+                        self._read(read_offset, stream_follow)
+                    if generation_prev != None \
+                       and generation_prev < generation:
+                        # console restarted, offsets are no longer
+                        # valid, re-read from the start; same as
+                        # expect_text_on_console_c._poll()
+                        target.report_info(
+                            "console %s:%s restarted, re-reading from start"
+                            % (target.fullid, self.console), dlevel = 5)
+                        generation, new_offset, followed = \
+                            self._read(0, 0)
+                    with self.lock:
+                        self.generation = generation
+                        self.read_offset = new_offset
+                    if not followed:
+                        # server doesn't know how to follow, poll
+                        time.sleep(self.poll_period)
+            except Exception as e:
+                with self.lock:
+                    self.exception = e
+
+
+class _console_scanner_c:
+    """
+    Search for patterns in a console capture file
+
+    There is one per poll context, shared by all the expectations
+    looking at the same console capture, so the file is mapped only
+    once each time it grows and not once per expectation and
+    detection pass.
+
+    Each pattern is searched for in place in the mapping (no copies)
+    and only over the data that came in since it was last searched
+    for in the same detection context, plus an overlap window so
+    matches that straddle the previous end of the data are still
+    found.
+    """
+    def __init__(self, of):
+        self.of = of
+        self.mapping = None
+        self.size = 0
+        #: How far each pattern has been searched for without a match
+        #:
+        #: Keyed by *( DETECT_CONTEXT, REGEX )*, value is an offset
+        #: in the capture file
+        self.scanned = {}
+
+    def map(self):
+        """
+        Map the current contents of the capture file
+
+        :returns: size of the data mapped
+        """
+        size = os.fstat(self.of.fileno()).st_size
+        if size == self.size:
+            return size
+        if self.mapping:
+            self.mapping.close()
+            self.mapping = None
+        self.size = size
+        if size == 0:			# can't map empty files
+            return size
+        # we mmap because we don't want to (a) read a lot of a huger
+        # file line by line and (b) share file pointers -- we'll look
+        # to our own offset instead of relying on that. Other
+        # expectations might be looking at this file in parallel.
+        if sys.platform == "win32":
+            extra_args = [ None, mmap.ACCESS_READ, 0 ] # just offset
+        else:
+            extra_args = [ mmap.MAP_PRIVATE, mmap.PROT_READ, 0 ]
+        self.mapping = mmap.mmap(self.of.fileno(), size, *extra_args)
+        return size
+
+    def search(self, regex, detect_context, search_offset, overlap):
+        """
+        Search for a regular expression in the mapped data
+
+        :param re.Pattern regex: compiled regular expression (bytes)
+        :param str detect_context: detection context the search is
+          done for; positions already searched are tracked per
+          context
+        :param int search_offset: offset from which to search
+        :param int overlap: how many bytes before the end of the
+          data searched last time to search again
+        :returns: :class:`_console_match_c` object, whose offsets
+          are absolute in the capture file, or *None*
+        """
+        if self.mapping == None:
+            return None
+        key = ( detect_context, regex )
+        pos = max(search_offset, self.scanned.get(key, 0) - overlap)
+        # search a view that starts at search_offset, as if it were
+        # the whole data, so *^* and look-behinds work the same as
+        # searching a copy of it; searching the mapping with a
+        # starting position would make *^* only match after
+        # newlines. Start searching at pos, where the data we
+        # haven't looked at yet starts.
+        #
+        # The views have to be released before the mapping can be
+        # closed, so don't return the match, which refers to them
+        with memoryview(self.mapping) as view, \
+             view[search_offset:] as data:
+            match = regex.search(data, pos - search_offset)
+            if match:
+                match = _console_match_c(match, search_offset)
+        if match:
+            # nothing past the match has been looked at
+            self.scanned.pop(key, None)
+        else:
+            self.scanned[key] = self.size
+        return match
+
+
+class _console_match_c:
+    """
+    Result of :meth:`_console_scanner_c.search`
+
+    Like a :class:`re.Match` object, but with offsets absolute in
+    the capture file and not referring to the data searched.
+    """
+    def __init__(self, match, offset):
+        self.offset = offset
+        self._spans = [
+            match.span(group) for group in range(match.re.groups + 1) ]
+        self._groups = match.groups()
+        self._group = match.group()
+        self._groupdict = match.groupdict()
+
+    def start(self, group = 0):
+        return self.span(group)[0]
+
+    def end(self, group = 0):
+        return self.span(group)[1]
+
+    def span(self, group = 0):
+        start, end = self._spans[group]
+        if start == -1:		# group didn't match
+            return start, end
+        return start + self.offset, end + self.offset
+
+    def group(self, group = 0):
+        if isinstance(group, str):
+            return self._groupdict[group]
+        if group == 0:
+            return self._group
+        return self._groups[group - 1]
+
+    def groups(self):
+        return self._groups
+
+    def groupdict(self):
+        return self._groupdict
+
+
 class expect_text_on_console_c(tc.expectation_c):
     """Object that expects to find a string or regex in a target's
     serial console.
@@ -102,6 +355,14 @@ class expect_text_on_console_c(tc.expectation_c):
     used with the expecter engine, :meth:`tcfl.tc.tc_c.expect`.
 
     """
+    #: When searching for text in the console output that has
+    #: already been searched, go back this many bytes from where the
+    #: previous search ended
+    #:
+    #: Text that spans more than this over the end of the previous
+    #: search might not be found.
+    scan_overlap = 4096
+
     def __init__(self,
                  text_or_regex,
                  console = None,	# default
@@ -259,6 +520,9 @@ class expect_text_on_console_c(tc.expectation_c):
         of = buffers_poll['of']
         ofd = of.fileno()
 
+        if stream_follow > 0:
+            return self._poll_stream(run_name, buffers_poll)
+
         try:
             ts_start = time.time()
             target.report_info(
@@ -315,6 +579,46 @@ class expect_text_on_console_c(tc.expectation_c):
                    target.fullid, self.console, read_offset, e),
                 { "error trace": traceback.format_exc() })
 
+    def _poll_stream(self, run_name, buffers_poll):
+        # the console is being read into the capture file by a
+        # _console_streamer_c thread; just account for what it has
+        # read so far
+        target = self.target
+        streamer = buffers_poll.get('streamer', None)
+        if streamer == None:
+            generation = buffers_poll.get('generation', None)
+            read_offset = buffers_poll.get('read_offset', 0)
+        else:
+            generation, read_offset, alive, exception = \
+                streamer.state_get()
+            if exception:
+                del buffers_poll['streamer']
+                raise tc.blocked_e(
+                    "%s/%s: error reading console %s:%s @%dB: %s\n"
+                    % (run_name, self.name,
+                       target.fullid, self.console, read_offset, exception),
+                    { "error trace": "".join(traceback.format_exception(
+                        type(exception), exception,
+                        exception.__traceback__)) })
+            if not alive:		# went idle, restart it
+                streamer = None
+        if streamer == None:
+            target.report_info(
+                "%s/%s: streaming console %s:%s @%d to %s"
+                % (run_name, self.name, target.fullid, self.console,
+                   read_offset, buffers_poll['of'].name), dlevel = 5)
+            streamer = _console_streamer_c(
+                target, self.console, buffers_poll['of'],
+                read_offset, generation, self.poll_period)
+            buffers_poll['streamer'] = streamer
+        # record the previous offset and the new one; we use this
+        # in target.console.wait_for_no_ouput()
+        buffers_poll['read_offset0'] = buffers_poll.get('read_offset',
+                                                        read_offset)
+        buffers_poll['read_offset'] = read_offset
+        if generation != None:
+            buffers_poll['generation'] = generation
+
     def poll(self, testcase, run_name, buffers_poll):
         # polling a console happens by reading the remote console into
         # a local file we keep as collateral
@@ -406,9 +710,13 @@ class expect_text_on_console_c(tc.expectation_c):
             target.report_info('%s/%s: not detecting, no console data yet'
                                % (run_name, self.name))
             return None
-        ofd = of.fileno()
-        stat_info = os.fstat(ofd)
-        if stat_info.st_size == 0:	# Nothing to read
+        # all the expectations on this console share the scanner
+        scanner = buffers_poll.get('scanner', None)
+        if scanner == None:
+            scanner = _console_scanner_c(of)
+            buffers_poll['scanner'] = scanner
+        size = scanner.map()
+        if size == 0:			# Nothing to read
             return None
 
         # if no detect context is given, we default to something
@@ -425,81 +733,70 @@ class expect_text_on_console_c(tc.expectation_c):
             buffers_poll[detect_context + 'search_offset'] = 0
         search_offset = buffers_poll[detect_context + 'search_offset']
 
-        # we mmap because we don't want to (a) read a lot of a huger
-        # file line by line and (b) share file pointers -- we'll look
-        # to our own offset instead of relying on that. Other
-        # expectations might be looking at this file in parallel.
-        if sys.platform == "win32":
-            extra_args = [ None, mmap.ACCESS_READ, 0 ] # just offset
+        target.report_info(
+            "%s/%s: looking for `%s` in console %s:%s @%d-%d [%s]"
+            % (run_name, self.name, self.regex.pattern,
+               target.fullid, self.console,
+               search_offset, size, of.name), dlevel = 4)
+        match = scanner.search(self.regex, detect_context, search_offset,
+                               self.scan_overlap)
+        if not match:
+            return None
+        # offsets in match are absolute in the capture file
+        offset_match_start = match.start()
+        offset_match_end = match.end()
+        # this allows us later to pick up stuff in report
+        # handlers without having to have context knowledge
+        buffers_poll[detect_context + 'search_offset_prev'] = search_offset
+        buffers_poll[detect_context + 'search_offset'] = offset_match_end
+        # take care of printing a meaningful message here, as
+        # this is one that many people rely on when doing
+        # debugging on the serial line
+        if self.name == self.regex.pattern:
+            # unnamed (we used the regex), that means they
+            # didn't care much for it, so dont' use it
+            _name = ""
         else:
-            extra_args = [ mmap.MAP_PRIVATE, mmap.PROT_READ, 0 ]
-        with contextlib.closing(
-                mmap.mmap(ofd, 0, *extra_args)) \
-                as mapping:
-            target.report_info(
-                "%s/%s: looking for `%s` in console %s:%s @%d-%d [%s]"
-                % (run_name, self.name, self.regex.pattern,
-                   target.fullid, self.console,
-                   search_offset, stat_info.st_size, of.name), dlevel = 4)
-            match = self.regex.search(mapping[search_offset:])
-            if match:
-                # this allows us later to pick up stuff in report
-                # handlers without having to have context knowledge
-                buffers_poll[detect_context + 'search_offset_prev'] = \
-                    search_offset
-                buffers_poll[detect_context + 'search_offset'] = \
-                    search_offset + match.end()
-                # take care of printing a meaningful message here, as
-                # this is one that many people rely on when doing
-                # debugging on the serial line
-                if self.name == self.regex.pattern:
-                    # unnamed (we used the regex), that means they
-                    # didn't care much for it, so dont' use it
-                    _name = ""
-                else:
-                    _name = "/" + self.name
-                if self.report == 0:
-                    console_output = None
-                elif isinstance(self.report, int):
-                    _search_offset = search_offset + match.end() - self.report
-                    search_offset = max(search_offset, _search_offset)
-                    console_output = "console output (partial)"
-                elif self.report == None:
-                    console_output = "console output"
-                else:
-                    raise AssertionError(
-                        "self.report: invalid type '%s' or value (%s)"
-                        % (type(self.report), self.report))
-                if console_output != None:
-                    match_data = {
-                        # this allows an exception raised when found to
-                        # include this iterator as an attachment that can
-                        # be reported
-                        console_output: target.console.generator_factory(
-                            self.console,
-                            search_offset, search_offset + match.end()),
-                    }
-                else:
-                    match_data = {}
-                target.report_info(
-                    "%s%s: found '%s' at @%d-%d on console %s:%s [%s]"
-                    % (run_name, _name, self.regex.pattern,
-                       search_offset + match.start(),
-                       search_offset + match.end(),
-                       target.fullid, self.console, of.name),
-                    attachments = match_data, dlevel = 1, alevel = 1)
-                # make this match on_timeout()'s as much as possible
-                match_data["target"] = self.target
-                match_data["origin"] = self.origin
-                match_data["console"] = self.console
-                match_data["pattern"] = self.regex.pattern
-                match_data["groupdict"] = match.groupdict()
-                match_data["offset"] = search_offset
-                match_data["offset_match_start"] = \
-                    search_offset + match.start()
-                match_data["offset_match_end"] = search_offset + match.end()
-                return match_data
-        return None
+            _name = "/" + self.name
+        report_offset = search_offset
+        if self.report == 0:
+            console_output = None
+        elif isinstance(self.report, int):
+            report_offset = max(search_offset,
+                                offset_match_end - self.report)
+            console_output = "console output (partial)"
+        elif self.report == None:
+            console_output = "console output"
+        else:
+            raise AssertionError(
+                "self.report: invalid type '%s' or value (%s)"
+                % (type(self.report), self.report))
+        if console_output != None:
+            match_data = {
+                # this allows an exception raised when found to
+                # include this iterator as an attachment that can
+                # be reported
+                console_output: target.console.generator_factory(
+                    self.console, report_offset, offset_match_end),
+            }
+        else:
+            match_data = {}
+        target.report_info(
+            "%s%s: found '%s' at @%d-%d on console %s:%s [%s]"
+            % (run_name, _name, self.regex.pattern,
+               offset_match_start, offset_match_end,
+               target.fullid, self.console, of.name),
+            attachments = match_data, dlevel = 1, alevel = 1)
+        # make this match on_timeout()'s as much as possible
+        match_data["target"] = self.target
+        match_data["origin"] = self.origin
+        match_data["console"] = self.console
+        match_data["pattern"] = self.regex.pattern
+        match_data["groupdict"] = match.groupdict()
+        match_data["offset"] = report_offset
+        match_data["offset_match_start"] = offset_match_start
+        match_data["offset_match_end"] = offset_match_end
+        return match_data
 
     def on_timeout(self, run_name, poll_context, buffers_poll, buffers,
                    ellapsed, timeout):
@@ -916,8 +1213,8 @@ class extension(tc.target_extension_c):
 
 
     def _read(self, console = None, offset = 0, _max_size = 0, fd = None,
-              newline = None,
-              **ttbd_iface_call_kwargs):
+              newline = None, follow = 0, _headers = None,
+              _chunk_cb = None, **ttbd_iface_call_kwargs):
         """
         Read data received on the target's console
 
@@ -925,6 +1222,17 @@ class extension(tc.target_extension_c):
         :param int offset: (optional) offset to read from (defaults to zero)
         :param int fd: (optional) file descriptor to which to write
           the output (in which case, it returns the bytes read).
+        :param float follow: (optional, default 0) if greater than
+          zero, ask the server to keep sending new data as the
+          console produces it for up to this many seconds.
+        :param dict _headers: (optional) dictionary to update with
+          the HTTP response headers
+        :param callable _chunk_cb: (optional) when writing to *fd*,
+          function called as *_chunk_cb(GENERATION, OFFSET)* after
+          each chunk is written and flushed, with the stream
+          generation and the offset at which the data written so
+          far ends; useful to know about data as it comes when
+          following.
         :returns: tuple consisting of:
           - stream generation
           - stream size after reading
@@ -936,9 +1244,14 @@ class extension(tc.target_extension_c):
         assert console == None or isinstance(console, str)
         assert offset >= 0
         assert fd == None or isinstance(fd, io.IOBase)
+        assert isinstance(follow, numbers.Real) and follow >= 0
+        assert _chunk_cb == None or callable(_chunk_cb)
 
         target = self.target
         console = self._console_get(console)
+        if follow > 0:
+            # only pass it if needed, so the request stays the same
+            ttbd_iface_call_kwargs['follow'] = follow
         # NOTE! if the content is encoded with chunks, we can't read
         # r.content more than once, so ensure we gather content-length
         # early!
@@ -959,6 +1272,11 @@ class extension(tc.target_extension_c):
                 chunk_size = 1024
                 content_length = 0
                 total = 0
+                if _chunk_cb:
+                    generation_s, offset_s = \
+                        r.headers.get('X-Stream-Gen-Offset', "0 0").split()
+                    generation = int(generation_s)
+                    offset_start = int(offset_s)
                 for chunk in r.iter_content(chunk_size):
                     while True:
                         try:
@@ -980,6 +1298,9 @@ class extension(tc.target_extension_c):
 
                     # don't use chunk_size, as it might be less
                     total += chunk_len
+                    if _chunk_cb:
+                        fd.flush()
+                        _chunk_cb(generation, offset_start + content_length)
                 fd.flush()
                 ret = total
                 l = total
@@ -991,6 +1312,8 @@ class extension(tc.target_extension_c):
                                        **ttbd_iface_call_kwargs)
             ret = self._newline_convert(r.text, newline)
             content_length = len(r.content)
+        if _headers != None:
+            _headers.update(r.headers)
         generation_s, offset_s = \
             r.headers.get('X-Stream-Gen-Offset', "0 0").split()
         generation = int(generation_s)
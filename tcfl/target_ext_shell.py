@@ -68,11 +68,16 @@ keep typing whichever command was being typed halfway.
 
 import binascii
 import collections
+import hashlib
+import io
+import os
 import re
+import shlex
 import threading
 import time
 import traceback
 import typing
+import zlib
 
 import commonl
 from . import tc
@@ -151,6 +156,303 @@ class _context_c:
         self.shell._fixups = self.shell.tls.fixups.pop()
 
 
+
+# Console file transfers
+#
+# file_copy_to() and friends start this helper in the target with
+# python3 (sent compressed as a one line bootstrap) as:
+#
+#   HELPER TOKEN recv|send PATH CHUNKSIZE WINDOW TIMEOUT
+#
+# It puts the console in raw mode and talks a line protocol; the
+# target prints lines prefixed with *TCFXFER-TOKEN*, so we can find
+# them among whatever else the console prints; the host sends
+# lines with no prefix:
+#
+# recv (host to target):
+#
+#   T: READY SIZE SHA256     partial file (PATH.tcfpart) size/hash
+#   H: S OFFSET              start at OFFSET (resume or zero)
+#   T: ACK OFFSET            all data up to OFFSET received
+#   H: D OFFSET CRC32 DATA   DATA is base64(zlib(chunk))
+#   T: NAK OFFSET            bad frame, resend from OFFSET
+#   H: E SIZE SHA256         end; verify and move to PATH
+#   T: DONE SIZE | BAD SIZE
+#   H: Q                     abort
+#
+# send (target to host):
+#
+#   T: READY SIZE SHA256
+#   H: S OFFSET
+#   T: D OFFSET CRC32 DATA   up to WINDOW chunks past the last A
+#   H: A OFFSET              all data up to OFFSET received
+#   H: R OFFSET              bad frame, resend from OFFSET
+#   T: E SIZE                all data sent
+#   H: Q                     done
+#
+# If the helper gets nothing for TIMEOUT seconds it prints TIMEOUT
+# and exits.
+_xfer_helper = r'''
+import base64, hashlib, os, select, sys, zlib
+
+def main(token, mode, path, chunk_size, window, timeout):
+    chunk_size = int(chunk_size)
+    window = int(window) * chunk_size
+    timeout = float(timeout)
+    fd = sys.stdin.fileno()
+    out = sys.stdout.buffer
+    buf = b""
+
+    def say(*fields):
+        out.write(("TCFXFER-%s %s\n" % (
+            token, " ".join(str(field) for field in fields))).encode())
+        out.flush()
+
+    def readline(wait):
+        nonlocal buf
+        while b"\n" not in buf:
+            if not select.select([ fd ], [], [], wait)[0]:
+                return None
+            data = os.read(fd, 65536)
+            if not data:
+                raise EOFError
+            buf += data.replace(b"\r", b"\n")
+        line, buf = buf.split(b"\n", 1)
+        return line.split() or [ b"" ]
+
+    def digest(f):
+        h = hashlib.sha256()
+        f.seek(0)
+        for block in iter(lambda: f.read(65536), b""):
+            h.update(block)
+        return h.hexdigest()
+
+    def recv():
+        with open(path + ".tcfpart", "ab+") as f:
+            say("READY", f.seek(0, 2), digest(f))
+            expected = None
+            nak = False
+            while True:
+                fields = readline(timeout)
+                if fields is None:
+                    say("TIMEOUT")
+                    return 1
+                if fields[0] == b"S":
+                    expected = int(fields[1])
+                    f.truncate(expected)
+                    say("ACK", expected)
+                elif fields[0] == b"D" and expected is not None:
+                    try:
+                        offset = int(fields[1])
+                        data = zlib.decompress(base64.b64decode(fields[3]))
+                        if zlib.crc32(data) != int(fields[2], 16):
+                            raise ValueError
+                    except Exception:
+                        offset = -1
+                    if offset == expected:
+                        f.write(data)
+                        expected += len(data)
+                        nak = False
+                        say("ACK", expected)
+                    elif 0 <= offset < expected:
+                        say("ACK", expected)
+                    elif not nak:
+                        nak = True
+                        say("NAK", expected)
+                elif fields[0] == b"E":
+                    f.flush()
+                    if expected == int(fields[1]) \
+                       and digest(f) == fields[2].decode():
+                        os.replace(path + ".tcfpart", path)
+                        say("DONE", expected)
+                        return 0
+                    say("BAD", expected)
+                elif fields[0] == b"Q":
+                    return 1
+
+    def send():
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            say("READY", size, digest(f))
+            offset = acked = None
+            end = False
+            retries = 0
+            while True:
+                if offset is not None and offset >= size and not end:
+                    say("E", size)
+                    end = True
+                blocking = offset is None or end or offset - acked >= window
+                fields = readline(timeout if blocking else 0)
+                if fields is None and not blocking:
+                    f.seek(offset)
+                    data = f.read(chunk_size)
+                    say("D", offset, "%08x" % zlib.crc32(data),
+                        base64.b64encode(zlib.compress(data)).decode())
+                    offset += len(data)
+                    continue
+                if fields is None:
+                    retries += 1
+                    if offset is None or retries > 3:
+                        say("TIMEOUT")
+                        return 1
+                    offset = acked
+                    end = False
+                    continue
+                retries = 0
+                if fields[0] in ( b"S", b"R" ):
+                    offset = acked = int(fields[1])
+                    end = False
+                elif fields[0] == b"A" and acked is not None:
+                    acked = max(acked, int(fields[1]))
+                elif fields[0] == b"Q":
+                    return 0
+
+    try:
+        import termios, tty
+        attrs = termios.tcgetattr(fd)
+        tty.setraw(fd)
+    except Exception:
+        attrs = None
+    try:
+        return recv() if mode == "recv" else send()
+    except EOFError:
+        return 1
+    finally:
+        if attrs:
+            termios.tcsetattr(fd, termios.TCSADRAIN, attrs)
+
+sys.exit(main(*sys.argv[1:]))
+'''
+
+_xfer_bootstrap = \
+    "python3 -c 'import base64,zlib;exec(zlib.decompress(" \
+    "base64.b64decode(\"%s\")))'" % binascii.b2a_base64(
+        zlib.compress(_xfer_helper.encode('utf-8'), 9),
+        newline = False).decode('ascii')
+
+# keep the command line under what a TTY in canonical mode takes
+assert len(_xfer_bootstrap) < 3072
+
+
+def _xfer_digest(f, size):
+    # SHA256 of the first size bytes of file object f
+    h = hashlib.sha256()
+    f.seek(0)
+    while size > 0:
+        data = f.read(min(size, 65536))
+        if not data:
+            break
+        h.update(data)
+        size -= len(data)
+    return h.hexdigest()
+
+
+def _xfer_frame(offset, data):
+    return "D %d %08x %s" % (
+        offset, zlib.crc32(data),
+        binascii.b2a_base64(zlib.compress(data), newline = False)\
+        .decode('ascii'))
+
+
+def _xfer_frame_parse(fields):
+    # Return offset and data of a frame, offset -1 if corrupted
+    try:
+        offset = int(fields[0])
+        data = zlib.decompress(binascii.a2b_base64(fields[2]))
+        if zlib.crc32(data) != int(fields[1], 16):
+            return -1, None
+        return offset, data
+    except (IndexError, ValueError, binascii.Error, zlib.error):
+        return -1, None
+
+
+class _xfer_c:
+    # Console side of a file transfer with the _xfer_helper
+    #
+    # Writes lines to the console and reads the target's replies from
+    # the console offset where the transfer was started.
+
+    def __init__(self, target, console, settings):
+        self.target = target
+        self.console = target.console._console_get(console)
+        self.settings = settings
+        self.token = commonl.mkid(f"{time.time()} {id(self)}", 8)
+        self.regex = re.compile(
+            f"TCFXFER-{self.token} ([A-Z]+)([^\n]*)\n")
+        self.offset = target.console.size(self.console) or 0
+        self.data = ""
+        self.naks = 0
+
+    def start(self, mode, remote_filename):
+        s = self.settings
+        self.target.send(
+            f"{_xfer_bootstrap} {self.token} {mode}"
+            f" {shlex.quote(remote_filename)} {s['chunk_size']}"
+            f" {s['window']} {s['timeout'] * 3}",
+            console = self.console)
+
+    def send(self, *lines):
+        self.target.console.write(
+            "".join(line + "\n" for line in lines), console = self.console)
+
+    def read(self, timeout):
+        # Return a list of ( TAG, FIELDS ) messages from the target,
+        # waiting up to timeout seconds for at least one
+        ts0 = time.time()
+        while True:
+            _generation, self.offset, data = self.target.console._read(
+                console = self.console, offset = self.offset,
+                newline = "\n")
+            self.data += data
+            messages = []
+            # parse only full lines, keep the rest for next time
+            end = self.data.rfind("\n")
+            if end >= 0:
+                for m in self.regex.finditer(self.data, 0, end + 1):
+                    messages.append(( m.group(1), m.group(2).split() ))
+                self.data = self.data[end + 1:]
+            if messages:
+                return messages
+            if time.time() - ts0 >= timeout:
+                return []
+            time.sleep(self.settings['poll_period'])
+
+    def expect(self, *tags):
+        ts0 = time.time()
+        timeout = self.settings['timeout']
+        while time.time() - ts0 < timeout:
+            for tag, fields in self.read(timeout):
+                if tag == "BAD":
+                    raise tc.error_e(
+                        "shell/xfer: target side verification failed",
+                        dict(target = self.target, fields = fields))
+                if tag == "TIMEOUT":
+                    raise tc.error_e(
+                        "shell/xfer: target side timed out",
+                        dict(target = self.target))
+                if tag in tags:
+                    return fields
+        raise tc.error_e(
+            f"shell/xfer: timed out waiting for {'|'.join(tags)}"
+            " from target side helper", dict(target = self.target))
+
+    def abort(self):
+        # tell the helper to quit so the console goes back to the
+        # shell; best effort, we are already failing
+        try:
+            self.send("Q")
+        except Exception as e:
+            self.target.report_info(
+                f"shell/xfer: can't abort target side helper: {e}",
+                dlevel = 2)
+
+    def report(self, remote_filename, size, ts):
+        self.target.report_info(
+            f"shell/xfer: {remote_filename}: {size}B in {ts:.1f}s"
+            f" ({size / max(ts, 0.001) / 1024:.1f}KiB/s,"
+            f" {self.naks} retransmissions)", dlevel = 1)
+
+
 class shell(tc.target_extension_c):
     """
     Extension to :py:class:`tcfl.tc.target_c` for targets that support
@@ -961,128 +1263,253 @@ class shell(tc.target_extension_c):
 
         self.run("rm -f " + " ".join(remote_filenames))
 
-    def file_copy_to(self, local_filename, remote_filename):
+
+    #: Size (in bytes) of each chunk of data :meth:`file_copy_to`,
+    #: :meth:`string_copy_to_file` and :meth:`file_copy_from` send
+    #: over the console; each chunk is compressed, base64 encoded and
+    #: sent as a single line along with its offset and CRC32.
+    #:
+    #: Lower it for consoles that drop data on long lines.
+    xfer_chunk_size = 8192
+
+    #: How many chunks can be in flight before the sender has to wait
+    #: for the receiver to acknowledge them
+    xfer_window = 4
+
+    #: Seconds to wait without progress in a file transfer before
+    #: retransmitting; the target side helper gives up after waiting
+    #: a few times this long
+    xfer_timeout = 10
+
+    #: How many times to retransmit without progress before
+    #: declaring a file transfer failed
+    xfer_retries = 5
+
+    #: Seconds to wait between console reads when waiting for data
+    #: from the target during a file transfer
+    xfer_poll_period = 0.05
+
+    def _xfer_kwargs_resolve(self, kwargs):
+        for key in kwargs:
+            assert hasattr(self, "xfer_" + key), \
+                f"unknown file transfer setting {key}"
+        return {
+            key: kwargs.get(key, getattr(self, "xfer_" + key))
+            for key in ( "chunk_size", "window", "timeout",
+                         "retries", "poll_period" )
+        }
+
+    def _xfer_to(self, f, size, remote_filename, console, **kwargs):
+        # Send what is in file object f to the target
+        target = self.target
+        settings = self._xfer_kwargs_resolve(kwargs)
+        chunk_size = settings['chunk_size']
+        window = settings['window'] * chunk_size
+        xfer = _xfer_c(target, console, settings)
+        ts0 = time.time()
+        xfer.start("recv", remote_filename)
+        try:
+            fields = xfer.expect("READY")
+            remote_size = int(fields[0])
+            digest = _xfer_digest(f, size)
+            sent = acked = 0
+            if 0 < remote_size <= size \
+               and _xfer_digest(f, remote_size) == fields[1]:
+                # a previous, interrupted transfer of this file left
+                # a partial copy we can continue
+                sent = acked = remote_size
+                target.report_info(
+                    f"shell/xfer: {remote_filename}: resuming at"
+                    f" {remote_size}B", dlevel = 1)
+            xfer.send(f"S {acked}")
+            xfer.expect("ACK")
+            stalls = 0
+            while acked < size:
+                lines = []
+                while sent < size and sent - acked < window:
+                    f.seek(sent)
+                    data = f.read(chunk_size)
+                    lines.append(_xfer_frame(sent, data))
+                    sent += len(data)
+                if lines:
+                    xfer.send(*lines)
+                messages = xfer.read(settings['timeout'])
+                if not messages:
+                    stalls += 1
+                    if stalls > settings['retries']:
+                        raise tc.error_e(
+                            f"shell/xfer: {remote_filename}: no progress"
+                            f" after {stalls} retries at {acked}B",
+                            dict(target = target))
+                    # go back to the last acknowledged offset
+                    sent = acked
+                    continue
+                for tag, fields in messages:
+                    if tag == "ACK":
+                        offset = int(fields[0])
+                        if offset > acked:
+                            acked = offset
+                            stalls = 0
+                    elif tag == "NAK":
+                        # CRC error or lost data, resend from there
+                        sent = acked = int(fields[0])
+                        xfer.naks += 1
+                    elif tag == "TIMEOUT":
+                        raise tc.error_e(
+                            f"shell/xfer: {remote_filename}: target"
+                            f" timed out waiting for data at {acked}B",
+                            dict(target = target))
+            xfer.send(f"E {size} {digest}")
+            xfer.expect("DONE", "BAD")
+        except:
+            xfer.abort()
+            raise
+        self.run()			# wait for the prompt to come back
+        xfer.report(remote_filename, size, time.time() - ts0)
+
+    def _xfer_from(self, f, remote_filename, console, **kwargs):
+        # Receive a file from the target, writing it to file object f
+        target = self.target
+        settings = self._xfer_kwargs_resolve(kwargs)
+        xfer = _xfer_c(target, console, settings)
+        ts0 = time.time()
+        xfer.start("send", remote_filename)
+        try:
+            fields = xfer.expect("READY")
+            size = int(fields[0])
+            digest = fields[1]
+            h = hashlib.sha256()
+            received = 0
+            # True if we asked the target to go back and have not
+            # yet seen that data
+            rewinding = False
+            stalls = 0
+            xfer.send("S 0")
+            while True:
+                messages = xfer.read(settings['timeout'])
+                if not messages:
+                    stalls += 1
+                    if stalls > settings['retries']:
+                        raise tc.error_e(
+                            f"shell/xfer: {remote_filename}: no progress"
+                            f" after {stalls} retries at {received}B",
+                            dict(target = target))
+                    xfer.send(f"R {received}")
+                    continue
+                progress = False
+                end = False
+                for tag, fields in messages:
+                    if tag == "D":
+                        offset, data = _xfer_frame_parse(fields)
+                        if offset == received:
+                            f.write(data)
+                            h.update(data)
+                            received += len(data)
+                            progress = True
+                            rewinding = False
+                        elif offset < 0 or offset > received:
+                            # corrupted or lost a frame; ask once
+                            # to go back, ignore the rest
+                            if not rewinding:
+                                xfer.send(f"R {received}")
+                                xfer.naks += 1
+                                rewinding = True
+                        # offset < received: repeated data, ignore
+                    elif tag == "E":
+                        end = True
+                    elif tag == "TIMEOUT":
+                        raise tc.error_e(
+                            f"shell/xfer: {remote_filename}: target"
+                            f" timed out waiting for acknowledgement"
+                            f" at {received}B", dict(target = target))
+                if progress:
+                    stalls = 0
+                if received >= size:
+                    break
+                if progress:
+                    xfer.send(f"A {received}")
+                elif end:
+                    # the target is done but we lost the tail
+                    xfer.send(f"R {received}")
+                    rewinding = True
+            xfer.send("Q")
+            if h.hexdigest() != digest:
+                raise tc.error_e(
+                    f"shell/xfer: {remote_filename}: SHA256 mismatch",
+                    dict(target = target, local = h.hexdigest(),
+                         remote = digest))
+        except:
+            xfer.abort()
+            raise
+        self.run()			# wait for the prompt to come back
+        xfer.report(remote_filename, size, time.time() - ts0)
+
+    def file_copy_to(self, local_filename, remote_filename,
+                     console = None, **kwargs):
         """\
         Send a file to the target via the console (if the target supports it)
 
-        Encodes the file to base64 and sends it via the console in chunks
-        of 64 bytes (some consoles are kinda...unreliable) to a file in
-        the target called /tmp/file.b64, which then we decode back to
-        normal.
+        A small helper is started in the target with *python3* which
+        puts the console in raw mode and receives the file in chunks
+        of :data:`xfer_chunk_size` bytes. Each chunk is compressed,
+        base64 encoded and sent with its offset and CRC32 as a
+        single line; up to :data:`xfer_window` chunks are in flight
+        before waiting for the target to acknowledge them.
 
-        Assumes the target has python3; permissions are not maintained
+        Chunks that arrive corrupted or out of order are sent again
+        from the last good offset, as are chunks not acknowledged for
+        :data:`xfer_timeout` seconds. Data is written to
+        *REMOTE_FILENAME.tcfpart* and moved into place only once its
+        SHA256 matches the local file; if a transfer is interrupted,
+        the next transfer of the same file continues where it left
+        off.
+
+        The local file is read as needed, not loaded in memory.
 
-        .. note:: it is *slow*. The limits are not well defined; how
-                  big a file can be sent/received will depend on local
-                  and remote memory capacity, as things are read
-                  hole. This could be optimized to stream instead of
-                  just read all, but still sending a way big file over
-                  a cheap ASCII protocol is not a good idea. Warned
-                  you are.
+        Assumes the target has python3; permissions are not maintained
 
+        :param str local_filename: local file to send
+        :param str remote_filename: name of the file in the target
+        :param str console: (optional) console to use; defaults to the
+          default console
+        :param kwargs: override the defaults for transfer settings
+          *chunk_size*, *window*, *timeout*, *retries* and
+          *poll_period* (see :data:`xfer_chunk_size` and friends)
         """
         assert isinstance(local_filename, str)
         assert isinstance(remote_filename, str)
-        self.files_remove(remote_filename, "/tmp/file.b64")
         with open(local_filename, "rb") as f:
-            s = binascii.b2a_base64(f.read())
-            for i in range(0, len(s), 64):
-                # increase the log level to report each chunk of the
-                # file we are transmitting
-                with msgid_c("C.%d" % i):
-                    self.run("echo -n %s  >> /tmp/file.b64"
-                             % s[i:i+64].decode('utf-8').strip())
-
-        # Now we do a python3 command in there (as cloud
-        # versions don't include python2. good) to regenerate
-        # it from base64 to bin
-        self.run(
-            'python3 -c "import sys, binascii; '
-            'sys.stdout.buffer.write(binascii.a2b_base64(sys.stdin.buffer.read()))"'
-            ' < /tmp/file.b64 > %s' % remote_filename)
-        # FIXME: checksum and verify :/
-
-    def string_copy_to_file(self, s, remote_filename):
+            size = os.fstat(f.fileno()).st_size
+            self._xfer_to(f, size, remote_filename, console, **kwargs)
+
+    def string_copy_to_file(self, s, remote_filename,
+                            console = None, **kwargs):
         """\
         Store a string in a target's file via the console (if the target supports it)
 
-        Encodes the file to base64 and sends it via the console in chunks
-        of 64 bytes (some consoles are kinda...unreliable) to a file in
-        the target called /tmp/file.b64, which then we decode back to
-        normal.
-
-        Assumes the target has python3; permissions are not maintained
-
-        See :meth:`file_copy_to`
-
-        .. note:: it is *slow*. The limits are not well defined; how
-                  big a file can be sent/received will depend on local
-                  and remote memory capacity, as things are read
-                  whole. This could be optimized to stream instead of
-                  just read all, but still sending a way big file over
-                  a cheap ASCII protocol is not a good idea. Warned
-                  you are.
-
+        The string is encoded as UTF-8 and sent as described in
+        :meth:`file_copy_to`, which takes the same arguments.
         """
         assert isinstance(s, str)
         assert isinstance(remote_filename, str)
-        self.files_remove(remote_filename, "/tmp/file.b64")
-        s = binascii.b2a_base64(s)
-        for i in range(0, len(s), 64):
-            # increase the log level to report each chunk of the
-            # file we are transmitting
-            self.run("echo -n %s  >> /tmp/file.b64"
-                     % s[i:i+64].decode('utf-8').strip())
-
-        # Now we do a python3 command in there (as cloud
-        # versions don't include python2. good) to regenerate
-        # it from base64 to bin
-        self.run(
-            'python3 -c "import sys, binascii; '
-            'sys.stdout.buffer.write(binascii.a2b_base64(sys.stdin.buffer.read()))"'
-            ' < /tmp/file.b64 > %s' % remote_filename)
-        # FIXME: checksum and verify :/
-
-    def file_copy_from(self, local_filename, remote_filename):
-        """\
-        Send a file to the target via the console (if the target supports it)
-
-        Encodes the file to base64 and sends it via the console in chunks
-        of 64 bytes (some consoles are kinda...unreliable) to a file in
-        the target called /tmp/file.b64, which then we decode back to
-        normal.
+        data = s.encode('utf-8')
+        self._xfer_to(io.BytesIO(data), len(data), remote_filename,
+                      console, **kwargs)
 
-        Assumes the target has python3; permissions are not maintained
+    def file_copy_from(self, local_filename, remote_filename,
+                       console = None, **kwargs):
+        """\
+        Get a file from the target via the console (if the target supports it)
 
-        .. note:: it is *slow*. The limits are not well defined; how
-                  big a file can be sent/received will depend on local
-                  and remote memory capacity, as things are read
-                  whole. This could be optimized to stream instead of
-                  just read all, but still sending a way big file over
-                  a cheap ASCII protocol is not a good idea. Warned
-                  you are.
+        Works as :meth:`file_copy_to` in the other direction; the
+        target sends up to :data:`xfer_window` chunks before waiting
+        for acknowledgement and the data is written to
+        *local_filename* as it is received. The SHA256 of the received
+        data is verified against the one the target computed.
 
+        Takes the same arguments as :meth:`file_copy_to`.
         """
         assert isinstance(local_filename, str)
         assert isinstance(remote_filename, str)
-
-        # Now we do a python3 command in there (as cloud
-        # versions don't include python2. good) to encode the file in
-        # b64 and read it from the console
-        output = self.run(
-            'python3 -c "import sys, binascii; '
-            'sys.stdout.buffer.write(binascii.b2a_base64(sys.stdin.buffer.read()))"'
-            ' < %s' % remote_filename, output = True)
-        # output comes as
-        ## python3 -c...
-        ## B64DATA
-        ## PROMPT
-        # so extract it
-        first_nl = output.find('\n')
-        last_nl = output.rfind('\n')
-        output = output[first_nl+1:last_nl+1]
         with open(local_filename, "wb") as f:
-            for line in output.splitlines():
-                data = binascii.a2b_base64(line)
-                f.write(data)
-        # FIXME: checksum and verify :/
+            self._xfer_from(f, remote_filename, console, **kwargs)
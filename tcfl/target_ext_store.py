@@ -15,6 +15,7 @@ import contextlib
 import json
 import hashlib
 import io
+import os
 
 import pprint
 import tabulate
@@ -57,16 +58,83 @@ class extension(tc.target_extension_c):
     interface is supported.
 
     """
+    #: Size of the chunks in which files are uploaded to the server's
+    #: content-addressed blob store (see :meth:`upload`)
+    blob_chunk_size = 4 * 1024 * 1024
+
+    #: For how long to retry uploading a chunk if the connection to
+    #: the server drops (in seconds); uploads resume from the last
+    #: chunk the server acknowledged.
+    blob_retry_timeout = 60
+
+    def _upload_blob(self, remote, local):
+        # Upload via the content-addressed blob store; returns False
+        # if the server doesn't support it.
+        #
+        # hash_file_cached() keeps the digest on disk, so uploading
+        # the same file to multiple targets hashes it only once
+        target = self.target
+        size = os.stat(local).st_size
+        if size == 0:		# nothing to share, upload the old way
+            return False
+        digest = commonl.hash_file_cached(local, "sha512")
+        try:
+            r = target.ttbd_iface_call(
+                "store", "blob", method = "GET", digest = digest,
+                retry_timeout = self.blob_retry_timeout)
+        except tcfl.exception as e:
+            if 'blob: unsupported' not in repr(e):
+                raise
+            return False
+        if not r['present'] and r['size'] > 0:
+            target.report_info(
+                f"store: {remote}: resuming upload of {local} at"
+                f" {r['size']}/{size} bytes", dlevel = 2)
+        with io.open(local, "rb") as inf:
+            while not r['present'] and r['size'] < size:
+                offset = r['size']
+                inf.seek(offset)
+                data = inf.read(self.blob_chunk_size)
+                # post_blob is idempotent (the server ignores data it
+                # already has), so retrying on a dropped connection
+                # is safe
+                r = target.ttbd_iface_call(
+                    "store", "blob", method = "POST",
+                    digest = digest, offset = offset,
+                    files = { 'chunk': ( 'chunk', data ) },
+                    retry_timeout = self.blob_retry_timeout)
+        if r['present']:
+            target.report_info(
+                f"store: {remote}: server already has {local}"
+                f" ({digest[:10]}), not uploading", dlevel = 3)
+        target.ttbd_iface_call(
+            "store", "blob", method = "PUT",
+            digest = digest, file_path = remote, size = size,
+            retry_timeout = self.blob_retry_timeout)
+        return True
+
     def upload(self, remote, local, force = False):
         """
         Upload a local file to the store
 
+        If the server supports it, the file is uploaded to a
+        content-addressed store shared by all the users and targets
+        of the server, keyed by the file's SHA512 digest and *remote*
+        is made an alias to it; the data is only uploaded if the
+        server doesn't have it yet, in chunks of
+        :data:`blob_chunk_size` bytes. If the connection drops or the
+        upload is interrupted, the next upload of the same data
+        resumes from the last chunk the server received.
+
         :param str remote: name in the server
         :param str local: local file name
 
         :param bool force: (default *False*) if the file already
           exists and has the same digest, do not re-upload it.
         """
+        if force == False and self._upload_blob(remote, local):
+            return
+
         fl = self.list([ remote ])
         if force == False and remote in fl:
             remote_hash = fl[remote]
@@ -62,8 +62,9 @@ interfaces.power.AC.instrument); a missing symbol evaluates as
    target that has any RAM more than 2 GiB and two installed disks.
 
 
-See also :func:`tcfl.targets.select_by_ast` :mod:`commonl.expr_parser`
-for implementation details.
+See also :func:`tcfl.targets.select_by_ast`,
+:meth:`tcfl.targets.discovery_agent_c.select` and
+:mod:`commonl.expr_parser` for implementation details.
 
 """
 # FIXME:
@@ -74,6 +75,7 @@ for implementation details.
 
 import bisect
 import collections
+import collections.abc
 import concurrent.futures
 import logging
 import traceback
@@ -144,6 +146,9 @@ class discovery_agent_c:
         self.executor = None
         self.rs = {}
 
+        # ( OPERATOR, FIELD ) -> index, see _index_lookup()
+        self._indexes = {}
+
 
 
     def _cache_rt_handle(self, fullid, rt):
@@ -182,6 +187,7 @@ class discovery_agent_c:
         self.rts_flat.clear()
         self.rts_fullid_sorted.clear()
         self.inventory_keys.clear()
+        self._indexes.clear()
         # load all the servers at the same time using a thread pool
         if not tcfl.server_c.servers:
             logger.info("found no servers, will find no targets")
@@ -236,6 +242,7 @@ class discovery_agent_c:
                     len(self.rts), len(tcfl.server_c.servers))
         self.executor = None
         self.rs = {}
+        self._indexes.clear()
 
         # shall we flatten IDs? normally all the names are
         # SERVERSHORTNAME/TARGETNAME, so if two servers have the same
@@ -278,6 +285,99 @@ class discovery_agent_c:
             tcfl.rts_fullid_enabled = self.rts_fullid_enabled
 
 
+    #: Use indexes in :meth:`select` when there are at least this
+    #: many targets (*None* to never use them)
+    #:
+    #: Building an index for a field takes a pass over all the
+    #: targets, about the same as evaluating an expression on all of
+    #: them, so they only pay off with large inventories that are
+    #: queried more than once.
+    index_min_targets = 1000
+
+    def _index_lookup(self, operator, field, values):
+        # Indexes are built on first use for each field and kept
+        # until the inventory is updated; they map values to the set
+        # of targets that might match, as in
+        # commonl.expr_parser.ast_candidates(); they might include
+        # targets that are not in the inventory anymore.
+        #
+        # - "==": value as evaluated by ast_sym() -> targets that have
+        #   it; unhashable values (dicts, lists) never equal a constant
+        #   so they are not indexed
+        #
+        # - "in": member of a field that is a dict, list or set ->
+        #   targets that have it; the None key holds the targets on
+        #   which the field is a scalar, as those evaluate as a
+        #   substring match and are always candidates
+        index = self._indexes.get(( operator, field ), None)
+        if index == None:
+            index = collections.defaultdict(set)
+            for rtfullid, rt_flat in self.rts_flat.items():
+                value = commonl.expr_parser.ast_sym(field, rt_flat)
+                if operator == "==":
+                    if isinstance(value, collections.abc.Hashable):
+                        index[value].add(rtfullid)
+                elif isinstance(value, ( dict, list, set )):
+                    for member in value:
+                        if isinstance(member, collections.abc.Hashable):
+                            index[member].add(rtfullid)
+                else:
+                    index[None].add(rtfullid)
+            self._indexes[( operator, field )] = index
+        if operator == "==":
+            candidates = set()
+            for value in values:
+                if not isinstance(value, collections.abc.Hashable):
+                    return None
+                candidates |= index.get(value, set())
+            return candidates
+        if not isinstance(values, collections.abc.Hashable):
+            return None
+        return index.get(values, set()) | index.get(None, set())
+
+    def select(self, expr_ast: tuple, include_disabled: bool = False):
+        """
+        Return which targets match a conditional AST expression
+
+        :param tuple expr_ast: compiled targetspec AST expression
+          (see :func:`select_by_ast`); *None* to select all targets
+
+        :param bool include_disabled: (optional, default *False*)
+          consider disabled targets
+
+        :returns list[str]: sorted list of target full IDs that
+          match
+
+        This is equivalent to (but faster than) calling
+        :func:`select_by_ast` for each target in
+        :data:`rts_fullid_sorted`: the expression is compiled once
+        and, with large inventories (see :data:`index_min_targets`),
+        equality and membership conditions (*type == "qemu"*, *type
+        in [ "a", "b" ]*, *"ic0" in interconnects*...) are looked up
+        in indexes to skip evaluating targets that can't match.
+        """
+        rtfullids = self.rts_fullid_sorted
+        if expr_ast and self.index_min_targets != None \
+           and len(self.rts_flat) >= self.index_min_targets:
+            candidates = commonl.expr_parser.ast_candidates(
+                expr_ast, self._index_lookup)
+            if candidates != None:
+                rtfullids = sorted(candidates.intersection(self.rts_flat))
+        # same as select_by_ast(), compiling only once
+        fn = commonl.expr_parser.ast_compile(expr_ast) if expr_ast else None
+        selected = []
+        for rtfullid in rtfullids:
+            rt_flat = self.rts_flat.get(rtfullid, None)
+            if rt_flat == None:
+                continue
+            if not include_disabled and rt_flat.get('disabled', False):
+                continue
+            if fn and not fn(rt_flat):
+                continue
+            selected.append(rtfullid)
+        return selected
+
+
 
 def select_by_ast(rt_flat: dict,
                   expr_ast: tuple, include_disabled: bool):
@@ -318,7 +418,7 @@ def select_by_ast(rt_flat: dict,
     """
     if not include_disabled and rt_flat.get('disabled', False):
         return False
-    if expr_ast and not commonl.expr_parser.parse("", rt_flat, expr_ast):
+    if expr_ast and not commonl.expr_parser.ast_compile(expr_ast)(rt_flat):
         return False
     return True
 
@@ -463,38 +563,22 @@ def setup_by_spec(targetspecs: list, verbosity: int = 1,
     # filter targets: because this discovery agent is created just for
     # us, we can directly modify its lists, deleting any target that
     # doesn't match the critera
-
-    # the filter() function is fed a filtering agent
-    # `tcfl.targets.select_by_ast()`; we use an adaptor function
-    # instead of a lambda for clarity, since select_by_ast() function
-    # needs the ast expression and targets_all.
-
-    def _filter_rtfullid_by_ast(rtfullid):
-
-        if rtfullid not in tcfl.targets.discovery_agent.rts_flat:
+    discovery_agent = tcfl.targets.discovery_agent
+    selected = set(discovery_agent.select(expr_ast, targets_all))
+    rtfullids_kept = []
+    for rtfullid in discovery_agent.rts_fullid_sorted:
+        if rtfullid in selected:
+            rtfullids_kept.append(rtfullid)
+            continue
+        if rtfullid not in discovery_agent.rts_flat:
             logger.error(f"BUG/FIXME: {rtfullid} is not in rts_flat")
-            return True
-
-        if tcfl.targets.select_by_ast(
-                tcfl.targets.discovery_agent.rts_flat[rtfullid],
-                expr_ast, targets_all):
-            # if the selection matches, we return False so the for
-            # loop next block does not remove it from the list, we
-            # want to keep it
-            return False
-        # If the select does not match we return True so the for loop
-        # next block removes it from the list
-        return True
-
-    for rtfullid in filter(_filter_rtfullid_by_ast,
-                           # note we create another list since we are
-                           # going to modify it
-                           list(tcfl.targets.discovery_agent.rts_fullid_sorted)):
-        tcfl.targets.discovery_agent.rts_fullid_sorted.remove(rtfullid)
-        if rtfullid in tcfl.targets.discovery_agent.rts: # BUG/FIXME
-            del tcfl.targets.discovery_agent.rts[rtfullid]
-        if rtfullid in tcfl.targets.discovery_agent.rts_flat: # BUG/FIXME
-            del tcfl.targets.discovery_agent.rts_flat[rtfullid]
+            rtfullids_kept.append(rtfullid)
+            continue
+        if rtfullid in discovery_agent.rts: # BUG/FIXME
+            del discovery_agent.rts[rtfullid]
+        del discovery_agent.rts_flat[rtfullid]
+    # modify in place, it might be referenced from tcfl.rts_fullid_sorted
+    discovery_agent.rts_fullid_sorted[:] = rtfullids_kept
 
 
 def _run_fn_on_targetid(
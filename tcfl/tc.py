@@ -104,6 +104,7 @@ import numbers
 import os
 import platform
 import pprint
+import queue
 import random
 import re
 import shutil
@@ -370,6 +371,44 @@ class report_driver_c(object):
     - :mod:`tcfl.report_taps`
     - :mod:`tcfl.report_mongodb`
 
+    **Asynchronous reporting**
+
+    Drivers that do slow operations (network I/O to databases, heavy
+    file I/O) can set :data:`asynchronous`; then the reporting API
+    doesn't call :meth:`report` on the thread of the testcase or
+    target that is reporting, which would stall it (eg: in the middle
+    of an :meth:`tcfl.tc.tc_c.expect` loop). Instead, messages are
+    placed in a bounded queue (of :data:`queue_size` entries)
+    from which a worker thread, one per driver, takes them in batches
+    of up to :data:`batch_size` and passes them to
+    :meth:`report_batch`.
+
+    - messages are delivered in the same order they were reported,
+      thus ordering per testcase is preserved.
+
+    - when the queue is full, the reporter blocks until there is
+      space, unless :data:`queue_drop_level` is set; then *INFO*
+      messages of that level or higher are dropped instead (and
+      counted in :data:`dropped`).
+
+    - a *COMPLETION* message is a flush barrier: the reporter waits
+      until the driver has processed it before continuing, so when a
+      testcase is considered completed, all its reports have been
+      delivered.
+
+    - since :meth:`report` is called after the reporting call
+      returned, the *attachments* dictionary is copied when
+      queued; the values in it shall not be modified after
+      reporting them.
+
+    - the :class:`tcfl.msgid_c` context of the reporter (used by eg:
+      :meth:`tc_c.ident`) is captured when queued and restored in
+      the worker thread while calling :meth:`report`.
+
+    - exceptions raised by the driver in the worker thread are raised
+      to the next caller of :meth:`flush` (eg: when reporting a
+      *COMPLETION* message).
+
     """
 
     #: Name for the driver
@@ -378,6 +417,30 @@ class report_driver_c(object):
     #: :meth:`report_driver_c.add() <add>` call.
     name = None
 
+    #: Deliver messages to this driver from a worker thread instead of
+    #: from the thread that is reporting (see *Asynchronous reporting*
+    #: above)
+    asynchronous = False
+
+    #: Maximum number of messages pending delivery to an asynchronous
+    #: driver
+    queue_size = 4096
+
+    #: When the queue of an asynchronous driver is full, drop *INFO*
+    #: messages with a level equal or higher to this (higher levels
+    #: are chattier) instead of blocking the reporter; *None* always
+    #: blocks. Other messages (results, data, completion...) are
+    #: never dropped.
+    queue_drop_level = None
+
+    #: Maximum number of messages an asynchronous driver takes from
+    #: the queue to pass to :meth:`report_batch` in one go
+    batch_size = 256
+
+    #: Number of messages dropped because the queue was full (see
+    #: :data:`queue_drop_level`)
+    dropped = 0
+
     def report(self, testcase, target, tag, ts, delta,
                level, message, alevel, attachments):
         """Low level report from testcases
@@ -481,6 +544,147 @@ class report_driver_c(object):
         """
         raise NotImplementedError
 
+    def report_batch(self, records):
+        """Report a batch of messages
+
+        Called from the worker thread of an :data:`asynchronous`
+        driver with a list of messages, in the order in which they
+        were reported.
+
+        The default implementation calls :meth:`report` for each;
+        drivers can override it to amortize work across the batch
+        (eg: keeping files open or doing a single database
+        transaction).
+
+        :param list records: list of tuples *( MSGID, ARGS )*; *ARGS*
+          is a tuple with the arguments to :meth:`report`
+          (*testcase, target, tag, ts, delta, level, message, alevel,
+          attachments*) and *MSGID* a context manager that restores
+          the :class:`tcfl.msgid_c` context the message was reported
+          with, to wrap the call to :meth:`report`.
+        """
+        for msgid, record in records:
+            try:
+                with msgid:
+                    self.report(*record)
+            except Exception as e:
+                self._bus_exception(e)
+
+    # the queue and worker thread for asynchronous drivers are
+    # created on first use and for each process, since threads are
+    # not carried over on fork
+    _bus_pid = None
+    _bus_queue = None
+    _bus_thread = None
+    _bus_exceptions = None
+    _bus_lock = threading.Lock()
+    _bus_msgid_null = contextlib.nullcontext()
+
+    def _bus_exception(self, e):
+        # keep the worker alive, or reporters would block forever;
+        # flush() raises it to the reporter
+        logging.exception(
+            "%s: report driver raised exception: %s",
+            self.name or type(self).__name__, e)
+        with self._bus_lock:
+            self._bus_exceptions.append(e)
+
+    def _bus_worker(self, q):
+        while True:
+            batch = [ q.get() ]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            records = []
+            for item in batch:
+                if isinstance(item, threading.Event):	# flush barrier
+                    self._bus_deliver(records)
+                    records = []
+                    item.set()
+                else:
+                    records.append(item)
+            self._bus_deliver(records)
+
+    def _bus_deliver(self, records):
+        if not records:
+            return
+        try:
+            self.report_batch(records)
+        except Exception as e:
+            self._bus_exception(e)
+
+    def _bus_get(self):
+        pid = os.getpid()
+        if self._bus_pid == pid:
+            return self._bus_queue
+        with self._bus_lock:
+            if self._bus_pid != pid:
+                self._bus_queue = queue.Queue(self.queue_size)
+                self._bus_exceptions = []
+                thread = threading.Thread(
+                    target = self._bus_worker, args = ( self._bus_queue, ),
+                    name = f"report-{self.name or type(self).__name__}",
+                    daemon = True)
+                thread.start()
+                self._bus_thread = thread
+                self._bus_pid = pid
+                atexit.register(self.flush)
+        return self._bus_queue
+
+    def _report_enqueue(self, record):
+        # record is the tuple of arguments to self.report(); the
+        # worker thread has no msgid context of its own, so take a
+        # copy of the reporter's (the original might be modified or
+        # gone by the time it is delivered), same for the attachments
+        q = self._bus_get()
+        tag = record[2]
+        level = record[5]
+        message = record[6]
+        attachments = record[8]
+        if attachments != None:
+            record = record[:8] + ( dict(attachments), )
+        msgid = msgid_c.current()
+        if msgid:
+            record = ( msgid_c(parent = msgid), record )
+        else:
+            record = ( self._bus_msgid_null, record )
+        if self.queue_drop_level != None and tag == "INFO" \
+           and self.queue_drop_level <= level < 1000:
+            try:
+                q.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            return
+        q.put(record)
+        if message.startswith("COMPLETION"):
+            self.flush()
+
+    def flush(self):
+        """
+        Wait until all the messages reported so far to an
+        :data:`asynchronous` driver have been delivered
+
+        If the driver raised exceptions delivering them, the first one
+        is raised.
+        """
+        if not self.asynchronous or self._bus_pid != os.getpid() \
+           or threading.current_thread() == self._bus_thread:
+            return
+        barrier = threading.Event()
+        self._bus_queue.put(barrier)
+        barrier.wait()
+        with self._bus_lock:
+            exceptions = self._bus_exceptions
+            self._bus_exceptions = []
+        if exceptions:
+            if len(exceptions) > 1:
+                logging.error(
+                    "%s: report driver raised %d more exceptions",
+                    self.name or type(self).__name__, len(exceptions) - 1)
+            raise exceptions[0]
+
     _drivers = []
 
     @classmethod
@@ -741,6 +945,11 @@ class reporter_c:
                 target = self
             else:
                 target = None
+            if driver.asynchronous:
+                driver._report_enqueue((
+                    report_on, target, tag, ts, delta, level,
+                    commonl.mkutf8(message), alevel, attachments))
+                continue
             driver.report(
                 report_on, target, tag, ts, delta, level,
                 commonl.mkutf8(message), alevel, attachments)
@@ -1055,6 +1264,142 @@ class reporter_c:
         if record.level < logging.DEBUG:
             self.info(record.getMessage(), attachments, level = 3 + level)
 
+class batch_c:
+    """
+    Batch of interface calls to execute in the server in a single
+    request
+
+    Each interface call (as done with
+    :meth:`target_c.ttbd_iface_call`) is an HTTP request to the
+    server; when doing many calls in sequence, batching them saves
+    the round trips and the server's per-request overhead:
+
+    >>> batch = target.batch()
+    >>> batch.add("power", "off")
+    >>> batch.add("console", "enable", component = "serial0")
+    >>> batch.add("power", "on", target = target1)
+    >>> results = batch.run()
+
+    calls are executed in order and can be done on any target in the
+    same server. Calls that return streamed data (like reading from a
+    console or downloading files) are not supported.
+
+    :param tcfl.tc.target_c target: target on which calls are done by
+      default; this also determines the server.
+
+    :param bool stop_on_error: (optional; default *True*) stop
+      executing calls at the first one that fails and raise an
+      exception describing it (see :meth:`run`).
+    """
+    def __init__(self, target, stop_on_error = True):
+        assert isinstance(target, target_c)
+        assert isinstance(stop_on_error, bool)
+        self.target = target
+        self.stop_on_error = stop_on_error
+        self.steps = []
+
+    def add(self, interface, call, method = "PUT", component = None,
+            target = None, **kwargs):
+        """
+        Add an interface call to the batch
+
+        Arguments are the same as for :meth:`target_c.ttbd_iface_call`
+
+        :param tcfl.tc.target_c target: (optional; default the
+          batch's) target on which to execute the call; has to be in
+          the same server.
+
+        :returns: the batch, so calls can be chained
+        """
+        assert isinstance(interface, str)
+        assert isinstance(call, str)
+        assert component == None or isinstance(component, str)
+        assert method.upper() in ( "PUT", "GET", "DELETE", "POST" ), \
+            "method must be PUT|GET|DELETE|POST; got %s" % method
+        if target == None:
+            target = self.target
+        assert isinstance(target, target_c)
+        if target.server != self.target.server:
+            raise ValueError(
+                f"{target.id}: can't batch calls to a target in"
+                f" {target.server.url}; batch is for {self.target.server.url}")
+        # same encoding ttbd_iface_call() does
+        args = {}
+        for k, v in kwargs.items():
+            if v == None:
+                continue
+            args[k] = json.dumps(v)
+        if component:
+            args['component'] = json.dumps(component)
+        self.steps.append(dict(
+            target = target.id, interface = interface, call = call,
+            method = method.upper(), args = args,
+            ticket = target.mkticket_for_call()))
+        return self
+
+    def run(self, timeout = 160):
+        """
+        Execute the calls in the batch in the server
+
+        If the server does not support batches, the calls are
+        executed one by one.
+
+        :param int timeout: (optional; default 160s) timeout for the
+          whole batch to complete.
+
+        :returns list: a list with an entry for each call executed, in
+          order; each entry is a dictionary with either a *result*
+          field (what the call returned) or an *error* field (a string
+          describing why it failed). If *stop_on_error* is *False*,
+          all calls are executed and reported.
+
+        :raises tcfl.tc.error_e: if *stop_on_error* is *True* and a
+          call failed
+        """
+        target = self.target
+        try:
+            r = target.server.send_request(
+                "PUT", "batch", timeout = timeout, timeout_extra = None,
+                data = dict(
+                    calls = json.dumps(self.steps),
+                    stop_on_error = json.dumps(self.stop_on_error),
+                    ticket = target.mkticket_for_call()))
+            results = r['results']
+        except requests.exceptions.HTTPError as e:
+            if getattr(e, "status_code", None) != 404:
+                raise error_e(f"{target.id}: batch: remote call failed: {e}",
+                              dict(target = target, error = str(e))) from e
+            results = self._run_serial()
+        except requests.RequestException as e:
+            raise error_e(f"{target.id}: batch: remote call failed: {e}",
+                          dict(target = target, error = str(e))) from e
+        for index, result in enumerate(results):
+            if 'error' in result and self.stop_on_error:
+                step = self.steps[index]
+                raise error_e(
+                    f"{step['target']}: batch call #{index}"
+                    f" {step['interface']}/{step['call']} failed:"
+                    f" {result['error']}",
+                    dict(target = target, results = results))
+        return results
+
+    def _run_serial(self):
+        # COMPAT: server without batch support
+        results = []
+        for step in self.steps:
+            try:
+                r = self.target.server.send_request(
+                    step['method'],
+                    f"targets/{step['target']}/{step['interface']}/{step['call']}",
+                    data = dict(step['args'], ticket = step['ticket']))
+                results.append(dict(result = r))
+            except requests.RequestException as e:
+                results.append(dict(error = str(e)))
+                if self.stop_on_error:
+                    break
+        return results
+
+
 class target_c(reporter_c):
     """A remote target that can be manipulated
 
@@ -2348,6 +2693,21 @@ class target_c(reporter_c):
         return s
 
 
+    def batch(self, stop_on_error = True):
+        """
+        Return a batch to execute multiple interface calls in the
+        server in a single request
+
+        >>> target.batch() \\
+        >>>     .add("power", "off") \\
+        >>>     .add("console", "enable", component = "serial0") \\
+        >>>     .add("power", "on") \\
+        >>>     .run()
+
+        See :class:`batch_c` for details.
+        """
+        return batch_c(self, stop_on_error = stop_on_error)
+
     def ttbd_iface_call(self, interface, call, method = "PUT",
                         component = None, stream = False, raw = False,
                         files = None, timeout = 160,
@@ -3968,6 +4328,27 @@ class tc_c(reporter_c, metaclass=_tc_mc):
     #: limitations until the improved orchestrator is ready.
     max_runs_per_tc = 0
 
+    #: Maximum number of target groups to generate per testcase
+    #:
+    #: Also used to limit the number of interconnect groups when a
+    #: testcase declares more than one interconnect.
+    #:
+    #: Set with the command line *-P/--max-permutations*.
+    max_permutations = 10
+
+    #: How to pick remote targets when generating target groups
+    #:
+    #: - *random*: in a random order, different on each run
+    #:
+    #: - *sequential*: sorted by remote target name and BSP model
+    #:
+    #: - any other string: in a pseudo-random order seeded with
+    #:   the string, so the same target groups are generated on each
+    #:   run given the same inventory
+    #:
+    #: Set with the command line *--permutations-randomizer*.
+    permutations_randomizer = "random"
+
     #: reporting hooks on exception keyed by callable, value origin
     _report_exception_hooks = {}
 
@@ -6503,8 +6884,10 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         assert isinstance(value, (str, int)), \
                 "value: expected str|int, got %s: %s" % (type(value).__name__, value)
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            # walk the frames, inspect.stack() is too expensive for
+            # something called this often
+            frame = inspect.currentframe().f_back
+            origin = "%s:%s" % (frame.f_code.co_filename, frame.f_lineno)
         else:
             assert isinstance(origin, str)
         self.kws[kw] = value
@@ -7075,30 +7458,70 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                 s += "%s=%s:%s " % (twn, rt_full_id, bsp_model)
         return s[:-1]
 
-    def _target_wants_list_permutations(self, target_want_candidates, n,
-                                        tag = "target", name_prefix = ""):
-
-        # Compute how many unique candidates we have
-        candidates = set()
-        for c in list(target_want_candidates.values()):
-            candidates |= c
+    def _permutations_rng_get(self, tag, name_prefix):
+        # Return a random.Random to shuffle candidates with or None
+        # to keep them sorted (see permutations_randomizer)
+        randomizer = self.permutations_randomizer
+        if randomizer == "sequential":
+            return None
+        if randomizer == "random":
+            return random.Random()
+        # seed also with what we are generating groups for, so each
+        # testcase and interconnect group gets a different sequence
+        # that is still the same from run to run
+        return random.Random("%s %s %s %s" % (
+            randomizer, self.name, tag, name_prefix))
 
-        # max_repeats is how many repetitions we will allow before we
-        # call it quits
-        #
-        # A repetition is when we have to reject a candidate target
-        # group because:
-        #
-        #  - we have already considered that type
-        #
-        #  - it involves an invalid combination of targets
+    @staticmethod
+    def _target_wants_match(target_want_candidates):
+        # Assign to each target want one of its candidates so no
+        # remote target is used by more than one target want
         #
-        # Now, this algorithm is anything but efficient now and this
-        # is a hack that will be rid of when we make this algorithm
-        # proper.
+        # target_want_candidates is a list of (TWN, [CANDIDATES]),
+        # CANDIDATES being (RTFULLID, BSPMODEL) in order of
+        # preference. This is a maximum bipartite matching (Kuhn's
+        # augmenting paths), so if there is a way to assign them all,
+        # this finds it.
         #
-        # As we have more candidates, we need more chances to find it
-        max_repeats = max(100, 5 * len(candidates))
+        # Returns a dict TWN -> (RTFULLID, BSPMODEL) or None if
+        # they can't all be assigned.
+        owner = {}		# RTFULLID -> index in target_want_candidates
+        assigned = {}		# index -> (RTFULLID, BSPMODEL)
+
+        def _assign(index, visited):
+            # take a free one if there is, so we respect the order
+            # of preference as much as possible...
+            for candidate in target_want_candidates[index][1]:
+                if candidate[0] not in owner:
+                    owner[candidate[0]] = index
+                    assigned[index] = candidate
+                    return True
+            # ...otherwise try to move somebody else out of the way
+            for candidate in target_want_candidates[index][1]:
+                rt_fullid = candidate[0]
+                if rt_fullid in visited:
+                    continue
+                visited.add(rt_fullid)
+                if rt_fullid not in owner \
+                   or _assign(owner[rt_fullid], visited):
+                    owner[rt_fullid] = index
+                    assigned[index] = candidate
+                    return True
+            return False
+
+        for index in range(len(target_want_candidates)):
+            if not _assign(index, set()):
+                return None
+        return {
+            twn: assigned[index]
+            for index, (twn, _candidates) in enumerate(target_want_candidates)
+        }
+
+    def _target_wants_list_permutations(self, target_want_candidates, n,
+                                        tag = "target", name_prefix = ""):
+
+        if not target_want_candidates or n <= 0:
+            return {}
 
         # Limited evaluation: this means to only do one target of each
         # type. This can be general (set on the command line, applies to all
@@ -7131,7 +7554,6 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                         _n += bsp_model_count
                     if _n > n:
                         n = _n
-                        max_repeats = 3 * _n
             else:
                 assert True, "Unknown mode in self._mode (%s) "\
                     "or target_want['kws']['mode'] (%s)" \
@@ -7182,116 +7604,125 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         #
         # We are left with just two groups to test
         #
-        # For tracking limited mode: for each permutation we generate,
-        # we have a string [TARGET-WANT-NAME1:TARGET-TYPE1
-        # TARGET-WANT-NAME2:TARGET-TYPE2 ...]; if the string is in the
-        # @types_seen set, then it means we already have that type
-        # covered, so we ignore it.
+        # So what we really enumerate are assignments of *type keys*
+        # to target wants: in one-per-type mode the key is the
+        # remote target's (TYPE, BSPMODEL), in any mode it is the
+        # same for all candidates and in all mode each candidate is
+        # its own key. For each target want we group its candidates
+        # by key, then walk the keys of each want as a tree; before
+        # going down into a key we verify (with
+        # _target_wants_match()) that there still is a way to give
+        # all the target wants a different remote target, so we
+        # never go into a branch that can't produce a group. Each
+        # group we produce thus has a type combination we haven't
+        # seen, and we stop as soon as we have n of them, without
+        # generating and discarding repeats.
         #
-        # If we generate this many groups that are repeated, we are maybe out
-        # of permutations to generate. LAME, but quick to implement
-        types_seen = set()
-
-        permutations = {}
-        itr = 0
-        target_counter = 0
-        while itr < n:
-            if max_repeats == 0:
-                # Lame way to avoid getting stuck in not being able to generate
-                # good permutations
-                self.report_info("Exiting after generating %d permutations "
-                                 "(tried to generate more, but discarded "
-                                 "too many)" % len(permutations), dlevel = 6)
-                break
+        # The branches of each level are taken round robin, one group
+        # from each in turn; depth first, the first n groups would
+        # only vary the last target wants, leaving the first ones on
+        # the same remote targets.
+        #
+        # Candidates and keys are ordered according to
+        # permutations_randomizer, so with a seed the same groups
+        # come out on each run.
+        rng = self._permutations_rng_get(tag, name_prefix)
+        twns = sorted(target_want_candidates)
+        keys = {}		# TWN -> [ KEY, ... ]
+        key_candidates = {}	# (TWN, KEY) -> [ (RTFULLID, BSPMODEL), ... ]
+        for twn in twns:
+            candidates = sorted(target_want_candidates[twn],
+                                key = lambda x: ( x[0], x[1] or "" ))
+            if rng:
+                rng.shuffle(candidates)
+            if not candidates:
+                spec = self._targets[twn].get('spec', "")
+                self.report_skip(
+                    "%s group %s: no remote targets (or group of) "
+                    "can satisfy the conditions [%s] for wanted target '%s'" %
+                    (tag, name_prefix, spec, twn),
+                    alevel = 1)
+                type(self).class_result += result_c(0, 0, 0, 0, 1)
+                return {}
+            keys[twn] = []
+            for rt_fullid, bsp_model in candidates:
+                if _types_seen[twn] == 'one-per-type':
+                    key = ( self.rt_all[rt_fullid]['type'], bsp_model )
+                elif _types_seen[twn] == 'any':
+                    key = ( 'any', None )
+                else:	#  run in 'ALL' targets: each candidate is
+                        #  its own type
+                    key = ( rt_fullid, bsp_model )
+                if ( twn, key ) not in key_candidates:
+                    keys[twn].append(key)
+                    key_candidates[( twn, key )] = []
+                key_candidates[( twn, key )].append(( rt_fullid, bsp_model ))
+
+        def _match(keys_chosen):
+            # wants with a key chosen can only use candidates with
+            # that key, the rest any of theirs
+            return self._target_wants_match([
+                (
+                    twn,
+                    key_candidates[( twn, keys_chosen[twn] )]
+                    if twn in keys_chosen
+                    else [
+                        candidate
+                        for key in keys[twn]
+                        for candidate in key_candidates[( twn, key )]
+                    ]
+                )
+                for twn in twns
+            ])
 
-            # Instead of brute forcing a random number, converting it to our
-            # base and discarding the invalids, we are going to go for each
-            # target want at random order in the list and pick up a candidate
-            # at random, making sure it is not taken already
-
-            # This keeps track of which physical remote targets have already
-            # been taken, so we don't try to pick it again
-            rts_taken = set()
-            _types = dict()
-            perm = {}
-            cnt = 0
-            for target_want_name in random.sample(list(target_want_candidates.keys()), len(target_want_candidates)):
-                target_want = self._targets[target_want_name]
-                # Of the want's candidates, get which aren't taken already
-                rts_not_taken = set()
-                for rt_full_id, bsp_model in target_want_candidates[target_want_name]:
-                    if rt_full_id in rts_taken:
-                        continue
-                    rts_not_taken.add((rt_full_id, bsp_model))
-                if len(rts_not_taken) == 0:
-                    spec = target_want.get('spec', "")
-                    self.report_skip(
-                        "%s group %s: no remote targets (or group of) "
-                        "can satisfy the conditions [%s] for wanted target '%s'" %
-                        (tag, name_prefix, spec, target_want_name),
-                        attachments = { "length_perm": len(perm), "perm": perm },
-                        alevel = 1)
-                    perm.clear()
-                    type(self).class_result += result_c(0, 0, 0, 0, 1)
-                    break
-                # From available candidates, pick one at random and
-                # mark it taken
-                # need the sorted since in newer pythons,
-                # random.sample() requires it.
-                (rt_fullid, bsp_model) = random.sample(sorted(rts_not_taken), 1)[0]
-                rts_taken.add(rt_fullid)
-                perm[target_want_name] = (rt_fullid, bsp_model)
-                rt_type = self.rt_all[rt_fullid]['type']
-                if _types_seen[target_want_name] == 'one-per-type':
-                    _types[target_want_name] = (rt_type, bsp_model)
-                elif _types_seen[target_want_name] == 'any':
-                    # Use always the same string, so it is simplified
-                    # by the set
-                    _types[target_want_name] = ('any', None)
-                else: 	#  run in 'ALL' targets: use the sequential
-                        #  counter as a "type" so they are all
-                        #  different and thus are unique so it is not
-                        #  eliminated by the set reduction
-                    _types[target_want_name] = ("%d" % target_counter, None)
-                self.report_info(
-                    "%s group %s: target '%s': candidate %s:%s"
-                    % (tag, name_prefix, target_want_name,
-                       rt_fullid, bsp_model),
-                    dlevel = 8)
-                cnt += 1
-                target_counter += 1
+        def _keys_enumerate(index, keys_chosen):
+            if _match(keys_chosen) == None:
+                return
+            if index == len(twns):
+                yield keys_chosen
+                return
+            twn = twns[index]
+            branches = collections.deque()
+            for key in keys[twn]:
+                _keys_chosen = dict(keys_chosen)
+                _keys_chosen[twn] = key
+                branches.append(_keys_enumerate(index + 1, _keys_chosen))
+            while branches:
+                branch = branches.popleft()
+                keys_chosen = next(branch, None)
+                if keys_chosen == None:
+                    continue
+                yield keys_chosen
+                branches.append(branch)
 
-            if perm == {}:
-                # This meant we don't have enough targets to assign
+        permutations = {}
+        for keys_chosen in _keys_enumerate(0, {}):
+            if len(permutations) >= n:
                 break
+            perm = _match(keys_chosen)
             perm_id = commonl.mkid(self._tg_str(perm), l = 4)
-            # Generate a unique string that lists the target want
-            # names and the type of remote target they got assigned
-            perm_types_id = " ".join([
-                twn + "=" + rt_type + \
-                  ((":" + bsp_model) if bsp_model else "")\
-                for twn, (rt_type, bsp_model) in sorted(iter(_types.items()),
-                                                        key = lambda x: x[0])])
-            # Have we seen that permutations of target wants / remote
-            # target types?
-            if perm_types_id in types_seen:
-                max_repeats -=1
-                self.report_info("%s group %s: "
-                                 "ignoring (types already considered) %s"
-                                 % (tag, perm_id, perm_types_id), dlevel = 7)
-                continue
-            elif perm_id in permutations:
-                # We have one like this already
+            if perm_id in permutations:
+                # different types, but the ID hashes the same; unlikely
                 _name_prefix = "-" + name_prefix
                 self.report_info("%s group %s%s: "
                                  "ignoring (repeated)"
                                  % (tag, _name_prefix, perm_id), dlevel = 7)
-                max_repeats -=1
                 continue
-
-            itr += 1
-            types_seen.add(perm_types_id)
+            self.report_info("%s group %s: %s: %s"
+                             % (tag, name_prefix, perm_id,
+                                self._tg_str(perm)), dlevel = 8)
             permutations[perm_id] = perm
+
+        if not permutations:
+            self.report_skip(
+                "%s group %s: no remote targets (or group of) "
+                "can satisfy the conditions for wanted targets %s"
+                " at the same time" % (tag, name_prefix, " ".join(twns)),
+                attachments = {
+                    twn: self._targets[twn].get('spec', "") for twn in twns
+                },
+                alevel = 1)
+            type(self).class_result += result_c(0, 0, 0, 0, 1)
         return permutations
 
 
@@ -7787,8 +8218,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
             max_permutations = \
                 len(self._rt_types(ic_candidates[ic_want_name]))
         else:
-            # FIXME: get from command line and defaults
-            max_permutations = 10
+            max_permutations = tc_c.max_permutations
         self.report_info("interconnect groups: generating %d by "
                          "permuting remote ic targets" %
                          max_permutations, dlevel = 6)
@@ -8812,19 +9242,38 @@ def _allocid_server_keepalive(server, allocids):
         logging.error(f"keepalive: {server.aka}: error (ignoring): {e}")
 
 
+# threads to keepalive multiple servers in parallel, created once
+# per process (threads don't survive a fork)
+_allocids_keepalive_executor = None
+_allocids_keepalive_executor_pid = None
+
 def _allocids_keepalive_once():
     # send keepalives for all current ALLOCIds
     # paralellizes per server
     #
     # This is used by _targets_assign to start a keepalive thread that
     # keeps the allocationa live. It's a hack.
+    global _allocids_keepalive_executor
+    global _allocids_keepalive_executor_pid
     with _allocids_mutex:	# make a local copy of the current list
         allocids_local = dict(_allocids)
-
-    with concurrent.futures.ThreadPoolExecutor(len(allocids_local)) as executor:
-        _rs = executor.map(lambda i: _allocid_server_keepalive(i[0], i[1]),
-                          allocids_local.items())
-        # with waits for all the executors to finish
+        if len(allocids_local) > 1 \
+           and _allocids_keepalive_executor_pid != os.getpid():
+            _allocids_keepalive_executor = \
+                concurrent.futures.ThreadPoolExecutor(
+                    16, thread_name_prefix = "keepalive")
+            _allocids_keepalive_executor_pid = os.getpid()
+
+    if not allocids_local:
+        return
+    if len(allocids_local) == 1:
+        for server, allocids in allocids_local.items():
+            _allocid_server_keepalive(server, allocids)
+        return
+    # wait for all the servers to be done
+    list(_allocids_keepalive_executor.map(
+        lambda i: _allocid_server_keepalive(i[0], i[1]),
+        allocids_local.items()))
 
 
 def _run(args):
@@ -8900,6 +9349,7 @@ def _run(args):
         tc_c.runid_extra[key] = value
 
     tc_c.max_permutations = args.max_permutations
+    tc_c.permutations_randomizer = args.permutations_randomizer
     tc_c.max_runs_per_tc = args.max_runs_per_tc
 
     # Establish what is our log directory
@@ -9339,6 +9789,13 @@ def argp_setup(arg_subparsers):
         action = "store", type = int, default = 10,
         help = "Maximum number of permutuations of targets for a "
         "single test that shall be considered")
+    ap.add_argument(
+        "--permutations-randomizer",
+        action = "store", type = str, default = "random",
+        help = "How to pick remote targets for each target group: "
+        "'random' (different on each run), 'sequential' (sorted by "
+        "name) or any other string to use as a seed, so the same "
+        "groups are picked on each run [%(default)s]")
     ap.add_argument(
         "--max-runs-per-tc",
         action = "store", type = int, default = 0,
@@ -17,6 +17,7 @@ import ssl
 import time
 import traceback
 import urllib.parse
+import weakref
 
 import pyte
 
@@ -82,6 +83,227 @@ def ansi_render_approx(s, width = 80, height = 2000):
     return r
 
 
+def ansi_sgr_attrs(sequence):
+    """
+    Return the character attributes an ANSI SGR sequence sets
+
+    :param str sequence: sequence of ANSI *Select Graphic
+      Rendition* escapes; it can also be written as a Python regular
+      expression, as the strings in :mod:`tcfl.biosl` are, eg::
+
+        \\x1b\\[0m\\x1b\\[37m\\x1b\\[40m
+
+    :returns dict: dictionary with fields *fg*, *bg* (colors as
+      named by :mod:`pyte`, eg *white*, *black*, *cyan*...) and *bold*
+      (bool)
+    """
+    assert isinstance(sequence, str)
+    # undo the regex escaping, then the Python escaping
+    sequence = re.sub(r"\\([][])", r"\1", sequence)
+    sequence = sequence.encode('latin-1', errors = 'backslashreplace')\
+                       .decode('unicode_escape')
+    screen = pyte.Screen(1, 1)
+    pyte.Stream(screen).feed(sequence)
+    attrs = screen.cursor.attrs
+    return dict(fg = attrs.fg, bg = attrs.bg, bold = attrs.bold)
+
+
+class ansi_screen_c:
+    """
+    Persistent model of what an ANSI terminal connected to a
+    target's console is displaying
+
+    Instead of rendering a string from scratch (as
+    :func:`ansi_render_approx` does), this keeps a :mod:`pyte`
+    screen which is fed only the console output received since
+    the last call to :meth:`update`. The output is taken from the
+    console capture file the expect engine maintains, so it costs no
+    extra server round trips.
+
+    Get it with :func:`ansi_screen_get`, so there is only one per
+    target and console:
+
+    >>> screen = tcfl.tl.ansi_screen_get(target)
+    >>> target.console.wait_for_no_output()
+    >>> screen.update()
+    >>> for entry in screen.menu_entries(4, highlight):
+    >>>     ...
+
+    Rows and columns are counted from one, as in ANSI sequences.
+
+    :param tcfl.tc.target_c target: target whose console is modelled
+
+    :param str console: (optional; default console) console name
+
+    :param int width: (optional; default 80) screen columns
+
+    :param int height: (optional; default 25) screen rows
+
+    :param int backlog: (optional; default 128KiB) when starting (or
+      when the capture file is restarted), how many bytes of the
+      console's past output to feed to build the initial state of the
+      screen.
+    """
+    def __init__(self, target, console = None,
+                 width = 80, height = 25, backlog = 128 * 1024):
+        assert isinstance(target, tcfl.tc.target_c)
+        assert console == None or isinstance(console, str)
+        assert isinstance(width, int) and width > 0
+        assert isinstance(height, int) and height > 0
+        assert isinstance(backlog, int) and backlog >= 0
+        self.target = target
+        self.console = console
+        self.backlog = backlog
+        self.screen = pyte.Screen(width, height)
+        self.stream = pyte.ByteStream(self.screen)
+        # where we read up to in the capture file; None to start again
+        self.offset = None
+        self.inode = None
+
+    def reset(self):
+        """
+        Clear the screen state; the next :meth:`update` will rebuild
+        it from the capture's backlog
+        """
+        self.screen.reset()
+        self.stream = pyte.ByteStream(self.screen)
+        self.offset = None
+
+    def update(self):
+        """
+        Feed to the screen the console output captured since the
+        last update
+
+        Note this does not poll the console; the expect engine
+        (:meth:`tcfl.tc.target_c.expect`,
+        :meth:`tcfl.target_ext_console.extension.wait_for_no_output`,
+        etc) does it.
+
+        :returns int: number of bytes fed
+        """
+        filename = self.target.console.capture_filename(self.console)
+        try:
+            with open(filename, "rb") as f:
+                stat_info = os.fstat(f.fileno())
+                if self.offset == None or stat_info.st_ino != self.inode \
+                   or stat_info.st_size < self.offset:
+                    # first time or the capture file was restarted
+                    self.reset()
+                    self.inode = stat_info.st_ino
+                    self.offset = max(0, stat_info.st_size - self.backlog)
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0		# nothing captured yet
+        self.stream.feed(data)
+        self.offset += len(data)
+        return len(data)
+
+    @property
+    def display(self):
+        """
+        List of strings, one per screen row, with what it displays
+        """
+        return self.screen.display
+
+    def row_runs(self, row):
+        """
+        Split a screen row in runs of characters with the same attributes
+
+        :param int row: row number (starting at one)
+
+        :returns list: list of tuples *(COLUMN, TEXT, ATTRS)*, where
+          *ATTRS* is a dictionary as returned by :func:`ansi_sgr_attrs`.
+        """
+        line = self.screen.buffer[row - 1]
+        runs = []
+        text = ""
+        attrs = None
+        column = 1
+        for x in range(self.screen.columns):
+            char = line[x]
+            _attrs = dict(fg = char.fg, bg = char.bg, bold = char.bold)
+            if _attrs != attrs:
+                if text:
+                    runs.append(( column, text, attrs ))
+                column = x + 1
+                text = ""
+                attrs = _attrs
+            text += char.data
+        if text:
+            runs.append(( column, text, attrs ))
+        return runs
+
+    def menu_entries(self, column_key, highlight):
+        """
+        Parse the screen as a menu, listing its entries in display order
+
+        Entries are rows which have text starting at *column_key*; an
+        entry is highlighted if any non-blank text in it is displayed
+        with the *highlight* attributes. For key/value entries, BIOSes
+        tend to highlight only the value.
+
+        :param int column_key: column (starting at one) where the
+          entry names are displayed
+
+        :param dict highlight: attributes used to display
+          highlighted text, as returned by :func:`ansi_sgr_attrs`
+
+        :returns list: list of dictionaries with fields:
+
+          - *row*: row where the entry is displayed
+          - *key*: entry's name
+          - *highlighted*: *True* if highlighted
+          - *column_value* and *value*: if the highlighted text is
+            not the key, where it starts and what it is (*None*
+            otherwise)
+        """
+        assert isinstance(column_key, int) and column_key > 0
+        assert isinstance(highlight, dict)
+        entries = []
+        for row in range(1, self.screen.lines + 1):
+            line = self.screen.display[row - 1]
+            if line[column_key - 1:column_key].strip() == "" \
+               or line[column_key - 2:column_key - 1].strip() != "":
+                continue
+            # names end at the first run of two spaces
+            key = re.split(r"\s{2,}", line[column_key - 1:])[0].strip()
+            entry = dict(row = row, key = key, highlighted = False,
+                         column_value = None, value = None)
+            for column, text, attrs in self.row_runs(row):
+                if not text.strip() or any(
+                        attrs[k] != v for k, v in highlight.items()):
+                    continue
+                entry['highlighted'] = True
+                if column > column_key:
+                    entry['column_value'] = column
+                    entry['value'] = text.strip()
+                break
+            entries.append(entry)
+        return entries
+
+
+_ansi_screens = weakref.WeakKeyDictionary()
+
+def ansi_screen_get(target, console = None, **kwargs):
+    """
+    Return the :class:`ansi_screen_c` screen model for a target's console
+
+    It is created the first time it is requested, with *kwargs*
+    passed to the constructor; after that it is kept for as long as
+    the target object lives.
+
+    :param tcfl.tc.target_c target: target whose console is modelled
+
+    :param str console: (optional; default console) console name
+    """
+    console = target.console._console_get(console)
+    screens = _ansi_screens.setdefault(target, {})
+    if console not in screens:
+        screens[console] = ansi_screen_c(target, console, **kwargs)
+    return screens[console]
+
+
 def ipxe_sanboot_url(target, sanboot_url, dhcp = None,
                      power_cycle: bool = True,
                      precommands: list = None,
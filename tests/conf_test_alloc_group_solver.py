@@ -0,0 +1,13 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.allocation
+
+ttbl.allocation.group_solver = True
+
+for name in [ "t0", "t1", "t2" ]:
+    target = ttbl.test_target(name)
+    ttbl.config.target_add(target)
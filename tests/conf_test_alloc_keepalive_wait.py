@@ -0,0 +1,15 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.config
+
+for name in [ "t0", "t1" ]:
+    target = ttbl.test_target(name)
+    ttbl.config.target_add(target)
+
+# keepalive waits are disabled by default; allow one at a time
+import ttbl.allocation
+ttbl.allocation.keepalive_waiters_max = 1
@@ -0,0 +1,17 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.power
+
+for name in [ "t0", "t1" ]:
+    target = ttbl.test_target(name)
+    ttbl.config.target_add(target)
+    target.interface_add(
+        "power",
+        ttbl.power.interface(
+            p0 = ttbl.power.fake_c(name = "p0"),
+            p1 = ttbl.power.fake_c(name = "p1"),
+        ))
@@ -0,0 +1,155 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import ttbl
+import ttbl.console
+
+# A BIOS-like menu drawn with ANSI sequences; arrows move the
+# highlight (redrawing only the rows that change), enter selects.
+#
+# The Language entry is a key/value one: when selected, only the
+# value is highlighted.
+menu = r"""
+import os, sys, termios, tty
+
+entries = [ "Main", "Language", "Device Manager", "Boot Manager",
+            "Boot Maintenance Manager", "Network", "Security",
+            "Save & Exit", "Tls Auth Configuration", "Continue", "Reset" ]
+normal = "\x1b[0m\x1b[30m\x1b[47m"
+highlight = "\x1b[0m\x1b[37m\x1b[40m"
+out = sys.stdout
+
+def draw(index, selected):
+    row = 5 + index
+    if entries[index] == "Language":
+        out.write((highlight if selected else normal)
+                  + "\x1b[%02d;31H<Standard English>" % row
+                  + normal + "\x1b[%02d;04HLanguage" % row)
+    else:
+        out.write((highlight if selected else normal)
+                  + "\x1b[%02d;04H%-30s" % (row, entries[index])
+                  + normal + "\x1b[%02d;35H " % row)
+
+tty.setraw(0)
+out.write(normal + "\x1b[2J\x1b[02;30HMain Menu")
+current = 0
+for index in range(len(entries)):
+    draw(index, index == current)
+out.write("\x1b[24;01HF10=Save Changes and Exit")
+out.flush()
+data = b""
+while True:
+    data += os.read(0, 1024)
+    while data:
+        if data.startswith(b"\x1b[A") or data.startswith(b"\x1b[B"):
+            new = current + (1 if data[2:3] == b"B" else -1)
+            data = data[3:]
+            if 0 <= new < len(entries):
+                draw(current, False)
+                draw(new, True)
+                current = new
+        elif data.startswith(b"\r"):
+            data = data[1:]
+            out.write("\x1b[20;04Hselected %s\r\n" % entries[current])
+        elif data.startswith(b"\x1b") and len(data) < 3:
+            break
+        else:
+            data = data[1:]
+    out.flush()
+"""
+
+# Run the menu on a PTY; what comes over the console-NAME.write
+# socket goes to the PTY and what comes out of it is appended to
+# console-NAME.read. Exits when the daemon is gone.
+bridge = """
+import fcntl, os, pty, select, socket, sys
+sock_path, read_path, ttbd_pid, menu = sys.argv[1:5]
+pid, master = pty.fork()
+if pid == 0:
+    os.execv(sys.executable, [ sys.executable, "-c", menu ])
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(sock_path)
+server.listen(16)
+clients = []
+with open(read_path, "ab", buffering = 0) as out:
+    while True:
+        r, _, _ = select.select([ master, server ] + clients, [], [], 1)
+        try:
+            os.kill(int(ttbd_pid), 0)
+        except OSError:
+            os.killpg(0, 9)
+        for f in r:
+            if f is server:
+                clients.append(server.accept()[0])
+            elif f == master:
+                try:
+                    out.write(os.read(master, 65536))
+                except OSError:
+                    sys.exit(0)
+            else:
+                data = f.recv(65536)
+                if not data:
+                    clients.remove(f)
+                    f.close()
+                    continue
+                os.write(master, data)
+"""
+
+# the config is read by the main daemon process
+ttbd_pid = os.getpid()
+
+class console_pty_menu_c(ttbl.console.generic_c):
+
+    def enable(self, target, component):
+        write_file_name = os.path.join(target.state_dir,
+                                       "console-%s.write" % component)
+        read_file_name = os.path.join(target.state_dir,
+                                      "console-%s.read" % component)
+        self.disable(target, component)
+        with open(read_file_name, "w"):
+            pass
+        p = subprocess.Popen(
+            [ sys.executable, "-c", bridge,
+              write_file_name, read_file_name, str(ttbd_pid), menu ],
+            start_new_session = True, close_fds = True,
+            stdin = subprocess.DEVNULL)
+        target.fsdb.set("interfaces.console." + component + ".pid",
+                        str(p.pid))
+        ts0 = time.time()
+        while not os.path.exists(write_file_name):
+            if time.time() - ts0 > 5:
+                raise RuntimeError("pty bridge didn't start")
+            time.sleep(0.1)
+        ttbl.console.generic_c.enable(self, target, component)
+
+    def disable(self, target, component):
+        pid = target.fsdb.get("interfaces.console." + component + ".pid")
+        if pid:
+            try:
+                os.killpg(int(pid), signal.SIGKILL)
+            except OSError:
+                pass
+            target.fsdb.set("interfaces.console." + component + ".pid", None)
+        write_file_name = os.path.join(target.state_dir,
+                                       "console-%s.write" % component)
+        if os.path.exists(write_file_name):
+            os.unlink(write_file_name)
+        ttbl.console.generic_c.disable(self, target, component)
+
+
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add("console", ttbl.console.interface(
+    serial0 = console_pty_menu_c(),
+    default = "serial0",
+))
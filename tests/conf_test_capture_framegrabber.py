@@ -0,0 +1,52 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import sys
+
+import ttbl.capture
+
+# fake grabber: 64x48 RGB frames at ~20fps whose color changes every
+# two seconds
+grabber_code = """
+import sys, time
+while True:
+    sys.stdout.buffer.write(bytes([ int(time.time() / 2) & 0xff ]) * 64 * 48 * 3)
+    sys.stdout.buffer.flush()
+    time.sleep(0.05)
+"""
+
+# fake grabber: a 160x120 RGB frame of noise that never changes
+grabber_pattern_code = """
+import random, sys, time
+rng = random.Random(0)
+frame = bytes(rng.randrange(256) for _ in range(160 * 120 * 3))
+while True:
+    sys.stdout.buffer.write(frame)
+    sys.stdout.buffer.flush()
+    time.sleep(0.05)
+"""
+
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add(
+    "capture", ttbl.capture.interface(
+        screen = ttbl.capture.framegrabber_c(
+            "%(id)s fake screen",
+            [ sys.executable, "-c", grabber_code ], 64, 48),
+        screen_idle = ttbl.capture.framegrabber_c(
+            "%(id)s fake screen (idle)",
+            [ sys.executable, "-c", grabber_code ], 64, 48,
+            idle_timeout = 1),
+        screen_pattern = ttbl.capture.framegrabber_c(
+            "%(id)s fake screen (pattern)",
+            [ sys.executable, "-c", grabber_pattern_code ], 160, 120),
+        # what it costs to run a program for each snapshot
+        snapshot = ttbl.capture.generic_snapshot(
+            "%(id)s fake snapshot",
+            "dd if=/dev/zero of=%(output_file_name)s bs=9216 count=1",
+            mimetype = "image/x-portable-pixmap", extension = ".ppm"),
+    )
+)
@@ -44,4 +44,23 @@ target.interface_add(
             # will always timeout
             estimated_duration = 5,
         ),
+        # parallel, but only one at the same time can use bus0
+        image_bus0 = ttbl.images.flash_shell_cmd_c(
+            cmdline = [
+                "/usr/bin/bash",
+                "-c",
+                "for ((count = 0; count < 3; count++)); do echo step $count; sleep 1s; done"
+            ],
+            estimated_duration = 10, parallel = True, bus = "bus0",
+        ),
+        image_bus1 = ttbl.images.flash_shell_cmd_c(
+            cmdline = [
+                "/usr/bin/bash",
+                "-c",
+                "for ((count = 0; count < 3; count++)); do echo step $count; sleep 1s; done"
+            ],
+            estimated_duration = 10, parallel = True, bus = "bus0",
+        ),
     ))
+
+ttbl.images.bus_concurrency["bus0"] = 1
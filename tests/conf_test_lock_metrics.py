@@ -0,0 +1,60 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import time
+
+import ttbl
+
+class locker_interface(ttbl.tt_interface):
+    """
+    Take the target's lock in ways the test can measure
+    """
+    def _target_setup(self, target, iface_name):
+        pass
+
+    def _release_hook(self, target, _force):
+        pass
+
+    def put_contend(self, target, who, args, _files, _user_path):
+        # another process holds the target's lock for a while and we
+        # wait for it
+        seconds = self.arg_get(args, "seconds", ( int, float ))
+        with target.target_owned_and_locked(who):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                target.lock.acquire()
+                os.write(write_fd, b"locked")
+                time.sleep(seconds)
+                target.lock.release()
+                os._exit(0)
+            os.read(read_fd, 10)
+            os.close(read_fd)
+            os.close(write_fd)
+            with target.lock:
+                pass
+            os.waitpid(pid, 0)
+        return {}
+
+    def put_holder_dies(self, target, who, _args, _files, _user_path):
+        # a process that dies holding the target's lock
+        with target.target_owned_and_locked(who):
+            pid = os.fork()
+            if pid == 0:
+                target.lock.acquire()
+                os._exit(0)
+            os.waitpid(pid, 0)
+            with target.lock:
+                pass
+        return {}
+
+# make the metrics of all the processes visible right away
+ttbl.lock_metrics_flush_period = 0
+
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add("locker", locker_interface())
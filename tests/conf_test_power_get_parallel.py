@@ -0,0 +1,23 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.power
+
+# power rail whose states are read in parallel, half with processes,
+# half with threads; the gets are slow so we can tell they run in
+# parallel
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add(
+    "power",
+    ttbl.power.interface(
+        get_parallel = True,
+        **{
+            f"p{i}": ttbl.power.fake_c(
+                name = f"p{i}", delay = 0.5,
+                get_executor = "thread" if i % 2 else "process")
+            for i in range(8)
+        }))
@@ -0,0 +1,20 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.power
+
+# p1..p4 are independent, so they are powered on/off at the same
+# time; each operation takes a second
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add(
+    "power",
+    ttbl.power.interface(
+        stages = [ [ "p1", "p2", "p3", "p4" ] ],
+        **{
+            f"p{i}": ttbl.power.fake_c(name = f"p{i}", delay = 1)
+            for i in range(6)
+        }))
@@ -0,0 +1,127 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import ttbl
+import ttbl.console
+
+# Run a shell on a PTY; what comes over the console-NAME.write socket
+# goes to the PTY and what comes out of it is appended to
+# console-NAME.read.
+#
+# Exits when the daemon is gone.
+#
+# Once in each direction, flip a byte in the middle of a large
+# chunk of data, to simulate a noisy serial line.
+bridge = """
+import fcntl, os, pty, select, socket, sys
+sock_path, read_path, ttbd_pid = sys.argv[1:4]
+pid, master = pty.fork()
+if pid == 0:
+    os.execvpe("/bin/bash", [ "bash", "--norc", "--noprofile", "-i" ],
+               { "PATH": os.environ["PATH"], "TERM": "dumb", "HOME": "/tmp" })
+fcntl.fcntl(master, fcntl.F_SETFL, os.O_NONBLOCK)
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(sock_path)
+server.listen(16)
+clients = []
+pending = b""
+corrupt_in = corrupt_out = True
+read_total = 0
+
+def flip(data, index):
+    c = b"A"[0] if data[index] != b"A"[0] else b"B"[0]
+    return data[:index] + bytes([ c ]) + data[index + 1:]
+
+with open(read_path, "ab", buffering = 0) as out:
+    while True:
+        r, w, _ = select.select([ master, server ] + clients,
+                                [ master ] if pending else [], [], 1)
+        try:
+            os.kill(int(ttbd_pid), 0)
+        except OSError:
+            os.killpg(0, 9)
+        if w:
+            pending = pending[os.write(master, pending):]
+        for f in r:
+            if f is server:
+                clients.append(server.accept()[0])
+            elif f == master:
+                try:
+                    data = os.read(master, 65536)
+                except OSError:
+                    sys.exit(0)
+                read_total += len(data)
+                if corrupt_out and read_total > 300000:
+                    corrupt_out = False
+                    data = flip(data, len(data) // 2)
+                out.write(data)
+            else:
+                data = f.recv(65536)
+                if not data:
+                    clients.remove(f)
+                    f.close()
+                    continue
+                if corrupt_in and len(data) > 16384:
+                    corrupt_in = False
+                    data = flip(data, len(data) // 2)
+                pending += data
+"""
+
+# the config is read by the main daemon process
+ttbd_pid = os.getpid()
+
+class console_pty_shell_c(ttbl.console.generic_c):
+
+    def enable(self, target, component):
+        write_file_name = os.path.join(target.state_dir,
+                                       "console-%s.write" % component)
+        read_file_name = os.path.join(target.state_dir,
+                                      "console-%s.read" % component)
+        self.disable(target, component)
+        with open(read_file_name, "w"):
+            pass
+        p = subprocess.Popen(
+            [ sys.executable, "-c", bridge,
+              write_file_name, read_file_name, str(ttbd_pid) ],
+            start_new_session = True, close_fds = True,
+            stdin = subprocess.DEVNULL)
+        target.fsdb.set("interfaces.console." + component + ".pid",
+                        str(p.pid))
+        ts0 = time.time()
+        while not os.path.exists(write_file_name):
+            if time.time() - ts0 > 5:
+                raise RuntimeError("pty bridge didn't start")
+            time.sleep(0.1)
+        ttbl.console.generic_c.enable(self, target, component)
+
+    def disable(self, target, component):
+        pid = target.fsdb.get("interfaces.console." + component + ".pid")
+        if pid:
+            try:
+                os.killpg(int(pid), signal.SIGKILL)
+            except OSError:
+                pass
+            target.fsdb.set("interfaces.console." + component + ".pid", None)
+        write_file_name = os.path.join(target.state_dir,
+                                       "console-%s.write" % component)
+        if os.path.exists(write_file_name):
+            os.unlink(write_file_name)
+        ttbl.console.generic_c.disable(self, target, component)
+
+
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add("console", ttbl.console.interface(
+    serial0 = console_pty_shell_c(),
+    default = "serial0",
+))
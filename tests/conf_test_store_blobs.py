@@ -0,0 +1,12 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.store
+import ttbl.config
+
+for name in [ "t0", "t1" ]:
+    target = ttbl.test_target(name)
+    ttbl.config.target_add(target) # store interface added automatically
@@ -0,0 +1,31 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+# a few targets with an inventory of a size similar to real ones
+for i in range(100):
+    target = ttbl.test_target(f"t{i}")
+    ttbl.config.target_add(
+        target,
+        tags = {
+            "dict": {
+                "1": "1",
+                "2" : {
+                    "2a": "2a",
+                },
+                "3": {
+                },
+            },
+            "interconnects": {
+                f"ic{j}": {
+                    "mac_addr": f"02:00:00:00:{i:02x}:{j:02x}",
+                    "ipv4_addr": f"192.168.{j}.{i + 2}",
+                    "ipv4_prefix_len": 24,
+                    "ipv6_addr": f"fd:00:{j:02x}::{i + 2:02x}",
+                    "ipv6_prefix_len": 104,
+                }
+                for j in range(10)
+            },
+        })
@@ -0,0 +1,11 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.config
+
+ttbl.config.timestamp_flush_period = 10
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
@@ -0,0 +1,21 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.config
+import ttbl.auth_localdb
+
+ttbl.config.add_authenticator(ttbl.auth_localdb.authenticator_localdb_c(
+    "Test user database",
+    [
+        [ 'user1', 'password', 'user', 'context1' ],
+    ]))
+
+ttbl.config.target_add(ttbl.test_target('tg_req_c1'), tags = dict(
+    _roles_required = [ 'context1' ],
+))
+
+for i in range(20):
+    ttbl.config.target_add(ttbl.test_target(f't{i}'))
@@ -0,0 +1,110 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+
+import commonl.testing
+import tcfl.tc
+import tcfl.target_ext_alloc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "Traceback",
+        "DEBUG[",
+        # this is not our fault, is a warning on the core
+        "FIXME: delete the allocation",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + ' and t2')
+class _test(tcfl.tc.tc_c):
+    """
+    With the group solver, allocations get whole groups at once and
+    never hold part of one
+
+    See ttbl.allocation.group_solver
+
+    1. allocation A gets t0
+    2. allocation B asks for t0 and t1; it can't get t0, so it
+       doesn't take t1 either
+    3. allocation C asks for t1, gets it (same priority as B, so it
+       can use what B is waiting for)
+    4. A is removed; B still can't get its group, since C has t1
+    5. allocation D, lower priority, asks for t0; it does not get it,
+       since B, higher priority, is waiting for it
+    6. C is removed: B gets t0 and t1 at the same time
+
+    """
+
+    def _alloc(self, server, targets, state_expected, priority = 700):
+        allocid, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": targets }, wait_in_queue = False,
+            priority = priority)
+        if state != state_expected:
+            raise tcfl.tc.failed_e(
+                f"allocation for {','.join(targets)} got state '{state}',"
+                f" expected '{state_expected}'")
+        return allocid
+
+    def _check(self, server, **expected):
+        r = server.send_request("PUT", "keepalive",
+                                json = dict.fromkeys(expected.values()))
+        for name, allocid in expected.items():
+            state = r.get(allocid, { "state": "allocid missing" })['state']
+            if name.endswith("_active"):
+                state_expected = "active"
+            else:
+                state_expected = "queued"
+            if state != state_expected:
+                raise tcfl.tc.failed_e(
+                    f"allocation {name} ({allocid}) is in state {state},"
+                    f" expected {state_expected}")
+
+    def _owner(self, server, target_name):
+        r = server.send_request("GET", "targets/" + target_name,
+                                data = { "projection": [ "_alloc.id" ] })
+        return r.get('_alloc', {}).get('id', None)
+
+    def eval(self, target):
+        server = tcfl.server_c.servers[target.rt['server']]
+
+        allocid_a = self._alloc(server, [ "t0" ], "active")
+        allocid_b = self._alloc(server, [ "t0", "t1" ], "queued")
+        owner = self._owner(server, "t1")
+        if owner != None:
+            raise tcfl.tc.failed_e(
+                f"t1 is owned by {owner} while B {allocid_b} waits for t0")
+        self.report_pass("allocation waiting for t0 doesn't hold t1")
+
+        allocid_c = self._alloc(server, [ "t1" ], "active")
+        self.report_pass("same priority allocation got t1 meanwhile")
+
+        tcfl.target_ext_alloc._delete(server, allocid_a)
+        self._check(server, b = allocid_b, c_active = allocid_c)
+        allocid_d = self._alloc(server, [ "t0" ], "queued", priority = 900)
+        self.report_pass("lower priority allocation can't get t0,"
+                         " which B waits for")
+
+        tcfl.target_ext_alloc._delete(server, allocid_c)
+        self._check(server, b_active = allocid_b, d = allocid_d)
+        for target_name in [ "t0", "t1" ]:
+            owner = self._owner(server, target_name)
+            if owner != allocid_b:
+                raise tcfl.tc.failed_e(
+                    f"{target_name} owned by {owner}, expected B {allocid_b}")
+        self.report_pass("B got t0 and t1 once both were available")
+
+        tcfl.target_ext_alloc._delete(server, allocid_b)
+        self._check(server, d_active = allocid_d)
+        tcfl.target_ext_alloc._delete(server, allocid_d)
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,96 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+A keepalive asked to wait returns as soon as an allocation changes
+state, or after the wait if nothing changes; a client waiting in the
+queue gets its targets right when they are released, not a
+keepalive period later
+"""
+
+import os
+import threading
+import time
+
+import commonl.testing
+import tcfl.target_ext_alloc
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "DEBUG[",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + ' and t0')
+class _test(tcfl.tc.tc_c):
+
+    def eval(self, target):
+        server = target.server
+
+        ts0 = time.time()
+        r = server.send_request("PUT", "keepalive?wait=2",
+                                json = { self.allocid: "active" })
+        ts = time.time() - ts0
+        if r or ts < 1.5 or ts > 4:
+            raise tcfl.tc.failed_e(
+                "keepalive with no changes expected to return nothing"
+                f" after ~2s; got {r} after {ts:.1f}s")
+        self.report_pass(f"keepalive with no changes waited {ts:.1f}s")
+
+        ts0 = time.time()
+        r = server.send_request("PUT", "keepalive?wait=10",
+                                json = { self.allocid: "queued" })
+        ts = time.time() - ts0
+        if r.get(self.allocid, {}).get('state') != "active" or ts > 1:
+            raise tcfl.tc.failed_e(
+                "keepalive with a different state expected to return"
+                f" right away; got {r} after {ts:.1f}s")
+        self.report_pass(f"keepalive with changes returned in {ts:.1f}s")
+
+        # allocate t1, then remove that allocation while another one
+        # waits for t1 in the queue, keepaliving every 10s
+        allocid0, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t1" ] }, queue = True)
+        ts_release = []
+        def _release():
+            time.sleep(2)
+            ts_release.append(time.time())
+            tcfl.target_ext_alloc._delete(server, allocid0)
+
+        thread = threading.Thread(target = _release)
+        thread.start()
+        keepalive_wait = tcfl.target_ext_alloc.keepalive_wait
+        tcfl.target_ext_alloc.keepalive_wait = True
+        try:
+            allocid, state, _ = tcfl.target_ext_alloc._alloc_targets(
+                server, { "group": [ "t1" ] },
+                keepalive_period = 10, queue = True)
+            ts = time.time()
+        finally:
+            tcfl.target_ext_alloc.keepalive_wait = keepalive_wait
+            thread.join()
+        try:
+            if state != "active":
+                raise tcfl.tc.failed_e(
+                    f"queued allocation {allocid} expected to become"
+                    f" active; got {state}")
+            delay = ts - ts_release[0]
+            if delay > 1:
+                raise tcfl.tc.failed_e(
+                    f"queued allocation {allocid} took {delay:.1f}s to"
+                    " become active after the target was released")
+            self.report_pass(f"queued allocation became active {delay:.1f}s"
+                             " after the target was released")
+        finally:
+            tcfl.target_ext_alloc._delete(server, allocid)
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,116 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+import tcfl.target_ext_alloc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "Traceback",
+        "DEBUG[",
+        # this is not our fault, is a warning on the core
+        "FIXME: delete the allocation",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + ' and t2')
+class _test(tcfl.tc.tc_c):
+    """
+    An allocation that holds part of a group gets ahead in the queue
+    of the targets it still needs
+
+    See ttbl.allocation._target_starvation_recalculate()
+
+    1. allocation A gets t0
+    2. allocation C queues for t0
+    3. allocation B, same priority, asks for t0 and t1; gets t1 and
+       queues for t0, behind C since it came later
+    4. A is removed: t0 has to go to B, which has been boosted over
+       C for holding half of its group already
+
+    Boosts don't allow preempting an owner of the same user priority:
+
+    5. allocation D gets t0
+    6. allocation E, same priority, asks with preemption for t0 and
+       t1; gets t1 and queues for t0, boosted for holding half its
+       group
+    7. allocation F queues for t0, running the scheduler on it
+       again -- D keeps t0
+
+    """
+
+    def _state_get(self, server, allocid):
+        r = server.send_request("PUT", "keepalive",
+                                json = { allocid: None })
+        return r.get(allocid, { "state": "allocid missing" })['state']
+
+    def eval(self, target):
+        server = tcfl.server_c.servers[target.rt['server']]
+
+        allocid_a, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t0" ] }, wait_in_queue = False)
+        assert state == "active", \
+            f"allocation A got state '{state}', expected 'active'"
+        allocid_c, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t0" ] }, wait_in_queue = False)
+        assert state == "queued", \
+            f"allocation C got state '{state}', expected 'queued'"
+        # make sure B's queue entry is younger
+        time.sleep(1.5)
+        allocid_b, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t0", "t1" ] }, wait_in_queue = False)
+        assert state == "queued", \
+            f"allocation B got state '{state}', expected 'queued'"
+        self.report_info(f"A {allocid_a} has t0, C {allocid_c} and"
+                         f" B {allocid_b} wait for it")
+
+        tcfl.target_ext_alloc._delete(server, allocid_a)
+        state_b = self._state_get(server, allocid_b)
+        state_c = self._state_get(server, allocid_c)
+        if state_b != "active" or state_c != "queued":
+            raise tcfl.tc.failed_e(
+                "t0 did not go to allocation B, which holds half its group",
+                dict(state_b = state_b, state_c = state_c))
+        self.report_pass("t0 went to B, which holds half its group")
+        tcfl.target_ext_alloc._delete(server, allocid_b)
+        tcfl.target_ext_alloc._delete(server, allocid_c)
+
+        allocid_d, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t0" ] }, wait_in_queue = False)
+        assert state == "active", \
+            f"allocation D got state '{state}', expected 'active'"
+        allocid_e, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t0", "t1" ] }, preempt = True,
+            wait_in_queue = False)
+        assert state == "queued", \
+            f"allocation E got state '{state}', expected 'queued'"
+        allocid_f, state, _ = tcfl.target_ext_alloc._alloc_targets(
+            server, { "group": [ "t0" ] }, wait_in_queue = False)
+        assert state == "queued", \
+            f"allocation F got state '{state}', expected 'queued'"
+        state_d = self._state_get(server, allocid_d)
+        state_e = self._state_get(server, allocid_e)
+        if state_d != "active" or state_e != "queued":
+            raise tcfl.tc.failed_e(
+                "boosted allocation E preempted D, of the same priority",
+                dict(state_d = state_d, state_e = state_e))
+        self.report_pass("boosted allocation did not preempt one of the"
+                         " same priority")
+        tcfl.target_ext_alloc._delete(server, allocid_d)
+        tcfl.target_ext_alloc._delete(server, allocid_e)
+        tcfl.target_ext_alloc._delete(server, allocid_f)
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
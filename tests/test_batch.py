@@ -0,0 +1,80 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Batched interface calls: multiple calls on multiple targets are
+executed in order in a single request, with per-call results
+"""
+
+import os
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        # eval_10 makes a call fail on purpose
+        "Traceback",
+        "unavailable interface",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+@tcfl.tc.target(ttbd.url_spec + " and t1")
+class _test(tcfl.tc.tc_c):
+
+    def eval_00_ordered(self, target, target1):
+        target.power.off()
+        target1.power.off()
+        results = target.batch() \
+            .add("power", "on", component = "p0") \
+            .add("power", "on", target = target1) \
+            .add("power", "list", method = "GET") \
+            .add("power", "list", method = "GET", target = target1) \
+            .run()
+        if len(results) != 4 or any('error' in r for r in results):
+            raise tcfl.tc.failed_e("batch failed", dict(results = results))
+        # t0 only had p0 powered, so it is partially on -> False
+        if results[2]['result'].get('state', None) != False:
+            raise tcfl.tc.failed_e("t0 power state wrong",
+                                   dict(results = results))
+        if results[3]['result'].get('state', None) != True:
+            raise tcfl.tc.failed_e("t1 power state wrong",
+                                   dict(results = results))
+        self.report_pass("calls on two targets executed in order")
+
+    def eval_10_errors(self, target):
+        batch = target.batch(stop_on_error = False)
+        batch.add("nonexistant", "call")
+        batch.add("power", "off")
+        results = batch.run()
+        if len(results) != 2 or 'error' not in results[0] \
+           or 'result' not in results[1]:
+            raise tcfl.tc.failed_e("batch did not continue after error",
+                                   dict(results = results))
+        self.report_pass("batch continues after error if asked")
+
+        batch = target.batch()
+        batch.add("nonexistant", "call")
+        batch.add("power", "on")
+        try:
+            batch.run()
+            raise tcfl.tc.failed_e("failing batch did not raise")
+        except tcfl.tc.error_e as e:
+            results = e.attachments['results']
+            if len(results) != 1:
+                raise tcfl.tc.failed_e("batch did not stop on error",
+                                       dict(results = results)) from e
+        if target.power.get() != False:
+            raise tcfl.tc.failed_e("call after error was executed")
+        self.report_pass("batch stops on error")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,85 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Navigate an ANSI menu with :func:`tcfl.biosl.menu_scroll_to_entry`
+using the terminal screen model in :func:`tcfl.tl.ansi_screen_get`
+
+- the screen model finds the entries and which one is highlighted,
+  also for key/value entries (where only the value is highlighted)
+
+- scrolling to an entry sends all the keystrokes at once, in both
+  directions
+"""
+
+import os
+import time
+
+import commonl.testing
+import tcfl.biosl
+import tcfl.tc
+import tcfl.tl
+
+srcdir = os.path.dirname(__file__)
+
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+@tcfl.tc.target(ttbd.url_spec)
+class _test(tcfl.tc.tc_c):
+
+    def eval_00_screen(self, target):
+        target.console.enable()
+        target.expect("F10=Save Changes and Exit")
+        screen = tcfl.tl.ansi_screen_get(target)
+        if screen is not tcfl.tl.ansi_screen_get(target):
+            raise tcfl.tc.failed_e("screen model not kept per console")
+        screen.update()
+        highlight = tcfl.tl.ansi_sgr_attrs(tcfl.biosl.normal_white_fg_black_bg)
+        entries = screen.menu_entries(4, highlight)
+        keys = [ entry['key'] for entry in entries ]
+        if keys[:3] != [ "Main", "Language", "Device Manager" ] \
+           or len(keys) != 11:
+            raise tcfl.tc.failed_e("unexpected menu entries",
+                                   dict(keys = keys))
+        highlighted = [ entry['key'] for entry in entries
+                        if entry['highlighted'] ]
+        if highlighted != [ "Main" ]:
+            raise tcfl.tc.failed_e("unexpected highlighted entries",
+                                   dict(highlighted = highlighted))
+        self.report_pass("screen model parses the menu")
+
+    def _scroll_to(self, target, entry, **kwargs):
+        ts0 = time.time()
+        r = tcfl.biosl.menu_scroll_to_entry(target, entry, **kwargs)
+        ts = time.time() - ts0
+        if not r:
+            raise tcfl.tc.failed_e(f"can't scroll to entry {entry}")
+        return r, ts
+
+    def eval_10_scroll(self, target):
+        r, ts = self._scroll_to(target, "Tls Auth")
+        if r['key_novalue'] != b"Tls Auth Configuration" \
+           or r['row_novalue'] != b"13":
+            raise tcfl.tc.failed_e("unexpected entry", dict(r = r))
+        # one key at a time takes at least 0.6s per entry to let the
+        # display settle; eight entries down, in one go it takes two
+        if ts > 8 * 0.6:
+            raise tcfl.tc.failed_e(
+                f"scrolling took {ts:.1f}s; keystrokes not batched?")
+        tcfl.biosl.entry_select(target)
+        target.expect("selected Tls Auth Configuration")
+        self.report_pass(f"scrolled down to entry in {ts:.1f}s")
+
+        r, ts = self._scroll_to(target, "Lang(?P<suffix>[a-z]+)",
+                                has_value = True)
+        if r['key_value'] != b"Language" or r['suffix'] != b"uage" \
+           or r['value'] != b"<Standard English>" \
+           or r['column_value'] != b"31":
+            raise tcfl.tc.failed_e("unexpected entry", dict(r = r))
+        self.report_pass(f"scrolled up to key/value entry in {ts:.1f}s")
@@ -0,0 +1,181 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+A framegrabber capturer serves the latest frame from a long running
+grabber, tells clients when the frame has not changed since the one
+they have and stops the grabber when nobody asks for frames
+"""
+
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd'))),
+    ],
+    errors_ignore = [
+        "DEBUG[",
+        # eval_00_sequenced() tries 'since' on a generic snapshot
+        "Traceback",
+        "does not number its",
+        "capture/start:EXIT:EXCEPTION",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class _test(tcfl.tc.tc_c):
+
+    def _frame_check(self, target, file_name):
+        with open(file_name, "rb") as f:
+            data = f.read()
+        header = b"P6\n64 48\n255\n"
+        if not data.startswith(header) \
+           or len(data) != len(header) + 64 * 48 * 3:
+            raise tcfl.tc.failed_e(
+                "frame is not a 64x48 PPM image",
+                dict(header = data[:20], size = len(data)))
+        return data[len(header)]
+
+    def eval_00_sequenced(self, target):
+        if not target.rt['interfaces']['capture']['screen'].get('sequenced'):
+            raise tcfl.tc.failed_e("framegrabber doesn't publish 'sequenced'")
+        if target.rt['interfaces']['capture']['snapshot'].get('sequenced'):
+            raise tcfl.tc.failed_e("generic snapshot publishes 'sequenced'")
+        try:
+            target.capture.start("snapshot", since = 1)
+            raise tcfl.tc.failed_e("generic snapshot accepted 'since'")
+        except tcfl.tc.error_e as e:
+            self.report_pass("generic snapshot rejects 'since'",
+                             dict(exception = e))
+
+    def eval_10_frames(self, target):
+        ts0 = time.time()
+        r = target.capture.start("screen")
+        self.report_info("first frame (starting the grabber) in %.2fs"
+                         % (time.time() - ts0))
+        sequence = r['sequence']
+        if not r['changed']:
+            raise tcfl.tc.failed_e("first frame reported unchanged",
+                                   dict(r = r))
+        file_name = os.path.join(self.tmpdir, "frame0.ppm")
+        target.capture.get("screen", "default", file_name)
+        self._frame_check(target, file_name)
+        self.report_pass("got frame #%d" % sequence)
+
+        # the color changes every two seconds; wait for it to change
+        # so the polls below start right after and don't straddle
+        # the next one
+        ts0 = time.time()
+        while True:
+            r = target.capture.start("screen", since = sequence)
+            if r['changed']:
+                break
+            if time.time() - ts0 > 5:
+                raise tcfl.tc.failed_e("frame not reported changed in 5s",
+                                       dict(r = r, sequence = sequence))
+            time.sleep(0.05)
+        sequence = r['sequence']
+        target.capture.get("screen", "default", file_name)
+        color0 = self._frame_check(target, file_name)
+
+        count = 20
+        changes = []
+        ts0 = time.time()
+        for _ in range(count):
+            r = target.capture.start("screen", since = sequence)
+            changes.append(r['changed'])
+        ts = time.time() - ts0
+        unchanged = changes.index(True) if True in changes else count
+        # if slow, the next change might still come in; but once a
+        # poll reports a change, all the next ones have to, since
+        # they are all relative to the same frame
+        if unchanged == 0 or False in changes[unchanged:]:
+            raise tcfl.tc.failed_e(
+                "polls since frame #%d shall report it unchanged until"
+                " it changes" % sequence, dict(changes = changes))
+        self.report_pass("%d/%d polls unchanged, %.1fms per poll"
+                         % (unchanged, count, 1000 * ts / count))
+
+        ts0 = time.time()
+        for _ in range(count):
+            target.capture.start("screen")
+        ts = time.time() - ts0
+        self.report_info("framegrabber: %.1fms per frame" % (1000 * ts / count))
+        ts0 = time.time()
+        for _ in range(count):
+            target.capture.start("snapshot")
+        ts = time.time() - ts0
+        self.report_info("generic snapshot: %.1fms per frame"
+                         % (1000 * ts / count))
+
+        time.sleep(2.5)
+        r = target.capture.start("screen", since = sequence)
+        if not r['changed'] or r['sequence'] <= sequence:
+            raise tcfl.tc.failed_e("frame not reported changed after 2.5s",
+                                   dict(r = r, sequence = sequence))
+        file_name = os.path.join(self.tmpdir, "frame1.ppm")
+        target.capture.get("screen", "default", file_name)
+        color1 = self._frame_check(target, file_name)
+        if color1 == color0:
+            raise tcfl.tc.failed_e(
+                "frame #%d has the same contents as #%d"
+                % (r['sequence'], sequence))
+        self.report_pass("frame #%d changed" % r['sequence'])
+
+    def eval_20_idle(self, target):
+        target.capture.start("screen_idle")
+        time.sleep(3)
+        file_name = os.path.join(self.tmpdir, "screen_idle.log")
+        target.capture.get("screen_idle", "log", file_name)
+        with open(file_name) as f:
+            log = f.read()
+        if "stopped after" not in log:
+            raise tcfl.tc.failed_e("idle grabber not stopped",
+                                   dict(log = log))
+        self.report_pass("idle grabber stopped")
+        r = target.capture.start("screen_idle")
+        file_name = os.path.join(self.tmpdir, "frame2.ppm")
+        target.capture.get("screen_idle", "default", file_name)
+        self._frame_check(target, file_name)
+        self.report_pass("grabber restarted after idling, frame #%d"
+                         % r['sequence'])
+
+    def eval_30_image_on_screenshot(self, target):
+        try:
+            import cv2
+        except ImportError as e:
+            raise tcfl.tc.skip_e("need packages cv2, imutils, numpy: %s" % e)
+        target.capture.start("screen_pattern")
+        file_name = os.path.join(self.tmpdir, "pattern.ppm")
+        target.capture.get("screen_pattern", "default", file_name)
+        image = cv2.imread(file_name)
+        template_name = os.path.join(self.tmpdir, "template.png")
+        cv2.imwrite(template_name, image[40:80, 60:100])
+        other_name = os.path.join(self.tmpdir, "other.png")
+        cv2.imwrite(other_name, 255 - image[40:80, 60:100])
+        r = self.expect(
+            timeout = 10,
+            found = target.capture.image_on_screenshot(
+                template_name, capturer = "screen_pattern",
+                poll_period = 0.5, timeout = 10),
+            # optional, never found; gets matched with found
+            other = target.capture.image_on_screenshot(
+                other_name, capturer = "screen_pattern",
+                poll_period = 0.5, timeout = 0),
+        )
+        if 'found' not in r or 'other' in r:
+            raise tcfl.tc.failed_e("expected only 'found' to be found",
+                                   dict(r = r))
+        absolute = r['found'][1.0]['absolute']
+        if tuple(absolute) != ( 60, 40, 100, 80 ):
+            raise tcfl.tc.failed_e("template found in the wrong place",
+                                   dict(r = r))
+        self.report_pass("template found on framegrabber screenshots")
@@ -0,0 +1,144 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Console streaming (*follow* argument to *console/read*)
+
+- a following read returns data written while it is open
+
+- a following read flushes and reports each chunk as it writes it
+
+- when all the server's follow slots are taken, a read returns the
+  data available without following
+
+- expectations with :data:`tcfl.target_ext_console.stream_follow`
+  enabled find text without polling the server
+"""
+
+import fcntl
+import os
+import threading
+import time
+
+import commonl.testing
+import tcfl.tc
+import tcfl.target_ext_console
+
+srcdir = os.path.dirname(__file__)
+
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+@tcfl.tc.target(ttbd.url_spec)
+class _test(tcfl.tc.tc_c):
+
+    @staticmethod
+    def _write_later(target, console, data, wait):
+        time.sleep(wait)
+        target.console.write(data, console = console)
+
+    def eval_00_follow(self, target):
+        target.console.enable("c1")
+        s = "%d" % time.time()
+        thread = threading.Thread(target = self._write_later,
+                                  args = ( target, "c1", s, 1 ))
+        thread.start()
+        headers = {}
+        ts0 = time.time()
+        _generation, offset, r = target.console.read_full(
+            "c1", 0, follow = 10, _headers = headers)
+        ts = time.time() - ts0
+        thread.join()
+        if 'X-Stream-Follow' not in headers:
+            raise tcfl.tc.failed_e("server did not follow",
+                                   dict(headers = headers))
+        if r != s or offset != len(s):
+            raise tcfl.tc.failed_e(
+                f"read data '{r}' @{offset} != written data '{s}'")
+        if ts >= 10:
+            raise tcfl.tc.failed_e(
+                f"following took {ts:.1f}s, shall finish after data came")
+        self.report_pass(f"followed read got data written later in {ts:.2f}s")
+
+    @staticmethod
+    def _write_many_later(target, console, count, wait):
+        for i in range(count):
+            time.sleep(wait)
+            target.console.write("line %d %s\n" % (i, 90 * "x"),
+                                 console = console)
+
+    def eval_05_follow_chunks(self, target):
+        # data keeps coming for ~3s, so the server keeps following;
+        # each chunk has to be flushed to the file and reported as
+        # it is written, not when the read is done (note the test
+        # server buffers the whole response, so we can't check
+        # they come in before the read ends)
+        offset0 = target.console.size("c1")
+        thread = threading.Thread(target = self._write_many_later,
+                                  args = ( target, "c1", 15, 0.2 ))
+        chunks = []
+        def _chunk_cb(_generation, offset):
+            chunks.append(( offset, os.path.getsize(of.name) ))
+        with open(os.path.join(self.tmpdir, "c1.capture"), "wb") as of:
+            thread.start()
+            _generation, offset, _ = target.console.read_full(
+                "c1", offset0, fd = of, follow = 10, _chunk_cb = _chunk_cb)
+        thread.join()
+        if len(chunks) < 2 or chunks[-1][0] != offset:
+            raise tcfl.tc.failed_e(
+                f"expected several chunk callbacks ending at @{offset}",
+                dict(chunks = chunks))
+        offset_prev = offset0
+        for chunk_offset, size in chunks:
+            if chunk_offset - offset0 != size:
+                raise tcfl.tc.failed_e(
+                    f"chunk reported @{chunk_offset} before it was"
+                    f" flushed to the file (size {size})",
+                    dict(chunks = chunks))
+            if chunk_offset <= offset_prev:
+                raise tcfl.tc.failed_e(
+                    f"chunk reported @{chunk_offset}, not after"
+                    f" the previous one @{offset_prev}",
+                    dict(chunks = chunks))
+            offset_prev = chunk_offset
+        self.report_pass(f"{len(chunks)} chunks flushed and reported")
+
+    def eval_07_follow_busy(self, target):
+        # take the only follow slot the server has (see the conf
+        # file and ttbl.console.follow_slot_get())
+        lockfile = os.path.join(ttbd.state_dir, "console.follow.0.lock")
+        with open(lockfile, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            headers = {}
+            ts0 = time.time()
+            target.console.read_full("c1", 0, follow = 10,
+                                     _headers = headers)
+            ts = time.time() - ts0
+        if 'X-Stream-Follow' in headers:
+            raise tcfl.tc.failed_e("server followed with no slots free",
+                                   dict(headers = headers))
+        if ts >= 5:
+            raise tcfl.tc.failed_e(
+                f"read with no follow slots free took {ts:.1f}s")
+        self.report_pass("no follow slots free, read without following")
+
+    def eval_10_expect(self, target):
+        target.console.enable("c2")
+        tcfl.target_ext_console.stream_follow = 10
+        try:
+            s = "stream %d" % time.time()
+            thread = threading.Thread(target = self._write_later,
+                                      args = ( target, "c2", s, 2 ))
+            thread.start()
+            target.expect(s, console = "c2", timeout = 10)
+            thread.join()
+        finally:
+            tcfl.target_ext_console.stream_follow = 0
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
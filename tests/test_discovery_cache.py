@@ -0,0 +1,103 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Testcase discovery caches results on disk: unchanged files are not
+imported again, changed files are and a file that crashes its
+discovery worker is reported as blocked without affecting the rest
+"""
+
+import os
+
+import tcfl.discovery
+import tcfl.tc
+
+# each time this is imported, it leaves a mark in the imports file
+testcase_source = """\
+import os
+import tcfl.tc
+with open(os.path.join(os.path.dirname(__file__), "imports"), "a") as f:
+    f.write("%s\\n")
+class _test(tcfl.tc.tc_c):
+    def eval(self):
+        pass
+"""
+
+class _test(tcfl.tc.tc_c):
+
+    def _discover(self, srcdir):
+        agent = tcfl.discovery.agent_c()
+        agent.threads = 4
+        agent.cache_path = os.path.join(self.tmpdir, "cache")
+        agent.run(paths = [ srcdir ])
+        with open(os.path.join(srcdir, "imports")) as f:
+            imports = f.read().split()
+        return agent, imports
+
+    def eval(self):
+        srcdir = os.path.join(self.tmpdir, "tcs")
+        os.makedirs(srcdir)
+        testcase_path = os.path.join(srcdir, "test_cached.py")
+        with open(testcase_path, "w") as f:
+            f.write(testcase_source % "v1")
+        with open(os.path.join(srcdir, "test_crash.py"), "w") as f:
+            f.write("import os\nos._exit(3)\n")
+
+        # more than one testcase driver might import it
+        agent, imports0 = self._discover(srcdir)
+        if not imports0 or testcase_path not in agent.tcis:
+            raise tcfl.tc.failed_e(
+                "first discovery didn't find the testcase",
+                dict(imports = imports0, tcis = agent.tcis))
+        crashed = agent.tcis.get(os.path.join(srcdir, "test_crash.py"))
+        if not crashed or not crashed[0].result.blocked:
+            raise tcfl.tc.failed_e(
+                "crashing file not reported as blocked",
+                dict(tcis = agent.tcis))
+        self.report_pass("crashing file blocked, others discovered")
+
+        # results with errors or blocked are not cached, so ensure
+        # this one is good and cached or the next checks mean nothing
+        for tci in agent.tcis[testcase_path]:
+            if tci.exception or tci.result \
+               and ( tci.result.errors or tci.result.blocked ):
+                raise tcfl.tc.failed_e(
+                    "first discovery of the testcase not clean",
+                    dict(exception = tci.exception, result = tci.result))
+        cache = tcfl.discovery._cache_c(agent.cache_path,
+                                        tcfl.discovery._drivers_signature())
+        key = cache._key(testcase_path,
+                         agent.subcase_spec_by_filename[testcase_path])
+        if not os.path.isfile(os.path.join(agent.cache_path, key)):
+            raise tcfl.tc.failed_e(
+                "no cache entry for the testcase after first discovery",
+                dict(cache = os.listdir(agent.cache_path)))
+        self.report_pass("first discovery result cached")
+
+        agent, imports = self._discover(srcdir)
+        if imports != imports0 or testcase_path not in agent.tcis:
+            raise tcfl.tc.failed_e(
+                "unchanged file imported again",
+                dict(imports = imports, tcis = agent.tcis))
+        self.report_pass("unchanged file taken from the cache")
+
+        # new timestamp, same contents: still cached
+        os.utime(testcase_path, ns = ( 0, 0 ))
+        agent, imports = self._discover(srcdir)
+        if imports != imports0:
+            raise tcfl.tc.failed_e(
+                "touched but unchanged file imported again",
+                dict(imports = imports))
+        self.report_pass("touched but unchanged file taken from the cache")
+
+        with open(testcase_path, "w") as f:
+            f.write(testcase_source % "v2")
+        agent, imports = self._discover(srcdir)
+        if "v2" not in imports or testcase_path not in agent.tcis:
+            raise tcfl.tc.failed_e(
+                "modified file not discovered again",
+                dict(imports = imports, tcis = agent.tcis))
+        self.report_pass("modified file discovered again")
@@ -0,0 +1,68 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Discovery workers are reused across files; a module imported while
+scanning one file (eg: a helper next to it) must not be taken by
+another file importing a different module with the same name
+"""
+
+import os
+
+import tcfl.discovery
+import tcfl.tc
+
+helper_source = """\
+NAME = "%s"
+"""
+
+testcase_source = """\
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+import helper
+import tcfl.tc
+@tcfl.tc.tags(helper_name = helper.NAME)
+class _test(tcfl.tc.tc_c):
+    def eval(self):
+        pass
+"""
+
+class _test(tcfl.tc.tc_c):
+
+    def eval(self):
+        paths = {}
+        for name in [ "a", "b" ]:
+            srcdir = os.path.join(self.tmpdir, "tcs", name)
+            os.makedirs(srcdir)
+            with open(os.path.join(srcdir, "helper.py"), "w") as f:
+                f.write(helper_source % name)
+            paths[name] = os.path.join(srcdir, "test_helper.py")
+            with open(paths[name], "w") as f:
+                f.write(testcase_source)
+
+        # one worker, so it has to scan both files
+        agent = tcfl.discovery.agent_c()
+        agent.threads = 1
+        agent.cache_path = os.path.join(self.tmpdir, "cache")
+        agent.run(paths = [ os.path.join(self.tmpdir, "tcs") ])
+
+        for name, path in paths.items():
+            tcis = agent.tcis.get(path, [])
+            if not tcis:
+                raise tcfl.tc.failed_e(
+                    f"{path}: testcase not discovered",
+                    dict(tcis = agent.tcis))
+            for tci in tcis:
+                helper_name = tci.tags.get("helper_name", None)
+                if isinstance(helper_name, tuple):
+                    helper_name = helper_name[0]
+                if helper_name != name:
+                    raise tcfl.tc.failed_e(
+                        f"{path}: imported the wrong helper module;"
+                        f" got helper_name {helper_name}, expected {name}",
+                        dict(tags = tci.tags))
+        self.report_pass("each file imported its own helper module")
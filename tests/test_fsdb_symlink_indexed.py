@@ -0,0 +1,238 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Exercise the indexed symlink FSDB (:class:`commonl.fsdb_symlink_indexed_c`)
+
+- the same sequence of operations applied on it and on
+  :class:`commonl.fsdb_symlink_c` yields the same database contents
+
+- the index is rebuilt for databases that were created without it
+  and is not seen when opening them with :class:`commonl.fsdb_symlink_c`
+
+- values written with :meth:`commonl.fsdb_c.set_many` are seen by
+  readers all or none
+
+- micro-benchmark :meth:`commonl.fsdb_c.set` on databases with a few
+  hundred keys, which is what a target usually has
+"""
+
+import os
+import random
+import threading
+import time
+
+import commonl
+import tcfl.tc
+
+class _test(tcfl.tc.tc_c):
+
+    # set KEY to VALUE in order; *None* removes
+    ops = [
+        ( "a", 1 ),
+        ( "a.b.c", "abc" ),		# a is no longer an scalar
+        ( "a.b.d", True ),
+        ( "a.b.e.f", 3.0 ),
+        ( "a.g", "ag" ),
+        ( "a.b", "ab" ),		# wipes a.b.*
+        ( "h.i.j", "hij" ),
+        ( "h.i.k", "hik" ),
+        ( "h", None ),			# wipes h.*
+        ( "l.m", "lm" ),
+        ( "l.m.n.o", "lmno" ),		# l.m is no longer an scalar
+        ( "l.m.n.p", "lmnp" ),
+        ( "l.m.n", None ),
+        ( "name with spaces.sub", "s" ),
+        ( "name :/ weird.sub", "w" ),
+    ]
+
+    def _db_mk(self, name, cls):
+        dirname = os.path.join(self.tmpdir, name)
+        commonl.makedirs_p(dirname)
+        return cls(dirname)
+
+    @tcfl.tc.subcase()
+    def eval_00_same_as_symlink(self):
+        fsdb = self._db_mk("plain", commonl.fsdb_symlink_c)
+        fsdb_indexed = self._db_mk("indexed", commonl.fsdb_symlink_indexed_c)
+        for key, value in self.ops:
+            fsdb.set(key, value)
+            fsdb_indexed.set(key, value)
+            d = fsdb.get_as_dict()
+            d_indexed = fsdb_indexed.get_as_dict()
+            if d != d_indexed:
+                raise tcfl.tc.failed_e(
+                    f"setting {key} to {value}: databases differ",
+                    dict(fsdb = d, fsdb_indexed = d_indexed))
+        if sorted(fsdb.keys("a.*")) != sorted(fsdb_indexed.keys("a.*")):
+            raise tcfl.tc.failed_e(
+                "keys(PATTERN) differ",
+                dict(keys = fsdb.keys("a.*"),
+                     keys_indexed = fsdb_indexed.keys("a.*")))
+        if fsdb.get_as_slist() != fsdb_indexed.get_as_slist():
+            raise tcfl.tc.failed_e(
+                "get_as_slist() differs",
+                dict(slist = fsdb.get_as_slist(),
+                     slist_indexed = fsdb_indexed.get_as_slist()))
+        self.report_pass("indexed and plain symlink databases match")
+
+        # the index is not visible to the plain implementation
+        fsdb_plain = commonl.fsdb_symlink_c(fsdb_indexed.location)
+        if sorted(fsdb_plain.keys()) != sorted(fsdb_indexed.keys()):
+            raise tcfl.tc.failed_e(
+                "plain keys() on an indexed database lists the index",
+                dict(keys = fsdb_plain.keys(),
+                     keys_indexed = fsdb_indexed.keys()))
+        if fsdb_plain.get_as_slist() != fsdb_indexed.get_as_slist():
+            raise tcfl.tc.failed_e(
+                "plain get_as_slist() on an indexed database lists the index",
+                dict(slist = fsdb_plain.get_as_slist(),
+                     slist_indexed = fsdb_indexed.get_as_slist()))
+        self.report_pass("index not listed by plain symlink database")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_index_rebuild(self):
+        # create with plain, then open with indexed, which has to
+        # build an index to find a.b.* when setting a.b
+        fsdb = self._db_mk("rebuild", commonl.fsdb_symlink_c)
+        fsdb.set("a.b.c", 1)
+        fsdb.set("a.b.d", 2)
+        fsdb_indexed = commonl.fsdb_symlink_indexed_c(fsdb.location)
+        fsdb_indexed.set("a.b", 3)
+        d = fsdb_indexed.get_as_dict()
+        if d != { "a.b": 3 }:
+            raise tcfl.tc.failed_e("rebuilt index didn't wipe a.b.*",
+                                   dict(db = d))
+        self.report_pass("index rebuilt for pre-existing database")
+
+
+    @tcfl.tc.subcase()
+    def eval_15_set_many(self):
+        # set_many() / batch() have to yield the same as calling set()
+        # in sequence
+        for name, cls in ( ( "plain", commonl.fsdb_symlink_c ),
+                           ( "indexed", commonl.fsdb_symlink_indexed_c ) ):
+            with self.subcase(name):
+                fsdb = self._db_mk("set_many-" + name, cls)
+                fsdb_many = self._db_mk("set_many-many-" + name, cls)
+                for key, value in self.ops:
+                    fsdb.set(key, value)
+                fsdb_many.set_many(self.ops)
+                d = fsdb.get_as_dict()
+                d_many = fsdb_many.get_as_dict()
+                if d != d_many:
+                    raise tcfl.tc.failed_e(
+                        "set_many() differs from set()",
+                        dict(set = d, set_many = d_many))
+
+                with fsdb_many.batch() as batch:
+                    batch["a.b"] = "first"
+                    batch["a.b.x"] = "wipes a.b"
+                    batch["q"] = 1
+                    batch["q"] = None	# last one wins
+                    if fsdb_many.get("a.b.x") != None:
+                        raise tcfl.tc.failed_e(
+                            "batch() values visible before commit")
+                d_many = fsdb_many.get_as_dict()
+                if d_many.get("a.b.x") != "wipes a.b" \
+                   or "a.b" in d_many or "q" in d_many:
+                    raise tcfl.tc.failed_e(
+                        "batch() didn't apply values in order",
+                        dict(db = d_many))
+                if [ i for i in os.listdir(fsdb_many.location)
+                     if i.endswith("##field_creation##") ]:
+                    raise tcfl.tc.failed_e(
+                        "set_many() left staged values behind",
+                        dict(listdir = os.listdir(fsdb_many.location)))
+                self.report_pass("set_many() and batch() match set()")
+
+
+    @tcfl.tc.subcase()
+    def eval_16_set_many_group(self):
+        # while a thread writes groups of keys all set to the same
+        # value, readers shall always see all the keys with the same
+        # value
+        keys = [ f"group.key{count}" for count in range(50) ]
+        for name, cls in ( ( "plain", commonl.fsdb_symlink_c ),
+                           ( "indexed", commonl.fsdb_symlink_indexed_c ) ):
+            with self.subcase(name):
+                fsdb = self._db_mk("set_many-group-" + name, cls)
+                fsdb.set_many({ key: 0 for key in keys })
+                done = threading.Event()
+
+                def _write():
+                    fsdb_writer = cls(fsdb.location)
+                    for count in range(1, 100):
+                        fsdb_writer.set_many({ key: count for key in keys })
+                    done.set()
+
+                thread = threading.Thread(target = _write, daemon = True)
+                thread.start()
+                reads = 0
+                while not done.is_set():
+                    values = set(fsdb.get_as_dict("group.*").values())
+                    reads += 1
+                    if len(values) != 1:
+                        done.wait()
+                        raise tcfl.tc.failed_e(
+                            f"read part of a group: {sorted(values)}")
+                thread.join()
+                self.report_pass(f"{reads} reads saw only whole groups")
+
+
+    @tcfl.tc.subcase()
+    def eval_17_generation(self):
+        fsdb = self._db_mk("generation", commonl.fsdb_symlink_indexed_c)
+        fsdb_other = commonl.fsdb_symlink_indexed_c(fsdb.location)
+        generation0 = fsdb.generation_get()
+        fsdb.get_as_dict()
+        if fsdb.generation_get() != generation0:
+            raise tcfl.tc.failed_e("generation changed by reading")
+        fsdb_other.set("a.b", 1)
+        generation1 = fsdb.generation_get()
+        if generation1 == generation0:
+            raise tcfl.tc.failed_e("generation not changed by set()")
+        fsdb_other.set_many({ "a.b": None, "c": 2 })
+        if fsdb.generation_get() == generation1:
+            raise tcfl.tc.failed_e("generation not changed by set_many()")
+        self.report_pass("generation changes on writes, not on reads")
+
+
+    keys_count = 400
+    sets_count = 200
+
+    @tcfl.tc.subcase()
+    def eval_20_benchmark(self):
+        # populate databases with nested keys, similar to what
+        # targets have (interfaces.power.COMPONENT.FIELD...) and time
+        # setting random ones
+        rng = random.Random(0)
+        keys = [
+            f"interfaces.iface{i % 10}.component{i // 10}.field{i % 7}"
+            for i in range(self.keys_count)
+        ]
+        timings = {}
+        for name, cls in ( ( "plain", commonl.fsdb_symlink_c ),
+                           ( "indexed", commonl.fsdb_symlink_indexed_c ) ):
+            fsdb = self._db_mk("benchmark-" + name, cls)
+            fsdb.set_keys([ ( key, "value" ) for key in keys ])
+            ts0 = time.time()
+            for _ in range(self.sets_count):
+                fsdb.set(rng.choice(keys), "newvalue")
+            timings[name] = (time.time() - ts0) / self.sets_count * 1000
+            self.report_data("fsdb set() benchmark [ms/set]",
+                             f"{name} {self.keys_count} keys",
+                             timings[name])
+        self.report_info(
+            f"set() on {self.keys_count} keys:"
+            f" plain {timings['plain']:.3f}ms"
+            f" indexed {timings['indexed']:.3f}ms", level = 0)
+        if timings['indexed'] > timings['plain']:
+            raise tcfl.tc.failed_e("indexed set() is slower than plain",
+                                   dict(timings = timings))
+        self.report_pass("indexed set() is faster than plain")
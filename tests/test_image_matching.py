@@ -0,0 +1,141 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Image template matching finds the same matches when looking only
+where a screenshot changed, skips screenshots that didn't change and
+matches multiple templates in one pass; the time per frame each
+method takes on synthetic screenshots is reported
+"""
+
+import os
+import time
+import types
+
+import tcfl.tc
+import tcfl.target_ext_capture
+
+class _test(tcfl.tc.tc_c):
+
+    def _image(self, rng, width, height):
+        import cv2
+        import numpy
+        # blurred noise, so templates don't match by chance
+        image = rng.integers(0, 256, ( height, width, 3 ), dtype = numpy.uint8)
+        return cv2.GaussianBlur(image, ( 5, 5 ), 0)
+
+    def _frame(self, image):
+        import cv2
+        import zlib
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return dict(filename = "synthetic", gray = gray,
+                    crc = zlib.crc32(gray), pyramid = {}, results = {})
+
+    def eval(self):
+        try:
+            import cv2
+            import imutils
+            import numpy
+        except ImportError as e:
+            raise tcfl.tc.skip_e("need packages cv2, imutils, numpy: %s" % e)
+        ext = tcfl.target_ext_capture
+        rng = numpy.random.default_rng(0)
+
+        templates = {}
+        for name in [ "icon1", "icon2", "icon3" ]:
+            filename = os.path.join(self.tmpdir, name + ".png")
+            cv2.imwrite(filename, self._image(rng, 64, 64))
+            templates[name] = ( filename,
+                                cv2.imread(filename, cv2.IMREAD_GRAYSCALE),
+                                30, 30, None )
+        screen0 = self._image(rng, 1280, 720)
+        screen1 = screen0.copy()
+        # icon1 shows up at full size, icon2 at one of the scales we
+        # downscale templates to
+        screen1[200:264, 300:364] = cv2.imread(templates['icon1'][0])
+        scale = numpy.linspace(0.2, 1.0, 20)[::-1][9]
+        icon2 = imutils.resize(cv2.imread(templates['icon2'][0]),
+                               width = int(64 * scale))
+        screen1[500:500 + icon2.shape[0], 900:900 + icon2.shape[1]] = icon2
+
+        frame0 = self._frame(screen0)
+        frame1 = self._frame(screen1)
+        full = ext._templates_find("screen1", frame1['gray'], templates)
+        if not full['icon1'] or not full['icon2'] or full['icon3']:
+            raise tcfl.tc.failed_e("unexpected matches on synthetic screen",
+                                   dict(full = full))
+
+        # look only where screen1 changed from screen0
+        state = dict(gray = frame0['gray'], crc = frame0['crc'])
+        exp = types.SimpleNamespace(in_area = None)
+        area = ext._expect_image_on_screenshot_c._area_to_match(
+            exp, state, frame1)
+        if area != ( 300, 200, 900 + icon2.shape[1], 500 + icon2.shape[0] ):
+            raise tcfl.tc.failed_e("wrong changed area", dict(area = area))
+        templates_area = {
+            name: data[:4] + ( area, ) for name, data in templates.items()
+        }
+        partial = ext._templates_find("screen1", frame1['gray'],
+                                      templates_area)
+        if partial != full:
+            raise tcfl.tc.failed_e(
+                "matching where changed differs from matching everywhere",
+                dict(full = full, partial = partial))
+        self.report_pass("matching where the screen changed finds the same")
+
+        state = dict(gray = frame1['gray'], crc = frame1['crc'])
+        if ext._expect_image_on_screenshot_c._area_to_match(
+                exp, state, self._frame(screen1.copy())) != False:
+            raise tcfl.tc.failed_e("unchanged screen not skipped")
+        exp.in_area = ( 0, 0, 0.1, 0.1 )
+        if ext._expect_image_on_screenshot_c._area_to_match(
+                exp, dict(gray = frame0['gray'], crc = frame0['crc']),
+                frame1) != False:
+            raise tcfl.tc.failed_e("change out of in_area not skipped")
+        self.report_pass("unchanged screens and areas skipped")
+
+        # benchmark: a cursor moves a bit each frame, three templates
+        frames = []
+        for count in range(3):
+            screen = screen0.copy()
+            screen[100 + 10 * count : 116 + 10 * count, 640:656] = 255
+            frames.append(self._frame(screen))
+
+        def _separately():
+            for frame in frames:
+                for name, data in templates.items():
+                    # like before: template downscaled on each call
+                    ext._template_pyramids.clear()
+                    ext._templates_find("s", frame['gray'], { name: data })
+
+        def _one_pass():
+            for frame in frames:
+                ext._templates_find("s", frame['gray'], templates)
+
+        def _changed_only():
+            last = frames[0]
+            for frame in frames[1:]:
+                area = ext._expect_image_on_screenshot_c._area_to_match(
+                    types.SimpleNamespace(in_area = None),
+                    dict(gray = last['gray'], crc = last['crc']), frame)
+                ext._templates_find("s", frame['gray'], {
+                    name: data[:4] + ( area, )
+                    for name, data in templates.items()
+                })
+                last = frame
+            return len(frames) - 1
+
+        for what, fn in [
+                ( "each template separately", _separately ),
+                ( "all templates in one pass", _one_pass ),
+                ( "all templates where changed", _changed_only ),
+        ]:
+            ts0 = time.time()
+            count = fn() or len(frames)
+            ts = time.time() - ts0
+            self.report_info("%s: %.1fms/frame (3 templates, 1280x720)"
+                             % (what, 1000 * ts / count))
+        self.report_pass("benchmark completed")
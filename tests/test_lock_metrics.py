@@ -0,0 +1,73 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Target locks contended between daemon processes are handed over as
+soon as they are released, dead holders are detected and both show
+in the daemon's lock metrics
+"""
+
+import os
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "DEBUG[",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + ' and t0')
+class _test(tcfl.tc.tc_c):
+
+    def eval(self, target):
+        r = target.server.send_request("GET", "locks")
+        metrics0 = r['locks'].get("target/t0",
+                                  dict(contended = 0, dead_holders = 0))
+
+        # another daemon process holds the lock for 0.4s while the
+        # one serving the request waits for it; it shall be handed
+        # over as soon as it is released
+        target.ttbd_iface_call("locker", "contend", seconds = 0.4)
+        target.ttbd_iface_call("locker", "holder_dies")
+
+        r = target.server.send_request("GET", "locks")
+        if r['buckets'] != [ 0.0001, 0.001, 0.01, 0.1, 1, 10 ]:
+            raise tcfl.tc.failed_e("unexpected histogram buckets",
+                                   dict(response = r))
+        metrics = r['locks'].get("target/t0", None)
+        if metrics == None:
+            raise tcfl.tc.failed_e("no metrics for target/t0",
+                                   dict(response = r))
+        self.report_info("target/t0 lock metrics", metrics, level = 1)
+        if metrics['contended'] == metrics0['contended']:
+            raise tcfl.tc.failed_e("expected a contended wait",
+                                   dict(metrics = metrics))
+        # polling every 0.3s would have waited 0.6s
+        if metrics['wait']['max'] < 0.3 or metrics['wait']['max'] > 0.5:
+            raise tcfl.tc.failed_e(
+                "longest wait expected to be about a hold (0.4s), got %.2fs"
+                % metrics['wait']['max'], dict(metrics = metrics))
+        if metrics['hold']['max'] < 0.4:
+            raise tcfl.tc.failed_e("hold time not accounted",
+                                   dict(metrics = metrics))
+        if sum(metrics['wait']['buckets']) != metrics['count']:
+            raise tcfl.tc.failed_e("wait histogram doesn't match count",
+                                   dict(metrics = metrics))
+        self.report_pass("contention on target/t0 accounted")
+
+        if metrics['dead_holders'] - metrics0['dead_holders'] != 1:
+            raise tcfl.tc.failed_e("dead holder not detected",
+                                   dict(metrics = metrics))
+        self.report_pass("dead holder detected")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
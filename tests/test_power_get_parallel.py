@@ -0,0 +1,62 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Parallel power state gets with persistent executors and state cache
+
+- states are read in parallel, with threads or processes
+
+- a get right after another reuses the cached states
+
+- powering on/off invalidates the cache
+"""
+
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class _test(tcfl.tc.tc_c):
+
+    def _list_check(self, target, expected, what):
+        ts0 = time.time()
+        state, _substate, data = target.power.list()
+        ts = time.time() - ts0
+        states = { component: d['state'] for component, d in data.items() }
+        if state != expected \
+           or any(i != expected for i in states.values()):
+            raise tcfl.tc.failed_e(
+                f"{what}: expected all {expected}, got {state}",
+                dict(data = data))
+        return ts
+
+    def eval(self, target):
+        target.power.off()
+        # eight 0.5s gets, in parallel shall take way less than 4s
+        ts = self._list_check(target, False, "after off")
+        if ts > 2:
+            raise tcfl.tc.failed_e(
+                f"getting state took {ts:.2f}s, not parallel?")
+        ts = self._list_check(target, False, "after off, cached")
+        if ts > 0.5:
+            raise tcfl.tc.failed_e(
+                f"getting state again took {ts:.2f}s, not cached?")
+        target.power.on()
+        self._list_check(target, True, "after on")
+        target.power.off()
+        self._list_check(target, False, "after off again")
+        self.report_pass("power states read in parallel and cached")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
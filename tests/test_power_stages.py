@@ -0,0 +1,55 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Power rail stages: components in the same stage are powered on/off
+at the same time and the timing of each is reported
+"""
+
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class _test(tcfl.tc.tc_c):
+
+    def _power(self, target, verb):
+        ts0 = time.time()
+        r = target.ttbd_iface_call("power", verb)
+        ts = time.time() - ts0
+        timings = r.get('timings', {})
+        if sorted(timings.keys()) != [ f"p{i}" for i in range(6) ]:
+            raise tcfl.tc.failed_e(f"power {verb}: timings missing",
+                                   dict(r = r))
+        # six components taking 1s each, four of them at the same
+        # time; serially it'd take six seconds
+        if ts > 5:
+            raise tcfl.tc.failed_e(
+                f"power {verb} took {ts:.1f}s; stage not parallel?",
+                dict(r = r))
+        self.report_info(f"power {verb} took {ts:.1f}s", dict(r = r),
+                         level = 0)
+
+    def eval(self, target):
+        target.power.off()
+        self._power(target, "on")
+        if target.power.get() != True:
+            raise tcfl.tc.failed_e("not powered on")
+        self._power(target, "off")
+        if target.power.get() != False:
+            raise tcfl.tc.failed_e("not powered off")
+        self.report_pass("stages powered on/off in parallel")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
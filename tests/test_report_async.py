@@ -0,0 +1,171 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Asynchronous report drivers: reporting doesn't block on a slow
+driver, ordering is kept, the queue can drop chatty messages when
+full, flushing waits for delivery, the reporter's context is kept and
+driver errors are raised when flushing
+"""
+
+import threading
+import time
+
+import tcfl.tc
+
+class slow_report_driver_c(tcfl.tc.report_driver_c):
+    """
+    Report driver that records the messages starting with *async*
+    and that can be stalled by clearing :data:`gate`
+    """
+    asynchronous = True
+
+    def __init__(self):
+        tcfl.tc.report_driver_c.__init__(self)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.messages = []
+        self.idents = []
+        self.attachments = []
+        self.threads = set()
+        self.fail = False
+
+    def report(self, testcase, target, tag, ts, delta,
+               level, message, alevel, attachments):
+        if not message.startswith("async"):
+            return
+        self.gate.wait()
+        self.threads.add(threading.current_thread())
+        if self.fail and message.startswith("async raise"):
+            raise RuntimeError(message)
+        self.messages.append(message)
+        self.idents.append(testcase.ident())
+        self.attachments.append(
+            dict(attachments) if attachments != None else None)
+
+driver_ordered = slow_report_driver_c()
+tcfl.tc.report_driver_c.add(driver_ordered, name = "async-ordered")
+
+driver_drop = slow_report_driver_c()
+driver_drop.queue_size = 8
+driver_drop.queue_drop_level = 5
+tcfl.tc.report_driver_c.add(driver_drop, name = "async-drop")
+
+class _test(tcfl.tc.tc_c):
+
+    @tcfl.tc.subcase()
+    def eval_00_ordered(self):
+        driver = driver_ordered
+        driver.gate.clear()
+        try:
+            ts0 = time.time()
+            for count in range(100):
+                self.report_info(f"async ordered {count}", level = 2)
+            ts = time.time() - ts0
+        finally:
+            driver.gate.set()
+        driver.flush()
+        if ts > 1:
+            raise tcfl.tc.failed_e(
+                f"reporting took {ts:.1f}s with a stalled driver")
+        expected = [ f"async ordered {count}" for count in range(100) ]
+        if driver.messages != expected:
+            raise tcfl.tc.failed_e("messages out of order or missing",
+                                   dict(messages = driver.messages))
+        if threading.current_thread() in driver.threads:
+            raise tcfl.tc.failed_e("driver called on the reporter's thread")
+        self.report_pass("100 messages delivered in order from a worker")
+
+    @tcfl.tc.subcase()
+    def eval_10_drop(self):
+        driver = driver_drop
+        driver.gate.clear()
+        dropped = driver.dropped
+
+        def _report():
+            for count in range(50):
+                self.report_info(f"async chatty {count}", level = 6)
+
+        try:
+            thread = threading.Thread(target = _report, daemon = True)
+            thread.start()
+            thread.join(5)
+            if thread.is_alive():
+                raise tcfl.tc.failed_e(
+                    "reporting chatty messages blocked on a full queue")
+        finally:
+            driver.gate.set()
+        driver.flush()
+        if driver.dropped == dropped:
+            raise tcfl.tc.failed_e("no messages dropped on a full queue")
+        self.report_pass(f"{driver.dropped - dropped} chatty messages"
+                         " dropped instead of blocking")
+
+        # results are never dropped
+        driver.gate.clear()
+        try:
+            thread = threading.Thread(
+                target = lambda: [
+                    self.report_pass(f"async result {count}", level = 6)
+                    for count in range(20)
+                ], daemon = True)
+            thread.start()
+            time.sleep(0.5)
+        finally:
+            driver.gate.set()
+        thread.join()
+        driver.flush()
+        results = [ message for message in driver.messages
+                    if message.startswith("async result") ]
+        if len(results) != 20:
+            raise tcfl.tc.failed_e("results dropped",
+                                   dict(messages = driver.messages))
+        self.report_pass("results delivered even with a full queue")
+
+    @tcfl.tc.subcase()
+    def eval_20_context(self):
+        driver = driver_ordered
+        del driver.messages[:]
+        del driver.idents[:]
+        del driver.attachments[:]
+        driver.gate.clear()
+        try:
+            with tcfl.msgid_c("CTX"):
+                ident = self.ident()
+                data = dict(value = 1)
+                self.report_info("async context", data, level = 2)
+                # attachments are not to be modified, but the
+                # dictionary holding them can be
+                data['value'] = 2
+        finally:
+            driver.gate.set()
+        driver.flush()
+        if driver.idents != [ ident ]:
+            raise tcfl.tc.failed_e(
+                f"driver got ident {driver.idents}, expected {ident}")
+        if driver.attachments != [ dict(value = 1) ]:
+            raise tcfl.tc.failed_e(
+                "driver saw attachments modified after reporting",
+                dict(attachments = driver.attachments))
+        self.report_pass("reporter's ident and attachments kept")
+
+    @tcfl.tc.subcase()
+    def eval_30_exception(self):
+        driver = driver_ordered
+        driver.fail = True
+        try:
+            self.report_info("async raise", level = 2)
+            driver.flush()
+        except RuntimeError as e:
+            if str(e) != "async raise":
+                raise
+            self.report_pass("driver exception raised on flush")
+        else:
+            raise tcfl.tc.failed_e("driver exception not raised on flush")
+        finally:
+            driver.fail = False
+        # and only once
+        driver.flush()
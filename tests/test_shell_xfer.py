@@ -0,0 +1,86 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Transfer files over a console to a shell with the framed protocol in
+:meth:`tcfl.target_ext_shell.shell.file_copy_to` and
+:meth:`tcfl.target_ext_shell.shell.file_copy_from`
+
+The test console corrupts data once in each direction, so
+retransmissions are exercised too.
+"""
+
+import hashlib
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+@tcfl.tc.target(ttbd.url_spec)
+class _test(tcfl.tc.tc_c):
+
+    def _remote_sha256(self, target, remote_filename):
+        output = target.shell.run(f"sha256sum {remote_filename}",
+                                  output = True, trim = True)
+        return output.split()[0]
+
+    def eval(self, target):
+        target.console.enable()
+        target.shell.setup()
+        remote_dir = os.path.join(self.tmpdir, "remote")
+        os.makedirs(remote_dir)
+        target.shell.run(f"cd {remote_dir}")
+
+        local_path = os.path.join(self.tmpdir, "data")
+        # random is not compressible, so it really takes the size
+        data = os.urandom(512 * 1024) + b"compressible" * 100000
+        with open(local_path, "wb") as f:
+            f.write(data)
+        digest = hashlib.sha256(data).hexdigest()
+
+        ts0 = time.time()
+        target.shell.file_copy_to(local_path, "data")
+        ts = time.time() - ts0
+        remote_digest = self._remote_sha256(target, "data")
+        if remote_digest != digest:
+            raise tcfl.tc.failed_e(
+                "uploaded file SHA256 mismatch",
+                dict(local = digest, remote = remote_digest))
+        self.report_pass(f"uploaded {len(data)}B in {ts:.1f}s")
+
+        copy_path = os.path.join(self.tmpdir, "data.copy")
+        ts0 = time.time()
+        target.shell.file_copy_from(copy_path, "data")
+        ts = time.time() - ts0
+        with open(copy_path, "rb") as f:
+            if f.read() != data:
+                raise tcfl.tc.failed_e("downloaded file differs")
+        self.report_pass(f"downloaded {len(data)}B in {ts:.1f}s")
+
+        # leave half of the file as if a transfer had been
+        # interrupted; the next one has to continue from there
+        with open(os.path.join(remote_dir, "data2.tcfpart"), "wb") as f:
+            f.write(data[:len(data) // 2])
+        target.shell.file_copy_to(local_path, "data2", chunk_size = 4096,
+                                  window = 2)
+        if self._remote_sha256(target, "data2") != digest:
+            raise tcfl.tc.failed_e("resumed upload SHA256 mismatch")
+        self.report_pass("resumed upload")
+
+        s = "some text with UTF-8 áéí\n"
+        target.shell.string_copy_to_file(s, "string")
+        if self._remote_sha256(target, "string") \
+           != hashlib.sha256(s.encode('utf-8')).hexdigest():
+            raise tcfl.tc.failed_e("string copy SHA256 mismatch")
+        self.report_pass("string copied")
@@ -0,0 +1,122 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Content-addressed blob store: uploads of the same data to multiple
+targets are deduplicated and interrupted uploads are resumed
+"""
+
+import filecmp
+import hashlib
+import os
+
+import commonl
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        # eval_10 and eval_20 trigger errors on purpose
+        "Traceback",
+        "incomplete;",
+        "discarded",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + ' and t0')
+@tcfl.tc.target(ttbd.url_spec + ' and t1')
+class _test(tcfl.tc.tc_c):
+
+    def _file_mk(self, name, seed):
+        file_path = self.report_file_prefix + name
+        with open(file_path, "wb") as f:
+            for count in range(20000):
+                f.write(f"{seed} {count:06d}\n".encode('utf-8'))
+        h = hashlib.sha512()
+        commonl.hash_file(h, file_path)
+        return file_path, h.hexdigest()
+
+    def _check_dnload(self, target, remote, local):
+        dnload = self.report_file_prefix + remote + ".dnload"
+        target.store.dnload(remote, dnload)
+        if not filecmp.cmp(local, dnload, shallow = False):
+            raise tcfl.tc.failed_e(f"{target.id}: {remote}: data mismatch")
+
+    def eval_00_dedup(self, target, target1):
+        file_path, digest = self._file_mk("dedup", "dedup")
+        r = target.ttbd_iface_call("store", "blob", method = "GET",
+                                   digest = digest)
+        if r['present'] or r['size'] != 0:
+            raise tcfl.tc.failed_e("blob present before uploading",
+                                   dict(r = r))
+        target.store.blob_chunk_size = 64 * 1024
+        target.store.upload("t0-dedup", file_path)
+        r = target.ttbd_iface_call("store", "blob", method = "GET",
+                                   digest = digest)
+        if not r['present'] or r['size'] != os.stat(file_path).st_size:
+            raise tcfl.tc.failed_e("blob not present after uploading",
+                                   dict(r = r))
+        # second target, same data: only linked, not uploaded
+        target1.store.upload("t1-dedup", file_path)
+        self._check_dnload(target, "t0-dedup", file_path)
+        self._check_dnload(target1, "t1-dedup", file_path)
+        self.report_pass("same data uploaded once and aliased twice")
+
+    def eval_10_resume(self, target):
+        file_path, digest = self._file_mk("resume", "resume")
+        # upload the first 100k as if the connection had dropped
+        with open(file_path, "rb") as f:
+            data = f.read(100 * 1024)
+        r = target.ttbd_iface_call("store", "blob", method = "POST",
+                                   digest = digest, offset = 0,
+                                   files = { 'chunk': ( 'chunk', data ) })
+        if r['size'] != len(data):
+            raise tcfl.tc.failed_e("partial upload size mismatch",
+                                   dict(r = r))
+        # a retried chunk overlapping what is there is harmless
+        r = target.ttbd_iface_call("store", "blob", method = "POST",
+                                   digest = digest, offset = 50 * 1024,
+                                   files = { 'chunk': ( 'chunk', data[50 * 1024:] ) })
+        if r['size'] != len(data):
+            raise tcfl.tc.failed_e("retried chunk changed the size",
+                                   dict(r = r))
+        # linking an incomplete upload fails but keeps the data
+        try:
+            target.ttbd_iface_call("store", "blob", method = "PUT",
+                                   digest = digest, file_path = "resume",
+                                   size = os.stat(file_path).st_size)
+            raise tcfl.tc.failed_e("incomplete blob could be linked")
+        except tcfl.exception as e:
+            if 'incomplete' not in str(e):
+                raise
+        target.store.upload("resume", file_path)
+        self._check_dnload(target, "resume", file_path)
+        self.report_pass("interrupted upload resumed")
+
+    def eval_20_bad_data(self, target):
+        file_path, digest = self._file_mk("bad", "bad")
+        r = target.ttbd_iface_call("store", "blob", method = "POST",
+                                   digest = digest, offset = 0,
+                                   files = { 'chunk': ( 'chunk', b"garbage" ) })
+        try:
+            target.ttbd_iface_call("store", "blob", method = "PUT",
+                                   digest = digest, file_path = "bad")
+            raise tcfl.tc.failed_e("blob with bad data could be linked")
+        except tcfl.exception as e:
+            if 'discarded' not in str(e):
+                raise
+        r = target.ttbd_iface_call("store", "blob", method = "GET",
+                                   digest = digest)
+        if r['present'] or r['size'] != 0:
+            raise tcfl.tc.failed_e("bad data not discarded", dict(r = r))
+        self.report_pass("blob with mismatching digest discarded")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,145 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Exercise the console capture scanner
+(:class:`tcfl.target_ext_console._console_scanner_c`)
+
+- offsets are absolute in the capture file and match what searching
+  a copy of the data would give
+
+- text that straddles the end of the data searched before is found
+  once the rest comes in
+
+- *^* matches at the search offset, as when searching a copy of the
+  data from there on, and not where searching again over the overlap
+
+- micro-benchmark many detection passes over a growing capture
+  against slicing the whole mapping each time
+"""
+
+import mmap
+import os
+import re
+import time
+
+import tcfl.tc
+import tcfl.target_ext_console
+
+class _test(tcfl.tc.tc_c):
+
+    def _capture_mk(self, name):
+        return open(os.path.join(self.tmpdir, name), "ba+")
+
+    @tcfl.tc.subcase()
+    def eval_00_offsets(self):
+        of = self._capture_mk("offsets")
+        scanner = tcfl.target_ext_console._console_scanner_c(of)
+        regex = re.compile(b"(?P<name>[a-z]+)=(?P<value>[0-9]+)")
+        of.write(b"junk\nlength=54\nmore junk\nwidth=3\n")
+        of.flush()
+        scanner.map()
+        match = scanner.search(regex, "ctx", 0, 4096)
+        if match.start() != 5 or match.end() != 14 \
+           or match.groupdict() != { "name": b"length", "value": b"54" }:
+            raise tcfl.tc.failed_e("first match wrong",
+                                   dict(span = match.span(),
+                                        groupdict = match.groupdict()))
+        match = scanner.search(regex, "ctx", match.end(), 4096)
+        data = open(of.name, "rb").read()
+        match_copy = regex.search(data[14:])
+        if match.span() != ( 14 + match_copy.start(), 14 + match_copy.end() ):
+            raise tcfl.tc.failed_e("second match differs from a copy",
+                                   dict(span = match.span(),
+                                        span_copy = match_copy.span()))
+        self.report_pass("offsets are absolute")
+
+    @tcfl.tc.subcase()
+    def eval_10_straddle(self):
+        of = self._capture_mk("straddle")
+        scanner = tcfl.target_ext_console._console_scanner_c(of)
+        regex = re.compile(re.escape(b"login: "))
+        of.write(b"booting...\nlog")
+        of.flush()
+        scanner.map()
+        if scanner.search(regex, "ctx", 0, 4096):
+            raise tcfl.tc.failed_e("found partial text")
+        of.write(b"in: ")
+        of.flush()
+        scanner.map()
+        match = scanner.search(regex, "ctx", 0, 4096)
+        if not match or match.start() != 11:
+            raise tcfl.tc.failed_e("straddling text not found")
+        self.report_pass("straddling text found")
+
+    @tcfl.tc.subcase()
+    def eval_15_anchored(self):
+        # ^ matches where the search starts, as when searching a
+        # copy of the data from there on, but not where it searches
+        # again over the overlap
+        of = self._capture_mk("anchored")
+        scanner = tcfl.target_ext_console._console_scanner_c(of)
+        regex = re.compile(b"^[a-z]+\\$ ")
+        of.write(b"boot: user$ ")
+        of.flush()
+        scanner.map()
+        match = scanner.search(regex, "ctx", 6, 4096)
+        if not match or match.span() != ( 6, 12 ) \
+           or match.group() != b"user$ ":
+            raise tcfl.tc.failed_e(
+                "anchored regex not found at the search offset",
+                dict(span = match.span() if match else None))
+        of.write(b"\nroot$ ")
+        of.flush()
+        scanner.map()
+        match = scanner.search(regex, "ctx", 13, 4096)
+        if not match or match.span() != ( 13, 19 ):
+            raise tcfl.tc.failed_e(
+                "anchored regex not found at the new search offset",
+                dict(span = match.span() if match else None))
+        # searched up to @19 before, so this searches again from @14,
+        # in the middle of a line
+        regex = re.compile(b"^oot\\$ ")
+        if scanner.search(regex, "ctx", 0, 4096):
+            raise tcfl.tc.failed_e("search before the overlap test matched")
+        of.write(b"\n")
+        of.flush()
+        scanner.map()
+        match = scanner.search(regex, "ctx", 0, 5)
+        if match:
+            raise tcfl.tc.failed_e(
+                "anchored regex found in the middle of a line",
+                dict(span = match.span()))
+        self.report_pass("^ anchors at the search offset")
+
+    @tcfl.tc.subcase()
+    def eval_20_benchmark(self):
+        of = self._capture_mk("benchmark")
+        scanner = tcfl.target_ext_console._console_scanner_c(of)
+        regex = re.compile(re.escape(b"not there"))
+        line = b"x" * 79 + b"\n"
+        ts_scanner = 0
+        ts_slice = 0
+        for _ in range(200):
+            of.write(line * 100)
+            of.flush()
+            ts0 = time.time()
+            scanner.map()
+            scanner.search(regex, "ctx", 0, 4096)
+            ts1 = time.time()
+            with mmap.mmap(of.fileno(), 0, mmap.MAP_PRIVATE,
+                           mmap.PROT_READ) as mapping:
+                regex.search(mapping[0:])
+            ts2 = time.time()
+            ts_scanner += ts1 - ts0
+            ts_slice += ts2 - ts1
+        self.report_data("console scanner benchmark [ms/200 passes]",
+                         "scanner", ts_scanner * 1000)
+        self.report_data("console scanner benchmark [ms/200 passes]",
+                         "slice", ts_slice * 1000)
+        self.report_info(f"scanner {ts_scanner * 1000:.3f}ms"
+                         f" slice {ts_slice * 1000:.3f}ms", level = 0)
+        self.report_pass("benchmarked")
@@ -0,0 +1,136 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Target groups are generated by enumerating the target wants' type
+combinations: no valid combination is missed, there are no repeats,
+impossible groups are detected, seeded runs are reproducible and the
+groups generated vary all the target wants, not just the last ones
+"""
+
+import collections
+import time
+
+import tcfl.tc
+
+class _test(tcfl.tc.tc_c):
+
+    @staticmethod
+    def _tc_make(rt_all, wants, mode = "one-per-type",
+                 randomizer = "random"):
+        # a testcase with target wants WANTNAME -> [ RTFULLIDs ]
+        tc = tcfl.tc.tc_c("permutations", __file__, "builtin")
+        tc.rt_all = rt_all
+        tc._mode = mode
+        tc.permutations_randomizer = randomizer
+        # tc_c._targets is class-level, shared with every other
+        # testcase; give this one its own
+        tc._targets = collections.OrderedDict()
+        candidates = {}
+        for twn, rt_fullids in wants.items():
+            tc._targets[twn] = dict(kws = {}, spec = "")
+            candidates[twn] = set(( rt_fullid, None )
+                                  for rt_fullid in rt_fullids)
+        return tc, candidates
+
+    @staticmethod
+    def _types(rt_all, permutations):
+        return sorted(
+            " ".join(twn + "=" + rt_all[rt_fullid]['type']
+                     for twn, (rt_fullid, _) in sorted(perm.items()))
+            for perm in permutations.values())
+
+    def eval(self):
+        rt_all = {
+            "A1": dict(type = "A"),
+            "A2": dict(type = "A"),
+            "B1": dict(type = "B"),
+        }
+        tc, candidates = self._tc_make(rt_all, dict(
+            T1 = [ "A1", "A2", "B1" ],
+            T2 = [ "A1", "A2", "B1" ]))
+        permutations = tc._target_wants_list_permutations(candidates, 10)
+        types = self._types(rt_all, permutations)
+        if types != [ "T1=A T2=A", "T1=A T2=B", "T1=B T2=A" ]:
+            raise tcfl.tc.failed_e("expected the three type combinations",
+                                   dict(permutations = permutations))
+        for perm in permutations.values():
+            if len(set(rt_fullid for rt_fullid, _ in perm.values())) != 2:
+                raise tcfl.tc.failed_e("remote target used twice",
+                                       dict(permutations = permutations))
+        self.report_pass("all type combinations generated once")
+
+        # T1=A T2=A is only possible if T1 gets A2 and T2 A1
+        tc, candidates = self._tc_make(rt_all, dict(
+            T1 = [ "A1", "A2" ],
+            T2 = [ "A1", "B1" ]))
+        for count in range(20):
+            permutations = tc._target_wants_list_permutations(candidates, 10)
+            types = self._types(rt_all, permutations)
+            if types != [ "T1=A T2=A", "T1=A T2=B" ]:
+                raise tcfl.tc.failed_e("missed a valid combination",
+                                       dict(permutations = permutations))
+        self.report_pass("constrained combinations found")
+
+        tc, candidates = self._tc_make(rt_all, dict(
+            T1 = [ "A1" ], T2 = [ "A1" ]))
+        permutations = tc._target_wants_list_permutations(candidates, 10)
+        if permutations:
+            raise tcfl.tc.failed_e("impossible group generated",
+                                   dict(permutations = permutations))
+        self.report_pass("impossible group detected")
+
+        rt_all = {
+            "t%04d" % count: dict(type = "type%d" % (count % 5))
+            for count in range(1000)
+        }
+        wants = {
+            "T%02d" % count: list(rt_all)
+            for count in range(20)
+        }
+        groups = []
+        for _ in range(2):
+            tc, candidates = self._tc_make(rt_all, wants,
+                                           randomizer = "someseed")
+            ts0 = time.time()
+            permutations = tc._target_wants_list_permutations(candidates, 10)
+            ts = time.time() - ts0
+            groups.append(permutations)
+            if len(permutations) != 10:
+                raise tcfl.tc.failed_e(
+                    "expected 10 groups from 20 wants x 1000 targets",
+                    dict(permutations = permutations))
+            self.report_info("20 wants x 1000 targets: 10 groups in %.2fs"
+                             % ts)
+        if groups[0] != groups[1]:
+            raise tcfl.tc.failed_e("seeded runs generated different groups",
+                                   dict(groups = groups))
+        self.report_pass("seeded runs generate the same groups")
+
+        rt_all = {
+            "t%02d" % count: dict(type = "type%d" % count)
+            for count in range(20)
+        }
+        tc, candidates = self._tc_make(rt_all, dict(
+            T1 = list(rt_all), T2 = list(rt_all)))
+        permutations = tc._target_wants_list_permutations(candidates, 10)
+        t1s = set(perm["T1"][0] for perm in permutations.values())
+        if len(permutations) != 10 or len(t1s) != 10:
+            raise tcfl.tc.failed_e(
+                "expected 10 groups, each with a different remote target"
+                f" for the first target want; got {len(t1s)}",
+                dict(permutations = permutations))
+        self.report_pass("groups spread the first target want")
+
+        tc, candidates = self._tc_make(rt_all, wants, mode = "any",
+                                       randomizer = "sequential")
+        permutations = tc._target_wants_list_permutations(candidates, 10)
+        if len(permutations) != 1 \
+           or list(permutations.values())[0]["T00"][0] != "t0000":
+            raise tcfl.tc.failed_e(
+                "expected one sequential group in 'any' mode",
+                dict(permutations = permutations))
+        self.report_pass("'any' mode generates a single group")
@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Incremental inventory download (*GET /targets-delta/*)
+
+- the server only sends the inventories of targets whose ETag
+  differs from what we pass
+
+- :meth:`tcfl.server_c.targets_get` with the persistent inventory
+  cache yields the same as a full download, also after changing
+  the inventory
+"""
+
+import json
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class _test(tcfl.tc.tc_c):
+
+    def _targets_get_full(self, server):
+        # disable the delta mode just for this call
+        server.inventory_delta = False
+        try:
+            return server.targets_get()
+        finally:
+            server.inventory_delta = True
+
+    def _targets_get_check(self, server, what):
+        rts, rts_flat, inventory_keys = server.targets_get()
+        rts_full, rts_flat_full, inventory_keys_full = \
+            self._targets_get_full(server)
+        if rts != rts_full or rts_flat != rts_flat_full \
+           or inventory_keys != inventory_keys_full:
+            raise tcfl.tc.failed_e(
+                f"{what}: delta inventory differs from full",
+                dict(rts = rts, rts_full = rts_full,
+                     rts_flat = rts_flat, rts_flat_full = rts_flat_full))
+        return rts
+
+
+    @tcfl.tc.subcase()
+    def eval_00_delta(self, target):
+        server = tcfl.server_c.servers[target.rt['server']]
+        r = server.send_request("GET", "targets-delta/")
+        etags = r['etags']
+        if 't0' not in etags or etags.keys() != r['targets'].keys():
+            raise tcfl.tc.failed_e(
+                "no etags given: expected all targets", dict(r = r))
+
+        r = server.send_request("GET", "targets-delta/",
+                                data = { 'etags': json.dumps(etags) })
+        if r['targets'] or r['etags'] != etags:
+            raise tcfl.tc.failed_e(
+                "all etags given: expected no targets", dict(r = r))
+
+        target.property_set("delta_test", 1)
+        r = server.send_request("GET", "targets-delta/",
+                                data = { 'etags': json.dumps(etags) })
+        if list(r['targets'].keys()) != [ target.id ] \
+           or r['targets'][target.id].get('delta_test', None) != 1:
+            raise tcfl.tc.failed_e(
+                f"changed {target.id}: expected only it", dict(r = r))
+        self.report_pass("only changed targets are returned")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_client_cache(self, target):
+        server = tcfl.server_c.servers[target.rt['server']]
+        # run twice, so the second one uses the cache
+        self._targets_get_check(server, "first")
+        self._targets_get_check(server, "cached")
+        target.property_set("delta_test", 2)
+        rts = self._targets_get_check(server, "changed")
+        if rts[target.rt['fullid_always']].get('delta_test', None) != 2:
+            raise tcfl.tc.failed_e(
+                "changed property not seen", dict(rt = rts[target.rt['fullid_always']]))
+        self.report_pass("cached inventory matches full download")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_benchmark(self, target):
+        server = tcfl.server_c.servers[target.rt['server']]
+        count = 10
+        server.targets_get()		# prime the cache
+        for name, get in (
+                ( "full", lambda: self._targets_get_full(server) ),
+                ( "delta", server.targets_get ) ):
+            ts0 = time.time()
+            for _ in range(count):
+                get()
+            ms = (time.time() - ts0) / count * 1000
+            self.report_data("inventory download benchmark [ms/call]",
+                             name, ms)
+            self.report_info(f"{name}: {ms:.3f}ms/call", level = 0)
+        self.report_pass("benchmarked")
+
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
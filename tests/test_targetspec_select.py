@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Target specifications evaluated compiled and with inventory indexes
+select the same targets as interpreting the AST on each target; the
+time each method takes over 10k synthetic targets is reported
+"""
+
+import random
+import time
+
+import commonl.expr_parser
+import tcfl.targets
+import tcfl.tc
+
+specs = [
+    'type == "qemu-x86"',
+    'type in [ "nuc", "minnowboard", "qemu-arm" ]',
+    '"x86" in bsp_models',
+    '"ic0012" in interconnects',
+    'interconnects.ic0012.mac_addr : "^02:"',
+    'type == "nuc" and ram.size_gib > 8',
+    '( type == "nuc" or type == "qemu-x86" ) and not owner',
+    'id == "t04242" or id == "t00042"',
+    'owner',
+    'ram.size_gib >= 16 and disks.count > 1',
+    'not type == "nuc"',
+    '"nuc" in type',
+]
+
+class _test(tcfl.tc.tc_c):
+
+    @staticmethod
+    def _inventory_make(count):
+        rng = random.Random(0)
+        types = [ "nuc", "minnowboard", "qemu-x86", "qemu-arm", "frdm" ]
+        agent = tcfl.targets.discovery_agent_c()
+        for index in range(count):
+            rtid = "t%05d" % index
+            rt_type = rng.choice(types)
+            bsp_models = { "x86": None } if "x86" in rt_type \
+                or rt_type in ( "nuc", "minnowboard" ) else { "arm": None }
+            rt = {
+                "id": rtid,
+                "fullid": rtid,
+                "type": rt_type,
+                "bsp_models": bsp_models,
+                "interconnects": {},
+                "ram": { "size_gib": rng.choice([ 1, 2, 4, 8, 16, 32 ]) },
+                "disks": { "count": rng.randint(0, 3) },
+            }
+            for _ in range(rng.randint(0, 2)):
+                icid = "ic%04d" % rng.randrange(count // 100)
+                rt["interconnects"][icid] = {
+                    "mac_addr": "%02x:00:00:00:%02x:%02x" % (
+                        rng.choice([ 0, 2 ]), index // 256, index % 256)
+                }
+            if rng.random() < 0.2:
+                rt["owner"] = "someuser"
+            if rng.random() < 0.05:
+                rt["disabled"] = "for maintenance"
+            rt_flat = dict(rt)
+            rt_flat.update(commonl.dict_to_flat(rt, sort = False,
+                                                empty_dict = True))
+            agent.rts[rtid] = rt
+            agent.rts_flat[rtid] = rt_flat
+            agent.rts_fullid_sorted.append(rtid)
+        return agent
+
+    def eval(self):
+        agent = self._inventory_make(10000)
+        asts = [ commonl.expr_parser.precompile(spec) for spec in specs ]
+
+        ts0 = time.time()
+        expected = []
+        for expr_ast in asts:
+            expected.append([
+                rtfullid for rtfullid in agent.rts_fullid_sorted
+                if not agent.rts_flat[rtfullid].get('disabled', False)
+                and commonl.expr_parser.ast_expr(
+                    expr_ast, agent.rts_flat[rtfullid])
+            ])
+        ts_interpreted = time.time() - ts0
+
+        for index_min_targets, what in [
+                ( None, "compiled" ),
+                ( 1000, "compiled and indexed (building indexes)" ),
+                ( 1000, "compiled and indexed" ),
+        ]:
+            agent.index_min_targets = index_min_targets
+            ts0 = time.time()
+            for spec, expr_ast, rtfullids in zip(specs, asts, expected):
+                selected = agent.select(expr_ast)
+                if selected != rtfullids:
+                    raise tcfl.tc.failed_e(
+                        f"{what}: '{spec}' selected different targets",
+                        dict(selected = selected, expected = rtfullids))
+            ts = time.time() - ts0
+            self.report_info(
+                f"{len(specs)} specs over 10k targets: {what} {ts:.3f}s,"
+                f" interpreted {ts_interpreted:.3f}s")
+        self.report_pass("compiled and indexed selections match")
+
+        selected = agent.select(asts[0], include_disabled = True)
+        if not any(agent.rts_flat[rtfullid].get('disabled', False)
+                   for rtfullid in selected):
+            raise tcfl.tc.failed_e("disabled targets not included",
+                                   dict(selected = selected))
+        self.report_pass("disabled targets included when asked")
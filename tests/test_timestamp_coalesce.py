@@ -0,0 +1,55 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Marking a target as active many times in a row writes the
+allocation's timestamp at most once per daemon process in
+*ttbl.config.timestamp_flush_period*
+"""
+
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "DEBUG[",
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + ' and t0')
+class _test(tcfl.tc.tc_c):
+
+    def eval(self, target):
+        timestamps = set()
+        ts0 = time.time()
+        count = 0
+        while time.time() - ts0 < 3:
+            target.active()
+            count += 1
+            r = target.server.send_request("GET",
+                                           "allocation/" + self.allocid)
+            timestamps.add(r['timestamp'])
+        self.report_info(f"{count} activity marks in 3s wrote"
+                         f" {len(timestamps)} different timestamps",
+                         dict(timestamps = timestamps), level = 1)
+        # the allocation's timestamp has a resolution of a second;
+        # each daemon process (two in the test server) might write
+        # it once and the allocation wrote it when created
+        if len(timestamps) > 3:
+            raise tcfl.tc.failed_e(
+                "allocation timestamp written more than once per process",
+                dict(timestamps = timestamps))
+        self.report_pass("activity timestamps coalesced")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,57 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+"""
+Users are cached by the server: authenticated read-only requests
+don't write to the user database, but changes to the user's roles
+are seen right away
+"""
+
+import os
+
+import commonl
+import commonl.testing
+import tcfl
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+
+class _test(commonl.testing.shell_client_base):
+
+    def eval_00(self):
+        self.ttbd = ttbd
+        self.mk_tcf_config()
+        self.ttbd.local_auth_disable()
+
+        self.run_local(self.tcf_cmdline() + " login -p password user1")
+        user_path = os.path.join(self.ttbd.state_dir, "users",
+                                 "_user_" + commonl.mkid("user1"))
+        # let the stamps settle and then check nothing is touched
+        mtime0 = os.stat(user_path).st_mtime_ns
+        for _ in range(5):
+            self.run_local(self.tcf_cmdline() + " ls",
+                           "tg_req_c1")
+        mtime = os.stat(user_path).st_mtime_ns
+        if mtime != mtime0:
+            raise tcfl.tc.failed_e(
+                "user database modified by read-only requests")
+        self.report_pass("read-only requests don't write to the user DB")
+
+        self.run_local(self.tcf_cmdline() + " role-drop context1")
+        output = self.run_local(self.tcf_cmdline() + " ls")
+        if "tg_req_c1" in output:
+            raise tcfl.tc.failed_e(
+                "target requiring dropped role still listed",
+                dict(output = output))
+        self.run_local(self.tcf_cmdline() + " role-gain context1")
+        self.run_local(self.tcf_cmdline() + " ls", "tg_req_c1")
+        self.report_pass("role changes are seen right away")
@@ -0,0 +1,66 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Cached users see role and data changes made by others even if the
+user database's directory modification time doesn't change (eg: two
+changes in the same timestamp tick)
+"""
+
+import os
+import sys
+
+import tcfl.tc
+
+srcdir = os.path.realpath(os.path.dirname(__file__))
+ttbd_dir = os.path.join(srcdir, "..", "ttbd")
+if not ttbd_dir in sys.path:
+    # point to tcf.git/ttbd so we can import ttbl
+    sys.path.append(ttbd_dir)
+import ttbl.user_control
+
+class _test(tcfl.tc.tc_c):
+
+    def eval(self):
+        ttbl.user_control.User.state_dir = self.tmpdir
+        ttbl.user_control.User.state_dir_secondary = self.tmpdir
+
+        user = ttbl.user_control.user_get_cached(
+            "user1", roles = [ "context1" ], create = True)
+        if user.role_get("context1") != True:
+            raise tcfl.tc.failed_e("role context1 not gained")
+        # this user descriptor is now cached with the roles loaded
+        ttbl.user_control.user_get_cached("user1").role_list()
+
+        # drop the role as another daemon process would, then set
+        # the directory's times back to what they were, as if it had
+        # happened in the same timestamp tick
+        st = os.stat(user.fsdb.location)
+        other = ttbl.user_control.User("user1")
+        other.role_drop("context1")
+        os.utime(user.fsdb.location, ns = ( st.st_atime_ns, st.st_mtime_ns ))
+
+        user = ttbl.user_control.user_get_cached("user1")
+        if user.role_get("context1") != False:
+            raise tcfl.tc.failed_e(
+                "cached user didn't see role context1 dropped",
+                dict(roles = user.role_list()))
+        self.report_pass("cached user sees role changes in the same tick")
+
+        # same for data set by another process (eg: when logging in)
+        st = os.stat(user.fsdb.location)
+        other = ttbl.user_control.User("user1")
+        other.data_set("field1", "value1")
+        os.utime(user.fsdb.location, ns = ( st.st_atime_ns, st.st_mtime_ns ))
+
+        user_cached = ttbl.user_control.user_get_cached("user1")
+        if user_cached is user:
+            raise tcfl.tc.failed_e(
+                "cached user not reloaded after data was set")
+        if user_cached.to_dict().get("data", {}).get("field1") != "value1":
+            raise tcfl.tc.failed_e("data set not seen",
+                                   dict(user = user_cached.to_dict()))
+        self.report_pass("cached user reloaded after data was set")
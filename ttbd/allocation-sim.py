@@ -0,0 +1,232 @@
+#! /usr/bin/env python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Simulate a busy allocation workload against :mod:`ttbl.allocation`
+
+This creates a number of fake targets in a temporary state directory
+and runs the allocator in this process, with no daemon; a set of
+simulated clients keep placing allocation requests for random groups
+of targets with random priorities, hold them for a random number of
+steps once they become active and then delete them. Clients that
+wait too long give up and delete their allocations (as allocations
+holding parts of each other's groups might otherwise wait forever).
+Maintenance runs every few steps, like the daemon's cleanup thread
+would. When done, a last batch of allocations is queued and left
+alone for a few seconds, to time maintenance runs over queues that
+don't change (as in a lab whose allocations are held for long).
+
+At the end it reports the time spent in the allocator's entry points,
+how long allocations waited per priority and the target utilization,
+so different allocator implementations can be compared by running it
+on each tree (or with different options) with the same seed:
+
+ $ cd ttbd
+ $ ./allocation-sim.py --targets 200 --allocations 2000 --seed 1
+ $ ./allocation-sim.py --targets 200 --allocations 2000 --seed 1 --group-solver
+"""
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import ttbl.user_control
+
+ap = argparse.ArgumentParser(
+    description = __doc__,
+    formatter_class = argparse.RawDescriptionHelpFormatter)
+ap.add_argument("--targets", type = int, default = 200,
+                help = "Number of targets to create [%(default)d]")
+ap.add_argument("--allocations", type = int, default = 2000,
+                help = "Number of allocations to run [%(default)d]")
+ap.add_argument("--clients", type = int, default = 50,
+                help = "Number of allocations outstanding at any"
+                " time [%(default)d]")
+ap.add_argument("--group-size-max", type = int, default = 4,
+                help = "Maximum number of targets per group [%(default)d]")
+ap.add_argument("--groups-max", type = int, default = 3,
+                help = "Maximum number of groups per allocation"
+                " [%(default)d]")
+ap.add_argument("--priorities", type = int, default = 4,
+                help = "Number of different priorities to use"
+                " [%(default)d]")
+ap.add_argument("--hold-steps-max", type = int, default = 20,
+                help = "Maximum number of steps an active allocation"
+                " keeps its targets [%(default)d]")
+ap.add_argument("--patience", type = int, default = 100,
+                help = "Give up on (delete) an allocation that is not"
+                " active after this many steps [%(default)d]")
+ap.add_argument("--maintenance-period", type = int, default = 10,
+                help = "Run maintenance every this many steps"
+                " [%(default)d]")
+ap.add_argument("--settled-maintenance", type = int, default = 5,
+                help = "When done, queue a batch of allocations, let"
+                " them settle and time this many maintenance runs"
+                " over them [%(default)d]")
+ap.add_argument("--group-solver", action = "store_true", default = False,
+                help = "Allocate complete groups at once"
+                " (ttbl.allocation.group_solver)")
+ap.add_argument("--seed", type = int, default = 0,
+                help = "Random seed [%(default)d]")
+ap.add_argument("--keep", action = "store_true", default = False,
+                help = "Do not remove the state directory when done")
+ap.add_argument("-v", "--verbose", action = "count", default = 0)
+args = ap.parse_args()
+
+logging.basicConfig(
+    level = logging.WARNING - 10 * args.verbose,
+    format = "%(levelname)s: %(message)s")
+rng = random.Random(args.seed)
+
+state_dir = tempfile.mkdtemp(prefix = "allocation-sim-")
+ttbl.test_target.state_path = os.path.join(state_dir, "targets")
+os.makedirs(ttbl.test_target.state_path)
+ttbl.allocation.path = os.path.join(state_dir, "allocations")
+ttbl.allocation.init(state_dir)
+ttbl.user_control.User.state_dir = os.path.join(state_dir, "users")
+ttbl.user_control.User.state_dir_secondary = ttbl.user_control.User.state_dir
+os.makedirs(ttbl.user_control.User.state_dir)
+# we remove allocations ourselves, don't let them time out
+ttbl.config.target_max_idle = 1000000
+ttbl.allocation.group_solver = args.group_solver
+
+target_names = []
+for count in range(args.targets):
+    target = ttbl.test_target(f"t{count:05d}")
+    ttbl.config.target_add(target)
+    target_names.append(target.id)
+user = ttbl.user_control.User("local", roles = [ "admin" ])
+
+timings = collections.defaultdict(list)
+
+def _timed(what, fn, *args, **kwargs):
+    ts0 = time.perf_counter()
+    r = fn(*args, **kwargs)
+    timings[what].append(time.perf_counter() - ts0)
+    return r
+
+def _groups_random():
+    groups = {}
+    for count in range(rng.randint(1, args.groups_max)):
+        groups[f"group{count}"] = rng.sample(
+            target_names, rng.randint(1, args.group_size_max))
+    return groups
+
+# allocid -> [ priority, step requested, step active, steps to hold ]
+pending = {}
+waits = collections.defaultdict(list)
+utilization = []
+# fraction of the targets held by allocations that are not active
+# yet, waiting for the rest of a group
+held_partial = []
+requested = 0
+completed = 0
+rejected = 0
+gave_up = 0
+step = 0
+ts_start = time.time()
+while completed + rejected + gave_up < args.allocations:
+    step += 1
+    while len(pending) < args.clients and requested < args.allocations:
+        priority = rng.randrange(args.priorities)
+        r = _timed("request", ttbl.allocation.request,
+                   _groups_random(), user, "local", [],
+                   priority = priority, queue = True)
+        requested += 1
+        if r.get('state', None) not in ( "active", "queued" ):
+            logging.info("request rejected: %s", r)
+            rejected += 1
+            continue
+        pending[r['allocid']] = [
+            priority, step, None, rng.randint(1, args.hold_steps_max) ]
+
+    for allocid, data in list(pending.items()):
+        priority, step_requested, step_active, hold = data
+        if step_active == None:
+            state = _timed("get", ttbl.allocation.get,
+                           allocid, user)['state']
+            if state == "active":
+                data[2] = step
+                waits[priority].append(step - step_requested)
+            elif step - step_requested >= args.patience:
+                _timed("delete", ttbl.allocation.delete, allocid, user)
+                del pending[allocid]
+                gave_up += 1
+            continue
+        if step - step_active >= hold:
+            _timed("delete", ttbl.allocation.delete, allocid, user)
+            del pending[allocid]
+            completed += 1
+
+    if step % args.maintenance_period == 0:
+        _timed("maintenance", ttbl.allocation.maintenance,
+               datetime.datetime.now(), user)
+    owned = 0
+    partial = 0
+    for target_name in target_names:
+        allocid = ttbl.test_target.get(target_name).fsdb.get("_alloc.id")
+        if allocid == None:
+            continue
+        try:
+            state = ttbl.allocation.get_from_cache(allocid).state_get()
+        except ttbl.allocation.allocation_c.invalid_e:
+            continue
+        if state == "queued":
+            partial += 1
+        else:
+            owned += 1
+    utilization.append(owned / len(target_names))
+    held_partial.append(partial / len(target_names))
+
+ts_total = time.time() - ts_start
+
+if args.settled_maintenance:
+    for count in range(args.clients):
+        _timed("request", ttbl.allocation.request,
+               _groups_random(), user, "local", [],
+               priority = rng.randrange(args.priorities), queue = True)
+    time.sleep(3)
+    for count in range(args.settled_maintenance):
+        _timed("maintenance-settled", ttbl.allocation.maintenance,
+               datetime.datetime.now(), user)
+
+print(f"{completed} allocations completed ({gave_up} gave up,"
+      f" {rejected} rejected)"
+      f" over {args.targets} targets in {step} steps, {ts_total:.1f}s")
+for what, values in sorted(timings.items()):
+    values.sort()
+    print(f"  {what:20}  {len(values):6d} calls"
+          f"  mean {1000 * statistics.mean(values):8.2f}ms"
+          f"  p95 {1000 * values[int(len(values) * 0.95)]:8.2f}ms"
+          f"  total {sum(values):7.2f}s")
+print("wait until active (steps), by priority:")
+for priority, values in sorted(waits.items()):
+    values.sort()
+    print(f"  priority {priority}  {len(values):6d} allocations"
+          f"  mean {statistics.mean(values):7.2f}"
+          f"  p95 {values[int(len(values) * 0.95)]:5d}"
+          f"  max {values[-1]:5d}")
+print(f"target utilization: mean {100 * statistics.mean(utilization):.1f}%"
+      f" (plus {100 * statistics.mean(held_partial):.1f}% held by"
+      " allocations waiting for the rest of a group)")
+
+if args.keep:
+    print(f"state kept in {state_dir}")
+else:
+    shutil.rmtree(state_dir, ignore_errors = True)
@@ -128,6 +128,38 @@ capture_screenshot_ffmpeg_v4l = ttbl.capture.generic_snapshot(
 )
 
 
+def mk_capture_framegrabber_ffmpeg_v4l(width = 1920, height = 1080,
+                                       fps = 10, index = 0):
+    """
+    Create a capturer that keeps *ffmpeg* grabbing frames from
+    */dev/video-TARGETNAME-INDEX* and serves the latest one on each
+    snapshot (see :class:`ttbl.capture.framegrabber_c`)
+
+    Compared to :data:`capture_screenshot_ffmpeg_v4l`, this avoids
+    starting *ffmpeg*, warming up the capturer and encoding a PNG
+    for each screenshot, for testcases that poll the screen
+    often. The device setup is the same; to use:
+
+    >>> ttbl.test_target.get(TARGETNAME).interface_add(
+    >>>     "capture",
+    >>>     ttbl.capture.interface(
+    >>>         screen = "hdmi0_screenshot",
+    >>>         hdmi0_screenshot = mk_capture_framegrabber_ffmpeg_v4l(),
+    >>>     ))
+
+    :param int width: (optional) width to scale the frames to
+    :param int height: (optional) height to scale the frames to
+    :param int fps: (optional) frames per second to grab
+    :param int index: (optional) index of the video device
+    """
+    return ttbl.capture.framegrabber_c(
+        f"framegrabber:/dev/video-%(id)s-{index}",
+        f"ffmpeg -loglevel error -i /dev/video-%(id)s-{index}"
+        f" -vf fps={fps},scale={width}:{height}"
+        " -f rawvideo -pix_fmt rgb24 -",
+        width, height)
+
+
 #: A capturer to take screenshots from VNC
 #:
 #: Note the fields are target's tags and others specified in
@@ -144,51 +144,284 @@ def who_create(user_id, ticket = None):
         return user_id
 
 
+#: Upper limits (in seconds) of the buckets of the wait and hold time
+#: histograms :class:`process_posix_file_lock_c` keeps per lock name;
+#: there is an extra bucket for anything longer than the last one
+lock_metrics_buckets = ( 0.0001, 0.001, 0.01, 0.1, 1, 10 )
+
+#: Directory where each process dumps its lock metrics so they can
+#: be collected by :func:`lock_metrics_get`; *None* keeps the metrics
+#: only in memory
+lock_metrics_path = None
+
+#: Dump the lock metrics to :data:`lock_metrics_path` at most this
+#: often (in seconds) when releasing locks
+lock_metrics_flush_period = 10
+
+_lock_metrics = {}
+_lock_metrics_mutex = threading.Lock()
+_lock_metrics_pid = None
+_lock_metrics_ts_flush = 0
+
+def _lock_histogram_mk():
+    return dict(buckets = [ 0 ] * (len(lock_metrics_buckets) + 1),
+                total = 0, max = 0)
+
+def _lock_histogram_add(histogram, value):
+    histogram['buckets'][bisect.bisect_left(lock_metrics_buckets, value)] += 1
+    histogram['total'] += value
+    if value > histogram['max']:
+        histogram['max'] = value
+
+def _lock_metrics_entry_get(name):
+    # must be called with _lock_metrics_mutex taken
+    global _lock_metrics_pid
+    if _lock_metrics_pid != os.getpid():
+        # we forked from a process that already had metrics, which
+        # it'll report itself
+        _lock_metrics.clear()
+        _lock_metrics_pid = os.getpid()
+    entry = _lock_metrics.get(name, None)
+    if entry == None:
+        entry = dict(count = 0, contended = 0, timeouts = 0,
+                     dead_holders = 0,
+                     wait = _lock_histogram_mk(),
+                     hold = _lock_histogram_mk())
+        _lock_metrics[name] = entry
+    return entry
+
+def lock_metrics_flush(force = False):
+    """
+    Dump this process' lock metrics to :data:`lock_metrics_path`
+
+    :param bool force: (optional, default *False*) dump even if it
+      was done less than :data:`lock_metrics_flush_period` seconds ago
+    """
+    global _lock_metrics_ts_flush
+    if lock_metrics_path == None:
+        return
+    ts = time.time()
+    with _lock_metrics_mutex:
+        if not force \
+           and ts - _lock_metrics_ts_flush < lock_metrics_flush_period:
+            return
+        _lock_metrics_ts_flush = ts
+        if _lock_metrics_pid != os.getpid():
+            return
+        data = json.dumps(_lock_metrics)
+    file_name = os.path.join(lock_metrics_path, "%d.json" % os.getpid())
+    try:
+        with open(file_name + ".tmp", "w") as f:
+            f.write(data)
+        os.replace(file_name + ".tmp", file_name)
+    except OSError as e:
+        logging.warning("can't dump lock metrics to %s: %s", file_name, e)
+
+def lock_metrics_get():
+    """
+    Collect the lock metrics of all the processes
+
+    :returns dict: dictionary with the lock metrics, keyed by lock
+      name, accumulated over all the processes that dumped them to
+      :data:`lock_metrics_path` (or just this one's if not set); see
+      :class:`process_posix_file_lock_c`.
+    """
+    lock_metrics_flush(force = True)
+    if lock_metrics_path == None:
+        with _lock_metrics_mutex:
+            metrics = json.loads(json.dumps(_lock_metrics))
+        return dict(buckets = lock_metrics_buckets, locks = metrics)
+    metrics = {}
+    for file_name in glob.glob(os.path.join(lock_metrics_path, "*.json")):
+        try:
+            with open(file_name) as f:
+                process_metrics = json.load(f)
+        except ( OSError, ValueError ) as e:
+            logging.warning("%s: ignoring lock metrics: %s", file_name, e)
+            continue
+        for name, process_entry in process_metrics.items():
+            entry = metrics.get(name, None)
+            if entry == None:
+                metrics[name] = process_entry
+                continue
+            for field in ( 'count', 'contended', 'timeouts', 'dead_holders' ):
+                entry[field] += process_entry[field]
+            for field in ( 'wait', 'hold' ):
+                histogram = entry[field]
+                process_histogram = process_entry[field]
+                histogram['buckets'] = [
+                    a + b for a, b in zip(histogram['buckets'],
+                                          process_histogram['buckets'])
+                ]
+                histogram['total'] += process_histogram['total']
+                histogram['max'] = max(histogram['max'],
+                                       process_histogram['max'])
+    return dict(buckets = lock_metrics_buckets, locks = metrics)
+
+
 class process_posix_file_lock_c(object):
     """
-    Very simple interprocess file-based spinning lock
+    Simple interprocess file-based lock
+
+    The lock is taken with :func:`fcntl.flock`; when it is contended,
+    a helper thread blocks on it in the kernel while the caller waits
+    for it for up to *timeout* seconds, so it is acquired as soon as
+    the previous holder releases it.
+
+    The PID of the holder is written to the lock file while the lock
+    is held; if the lock is acquired and the file still contains the
+    PID of a process that is no longer running, the previous holder
+    died with the lock taken, a warning is logged and it is counted
+    in the lock's metrics, as the state protected by the lock might
+    be inconsistent.
+
+    Each process keeps metrics for each lock name: how many times it
+    was acquired, how many of those were contended, timed out or
+    found a dead previous holder and histograms of the time spent
+    waiting for it and holding it (see :func:`lock_metrics_get`).
+
+    :param str lockfile: name of the file to lock; it is created if
+      it does not exist.
+
+    :param float timeout: (optional, default 20) seconds to wait for
+      the lock before raising :exc:`timeout_e`.
+
+    :param float wait: (optional) ignored, kept for backwards
+      compatibility.
+
+    :param str name: (optional; default the lock file's basename)
+      name under which to account this lock's metrics; locks that
+      protect the same kind of resources can share a name so they
+      are accounted together.
 
     .. warning::
 
        - Won't work between threads of a process
 
-       - If a process dies, the next process can acquire it but there
-         will be no warning about the previous process having died,
-         thus state protected by the lock might be inconsistent
+       - If a contended lock times out, the helper thread waits
+         (holding a file descriptor) until the holder releases it
     """
 
     class timeout_e(Exception):
         pass
 
-    def __init__(self, lockfile, timeout = 20, wait = 0.3):
+    def __init__(self, lockfile, timeout = 20, wait = 0.3, name = None):
         self.lockfile = lockfile
         self.timeout = timeout
         self.wait = wait
+        if name == None:
+            name = os.path.basename(lockfile)
+        self.name = name
         self.fd = None
-        # ensure the file is created
-        with open(self.lockfile, "w+") as f:
-            f.write("")
+        self.ts_acquired = None
+        # ensure the file is created; don't truncate it, it might
+        # hold the PID of the current holder
+        os.close(os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o660))
+
+    def _acquire_blocking(self, fd):
+        # block on flock() in a helper thread, so we can give up
+        # waiting on timeout
+        acquired = threading.Event()
+        mutex = threading.Lock()
+        state = dict(abandoned = False, exception = None)
+
+        def _flock():
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except OSError as e:
+                state['exception'] = e
+            with mutex:
+                if state['abandoned']:
+                    # the caller timed out; closing releases the
+                    # lock if we got it
+                    os.close(fd)
+                    return
+                acquired.set()
+
+        thread = threading.Thread(target = _flock, daemon = True,
+                                  name = "lock " + self.name)
+        thread.start()
+        acquired.wait(self.timeout)
+        with mutex:
+            if not acquired.is_set():
+                state['abandoned'] = True
+                raise self.timeout_e(
+                    "%s: timed out after %ss waiting for lock"
+                    % (self.lockfile, self.timeout))
+        if state['exception']:
+            os.close(fd)
+            raise state['exception']
+
+    def _holder_check(self, fd):
+        pid_s = os.pread(fd, 32, 0).strip()
+        if not pid_s:
+            return False
+        try:
+            pid = int(pid_s)
+        except ValueError:
+            return False
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+            return False
+        except ProcessLookupError:
+            logging.warning("%s: previous holder PID %d died with the"
+                            " lock taken", self.lockfile, pid)
+            return True
+        except PermissionError:	# exists, but not ours
+            return False
 
     def acquire(self):
         ts0 = time.time()
-        self.fd = os.open(self.lockfile, os.O_RDWR | os.O_EXCL)
-        while True:
+        fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o660)
+        contended = False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                os.close(fd)
+                raise
+            contended = True
             try:
-                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                break
-            except IOError as e:
-                if e.errno != errno.EAGAIN:
-                    self.release()
-                    raise
-                time.sleep(self.wait)
-                ts = time.time()
-                if ts - ts0 > self.timeout:
-                    self.release()
-                    raise self.timeout_e
+                self._acquire_blocking(fd)
+            except self.timeout_e:
+                with _lock_metrics_mutex:
+                    entry = _lock_metrics_entry_get(self.name)
+                    entry['contended'] += 1
+                    entry['timeouts'] += 1
+                raise
+        ts = time.time()
+        dead_holder = self._holder_check(fd)
+        # lockdev's format, so it works with /var/lock/lockdev too
+        pid_s = b"%10d\n" % os.getpid()
+        os.pwrite(fd, pid_s, 0)
+        os.ftruncate(fd, len(pid_s))
+        self.fd = fd
+        self.ts_acquired = ts
+        with _lock_metrics_mutex:
+            entry = _lock_metrics_entry_get(self.name)
+            entry['count'] += 1
+            if contended:
+                entry['contended'] += 1
+            if dead_holder:
+                entry['dead_holders'] += 1
+            _lock_histogram_add(entry['wait'], ts - ts0)
 
     def release(self):
-        os.close(self.fd)
+        fd = self.fd
+        ts_acquired = self.ts_acquired
         self.fd = None
+        self.ts_acquired = None
+        try:
+            os.ftruncate(fd, 0)
+        finally:
+            os.close(fd)
+        with _lock_metrics_mutex:
+            _lock_histogram_add(
+                _lock_metrics_entry_get(self.name)['hold'],
+                time.time() - ts_acquired)
+        lock_metrics_flush()
 
     def locked(self):
         return self.fd != None
@@ -1138,6 +1371,9 @@ class test_target(object):
             self._type = type(self).__name__
         self.tags['id'] =  __id
         self.tags['type'] = self._type
+        #: Incremented every time the tags are updated with
+        #: :meth:`tags_update`; see :meth:`inventory_generation_get`
+        self._tags_generation = 0
         self.log = test_target_logadapter_c(logging.getLogger(), None)
         self.log.target = self
         self.log.propagate = False
@@ -1152,12 +1388,13 @@ class test_target(object):
         commonl.makedirs_p(os.path.join(self.state_dir, "queue"), 0o2770,
                            "target %s's allocation queue" % self.id)
         self.lock = process_posix_file_lock_c(
-            os.path.join(self.state_dir, "lockfile"))
+            os.path.join(self.state_dir, "lockfile"),
+            name = "target/" + self.id)
         #: filesystem database of target state; the multiple daemon
         #: processes use this to store information that reflect's the
         #: target's state.
         if fsdb == None:
-            self.fsdb = commonl.fsdb_symlink_c(self.state_dir)
+            self.fsdb = commonl.fsdb_symlink_indexed_c(self.state_dir)
         else:
             assert isinstance(fsdb, commonl.fsdb_c), \
                 "fsdb %s must inherit commonl.fsdb_c" % fsdb
@@ -1355,6 +1592,40 @@ class test_target(object):
         return r
 
 
+    def inventory_generation_get(self):
+        """
+        Return a value that changes when the data returned by
+        :meth:`to_dict` might have changed
+
+        This is used to cache inventory data; it changes when the
+        target's or its allocation's database (see
+        :meth:`commonl.fsdb_c.generation_get`), the owner or the tags
+        (when modified with :meth:`tags_update`) change.
+
+        :returns: opaque value that can only be compared for
+          equality with other values returned by this method; *None*
+          if it cannot be determined, which means the data cannot be
+          cached.
+        """
+        # take the generations before anything else, so if anything
+        # changes while we read, the generation will be different next
+        # time
+        generation = self.fsdb.generation_get()
+        if generation == None:
+            return None
+        allocid = self.fsdb.get('_alloc.id')
+        allocation_generation = None
+        if allocid:
+            try:
+                allocation_generation = \
+                    allocation.get_from_cache(allocid).generation_get()
+            except allocation.allocation_c.invalid_e:
+                pass
+        owner = self._acquirer.get() if self._acquirer else None
+        return ( generation, self._tags_generation, owner,
+                 allocid, allocation_generation )
+
+
     def kws_collect(self, impl = None, kws = None):
         """
         Create/update a key/value dictionary with the target's
@@ -1581,6 +1852,7 @@ class test_target(object):
         else:
             # FIXME: validate interconnects is a dict
             self.tags['interconnects'].setdefault(ic, {}).update(d)
+        self._tags_generation += 1	# see inventory_generation_get()
 
         # Once updated, we verify them and let it fail raising an
         # assertion if something is wrong
@@ -1603,7 +1875,11 @@ class test_target(object):
             allocdb = self._allocdb_get()
             if allocdb:
                 ts = allocdb.timestamp_get()
-                self.fsdb.set('timestamp', ts)
+                # only write if changed, so we don't modify the
+                # database just by reading it; each process changes
+                # it at most once per ttbl.config.timestamp_flush_period
+                if self.fsdb.get('timestamp') != ts:
+                    self.fsdb.set('timestamp', ts)
                 return ts
             # if there is no timestamp, forge the Epoch
             return self.fsdb.get('timestamp', "19700101000000")
@@ -1615,7 +1891,14 @@ class test_target(object):
         The activity is deemed as the user is using the target for
         something actively; most accesses to the target when it is
         acquired are considered activity.
+
+        This is called very often, so the timestamp is written only
+        if this process has not done it in the last
+        :data:`ttbl.config.timestamp_flush_period` seconds.
         """
+        allocid = self.fsdb.get('_alloc.id')
+        if allocid == None or allocation.timestamp_fresh(allocid):
+            return
         with self.lock:
             allocdb = self._allocdb_get()
             if allocdb:
@@ -11,7 +11,6 @@
 #    get/alloc-ls
 #  - reject messages to carry a 40x code?
 #  - each target allocation carries a max TTL per policy
-#  - starvation control missing
 #  - forbid fsdb writing to alloc fields
 #  - check lock order taking, always target or allocid,target
 #  * LRU caches needs being able to invalidate to avoid data
@@ -34,6 +33,12 @@
 #  - periodically by the maintenance() process, which is called from
 #    the system's cleanup thread
 #
+# Each target's queue is kept in its fsdb as _alloc.queue.* keys;
+# each process keeps a copy (_queue_c) that is reloaded only when the
+# keys change. maintenance() and _run_target() boost the priority of
+# waiters that have been waiting long or that hold part of a group
+# (see starvation_boost_*) by renaming their queue keys.
+#
 """
 Dynamic preemptable queue multi-resource allocator
 
@@ -60,17 +65,20 @@ Preemption use cases
 
 """
 
-import bisect
 import collections
+import ctypes
 import datetime
 import errno
+import fcntl
 import json
 import logging
 import numbers
 import pprint
 import os
 import re
+import select
 import shutil
+import struct
 import tempfile
 import time
 import uuid
@@ -112,6 +120,39 @@ states = {
 import collections
 import time
 
+# allocid -> time.time() when this process last wrote the allocation's
+# timestamp; see timestamp_fresh()
+_timestamps = {}
+
+def _timestamp_written(allocid, ts_now):
+    _timestamps[allocid] = ts_now
+    if len(_timestamps) > 1000:
+        # forget allocations this process hasn't touched lately, as
+        # if they were not in the dictionary
+        for allocid, ts in list(_timestamps.items()):
+            if ts_now - ts >= ttbl.config.timestamp_flush_period:
+                del _timestamps[allocid]
+
+def timestamp_fresh(allocid, ts_now = None):
+    """
+    Return if this process wrote the allocation's activity timestamp
+    less than :data:`ttbl.config.timestamp_flush_period` seconds ago
+
+    In that case, there is no need to write it again to mark the
+    allocation as active.
+
+    :param str allocid: allocation ID
+    :param float ts_now: (optional, default now) time to consider, as
+      returned by :func:`time.time`
+    :returns bool: *True* if the timestamp was written recently
+    """
+    ts = _timestamps.get(allocid, None)
+    if ts == None:
+        return False
+    if ts_now == None:
+        ts_now = time.time()
+    return ts_now - ts < ttbl.config.timestamp_flush_period
+
 # HACK: allow the allocation module to access the audit module, see
 # ttbl.allocation.audit; proper fix is to move the audit layer to its
 # own module. pending
@@ -152,7 +193,7 @@ class lru_aged_c(object):
         elif entry in self.cache:
             del self.cache[entry]
     
-class allocation_c(commonl.fsdb_symlink_c):
+class allocation_c(commonl.fsdb_symlink_indexed_c):
     """
     Backed by state in disk
 
@@ -161,13 +202,13 @@ class allocation_c(commonl.fsdb_symlink_c):
     """
     def __init__(self, allocid):
         dirname = os.path.join(path, allocid)
-        commonl.fsdb_symlink_c.__init__(self, dirname, concept = "allocid")
+        commonl.fsdb_symlink_indexed_c.__init__(self, dirname, concept = "allocid")
         self.allocid = allocid
         # protects writing to most fields
         # - group
         # - state
         self.lock = ttbl.process_posix_file_lock_c(
-            os.path.join(dirname, "lockfile"))
+            os.path.join(dirname, "lockfile"), name = "allocation")
         self.targets_all = None
         self.groups = None
         self.target_info_reload()
@@ -226,6 +267,10 @@ class allocation_c(commonl.fsdb_symlink_c):
                         target._allocid_wipe()
                 else:
                     targets = self.targets_all
+                    # take our waiters out of the queues now, so the
+                    # scheduler run doesn't have to find them invalid
+                    for target in targets.values():
+                        _target_waiters_remove(target, self.allocid)
         finally:
             # wipe the whole tree--this will render all the records that point
             # to it invalid and the next _run() call will clean them
@@ -239,7 +284,7 @@ class allocation_c(commonl.fsdb_symlink_c):
 
     def set(self, *args, force = True, **kwargs):
         # we default to forcing
-        return commonl.fsdb_symlink_c.set(
+        return commonl.fsdb_symlink_indexed_c.set(
             self, *args, force = force, **kwargs)
 
     def state_set(self, new_state):
@@ -256,8 +301,12 @@ class allocation_c(commonl.fsdb_symlink_c):
     def timestamp(self):
         # 20200323113030 is more readable than seconds since the epoch
         # and we still can do easy arithmentic with it.
-        ts = time.strftime("%Y%m%d%H%M%S")
+        ts_now = time.time()
+        ts = time.strftime("%Y%m%d%H%M%S", time.localtime(ts_now))
+        if timestamp_fresh(self.allocid, ts_now):
+            return ts
         self.set('timestamp', ts, force = True)
+        _timestamp_written(self.allocid, ts_now)
         return ts
 
     def timestamp_get(self):
@@ -307,7 +356,12 @@ class allocation_c(commonl.fsdb_symlink_c):
         # and before we got here somebody timestamped the target, thus
         # ts_last_keepalive > ts_now -> in this case, we are good, it
         # is fresh
-        if ts_idle.days >= 0 and seconds_idle > ttbl.config.target_max_idle:
+        #
+        # activity in the timestamp_flush_period after the timestamp
+        # was written might have not been written, so allow for it
+        if ts_idle.days >= 0 \
+           and seconds_idle > ttbl.config.target_max_idle \
+               + ttbl.config.timestamp_flush_period:
             # FIXME: make this per allocation?
             logging.info(
                 "ALLOC: allocation %s timedout (idle %s/%s), deleting",
@@ -363,19 +417,14 @@ class allocation_c(commonl.fsdb_symlink_c):
                     #    group_name, score, len(targets_allocated), len(group))
                     for target_name in not_yet_allocated:
                         targets_to_boost[target_name] = \
-                            min(targets_to_boost[target_name], score)
+                            max(targets_to_boost[target_name], score)
                 else:
                     # This group is complete, so we don't need the
                     # other targets tentatively allocated, so return
                     # the list so they can be released
                     # all targets needed for this group have been
-                    # allocated, let's then use it--if we set the "group"
-                    # value, then we have it allocated
-                    # Sort here because everywhere else we need a set
-                    self.set("group_allocated", ",".join(sorted(group)))
-                    self.set("timestamp_start", time.time())
-                    self.set("ts_start", time.time())	# COMPAT
-                    self.state_set("active")
+                    # allocated, let's then use it
+                    self._group_activate(group)
                     #logging.error("DEBUG: %s: group %s complete, state %s",
                     #              self.allocid, group_name,
                     #              self.state_get())
@@ -384,6 +433,17 @@ class allocation_c(commonl.fsdb_symlink_c):
             # no groups are complete, nothing else to do
             return targets_to_boost, []
 
+    def _group_activate(self, group):
+        # Mark the allocation active, with the targets in group
+        # allocated; call with self.lock taken
+        #
+        # if we set the "group" value, then we have it allocated
+        # Sort here because everywhere else we need a set
+        self.set("group_allocated", ",".join(sorted(group)))
+        self.set("timestamp_start", time.time())
+        self.set("ts_start", time.time())	# COMPAT
+        self.state_set("active")
+
     def check_user_is_creator_admin(self, user):
         assert isinstance(user, ttbl.user_control.User)
         userid = user.get_id()
@@ -578,31 +638,165 @@ def _waiter_validate(target, waiter_string, value):
     target.fsdb.set(waiter_string, None)	# invalid entry, wipe
     return None, None, None, None
 
+#: Seconds a waiter has to wait to get its priority boosted by
+#: :data:`starvation_boost_step`
+#:
+#: Waiters have a priority *USERPRIORITY * 1000*; the three lower
+#: digits are a subpriority that is boosted (decreased, as lower
+#: numbers are higher priority) the longer they wait, so they are
+#: first among those of their same user priority.
+starvation_boost_period = 60
+
+#: Subpriority points a waiter gets boosted each
+#: :data:`starvation_boost_period` seconds it has been waiting
+starvation_boost_step = 10
+
+#: Subpriority points an allocation waiting for a target gets
+#: boosted if it already holds other targets of one of its groups;
+#: it is scaled by the fraction of the group already held, so
+#: allocations close to completing their groups get their targets
+#: before others start holding targets of theirs.
+starvation_boost_partial = 200
+
+#: Maximum boost of a waiter's priority; lower than 1000 so a waiter
+#: never overtakes those of a higher user priority
+starvation_boost_max = 999
+
+
+class _queue_c:
+    # In-memory copy of a target's allocation queue
+    #
+    # The queue is kept in the target's fsdb as _alloc.queue.* keys
+    # (see request()); loading it requires listing the database, so
+    # we keep a copy around and reload it only when the keys change,
+    # as told by the fsdb's subkeys_stamp_get().
+    #
+    # Multiple daemon processes modify the queues, so we can't just
+    # update this with our changes: any change has to go to the
+    # fsdb, which will make us reload next time.
+
+    def __init__(self):
+        self.stamp = None
+        # list of ( PRIORITY, TIMESTAMP, FLAGS, ALLOCID, WAITERSTRING ),
+        # sorted by priority, then age
+        self.waiters = []
+        # count of waiters asking for preemption
+        self.preempt = 0
+
+    def load(self, target):
+        stamp = target.fsdb.subkeys_stamp_get("_alloc.queue")
+        if stamp != None and stamp == self.stamp:
+            return
+        waiters = []
+        for waiter_string, value in \
+                target.fsdb.get_as_slist("_alloc.queue.*"):
+            prio, ts, flags, allocid = \
+                _waiter_validate(target, waiter_string, value)
+            if prio == None:	# bad entry, killed
+                continue
+            waiters.append(( prio, ts, flags, allocid, waiter_string ))
+        waiters.sort()
+        self.waiters = waiters
+        self.preempt = sum(1 for waiter in waiters if 'P' in waiter[2])
+        self.stamp = stamp
+
+# target name -> _queue_c
+_queues = {}
+
+def _target_queue_get(target):
+    # Return the target's queue object, reloading it if needed
+    queue = _queues.get(target.id, None)
+    if queue == None:
+        queue = _queues[target.id] = _queue_c()
+    queue.load(target)
+    return queue
+
 def _target_queue_load(target):
-    # Load the target's queue
-    waiters = []
-    preempt = False
-    for waiter_string, value in target.fsdb.get_as_slist("_alloc.queue.*"):
-        # get_as_slist returns an alphabetical sort by key
-        # alphabetical sort by the
-        # prio/ts/flags/allocid/waiter_sstring gives us the highest
-        # prio first and within the same prio, sorted by the
-        # allocation creation time.  could use a regex to validate
-        # this, but the fields are so simple...
-        prio, ts, flags, allocid = \
-            _waiter_validate(target, waiter_string, value)
-        if prio == None:	# bad entry, killed
-            continue
-        if 'P' in flags:
-            preempt = True
-        bisect.insort(waiters, ( prio, ts, flags, allocid,
-                                 waiter_string ))
-    return waiters, preempt
+    # Load the target's queue, sorted by priority, then age
+    queue = _target_queue_get(target)
+    return queue.waiters, queue.preempt > 0
+
+def _target_waiters_remove(target, allocid):
+    # Remove an allocation's waiters from the target's queue
+    queue = _target_queue_get(target)
+    waiter_strings = [
+        waiter[4] for waiter in queue.waiters if waiter[3] == allocid ]
+    if waiter_strings:
+        target.fsdb.set_many(dict.fromkeys(waiter_strings))
+
+def _priority_user(prio):
+    # Return the user priority of a (maybe boosted) priority; boosts
+    # only decrease the lower three digits, so round up
+    return - (-prio // 1000)
+
+def _priority_preempts(prio, prio_owner):
+    # Can a waiter with priority PRIO preempt an owner that got the
+    # target with priority PRIO_OWNER?
+    #
+    # Only if it has a higher user priority; starvation boosts order
+    # the waiters of the same user priority, but don't give them the
+    # right to kick out an owner of the same user priority.
+    return _priority_user(prio) < _priority_user(prio_owner)
+
+def _waiter_priority_boosted(prio, ts, ts_now, score):
+    # What the priority of a waiter shall be after boosting it for
+    # the time it has been waiting and how much of a group it holds
+    prio_base = _priority_user(prio) * 1000
+    try:
+        age = ts_now - time.mktime(time.strptime(ts, "%Y%m%d%H%M%S"))
+    except ValueError:
+        age = 0
+    boost = max(0, int(age // starvation_boost_period)) \
+        * starvation_boost_step \
+        + int(score * starvation_boost_partial)
+    return max(0, prio_base - min(boost, starvation_boost_max))
 
 def _target_starvation_recalculate(allocdb, target, score):
-    # FIXME: don't print FIXME bc then it drives nuts all the unit
-    # tests and it is not necessarily a problem
-    logging.info("Not Implemented Yet: %s: %s: %s", allocdb, target.id, score)
+    # Boost the priority of the waiters in the target's queue
+    #
+    # allocdb: if not None, only boost this allocation's waiter
+    #
+    # score: fraction (0-1) of a group allocdb holds already
+    #
+    # Priorities are only ever boosted, never lowered, so boosts
+    # given for holding part of a group are kept.
+    queue = _target_queue_get(target)
+    if not queue.waiters:
+        return False
+    ts_now = time.time()
+    # renaming costs writes, so only do it if the waiter gets ahead
+    # of some other one; otherwise the order stays the same. Boosts
+    # never change the user priority, so they never make a waiter
+    # preempt the owner (see _priority_preempts())
+    prios = [ ( waiter[0], waiter[3] ) for waiter in queue.waiters ]
+    changes = []
+    for prio, ts, flags, allocid, waiter_string in queue.waiters:
+        if allocdb and allocid != allocdb.allocid:
+            continue
+        prio_new = _waiter_priority_boosted(
+            prio, ts, ts_now, score if allocdb else 0)
+        if prio_new >= prio:
+            continue
+        for prio_other, allocid_other in prios:
+            if allocid_other != allocid and prio_new <= prio_other <= prio:
+                break
+        else:
+            continue
+        changes.append(( waiter_string, allocid,
+                         "_alloc.queue.%06d-%s-%s-%s"
+                         % (prio_new, ts, flags, allocid) ))
+    if not changes:
+        return False
+    with target.lock:
+        with target.fsdb.batch() as batch:
+            for waiter_string, allocid, waiter_string_new in changes:
+                # it might have been taken out of the queue while
+                # we were not holding the lock
+                if target.fsdb.get(waiter_string) == None:
+                    continue
+                batch[waiter_string] = None
+                batch[waiter_string_new] = allocid
+    return True
 
 def _target_allocate_locked(target, current_allocdb, waiters, preempt):
     # return: allocdb from waiter that succesfully took it
@@ -667,8 +861,8 @@ def _target_allocate_locked(target, current_allocdb, waiters, preempt):
         #logging.error(
         #    "DEBUG: %s: current allocid %s, prios target %s waiter %s",
         #    target.id, current_allocid, priority_target, priority_waiter)
-        if priority_target <= priority_waiter:
-            # a higher or equal prio owner has the target
+        if not _priority_preempts(priority_waiter, priority_target):
+            # a higher or equal user prio owner has the target
             #logging.error("DEBUG: %s: busy w %s higher/equal prio owner"
             #              " (owner %d >=  waiter %d)",
             #              target.id, current_allocid,
@@ -694,21 +888,32 @@ def _target_allocate_locked(target, current_allocdb, waiters, preempt):
     # The target is not allocated either because it was free, the
     # allocation was invalid and got cleaned up or it got preempted;
     # let's latch on it
-    target.fsdb.set("_alloc.priority", priority_waiter)
-    target.fsdb.set("owner", allocdb.get('user'))
-    target.fsdb.set("_alloc.id", allocdb.allocid)
-    ts = time.strftime("%Y%m%d%H%M%S")
-    target.fsdb.set("_alloc.ts_start", ts)	# COMPAT
-    target.fsdb.set("_alloc.timestamp_start", ts)
-    target.fsdb.set("timestamp", ts)
-    # remove the waiter from the queue
-    target.fsdb.set(waiter[4], None)
+    _target_latch_locked(target, allocdb, priority_waiter, waiter[4])
     # ** This waiter is the owner now **
     #logging.error("DEBUG: %s: target allocated to %s",
     #              target.id, allocdb.allocid)
+    return allocdb
+
+def _target_latch_locked(target, allocdb, priority, waiter_string):
+    # Make allocdb the owner of the target, which has to be free
+    #
+    # waiter_string: name of the queue entry to remove, None if none
+    assert target.lock.locked()	    # Must have target.lock taken!
+    # write it all in one go, so others see the whole ownership
+    # change at once
+    ts = time.strftime("%Y%m%d%H%M%S")
+    with target.fsdb.batch() as batch:
+        batch["_alloc.priority"] = priority
+        batch["owner"] = allocdb.get('user')
+        batch["_alloc.id"] = allocdb.allocid
+        batch["_alloc.ts_start"] = ts	# COMPAT
+        batch["_alloc.timestamp_start"] = ts
+        batch["timestamp"] = ts
+        if waiter_string:
+            # remove the waiter from the queue
+            batch[waiter_string] = None
     for iface_name, allocate_hook in target.allocate_hooks.items():
         allocate_hook(target, iface_name, allocdb)
-    return allocdb
 
 
 def _run_target(target, preempt):
@@ -726,6 +931,10 @@ def _run_target(target, preempt):
     #
     while True:
         waiters, preempt_in_queue = _target_queue_load(target)
+        if not waiters and target.fsdb.get("_alloc.id") == None:
+            # nobody waiting and nobody owning, nothing to do; this
+            # avoids taking the lock on each idle target
+            return
         #logging.error("DEBUG: ALLOC: %s: waiters %s", target.id, len(waiters))
         # always run, even if there are no waiters, since we might
         # need to change the target's allocation (release it)
@@ -759,7 +968,8 @@ def _run_target(target, preempt):
                     target._deallocate_simple(allocdb.allocid)
             # we still need to allocate targets, maybe boost them
             for target_name, score in targets_to_boost.items():
-                _target_starvation_recalculate(allocdb, target, score)
+                _target_starvation_recalculate(
+                    allocdb, ttbl.test_target.get(target_name), score)
         else:
             #logging.error("DEBUG: ALLOC: %s: ownership didn't change",
             #              target.id)
@@ -768,8 +978,183 @@ def _run_target(target, preempt):
 
     assert True, "I should not be here"
 
+#: Allocate complete groups of targets at once
+#:
+#: By default, the scheduler walks the targets one by one, giving
+#: each to the highest priority waiter in its queue; an allocation
+#: asking for a group of targets thus gets them piecewise, holding
+#: some while waiting for the rest. When the groups of many
+#: allocations overlap, they end up holding parts of each other's
+#: groups, blocking each other and the targets they hold.
+#:
+#: When *True*, each scheduler run instead goes over the allocations
+#: waiting in the queues of the targets involved, in priority
+#: order, and assigns to each the first of its groups whose targets
+#: are all available (free or owned by a lower priority allocation
+#: that can be preempted), all at once. Allocations never hold
+#: partial groups. The targets wanted by an allocation that can't
+#: get any of its groups are not given in that run to allocations
+#: of lower user priority, so large groups are not starved by
+#: smaller ones of lower priority (among the same user priority,
+#: smaller groups can use them meanwhile).
+#:
+#: Set in a server configuration file with:
+#:
+#: >>> ttbl.allocation.group_solver = True
+group_solver = False
+
+def _target_owner_get(target):
+    # Return ( ALLOCID, PRIORITY ) of the valid owner of the target
+    # or None if free (or owned by an invalid allocation, which
+    # _allocdb_get() will clean up when taking it)
+    allocid = target.fsdb.get("_alloc.id")
+    if allocid == None:
+        return None
+    try:
+        get_from_cache(allocid)
+    except allocation_c.invalid_e:
+        return None
+    priority = target.fsdb.get("_alloc.priority", None)
+    if priority == None:
+        logging.error("%s: BUG: ALLOC: no priority recorded", target.id)
+        priority = 500
+    return allocid, priority
+
+def _group_assign(allocdb, priority, group, preemptable):
+    # Assign all the targets in group to allocdb, preempting their
+    # current owners if needed, or none of them
+    #
+    # Take the locks of all the targets, always in the same order so
+    # we don't deadlock with other processes doing the same, and
+    # check again nothing has changed since we looked.
+    #
+    # Then, with the allocation's lock also taken (so it can't be
+    # removed while we are at it), check it is still waiting and
+    # assign it all; anyone looking at the allocation or the targets
+    # sees the whole change or none.
+    targets = [ ttbl.test_target.get(target_name)
+                for target_name in sorted(group) ]
+    locked = []
+    try:
+        current_allocdbs = {}
+        for target in targets:
+            target.lock.acquire()
+            locked.append(target)
+            current_allocdb = target._allocdb_get()
+            if current_allocdb:
+                if target.id not in preemptable \
+                   or not _priority_preempts(
+                       priority, target.fsdb.get("_alloc.priority", 500)):
+                    return False
+                current_allocdbs[target.id] = current_allocdb
+        try:
+            allocdb.lock.acquire()
+        except FileNotFoundError:
+            return False	# allocation removed, the directory is gone
+        try:
+            if allocdb.state_get() != "queued":
+                return False	# removed or got a group some other way
+            for target in targets:
+                current_allocdb = current_allocdbs.get(target.id, None)
+                if current_allocdb:
+                    target._deallocate(current_allocdb, 'restart-needed')
+                _target_latch_locked(target, allocdb, priority, None)
+            allocdb._group_activate(group)
+            # we won't need to wait for any other target
+            for target in allocdb.targets_all.values():
+                _target_waiters_remove(target, allocdb.allocid)
+        finally:
+            allocdb.lock.release()
+    finally:
+        for target in locked:
+            target.lock.release()
+    return True
+
+def _run_groups(targets, preempt):
+    # Scheduler run that assigns complete groups (see group_solver)
+
+    # Collect the allocations waiting in the queues of the targets,
+    # with their best priority (might be boosted differently on
+    # each target) and which of those targets allow preemption
+    waiting = {}		# ALLOCID -> [ PRIORITY, TIMESTAMP, ALLOCID ]
+    invalid = set()
+    preemptable = set()
+    owners = {}		# TARGETNAME -> ( ALLOCID, PRIORITY ) or None
+    for target in targets:
+        owners[target.id] = _target_owner_get(target)
+        if owners[target.id] == None \
+           and target.fsdb.get("_alloc.id") != None:
+            # owned by an invalid allocation, clean it up
+            with target.lock:
+                target._allocdb_get()
+        queue = _target_queue_get(target)
+        if preempt or queue.preempt:
+            preemptable.add(target.id)
+        for prio, ts, _flags, allocid, waiter_string in queue.waiters:
+            if allocid in waiting:
+                waiting[allocid][0] = min(waiting[allocid][0], prio)
+                continue
+            if allocid not in invalid:
+                try:
+                    if get_from_cache(allocid).state_get() == "queued":
+                        waiting[allocid] = [ prio, ts, allocid ]
+                        continue
+                except allocation_c.invalid_e:
+                    pass
+                invalid.add(allocid)
+            # removed or not waiting anymore, wipe the entry
+            target.fsdb.set(waiter_string, None)
+
+    reserved = {}	# TARGETNAME -> USERPRIORITY of who reserved it
+    for prio, _ts, allocid in sorted(waiting.values()):
+        try:
+            allocdb = get_from_cache(allocid)
+        except allocation_c.invalid_e:
+            continue
+        user_priority = _priority_user(prio)
+        groups_available = []
+        for group_name, group in sorted(allocdb.groups.items()):
+            needs_preemption = False
+            for target_name in group:
+                if reserved.get(target_name, user_priority) < user_priority:
+                    break
+                if target_name not in owners:
+                    target = ttbl.test_target.get(target_name)
+                    owners[target_name] = _target_owner_get(target)
+                    if _target_queue_get(target).preempt:
+                        preemptable.add(target_name)
+                owner = owners[target_name]
+                if owner == None:
+                    continue
+                if target_name not in preemptable \
+                   or not _priority_preempts(prio, owner[1]):
+                    break
+                needs_preemption = True
+            else:
+                # prefer groups that need no preemption
+                groups_available.append(( needs_preemption, group_name ))
+        for _needs_preemption, group_name in sorted(groups_available):
+            group = allocdb.groups[group_name]
+            if _group_assign(allocdb, prio, group, preemptable):
+                for target_name in group:
+                    owners[target_name] = ( allocid, prio )
+                break
+            # somebody else took some of its targets, look again
+            for target_name in group:
+                owners.pop(target_name, None)
+        else:
+            # it has to wait; keep lower priority allocations away
+            # from what it wants
+            for target_name in allocdb.targets_all:
+                reserved[target_name] = \
+                    min(reserved.get(target_name, user_priority),
+                        user_priority)
+
 def _run(targets, preempt):
     # Main scheduler run
+    if group_solver:
+        _run_groups(targets, preempt)
+        return
     for target in targets:
         _run_target(target, preempt)
 
@@ -1212,12 +1597,176 @@ def keepalive(allocid, expected_state, _pressure, calling_user):
 
     allocdb.timestamp()				# first things first
     state = allocdb.state_get()
+    if state == None:
+        # removed since we cached it
+        return dict(state = "invalid", _message = states['invalid'])
     r = dict(state = state)
     if state == "active" and expected_state != 'active':
         # set in calculate_stuff()
         r['group_allocated'] = allocdb.get("group_allocated")
     return r
 
+#: Maximum time (in seconds) a keepalive can wait for a state change
+#: in any of its allocations (see :func:`keepalive_wait`)
+keepalive_wait_max = 60
+
+#: Maximum number of keepalives that can be waiting for state changes
+#: at the same time in all the daemon's processes; when all are
+#: taken, keepalives return right away.
+#:
+#: Each waiting keepalive takes a whole daemon process for the
+#: duration of the wait, during which it serves no other requests,
+#: so this is disabled (*0*) by default; enable it only in servers
+#: with processes to spare (see :data:`ttbl.config.processes`).
+keepalive_waiters_max = 0
+
+#: If the kernel can't notify us of changes in allocations, check
+#: their state this often (in seconds) while waiting
+keepalive_wait_poll_period = 0.25
+
+class _state_watcher_c:
+    # Wait for changes to the state of a set of allocations
+    #
+    # Uses inotify to watch the allocation's directories for the
+    # state field being replaced or removed; this works across all
+    # the daemon processes, since they all modify the same
+    # directories.
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_IGNORED = 0x8000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+
+    _libc = None
+
+    def __init__(self, allocids):
+        if _state_watcher_c._libc == None:
+            _state_watcher_c._libc = ctypes.CDLL("libc.so.6",
+                                                 use_errno = True)
+        libc = _state_watcher_c._libc
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        for allocid in allocids:
+            # if it doesn't exist, fine, it is invalid and the check
+            # after setting up the watches will catch it
+            libc.inotify_add_watch(
+                self.fd, os.path.join(path, allocid).encode('utf-8'),
+                self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+                | self.IN_DELETE_SELF | self.IN_MOVE_SELF)
+
+    def wait(self, timeout):
+        # Return True if a state might have changed, False on timeout
+        ts_end = time.time() + timeout
+        while True:
+            timeout = ts_end - time.time()
+            if timeout <= 0:
+                return False
+            readable, _, _ = select.select([ self.fd ], [], [], timeout)
+            if not readable:
+                return False
+            try:
+                data = os.read(self.fd, 16384)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                _wd, mask, _cookie, length = struct.unpack_from(
+                    "iIII", data, offset)
+                offset += 16
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name == b"state" \
+                   or mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF
+                              | self.IN_IGNORED):
+                    return True
+
+    def close(self):
+        os.close(self.fd)
+
+def _keepalive_wait_slot_get():
+    # Return a file descriptor holding a slot to wait in a keepalive,
+    # None if none is free; slots are numbered lock files in the
+    # daemon's state directory, freed when the holder closes them or
+    # dies
+    for slot in range(keepalive_waiters_max):
+        lockfile = os.path.join(
+            ttbl.test_target.state_path, "..",
+            "allocation.keepalive-wait.%d.lock" % slot)
+        fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError as e:
+            os.close(fd)
+            if e.errno != errno.EAGAIN:
+                raise
+    return None
+
+def keepalive_wait(allocids, pressure, calling_user, wait = 0):
+    """
+    Keepalive a set of allocations, waiting for any to change state
+
+    :param dict allocids: dictionary keyed by allocation ID of the
+      state the caller thinks each allocation is in
+    :param int pressure: see :func:`keepalive`
+    :param ttbl.user_control.User calling_user: user doing the call
+    :param float wait: (optional, default 0) if no allocation is in a
+      state different to the expected one, wait up to this many
+      seconds for any to change (capped to
+      :data:`keepalive_wait_max` and to half of
+      :data:`ttbl.config.target_max_idle`, so the allocations don't
+      idle out while waiting).
+
+      The wait might be shorter if too many keepalives are already
+      waiting; by default, no keepalive waits (see
+      :data:`keepalive_waiters_max`).
+
+    :returns dict: dictionary keyed by allocation ID with the result
+      of :func:`keepalive` for the allocations whose state is not
+      the one expected
+    """
+    assert isinstance(wait, numbers.Real), \
+        f"wait: expected number of seconds; got {type(wait)}"
+    wait = min(wait, keepalive_wait_max, ttbl.config.target_max_idle / 2)
+    ts_end = time.time() + wait
+    slot_fd = None
+    watcher = None
+    try:
+        while True:
+            result = {}
+            for allocid, expected_state in allocids.items():
+                r = keepalive(allocid, expected_state, pressure,
+                              calling_user)
+                if r['state'] != expected_state:
+                    result[allocid] = r
+            timeout = ts_end - time.time()
+            if result or timeout <= 0:
+                return result
+            if slot_fd == None:
+                slot_fd = _keepalive_wait_slot_get()
+                if slot_fd == None:
+                    return result		# too many waiting, don't
+                try:
+                    watcher = _state_watcher_c(allocids)
+                except OSError as e:
+                    logging.info("ALLOC: can't watch allocation state"
+                                 " changes, polling: %s", e)
+                # check again, in case it changed while setting up
+                continue
+            if watcher:
+                watcher.wait(timeout)
+            else:
+                time.sleep(min(timeout, keepalive_wait_poll_period))
+    finally:
+        if watcher:
+            watcher.close()
+        if slot_fd != None:
+            os.close(slot_fd)
+
 def _idle_power_off(target, calling_user,
                     idle_power_off, idle_power_fully_off):
     assert isinstance(target, ttbl.test_target)
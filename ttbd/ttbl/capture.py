@@ -111,6 +111,14 @@ Capture Inventory
        starts capturing and captures data until stopped and then
        returns the streams captured.
 
+   * - interfaces.capture.NAME.sequenced
+     - bool
+     - optional
+     - Indicates if this snapshot capturer numbers its snapshots (eg:
+       :class:`framegrabber_c`), so the client can ask if the
+       snapshot has changed since the last one it got. If not
+       present, it can be assumed to be *False*.
+
    * - interfaces.capture.NAME.capturing
      - bool
      - optional
@@ -145,13 +153,16 @@ import collections
 import datetime
 import errno
 import json
+import mmap
 import os
 import re
 import signal
 import shutil
+import struct
 import subprocess
 import time
 import sys
+import zlib
 
 import commonl
 import ttbl
@@ -162,12 +173,12 @@ else:
     str_type = basestring
 
 # mimetypes are NAME/NAME
-# NAME can be alphanumeric, dots and underscore
+# NAME can be alphanumeric, dots, dashes and underscore
 # Multiple mimetypes are thus NAME/NAME,NAME/NAME...
 
 mime_type_regex = re.compile(
-    r"^([_\.a-zA-Z0-9]+/[_\.a-zA-Z0-9]+)"
-    r"(,[_\.a-zA-Z0-9]+/[_\.a-zA-Z0-9]+)*$")
+    r"^([-_\.a-zA-Z0-9]+/[-_\.a-zA-Z0-9]+)"
+    r"(,[-_\.a-zA-Z0-9]+/[-_\.a-zA-Z0-9]+)*$")
 
 class impl_c(ttbl.tt_interface_impl_c):
     """
@@ -215,8 +226,8 @@ class impl_c(ttbl.tt_interface_impl_c):
                 "; got %s" % (k, type(v))
             assert mime_type_regex.search(v), \
                 "%s: MIME type specification not valid (only" \
-                "multiple [_a-zA-Z0-9]+/[_a-zA-Z0-9]+ separated by commas" \
-                % mimetype
+                "multiple [-_.a-zA-Z0-9]+/[-_.a-zA-Z0-9]+ separated by commas" \
+                % v
             self.stream[k] = v
         self.snapshot = snapshot
         ttbl.tt_interface_impl_c.__init__(self)
@@ -378,6 +389,14 @@ class interface(ttbl.tt_interface):
         capture_path = self._capture_path(target)
         for capturer in self.impls:
             impl = self.impls[capturer]
+            if isinstance(impl, framegrabber_c):
+                try:
+                    impl.grabber_stop(target, capturer)
+                except Exception as e:
+                    target.log.warning(
+                        "capture: %s:"
+                        " ignoring exception when stopping framegrabber"
+                        " upon release: %s", capturer, e)
             if impl.snapshot:
                 continue
             capturing = target.property_get(
@@ -408,11 +427,21 @@ class interface(ttbl.tt_interface):
         :param ttbl.test_target target: target on which we are capturing
         :param str capturer: capturer to use, as registered in
           :class:`ttbl.capture.interface`.
-        :returns: dictionary of values to pass to the client
+        :param int since: (optional) for capturers that number their
+          snapshots (:class:`framegrabber_c`), sequence number of the
+          last snapshot the client got; if there is no newer one,
+          nothing is captured and *changed* is returned as *False*.
+        :returns: dictionary of values to pass to the client; for
+          capturers that number their snapshots, it includes the
+          *sequence* number of the snapshot taken.
         """
         impl, capturer = self.arg_impl_get(args, "capturer")
         assert capturer in list(self.impls.keys()), \
             "capturer '%s' unknown" % capturer
+        since = self.arg_get(args, "since", int, allow_missing = True)
+        if since != None and not isinstance(impl, framegrabber_c):
+            raise RuntimeError("capturer '%s' does not number its"
+                               " snapshots; can't use 'since'" % capturer)
 
         capture_path = self._capture_path(target)
         with target.target_owned_and_locked(who):
@@ -430,7 +459,19 @@ class interface(ttbl.tt_interface):
                     impl.stop(target, capturer, capture_path)
                 except:
                     pass	# not care about errors here, resetting state
-            capturing, streams = impl.start(target, capturer, capture_path)
+            sequence = None
+            if isinstance(impl, framegrabber_c):
+                capturing = False
+                sequence, streams = impl.frame_get(target, capturer,
+                                                   capture_path, since)
+                if streams == None:
+                    # same frame the client has; the inventory
+                    # still points to the file it got it from
+                    return dict(capturing = False, sequence = sequence,
+                                changed = False)
+            else:
+                capturing, streams = impl.start(target, capturer,
+                                                capture_path)
             assert isinstance(capturing, bool) and isinstance(streams, dict), \
                 "%s: capture driver BUG (%s): start()'s return value " \
                 " expected (bool, dict); got (%s, %s)" % (
@@ -440,6 +481,9 @@ class interface(ttbl.tt_interface):
             target.property_set(
                 "interfaces.capture.%s.capturing" % capturer, True)
             r = dict(capturing = capturing)
+            if sequence != None:
+                r['sequence'] = sequence
+                r['changed'] = True
             for stream_name in streams:
                 file_name = streams[stream_name]
                 if os.path.isabs(file_name):
@@ -859,6 +903,396 @@ INFO: stream_file: %(_impl.stream_filename)s
         target.log.info("%s: generic streaming stopped", capturer)
 
 
+# Layout of the frame ring buffer file shared between the grabber
+# process and the ttbd processes serving frames:
+#
+# - header: magic, geometry, number of slots, sequence number of the
+#   most recent frame, frames read from the grabber, timestamps of
+#   the last frame grabbed and the last frame served.
+#
+# - SLOTS x [ slot header (sequence, timestamp, crc) + frame data ]
+#
+# The writer bumps the sequence only when a frame's contents differ
+# from the previous one, so two frames with the same sequence number
+# are the same frame. It zeroes the slot's sequence before
+# overwriting its data and sets it when done, so readers can tell if
+# they copied a slot that was being overwritten.
+_framebuffer_magic = b"TTBDFRB1"
+_framebuffer_header = struct.Struct("<8sIIIIQQdd")
+_framebuffer_header_size = 64
+# the writer updates sequence, frames and the grab timestamp, the
+# readers the read timestamp
+_framebuffer_header_w = struct.Struct("<QQd")
+_framebuffer_header_w_offset = 24
+_framebuffer_header_ts_read_offset = 48
+_framebuffer_slot_header = struct.Struct("<QdI")
+_framebuffer_slot_header_size = 32
+
+_framegrabber_pixel_formats = {
+    # ffmpeg's -pix_fmt: bytes per pixel, PNM magic, extension, mimetype
+    "rgb24": ( 3, b"P6", ".ppm", "image/x-portable-pixmap" ),
+    "gray": ( 1, b"P5", ".pgm", "image/x-portable-graymap" ),
+}
+
+def _framegrabber_run(ring_path, cmdline, log_filename,
+                      width, height, bpp, slots, idle_timeout, sequence):
+    # Runs in a process forked by framegrabber_c._grabber_start();
+    # start the grabber program and copy each frame it writes to
+    # stdout into the ring buffer until the grabber dies or nobody
+    # asked for a frame in idle_timeout seconds.
+    frame_size = width * height * bpp
+    slot_size = _framebuffer_slot_header_size + frame_size
+    size = _framebuffer_header_size + slots * slot_size
+    fd = os.open(ring_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        mm = mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+    ts = time.time()
+    _framebuffer_header.pack_into(
+        mm, 0, _framebuffer_magic, width, height, bpp, slots,
+        sequence, 0, 0, ts)
+
+    with open(log_filename, "a") as logf:
+        logf.write("INFO: framegrabber %d: starting: %s\n"
+                   % (os.getpid(), " ".join(cmdline)))
+        logf.flush()
+        p = subprocess.Popen(
+            cmdline, cwd = "/tmp", shell = False, close_fds = True,
+            stdin = subprocess.DEVNULL, stdout = subprocess.PIPE,
+            stderr = logf)
+    frames = 0
+    crc_last = None
+    try:
+        while True:
+            frame = p.stdout.read(frame_size)
+            if len(frame) < frame_size:
+                break		# grabber died
+            frames += 1
+            ts = time.time()
+            crc = zlib.crc32(frame)
+            if crc != crc_last:
+                crc_last = crc
+                sequence += 1
+                offset = _framebuffer_header_size \
+                    + (sequence % slots) * slot_size
+                _framebuffer_slot_header.pack_into(mm, offset, 0, ts, crc)
+                mm[offset + _framebuffer_slot_header_size
+                   : offset + slot_size] = frame
+                _framebuffer_slot_header.pack_into(
+                    mm, offset, sequence, ts, crc)
+            _framebuffer_header_w.pack_into(
+                mm, _framebuffer_header_w_offset, sequence, frames, ts)
+            ts_read, = struct.unpack_from(
+                "<d", mm, _framebuffer_header_ts_read_offset)
+            if ts - ts_read > idle_timeout:
+                break
+    finally:
+        p.kill()
+        p.wait()
+        with open(log_filename, "a") as logf:
+            logf.write("INFO: framegrabber %d: stopped after %d frames"
+                       " (%d different), grabber exit code %s\n"
+                       % (os.getpid(), frames, sequence, p.returncode))
+        mm.close()
+
+
+class framegrabber_c(impl_c):
+    """
+    Snapshot capturer that serves frames from a long running grabber
+
+    A :class:`generic_snapshot` capturer runs a program to grab a
+    frame and encode it to a file every time a snapshot is
+    requested; when a testcase polls the screen very often (eg:
+    :meth:`tcfl.target_ext_capture.extension.image_on_screenshot`),
+    most of the time goes into starting that program, opening the
+    video source and encoding.
+
+    Instead, this capturer starts on the first snapshot a grabber
+    program that keeps writing raw frames to its standard output; a
+    helper process copies them to a ring buffer of *slots* frames in
+    a memory mapped file in the target's state directory. Snapshots
+    just copy the most recent frame from there, with no encoding, to
+    a PPM (*rgb24*) or PGM (*gray*) file, which most image libraries
+    can read.
+
+    The grabber is stopped when the target is released or when no
+    snapshots have been requested in *idle_timeout* seconds; it is
+    started again with the next snapshot.
+
+    Frames are numbered with a sequence number that only increases
+    when the contents of the frame change; a client that passes the
+    sequence number of the last frame it got in the *since* argument
+    is just told it has not changed, with no file written or
+    downloaded. For example:
+
+    >>> capture_screen_v4l = ttbl.capture.framegrabber_c(
+    >>>     "%(id)s screen",
+    >>>     "ffmpeg -loglevel error -f v4l2 -i /dev/video-%(id)s-0"
+    >>>     " -vf fps=10,scale=1920:1080 -f rawvideo -pix_fmt rgb24 -",
+    >>>     1920, 1080)
+    >>>
+    >>> ttbl.test_target.get('TARGETNAME').interface_add(
+    >>>     "capture",
+    >>>     ttbl.capture.interface(
+    >>>         screen = capture_screen_v4l,
+    >>>         ...
+    >>>     )
+    >>> )
+
+    :param str name: name for error messages from this capturer
+
+    :param cmdline: command line (string or list of strings) to
+      start the grabber; it has to write to its standard output raw
+      frames of *width* x *height* pixels in *pixel_format*. As in
+      :class:`generic_snapshot`, all the arguments are
+      `%(keyword)s` expanded from the target's keywords.
+
+    :param int width: width of the frames in pixels
+
+    :param int height: height of the frames in pixels
+
+    :param str pixel_format: (optional, default *rgb24*) *rgb24* or
+      *gray*, as named by *ffmpeg*'s *-pix_fmt* option.
+
+    :param int slots: (optional, default 4) number of frames kept in
+      the ring buffer.
+
+    :param float idle_timeout: (optional, default 60) seconds after
+      the last snapshot when the grabber is stopped.
+
+    :param float first_frame_timeout: (optional, default 10) seconds
+      to wait for the first frame when the grabber is started.
+
+    :param list pre_commands: (optional) list of commands to run
+      before starting the grabber, as in :class:`generic_snapshot`.
+    """
+    def __init__(self, name, cmdline, width: int, height: int,
+                 pixel_format: str = "rgb24", slots: int = 4,
+                 idle_timeout: float = 60,
+                 first_frame_timeout: float = 10,
+                 pre_commands = None):
+        assert isinstance(name, str_type)
+        assert isinstance(width, int) and width > 0
+        assert isinstance(height, int) and height > 0
+        assert pixel_format in _framegrabber_pixel_formats, \
+            "pixel_format: expected one of %s; got %s" % (
+                " ".join(_framegrabber_pixel_formats), pixel_format)
+        assert isinstance(slots, int) and slots >= 2
+        assert idle_timeout > 0
+        assert first_frame_timeout > 0
+        self.name = name
+        if isinstance(cmdline, str):
+            self.cmdline = cmdline.split()
+            cmdline_s = cmdline
+        else:
+            commonl.assert_list_of_strings(cmdline, "commandline", "commands")
+            self.cmdline = cmdline
+            cmdline_s = ' '.join(cmdline)
+        if pre_commands:
+            commonl.assert_list_of_strings(pre_commands,
+                                           "pre_commands", "command")
+            self.pre_commands = pre_commands
+        else:
+            self.pre_commands = []
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.bpp, self.pnm_magic, self.extension, mimetype = \
+            _framegrabber_pixel_formats[pixel_format]
+        self.slots = slots
+        self.idle_timeout = idle_timeout
+        self.first_frame_timeout = first_frame_timeout
+        impl_c.__init__(self, True, mimetype, log = "text/plain")
+        self.upid_set(name, serial_number = commonl.mkid(cmdline_s))
+
+    def target_setup(self, target, iface_name, component):
+        impl_c.target_setup(self, target, iface_name, component)
+        # let clients know they can ask for frames since a sequence number
+        target.tags['interfaces'][iface_name][component]['sequenced'] = True
+
+    @staticmethod
+    def _ring_path(target, capturer):
+        return os.path.join(target.state_dir,
+                            "capture-%s.framebuffer" % capturer)
+
+    @staticmethod
+    def _pidfile(target, capturer):
+        return os.path.join(target.state_dir,
+                            "capture-%s.framegrabber.pid" % capturer)
+
+    def _ring_open(self, target, capturer):
+        # Map the ring buffer if there is one for our geometry with a
+        # grabber running on it
+        if not commonl.process_alive(self._pidfile(target, capturer)):
+            return None
+        ring_path = self._ring_path(target, capturer)
+        try:
+            with open(ring_path, "r+b") as f:
+                mm = mmap.mmap(f.fileno(), 0)
+        except (OSError, ValueError):
+            return None
+        header = _framebuffer_header.unpack_from(mm, 0)
+        if header[0:5] != ( _framebuffer_magic, self.width, self.height,
+                            self.bpp, self.slots ):
+            mm.close()
+            return None
+        return mm
+
+    def _grabber_start(self, target, capturer, log_filename):
+        kws = target.kws_collect(self)
+        kws['_impl.capturer'] = capturer
+        kws['_impl.log_filename'] = log_filename
+        with open(log_filename, "w+") as logf:
+            logf.write("INFO: ttbd starting framegrabber for '%s' at %s\n"
+                       % (capturer, datetime.datetime.utcnow()))
+            for command in self.pre_commands:
+                # yup, run with shell -- this is not a user level
+                # command, the configurator has full control
+                pre_command = commonl.kws_expand(command, kws)
+                logf.write("INFO: calling pre-command: %s\n" % pre_command)
+                logf.flush()
+                subprocess.check_call(
+                    pre_command,
+                    shell = True, close_fds = True, cwd = "/tmp",
+                    stdout = logf, stderr = subprocess.STDOUT)
+        cmdline = [ commonl.kws_expand(i, kws) for i in self.cmdline ]
+        target.log.info("%s: framegrabber command: %s",
+                        capturer, " ".join(cmdline))
+        ring_path = self._ring_path(target, capturer)
+        sequence = 0
+        try:
+            # keep counting from where a previous grabber for this
+            # source left it, so clients don't take an older frame
+            # number as current; remove it so we don't serve its
+            # frames until the new grabber produces one
+            with open(ring_path, "rb") as f:
+                header = _framebuffer_header.unpack(
+                    f.read(_framebuffer_header.size))
+            if header[0] == _framebuffer_magic:
+                sequence = header[5]
+        except (OSError, struct.error):
+            pass
+        commonl.rm_f(ring_path)
+        pid = os.fork()
+        if pid == 0:	# I'm the child
+            exit_code = 0
+            try:
+                # we have to reap our own grabber and don't want to
+                # keep the daemon's sockets open
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                # cleanup (kill the grabber) when terminated
+                signal.signal(signal.SIGTERM,
+                              lambda _signum, _frame: sys.exit(0))
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                for fd in os.listdir("/proc/self/fd"):
+                    if int(fd) > 2:
+                        try:
+                            os.close(int(fd))
+                        except OSError:
+                            pass
+                _framegrabber_run(ring_path, cmdline, log_filename,
+                                  self.width, self.height, self.bpp,
+                                  self.slots, self.idle_timeout, sequence)
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        with open(self._pidfile(target, capturer), "w+") as pidf:
+            pidf.write("%s" % pid)
+        ttbl.daemon_pid_add(pid)
+
+    def grabber_stop(self, target, capturer):
+        """
+        Stop the grabber for a capturer, if running
+        """
+        pidfile = self._pidfile(target, capturer)
+        if commonl.process_alive(pidfile):
+            target.log.info("%s: stopping framegrabber", capturer)
+            commonl.process_terminate(pidfile, tag = "capture:" + capturer)
+        commonl.rm_f(pidfile)
+
+    def frame_get(self, target, capturer, path, since = None):
+        """
+        Write the most recent frame to a file, starting the grabber
+        if needed
+
+        :param int since: (optional) sequence number of the last
+          frame the caller got
+
+        :returns (int, dict): sequence number of the most recent
+          frame and a dictionary of streams as returned by
+          :meth:`start`; if *since* is the sequence number of the
+          most recent frame, the dictionary is *None* and nothing is
+          written.
+        """
+        log_filename = os.path.join(path, capturer + ".log")
+        mm = self._ring_open(target, capturer)
+        if mm == None:
+            self._grabber_start(target, capturer, log_filename)
+            ts0 = time.time()
+            while True:
+                mm = self._ring_open(target, capturer)
+                if mm != None \
+                   and _framebuffer_header.unpack_from(mm, 0)[6] > 0:
+                    break
+                if mm != None:
+                    mm.close()
+                if time.time() - ts0 > self.first_frame_timeout:
+                    self.grabber_stop(target, capturer)
+                    raise RuntimeError(
+                        "%s: framegrabber produced no frames in %ss;"
+                        " see log in capture/%s.log" % (
+                            capturer, self.first_frame_timeout, capturer))
+                time.sleep(0.05)
+            target.log.info("%s: framegrabber started in %.2fs",
+                            capturer, time.time() - ts0)
+
+        frame_size = self.width * self.height * self.bpp
+        slot_size = _framebuffer_slot_header_size + frame_size
+        try:
+            # tell the grabber we are still interested
+            struct.pack_into("<d", mm, _framebuffer_header_ts_read_offset,
+                             time.time())
+            for _ in range(self.slots):
+                sequence = _framebuffer_header.unpack_from(mm, 0)[5]
+                if since == sequence:
+                    return sequence, None
+                offset = _framebuffer_header_size \
+                    + (sequence % self.slots) * slot_size
+                frame = mm[offset + _framebuffer_slot_header_size
+                           : offset + slot_size]
+                # if the writer started overwriting this slot while
+                # we copied, the slot's sequence number won't match
+                if _framebuffer_slot_header.unpack_from(mm, offset)[0] \
+                   == sequence:
+                    break
+            else:
+                raise RuntimeError("%s: framegrabber overran the frame"
+                                   " buffer while reading" % capturer)
+        finally:
+            mm.close()
+
+        stream_filename = capturer + self.extension
+        stream_path = os.path.join(path, stream_filename)
+        with open(stream_path + ".tmp", "wb") as f:
+            f.write(b"%s\n%d %d\n255\n" % (self.pnm_magic,
+                                          self.width, self.height))
+            f.write(frame)
+        os.rename(stream_path + ".tmp", stream_path)
+        return sequence, {
+            "default": stream_filename,
+            "log": capturer + ".log"
+        }
+
+    def start(self, target, capturer, path):
+        _sequence, streams = self.frame_get(target, capturer, path)
+        return False, streams
+
+    # no stop() because is a snapshot capturer
+
+
 class tcpdump_c(generic_stream):
     """
     Capture network traffic
@@ -237,6 +237,17 @@ target_max_idle_power_fully_off = 10 * target_max_idle
 #: Maximum time an acquired target is idle before it is released (seconds)
 target_owned_max_idle = 5 * 60  # 5 min
 
+#: Minimum time between writes of an allocation's activity timestamp
+#: (seconds)
+#:
+#: Targets and allocations are marked as active very often (console
+#: reads, store operations, flashing...); each daemon process writes
+#: the timestamp to the allocation's database only if it did not do
+#: so in this period. The idle timeout of allocations allows for
+#: this, so they might time out this much later than
+#: :data:`target_max_idle`.
+timestamp_flush_period = 5
+
 #: Time gap after which call the function to perform clean-up
 cleanup_files_period = 60 # 60sec
 
@@ -627,9 +627,16 @@ class interface(ttbl.tt_interface):
             return True
         return False
 
+    #: Maximum time (in seconds) a client can ask the daemon to
+    #: keep following a console when reading (see :meth:`get_read`
+    #: and :data:`followers_max`)
+    follow_max = 30
+
     def get_read(self, target, who, args, _files, _user_path):
         impl, component = self.arg_impl_get(args, "component")
         offset = int(args.get('offset', 0))
+        # if > 0, keep sending new data as it comes for this long
+        follow = min(float(args.get('follow', 0)), self.follow_max)
         if target.target_is_owned_and_locked(who):
             target.timestamp()	# only if the reader owns it
         last_enable_check = target.property_get("interfaces.console." + component + ".check_ts", 0)
@@ -648,6 +655,11 @@ class interface(ttbl.tt_interface):
                 'stream_generation': 0,
                 'stream_offset': 0
             }
+        if stream_file and follow > 0 and followers_max > 0:
+            # the daemon will keep streaming what is appended to the
+            # file if it can get a slot (see follow_slot_get()); see
+            # _target_interface() in ttbd
+            r['stream_follow'] = follow
         return r
 
     def get_size(self, target, _who, args, _files, _user_path):
@@ -676,6 +688,41 @@ class interface(ttbl.tt_interface):
                     raise
             return {}
 
+#: Maximum number of console reads that can be following a console
+#: (see the *follow* argument to :meth:`interface.get_read`) at the
+#: same time in all the daemon's processes; when all are taken,
+#: reads return only the data available.
+#:
+#: Each following read takes a whole daemon process for its
+#: duration, during which it serves no other requests, so this is
+#: disabled (*0*) by default; enable it only in servers with
+#: processes to spare (see :data:`ttbl.config.processes`).
+followers_max = 0
+
+def follow_slot_get():
+    """
+    Take a slot to follow a console (see :data:`followers_max`)
+
+    Slots are numbered lock files in the daemon's state directory,
+    freed when the holder closes them or dies.
+
+    :returns: file descriptor holding the slot, to close when done
+      following; *None* if none is free
+    """
+    for slot in range(followers_max):
+        lockfile = os.path.join(
+            ttbl.test_target.state_path, "..",
+            "console.follow.%d.lock" % slot)
+        fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError as e:
+            os.close(fd)
+            if e.errno != errno.EAGAIN:
+                raise
+    return None
+
 def generation_set(target, console):
     target.fsdb.set("interfaces.console." + console + ".generation",
                     # trunc the time and make it a string
@@ -209,11 +209,13 @@ import codecs
 import collections
 import copy
 import errno
+import fcntl
 import hashlib
 import json
 import numbers
 import os
 import re
+import selectors
 import subprocess
 import time
 
@@ -223,6 +225,80 @@ import commonl
 import ttbl
 import ttbl.store
 
+#: Maximum number of flashing processes that can run at the same
+#: time on a flashing bus
+#:
+#: Flashers that share a bus (eg: a USB hub or a JTAG chain to which
+#: the flashers of many targets are connected) declare it with the
+#: *bus* argument (see :class:`impl_c`); many flashing tools working
+#: at the same time on the same bus might slow each other down or
+#: fail, so this limits how many are run at the same time by all the
+#: processes of the daemon; others wait for their turn:
+#:
+#: >>> ttbl.images.bus_concurrency["usb-hub-3"] = 2
+#:
+#: Buses not listed take :data:`bus_concurrency_default`.
+bus_concurrency = {}
+
+#: Maximum number of flashing processes that can run at the same time
+#: on buses not listed in :data:`bus_concurrency` (*0* for no limit)
+bus_concurrency_default = 0
+
+#: While flashing, how often (in seconds) to refresh the flashing
+#: progress in the inventory (*interfaces.images.IMAGETYPE.progress*),
+#: timestamp the target so it doesn't idle out and try to start
+#: flashers waiting for their bus.
+#:
+#: Completion of flashers that provide a file descriptor to wait for
+#: (see :meth:`impl2_c.flash_done_fd_get`) is detected right away.
+progress_period = 2
+
+#: While flashing, how often (in seconds) to access the image files
+#: so automounters don't unmount them while tools that don't keep
+#: them open are working with them.
+files_keepalive_period = 30
+
+
+class _bus_slot_c:
+    # A slot to run a flasher on a bus, limited by bus_concurrency
+    #
+    # Slots are numbered lock files in the state directory, so they
+    # are shared by all the daemon processes; they are freed when the
+    # process holding them dies.
+    def __init__(self, bus):
+        self.bus = bus
+        self.fd = None
+
+    def acquire(self):
+        # Try to get a free slot, return True if we did
+        if self.fd != None:
+            return True
+        if self.bus == None:
+            return True
+        limit = bus_concurrency.get(self.bus, bus_concurrency_default)
+        if limit <= 0:
+            return True
+        for slot in range(limit):
+            lockfile = os.path.join(
+                # the daemon's state directory
+                ttbl.test_target.state_path, "..",
+                "images.bus.%s.%d.lock" % (commonl.mkid(self.bus), slot))
+            fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.fd = fd
+                return True
+            except OSError as e:
+                os.close(fd)
+                if e.errno != errno.EAGAIN:
+                    raise
+        return False
+
+    def release(self):
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
 class impl_c(ttbl.tt_interface_impl_c):
     """Driver interface for flashing with :class:`interface`
 
@@ -263,15 +339,22 @@ class impl_c(ttbl.tt_interface_impl_c):
       string to use to generate the log file name (*flash-NAME.log*);
       this is useful for drivers that are used for multiple images,
       where it is not clear which one will it be called to flash to.
+
+    :param str bus: (optional, default none) name of the bus (USB
+      hub, JTAG chain...) this flasher works over, to limit how many
+      flashers work on it at the same time; see
+      :data:`bus_concurrency`.
     """
     def __init__(self,
                  power_sequence_pre = None,
                  power_sequence_post = None,
                  consoles_disable = None,
                  log_name = None,
-                 estimated_duration = 60):
+                 estimated_duration = 60,
+                 bus = None):
         assert isinstance(estimated_duration, int)
         assert log_name == None or isinstance(log_name, str)
+        assert bus == None or isinstance(bus, str)
 
         commonl.assert_none_or_list_of_strings(
             consoles_disable, "consoles_disable", "console name")
@@ -285,6 +368,7 @@ class impl_c(ttbl.tt_interface_impl_c):
         self.consoles_disable = consoles_disable
         self.estimated_duration = estimated_duration
         self.log_name = log_name
+        self.bus = bus
         ttbl.tt_interface_impl_c.__init__(self)
 
     def target_setup(self, target, iface_name, component):
@@ -381,8 +465,10 @@ class impl2_c(impl_c):
 
     The flashing infrastructure will call :meth:flash_start to get the
     flashing process started and then call :meth:flash_check_done
-    periodically until it finishes; if it exceeds the declared timeout
-    in :attr:estimated_timeout, it will be killed with
+    when the file descriptor returned by :meth:flash_done_fd_get
+    signals completion or, if there is none, periodically until it
+    finishes; if it exceeds the declared timeout in
+    :attr:estimated_timeout, it will be killed with
     :meth:flash_kill, otherwise, execution will be verified with
     :meth:flash_check_done.
 
@@ -464,6 +550,40 @@ class impl2_c(impl_c):
         """
         raise NotImplementedError
 
+    def flash_done_fd_get(self, target, images, context):
+        """
+        Return a file descriptor that becomes readable when the
+        flashing process completes
+
+        Same arguments as :meth:flash_start.
+
+        This allows the infrastructure to wait for many flashers at
+        the same time and react as soon as each completes, instead of
+        calling :meth:flash_check_done every :attr:check_period
+        seconds. It stays owned by the driver.
+
+        :returns int: file descriptor (eg: a Linux *pidfd* for the
+          flashing process, see :class:flash_shell_cmd_c) or *None*
+          (default) to have :meth:flash_check_done polled.
+        """
+        return None
+
+    def flash_progress_get(self, target, images, context):
+        """
+        Report how the flashing process is going
+
+        Same arguments as :meth:flash_start.
+
+        Called periodically while flashing; what it returns is
+        published in the inventory as
+        *interfaces.images.IMAGETYPE.progress*.
+
+        :returns str: short progress message (eg: the last line
+          printed by the flashing tool) or *None* (default) if
+          nothing new to report.
+        """
+        return None
+
     def flash_kill(self, target, images, context, msg):
         """
         Kill a flashing process that has gone astray, timedout or others
@@ -536,6 +656,10 @@ class interface(ttbl.tt_interface):
     flash doesn't change) or to select where do we want to run
     (because you want an specific image flashed).
 
+    While flashing, *interfaces.images.DESTINATION.progress* reports
+    how it is going (*starting*, the last line printed by the
+    flashing tool, *flashed* or *failed*).
+
     """
     def __init__(self, *impls,
                  # python2 doesn't support this combo...
@@ -571,124 +695,231 @@ class interface(ttbl.tt_interface):
         #
         ## $ sha512sum FILENAME
         #
-        for image_type, name in list(images.items()):
-            ho = commonl.hash_file(hashlib.sha512(), name)
-            target.fsdb.set(
-                "interfaces.images." + image_type + ".last_sha512",
-                ho.hexdigest()
-            )
-            target.fsdb.set(
-                "interfaces.images." + image_type + ".last_name",
-                name
-            )
+        with target.fsdb.batch() as batch:
+            for image_type, name in list(images.items()):
+                ho = commonl.hash_file(hashlib.sha512(), name)
+                batch["interfaces.images." + image_type + ".last_sha512"] = \
+                    ho.hexdigest()
+                batch["interfaces.images." + image_type + ".last_name"] = \
+                    name
+
+    def _flash_file_check(self, target, image_name, filename):
+        # Ensure the files are accessile
+        #
+        # For files that are in automount directories, and for
+        # tools that don't really access them properly, this
+        # kinda tries a few times
+        last_e = None
+        for count in range(1, 4):
+            try:
+                os.stat(filename)
+                return
+            except Exception as e:
+                target.log.error(
+                    "%s: can't find %s to flash in %s: retrying %s/4",
+                    target.id, image_name, filename, count)
+                last_e = e
+                time.sleep(count * 0.2)	# give automounters some time
+        target.log.error(
+            "%s: can't find %s to flash in %s (gave up)",
+            target.id, image_name, filename)
+        raise last_e
+
+    @staticmethod
+    def _flash_files_keepalive(target, filenames):
+        # sometimes files are in dynamically mounted
+        # directories -- avoid they being mounted in very long
+        # flash process -- some tools are just not good at
+        # telling the system they are active
+        for filename in filenames:
+            try:
+                os.stat(filename)
+                target.log.info(
+                    "flashing: stating file %s", filename)
+            except Exception as e:
+                target.log.warning(
+                    "flashing: (ignoring) exception stating file %s: %s",
+                    filename, e)
+
+    @staticmethod
+    def _flash_progress_set(target, images, progress):
+        with target.fsdb.batch() as batch:
+            for image_type in images:
+                batch["interfaces.images." + image_type + ".progress"] = \
+                    progress
+
+    @staticmethod
+    def _flash_start(target, impl, images, context, selector):
+        impl.flash_start(target, images, context)
+        context['ts_check'] = time.time()
+        context['fd'] = impl.flash_done_fd_get(target, images, context)
+        if context['fd'] != None:
+            selector.register(context['fd'], selectors.EVENT_READ, impl)
+
+    @staticmethod
+    def _flash_unwatch(context, selector):
+        if context.get('fd', None) != None:
+            selector.unregister(context['fd'])
+            context['fd'] = None
+
+    def _flash_impl_do(self, target, impl, images):
+        # impl_c drivers can only flash synchronously
+        bus_slot = _bus_slot_c(impl.bus)
+        while not bus_slot.acquire():
+            target.timestamp()	# timestamp so we don't idle...
+            time.sleep(progress_period)
+        try:
+            for image_name, filename in images.items():
+                self._flash_file_check(target, image_name, filename)
+            self._flash_progress_set(target, images, "flashing")
+            impl.flash(target, images)
+            self._hash_record(target, images)
+            self._flash_progress_set(target, images, "flashed")
+        finally:
+            bus_slot.release()
 
     def _flash_parallel_do(self, target, parallel, image_names):
-        # flash a parallel-capable flasher in a serial fashion; when
-        # something fails, repeat it right away if it has retries
+        # Start all the flashers (as their buses allow) and wait for
+        # them to complete; when something fails, repeat it right
+        # away if it has retries
+        #
+        # We wait on the file descriptors the flashers give us to
+        # signal completion, so we know right away when each is done;
+        # those that give none are polled every check_period. We also
+        # wake up every progress_period to report progress, timestamp
+        # the target and try to start the flashers waiting for a slot
+        # in their bus.
+        if len(parallel) == 1:
+            impl, images = next(iter(parallel.items()))
+            if not isinstance(impl, impl2_c):
+                self._flash_impl_do(target, impl, images)
+                return
+
         contexts = {}
         estimated_duration = 0
-        check_period = 4
         all_images = [ ]
         filenames = set()
-        for impl, images in list(parallel.items()):
+        for impl, images in parallel.items():
             context = dict()
-            context['ts0'] = time.time()
             context['retry_count'] = 1	# 1 based, nicer for human display
+            context['bus_slot'] = _bus_slot_c(impl.bus)
             contexts[impl] = context
             estimated_duration = max(impl.estimated_duration, estimated_duration)
-            check_period = min(impl.check_period, check_period)
             all_images += images.keys()
             for image_name, filename in images.items():
                 filenames.add(filename)
-                # Ensure the files are accessile
-                #
-                # For files that are in automount directories, and for
-                # tools that don't really access them properly, this
-                # kinda tries a few times
-                last_e = None
-                for count in range(1, 4):
-                    try:
-                        os.stat(filename)
-                        break
-                    except Exception as e:
-                        target.log.error(
-                            "%s: can't find %s to flash in %s: retrying %s/4",
-                            target.id, image_name, filename, count)
-                        last_e = e
-                        time.sleep(count * 0.2)	# give automounters some time
-                else:
-                    target.log.error(
-                        "%s: can't find %s to flash in %s (gave up)",
-                        target.id, image_name, filename)
-                    raise last_e
-            target.log.info("%s: flashing %s", target.id, image_names[impl])
-            impl.flash_start(target, images, context)
-
-        ts = ts0 = time.time()
-        done = set()
-        done_impls = set()
-        while ts - ts0 < estimated_duration:
-            target.timestamp()	# timestamp so we don't idle...
+                self._flash_file_check(target, image_name, filename)
+
+        pending = list(parallel)	# waiting for a slot in their bus
+        running = set()
+        selector = selectors.DefaultSelector()
+        ts_progress = ts_keepalive = time.time()
+        try:
+            while pending or running:
+                for impl in list(pending):
+                    context = contexts[impl]
+                    if not context['bus_slot'].acquire():
+                        continue
+                    pending.remove(impl)
+                    running.add(impl)
+                    target.log.info("%s: flashing %s", target.id, image_names[impl])
+                    self._flash_progress_set(target, parallel[impl], "starting")
+                    context['ts0'] = time.time()
+                    context['ts_deadline'] = context['ts0'] + estimated_duration
+                    self._flash_start(target, impl, parallel[impl], context,
+                                      selector)
+
+                # sleep until something completes or we have to do
+                # something else
+                ts = time.time()
+                ts_wake = ts_progress + progress_period
+                for impl in running:
+                    context = contexts[impl]
+                    ts_wake = min(ts_wake, context['ts_deadline'])
+                    if context['fd'] == None:
+                        ts_wake = min(ts_wake,
+                                      context['ts_check'] + impl.check_period)
+                ready = set(
+                    key.data
+                    for key, _events in selector.select(max(0, ts_wake - ts))
+                )
 
-            # sometimes files are in dynamically mounted
-            # directories -- avoid they being mounted in very long
-            # flash process -- some tools are just not good at
-            # telling the system they are active
-            for filename in filenames:
-                try:
-                    os.stat(filename)
-                    target.log.info(
-                        "flashing: stating file %s", filename)
-                except Exception as e:
-                    target.log.warning(
-                        "flashing: (ignoring) exception stating file %s: %s",
-                        filename, exception)
-
-            time.sleep(check_period)
-            for impl, images in parallel.items():
-                if impl in done_impls:	# already completed? skip
-                    continue
-                context = contexts[impl]
-                retry_count = context['retry_count']
                 ts = time.time()
-                if ts - ts0 > impl.check_period \
-                   and impl.flash_check_done(target, images, context) == True:
+                if ts - ts_progress >= progress_period:
+                    ts_progress = ts
+                    target.timestamp()	# timestamp so we don't idle...
+                    for impl in running:
+                        context = contexts[impl]
+                        progress = impl.flash_progress_get(
+                            target, parallel[impl], context)
+                        if progress != None \
+                           and progress != context.get('progress', None):
+                            context['progress'] = progress
+                            self._flash_progress_set(
+                                target, parallel[impl], progress)
+                if ts - ts_keepalive >= files_keepalive_period:
+                    ts_keepalive = ts
+                    self._flash_files_keepalive(target, filenames)
+
+                for impl in list(running):
+                    images = parallel[impl]
+                    context = contexts[impl]
+                    retry_count = context['retry_count']
+                    done = False
+                    if impl in ready:
+                        # a readable fd stays readable, don't wait on
+                        # it anymore; if it is not done, poll it
+                        self._flash_unwatch(context, selector)
+                        context['ts_check'] = ts
+                        done = impl.flash_check_done(target, images, context) == True
+                    elif context['fd'] == None \
+                         and ts - context['ts_check'] >= impl.check_period:
+                        context['ts_check'] = ts
+                        done = impl.flash_check_done(target, images, context) == True
+                    if not done:
+                        if ts >= context['ts_deadline']:
+                            raise RuntimeError(
+                                "%s/%s: flashing failed: timedout after %ds"
+                                % (target.id, " ".join(all_images),
+                                   estimated_duration))
+                        continue
                     # says it is done, let's verify it
                     r = impl.flash_post_check(target, images, context)
                     if r == None:
-	                # success! we are done in this one
+                        # success! we are done in this one
                         self._hash_record(target, images)
-                        done.update(images.keys())
-                        done_impls.add(impl)
+                        self._flash_progress_set(target, images, "flashed")
+                        running.remove(impl)
+                        context['bus_slot'].release()
                         target.log.warning(
-                            "%s/%s: flashing completed; done_impls: %s",
-                            target.id, image_names[impl], done_impls)
+                            "%s/%s: flashing completed; %d flashers still running",
+                            target.id, image_names[impl], len(running))
                     elif retry_count <= impl.retries:
-	                # failed, retry?
+                        # failed, retry?
                         context['retry_count'] += 1
                         target.log.warning(
                             "%s/%s: flashing failed, retrying %d/%d: %s",
                             target.id, image_names[impl],
                             context['retry_count'], impl.retries, r)
-                        impl.flash_start(target, images, context)
+                        self._flash_start(target, impl, images, context,
+                                          selector)
                     else:
                         # failed, out of retries, error as soon as possible
                         msg = "%s/%s: flashing failed %d times, aborting: %s" % (
                             target.id, image_names[impl], retry_count, r)
                         target.log.error(msg)
-                        for _impl, _images in parallel.items():
-                            _impl.flash_kill(target, _images, contexts[_impl], msg)
                         raise RuntimeError(msg)
-            ts = time.time()
-            if len(done_impls) == len(parallel):
-                target.log.info("flashed images" + " ".join(image_names.values()))
-                return
-        else:
-            msg = "%s/%s: flashing failed: timedout after %ds" \
-                % (target.id, " ".join(all_images), estimated_duration)
-            for impl, images in list(parallel.items()):
-                impl.flash_kill(target, images, contexts[impl], msg)
-            raise RuntimeError(msg)
+            target.log.info("flashed images" + " ".join(image_names.values()))
+        except Exception as e:
+            for impl in running:
+                self._flash_unwatch(contexts[impl], selector)
+                impl.flash_kill(target, parallel[impl], contexts[impl], str(e))
+                self._flash_progress_set(target, parallel[impl], "failed")
+            raise
+        finally:
+            selector.close()
+            for context in contexts.values():
+                context['bus_slot'].release()
 
 
     def _flash_consoles_disable(self, target, parallel, image_names):
@@ -798,7 +1029,8 @@ class interface(ttbl.tt_interface):
                     "images.flash.decompress."
                     + commonl.mkid(file_name)
                     + ".lock")
-                with ttbl.process_posix_file_lock_c(lock_file_name):
+                with ttbl.process_posix_file_lock_c(
+                        lock_file_name, name = "images.flash.decompress"):
                     # if a decompressor crashed, we have no way to
                     # tell if the decompressed file is correct or
                     # truncated and thus corrupted -- we need manual
@@ -1401,15 +1633,15 @@ class fake_c(impl2_c):
         self.upid_set("Fake test flasher", _id = str(id(self)))
 
     def flash_start(self, target, images, context):
-        target.fsdb.set(f"fake-{'.'.join(images.keys())}-{context}.ts0", time.time())
+        target.fsdb.set(f"fake-{'.'.join(images.keys())}.ts0", time.time())
 
     def flash_check_done(self, target, images, context):
-        ts0 = target.fsdb.get(f"fake-{'.'.join(images.keys())}-{context}.ts0", None)
+        ts0 = target.fsdb.get(f"fake-{'.'.join(images.keys())}.ts0", None)
         ts = time.time()
         return ts - ts0 > self.estimated_duration - self.check_period
 
     def flash_kill(self, target, images, context, msg):
-        target.fsdb.set(f"fake-{'.'.join(images.keys())}-{context}.state", "started", None)
+        target.fsdb.set(f"fake-{'.'.join(images.keys())}.state", "started", None)
 
     def flash_post_check(self, target, images, context):
         return None
@@ -1610,6 +1842,10 @@ class flash_shell_cmd_c(impl2_c):
 
     :param dict env_add: (optional) variables to add to the environment when
       running the command
+
+    Completion of the command is detected as soon as it exits (using
+    a Linux *pidfd* when available) and the last line it prints to
+    the log file is reported as progress.
     """
     def __init__(self, cmdline, cwd = "/tmp", path = None, env_add = None,
                  **kwargs):
@@ -1631,6 +1867,7 @@ class flash_shell_cmd_c(impl2_c):
 
     def flash_start(self, target, images, context):
 
+        self._pidfd_close(context)	# if we are retrying
         kws = dict(target.kws)
         context['images'] = images
 
@@ -1690,6 +1927,7 @@ class flash_shell_cmd_c(impl2_c):
 
         ts0 = time.time()
         context['ts0'] = ts0
+        context['log_offset'] = 0
         try:
             target.log.info("flashing %s image with: %s",
                             image_types, " ".join(cmdline))
@@ -1698,6 +1936,9 @@ class flash_shell_cmd_c(impl2_c):
                     cmdline, env = env, stdin = None, cwd = cwd,
                     bufsize = 0,	# output right away, to monitor
                     stderr = subprocess.STDOUT, stdout = logf)
+            # keep it in the context, as the same driver might be
+            # flashing more than once at the same time
+            context['p'] = self.p
             with open(pidfile, "w+") as pidf:
                 pidf.write("%s" % self.p.pid)
             target.log.debug("%s: flasher PID %s file %s",
@@ -1719,25 +1960,64 @@ class flash_shell_cmd_c(impl2_c):
         # this is needed so SIGCHLD the process and it doesn't become
         # a zombie
         ttbl.daemon_pid_add(self.p.pid)	# FIXME: race condition if it died?
+        # a pidfd becomes readable when the process exits, so we can
+        # be told right away (Linux >= 5.3, Python >= 3.9)
+        if hasattr(os, "pidfd_open"):
+            try:
+                context['pidfd'] = os.pidfd_open(self.p.pid)
+            except OSError as e:
+                # might have died already, or the kernel doesn't
+                # support it; flash_check_done() will tell
+                target.log.debug("%s: flasher PID %s: can't get pidfd: %s",
+                                 image_types, self.p.pid, e)
         target.log.debug("%s: flasher PID %s started (%s)",
                          image_types, self.p.pid, cmdline_s)
         return
 
+    @staticmethod
+    def _pidfd_close(context):
+        pidfd = context.pop('pidfd', None)
+        if pidfd != None:
+            os.close(pidfd)
+
+    def flash_done_fd_get(self, target, images, context):
+        return context.get('pidfd', None)
+
+    def flash_progress_get(self, target, images, context,
+                           max_bytes = 2000):
+        # report the last line the tool wrote to the log since we
+        # last looked; progress bars usually rewrite with \r
+        try:
+            with open(context['logfile_name'], 'rb') as logf:
+                offset = max(context.get('log_offset', 0),
+                             os.fstat(logf.fileno()).st_size - max_bytes)
+                logf.seek(offset)
+                data = logf.read()
+        except FileNotFoundError:
+            return None
+        context['log_offset'] = offset + len(data)
+        for line in reversed(re.split(rb"[\r\n]+", data)):
+            line = line.strip()
+            if line:
+                return line.decode('utf-8', errors = 'replace')[:128]
+        return None
 
     def flash_check_done(self, target, images, context):
         ts = time.time()
         ts0 = context['ts0']
+        p = context['p']
         target.log.debug("%s: [+%.1fs] flasher PID %s checking",
-                         context['kws']['image_types'], ts - ts0, self.p.pid)
-        self.p.poll()
-        if self.p.returncode == None:
+                         context['kws']['image_types'], ts - ts0, p.pid)
+        p.poll()
+        if p.returncode == None:
             r = False
         else:
             r = True
+            self._pidfd_close(context)
         ts = time.time()
         target.log.debug(
             "%s: [+%.1fs] flasher PID %s checked %s",
-            context['kws']['image_types'], ts - ts0, self.p.pid, r)
+            context['kws']['image_types'], ts - ts0, p.pid, r)
         return r
 
 
@@ -1746,7 +2026,8 @@ class flash_shell_cmd_c(impl2_c):
         ts0 = context['ts0']
         target.log.debug(
             "%s: [+%.1fs] flasher PID %s terminating due to timeout",
-            context['kws']['image_types'], ts - ts0, self.p.pid)
+            context['kws']['image_types'], ts - ts0, context['p'].pid)
+        self._pidfd_close(context)
         commonl.process_terminate(context['pidfile'], path = self.path)
 
 
@@ -1775,9 +2056,10 @@ class flash_shell_cmd_c(impl2_c):
           returncode the command has to return on success. If *None*,
           don't check it.
         """
-        if expected_returncode != None and self.p.returncode != expected_returncode:
+        p = context['p']
+        if expected_returncode != None and p.returncode != expected_returncode:
             msg = "flashing with %s failed, returned %s: %s" % (
-                context['cmdline_s'], self.p.returncode,
+                context['cmdline_s'], p.returncode,
                 self._log_file_read(context))
             target.log.error(msg)
             return { "message": msg }
@@ -19,6 +19,15 @@ subdirectories) which can be use to place blobs which might be removed
 by the server after a certain time based on policy. Note these storage
 areas are common to all the targets for each user.
 
+Files can also be uploaded to a content-addressed area shared by all
+the users and targets in the server (see :meth:`interface.get_blob`,
+:meth:`interface.post_blob` and :meth:`interface.put_blob`); the
+client asks if the server has a blob with a given digest, uploads
+only the data the server is missing (resuming if a previous upload was
+interrupted) and then links the blob into the user's storage area
+under the name it wants; many names can alias the same blob without
+using extra space.
+
 Examples:
 
 - upload files to the server than then other tools will
@@ -26,12 +35,15 @@ Examples:
 
 """
 import errno
+import fcntl
 import glob
 import hashlib
 import os
 import pathlib
 import re
+import shutil
 import stat
+import threading
 
 import commonl
 import ttbl
@@ -51,6 +63,16 @@ import ttbl
 paths_allowed = {
 }
 
+#: Name of the directory inside the server's file storage area
+#: (:data:`ttbl.test_target.files_path`) where content-addressed blobs
+#: are kept.
+#:
+#: This sits next to the user's storage areas, so it is subject to
+#: the same cleanup policy (see
+#: :data:`ttbl.config.cleanup_files_maxage`); blobs are named after
+#: their SHA512 digest and partial uploads get a *.partial* suffix.
+blobs_subdir = "##blobs##"
+
 class interface(ttbl.tt_interface):
 
     def __init__(self):
@@ -258,6 +280,10 @@ class interface(ttbl.tt_interface):
         if not rw:
             raise PermissionError(f"{file_path}: is a read only location")
         file_object = files['file']
+        # the file might be a hardlink to a blob (see put_blob()),
+        # so remove it instead of overwriting, or we'd change the
+        # contents of the blob and all its aliases
+        commonl.rm_f(file_path_final)
         file_object.save(file_path_final)
         commonl.makedirs_p(user_path)
         target.log.debug("%s: saved" % file_path_final)
@@ -297,3 +323,177 @@ class interface(ttbl.tt_interface):
             raise PermissionError(f"{file_path}: is a read only location")
         commonl.rm_f(file_path_final)
         return dict()
+
+
+    _blob_digest_regex = re.compile("^[0-9a-f]{128}$")
+
+    def _blob_path_get(self, args):
+        digest = self.arg_get(args, 'digest', str)
+        if not self._blob_digest_regex.match(digest):
+            raise ValueError(f"{digest}: invalid digest; expected a"
+                             " lowercase hex SHA512 digest")
+        blob_dir = os.path.join(ttbl.test_target.files_path, blobs_subdir)
+        commonl.makedirs_p(blob_dir)
+        return digest, os.path.join(blob_dir, digest)
+
+    @staticmethod
+    def _blob_state(blob_path):
+        try:
+            return dict(present = True, size = os.stat(blob_path).st_size)
+        except FileNotFoundError:
+            pass
+        try:
+            return dict(present = False,
+                        size = os.stat(blob_path + ".partial").st_size)
+        except FileNotFoundError:
+            return dict(present = False, size = 0)
+
+    def get_blob(self, target, who, args, _files, _user_path):
+        """
+        Query if the server has a blob with a given digest
+
+        :param str digest: SHA512 digest (lowercase hex) of the data
+
+        :returns: dictionary with fields:
+
+          - *present* (bool): *True* if the blob is available and
+            can be linked with :meth:`put_blob`
+
+          - *size* (int): if *present*, size of the blob in bytes;
+            otherwise, how many bytes of the blob have been uploaded
+            so far--an upload shall continue at this offset
+        """
+        if target.target_is_owned_and_locked(who):
+            target.timestamp()
+        _digest, blob_path = self._blob_path_get(args)
+        return self._blob_state(blob_path)
+
+    def post_blob(self, target, who, args, files, _user_path):
+        """
+        Upload a chunk of a blob
+
+        :param str digest: SHA512 digest (lowercase hex) of the whole
+          blob
+        :param int offset: offset in the blob where the chunk goes
+        :param file chunk: data to store at *offset*
+
+        Data is appended to the partially uploaded blob; a chunk can
+        overlap data that was already uploaded (which is ignored) but
+        it can't leave a gap. As such, this call is idempotent and can
+        be safely retried, and multiple clients can upload the same
+        blob at the same time.
+
+        :returns: same as :meth:`get_blob`
+        """
+        if target.target_is_owned_and_locked(who):
+            target.timestamp()
+        digest, blob_path = self._blob_path_get(args)
+        offset = self.arg_get(args, 'offset', int)
+        if offset < 0:
+            raise ValueError(f"{digest}: offset {offset} can't be negative")
+        if os.path.exists(blob_path):
+            return self._blob_state(blob_path)
+        data = files['chunk'].read()
+        partial_path = blob_path + ".partial"
+        with open(partial_path, "ab") as f:
+            # serialize against other uploaders of the same blob and
+            # against put_blob() completing it; lock released on close
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(partial_path).st_ino != os.fstat(f.fileno()).st_ino:
+                    # while we waited for the lock, the partial upload
+                    # was completed or discarded
+                    return self._blob_state(blob_path)
+            except FileNotFoundError:
+                return self._blob_state(blob_path)
+            size = os.fstat(f.fileno()).st_size
+            if offset > size:
+                raise ValueError(
+                    f"{digest}: offset {offset} leaves a gap; only"
+                    f" {size} bytes have been uploaded so far")
+            skip = size - offset
+            if skip < len(data):
+                f.write(data[skip:])
+                size += len(data) - skip
+        return dict(present = False, size = size)
+
+    @staticmethod
+    def _blob_complete(target, digest, blob_path, size):
+        partial_path = blob_path + ".partial"
+        try:
+            f = open(partial_path, "rb")
+        except FileNotFoundError as e:
+            if os.path.exists(blob_path):	# completed by someone else
+                return
+            raise ValueError(f"{digest}: no data uploaded") from e
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.path.exists(blob_path):	# completed by someone else
+                return
+            partial_size = os.fstat(f.fileno()).st_size
+            if size != None and partial_size < size:
+                raise ValueError(
+                    f"{digest}: incomplete; {partial_size} out of"
+                    f" {size} bytes uploaded")
+            h = hashlib.sha512()
+            commonl.hash_file(h, partial_path)
+            if h.hexdigest() != digest:
+                os.unlink(partial_path)
+                raise ValueError(
+                    f"{digest}: uploaded data has digest {h.hexdigest()};"
+                    " discarded")
+            # the blob can be aliased by many names; make it harder
+            # for anyone to modify it in place
+            os.chmod(partial_path, 0o444)
+            os.rename(partial_path, blob_path)
+            target.log.info("%s: blob completed (%d bytes)",
+                            digest, partial_size)
+
+    def put_blob(self, target, who, args, _files, user_path):
+        """
+        Link a blob into the user's storage area
+
+        :param str digest: SHA512 digest (lowercase hex) of the blob
+        :param str file_path: name in the user's storage area under
+          which to make the blob available
+        :param int size: (optional) size of the blob; if the blob is
+          only partially uploaded and fewer bytes have been received,
+          the upload is reported as incomplete, so it can be resumed
+
+        If the upload is complete but not yet verified, its digest is
+        verified first; if it does not match, the uploaded data is
+        discarded and an error is returned.
+
+        *file_path* is made a hardlink to the blob (or a copy if the
+        filesystem does not support hardlinks), replacing any existing
+        file.
+        """
+        if target.target_is_owned_and_locked(who):
+            target.timestamp()
+        digest, blob_path = self._blob_path_get(args)
+        size = self.arg_get(args, 'size', int,
+                            allow_missing = True, default = None)
+        file_path = self.arg_get(args, 'file_path', str)
+        file_path_final, rw = self._validate_file_path(target, file_path, user_path)
+        if not rw:
+            raise PermissionError(f"{file_path}: is a read only location")
+        if not os.path.exists(blob_path):
+            self._blob_complete(target, digest, blob_path, size)
+        commonl.makedirs_p(user_path)
+        # link to a temporary name and rename, so the replacement is
+        # atomic for anyone using the old file
+        tmp_path = file_path_final \
+            + f".blob-{os.getpid()}-{threading.get_ident()}"
+        commonl.rm_f(tmp_path)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError as e:
+            if e.errno not in ( errno.EXDEV, errno.EPERM, errno.EMLINK ):
+                raise
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, file_path_final)
+        # refresh the timestamp so the cleanup process doesn't
+        # consider the blob (and thus this alias) stale
+        os.utime(file_path_final)
+        target.log.debug("%s: linked to blob %s", file_path_final, digest)
+        return dict()
@@ -4,6 +4,7 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 #
+import collections
 import errno
 import glob
 import logging
@@ -12,12 +13,23 @@ import os
 import pickle
 import shutil
 import threading
+import time
 
-# FIXME: create cache using lru_aged_c, so we don't constantly reload
 # FIXME: UGLY HACK, move code around
 import ttbl
 import commonl
 
+#: How long (in seconds) to keep a user's information in the
+#: per-process cache (see :func:`user_get_cached`) before reloading
+#: it from disk, even if it seems to be unmodified.
+cache_ttl = 30
+
+#: Maximum number of users to keep in the per-process cache
+cache_maxsize = 256
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
 def known_user_list():
     # this now is a HACK, FIXME, repeats a lot of code, but when
     # the user database is moved to fsdb it will be cleaned up
@@ -114,12 +126,65 @@ class User(object):
         except ( AssertionError, commonl.fsdb_c.exception ) as e:
             if fail_if_new:
                 raise self.user_not_existant_e("%s: no such user" % userid)
-        self.fsdb.set('userid', userid)
+        # only write if needed; this is called for every request
+        # that is not served from the cache
+        if self.fsdb.get('userid', None) != userid:
+            self.fsdb.set('userid', userid)
+            self._generation_bump()
+        # roles are read on first use and kept, see _roles_get(); to
+        # know if someone modified the database since we loaded it,
+        # we keep its generation, which changes every time a role is
+        # set--this has to be taken before reading anything
+        self._roles = None
+        self.stamp = self._stamp_get()
+        if self.stamp == None:	# database from before generations
+            self._generation_bump()
+            self.stamp = self._stamp_get()
         if roles:
             assert isinstance(roles, list)
             for role in roles:
                 self.role_add(role)
 
+    # counter to make each generation unique within this process
+    _generation_count = 0
+
+    def _generation_bump(self):
+        # Write a new unique generation for the user's database, to
+        # be called after modifying it; it is a regular file, which
+        # fsdb_symlink_c ignores
+        #
+        # We can't use the directory's mtime, as it might not change
+        # if two modifications are done within the same timestamp
+        # tick.
+        User._generation_count += 1
+        generation = "%d %d %d %d" % (
+            os.getpid(), threading.get_ident(), time.time_ns(),
+            User._generation_count)
+        file_name = os.path.join(self.fsdb.location, ".generation")
+        file_name_tmp = file_name + ".%d.%d" % (
+            os.getpid(), threading.get_ident())
+        with open(file_name_tmp, "w") as f:
+            f.write(generation)
+        os.replace(file_name_tmp, file_name)
+
+    def _stamp_get(self):
+        # Return the current generation of the user's database (see
+        # _generation_bump()), None if not available
+        try:
+            with open(os.path.join(self.fsdb.location, ".generation")) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _roles_get(self):
+        roles = self._roles
+        if roles == None:
+            roles = {}
+            for role_key in self.fsdb.keys('roles.*'):
+                roles[role_key[len("roles."):]] = self.fsdb.get(role_key, False)
+            self._roles = roles
+        return roles
+
     def to_dict(self):
         r = commonl.flat_keys_to_dict(self.fsdb.get_as_dict())
         r['name'] = os.path.basename(self.fsdb.location)
@@ -131,6 +196,8 @@ class User(object):
         logging it out.
         """
         shutil.rmtree(self.fsdb.location, ignore_errors = True)
+        with _cache_lock:
+            _cache.pop(self.userid, None)
 
     @staticmethod
     def is_authenticated():
@@ -171,7 +238,11 @@ class User(object):
         before with :meth:`role_add`.
         """
         assert isinstance(role, str)
-        self.fsdb.set('roles.' + role, False)
+        roles = self._roles_get()
+        if roles.get(role, None) != False:
+            self.fsdb.set('roles.' + role, False)
+            self._generation_bump()
+            roles[role] = False
 
     def role_gain(self, role):
         """
@@ -182,8 +253,26 @@ class User(object):
         before with :meth:`role_add`.
         """
         assert isinstance(role, str)
-        # FIXME: convert to normal booleans
-        self.fsdb.set('roles.' + role, True)
+        roles = self._roles_get()
+        if roles.get(role, None) != True:
+            # FIXME: convert to normal booleans
+            self.fsdb.set('roles.' + role, True)
+            self._generation_bump()
+            roles[role] = True
+
+    def data_set(self, key, value):
+        """
+        Set a field of data about the user (eg: provided by the
+        authenticator when logging in)
+
+        :param str key: name of the field; it is stored as *data.KEY*
+
+        :param value: value to store (*int*, *float*, *str*, *bool*);
+          *None* removes it
+        """
+        assert isinstance(key, str)
+        self.fsdb.set("data." + key, value)
+        self._generation_bump()
 
     def role_get(self, role):
         """
@@ -192,7 +281,7 @@ class User(object):
         :return: *True* if the user has the role gained, *False* if
           dropped, *None* if the user does not have the role.
         """
-        val = self.fsdb.get('roles.' + role, None)
+        val = self._roles_get().get(role, None)
         assert val == None or isinstance(val, bool), \
             "BUG: user %s[roles.%s] is val type %s; expected bool" \
             % (self.userid, role, type(val))
@@ -203,13 +292,13 @@ class User(object):
         Return *True* if the user has the role (gained or dropped),
         *False* otherwise
         """
-        return self.fsdb.get('roles.' + role, None) != None
+        return self._roles_get().get(role, None) != None
 
     def is_admin(self):
         """
         Return *True* if the user has the *admin* role gained.
         """
-        return self.fsdb.get('roles.admin', False) == True
+        return self._roles_get().get('admin', False) == True
 
     def role_list(self):
         """
@@ -217,12 +306,7 @@ class User(object):
 
         :returns dict: dict listing all roles and their state
         """
-        # note we need to remove from each key the leading
-        # roles. string to get the actual roles
-        d = {}
-        for role_key in self.fsdb.keys('roles.*'):
-            d[role_key[len("roles."):]] = self.fsdb.get(role_key, False)
-        return d
+        return dict(self._roles_get())
 
 
     @staticmethod
@@ -240,6 +324,64 @@ class User(object):
     @staticmethod
     def search_user(userid):
         try:
-            return User(userid, fail_if_new = True)
+            return user_get_cached(userid)
         except:
             return None
+
+
+def user_get_cached(userid, roles = None, create = False):
+    """
+    Return a user's descriptor, from a per-process cache if possible
+
+    Loading a user's information for every request is costly; this
+    keeps the descriptors (and the user's roles) in memory, up to
+    :data:`cache_maxsize` of them.
+
+    An entry is reused as long as the user's database has not been
+    modified (by this or other process; each modification bumps its
+    generation) and it is younger than
+    :data:`cache_ttl` seconds; otherwise it is reloaded. Thus, a user
+    being logged out or their roles changed by another process is
+    seen on the next request.
+
+    :param str userid: user ID
+
+    :param list(str) roles: (optional) roles to add to the user, as
+      in :meth:`User.role_add`; only written to disk if they change
+      anything.
+
+    :param bool create: (optional; default *False*) create the user
+      if it does not exist.
+
+    :returns User: descriptor for the user
+    :raises User.user_not_existant_e: if the user does not exist and
+      *create* is *False*.
+    """
+    ts = time.time()
+    with _cache_lock:
+        entry = _cache.get(userid, None)
+        if entry:
+            _cache.move_to_end(userid)
+    user = None
+    if entry:
+        user, ts_loaded = entry
+        if ts - ts_loaded > cache_ttl \
+           or user.stamp == None or user._stamp_get() != user.stamp:
+            user = None
+    if user == None:
+        try:
+            user = User(userid, fail_if_new = not create)
+        except User.user_not_existant_e:
+            with _cache_lock:
+                _cache.pop(userid, None)
+            raise
+        with _cache_lock:
+            _cache[userid] = ( user, ts )
+            _cache.move_to_end(userid)
+            while len(_cache) > cache_maxsize:
+                _cache.popitem(last = False)
+    if roles:
+        assert isinstance(roles, list)
+        for role in roles:
+            user.role_add(role)
+    return user